@@ -0,0 +1,88 @@
+"""Throughput benchmark for bulk vs single WhatsApp template sends.
+
+Queues the same template to consented leads once through one
+send-template call per recipient and once through send-template/bulk,
+and reports messages queued per second for each. Run it against a
+development database with Redis available and the worker stopped, so
+the queued jobs are not actually sent:
+
+    python benchmarks/bench_bulk_send.py --user-id <user> --number-id <number> --template <name> --recipients 2000
+
+The user needs at least --recipients leads with consent and a phone
+number; the template must be APPROVED on the number.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from src.main import app
+from src.models import Prisma
+
+
+async def consented_phones(user_id, limit):
+    """Load phone numbers of leads the template can be sent to"""
+    prisma = Prisma()
+    await prisma.connect()
+    leads = await prisma.lead.find_many(
+        where={
+            'userId': user_id,
+            'consentGiven': True,
+            'phoneNumber': {'not': None},
+            'status': {'not': 'UNSUBSCRIBED'}
+        },
+        take=limit
+    )
+    await prisma.disconnect()
+    return [lead.phoneNumber for lead in leads]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--number-id', required=True)
+    parser.add_argument('--template', required=True)
+    parser.add_argument('--language', default='en_US')
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    phones = asyncio.run(consented_phones(args.user_id, args.recipients))
+    if len(phones) < args.recipients:
+        raise SystemExit(f'Only {len(phones)} consented leads with phone numbers found')
+
+    with app.app_context():
+        headers = {'Authorization': f'Bearer {create_access_token(identity=args.user_id)}'}
+    client = app.test_client()
+    base = f'/api/whatsapp/numbers/{args.number_id}'
+    template = {'templateName': args.template, 'language': args.language}
+
+    started = time.perf_counter()
+    single_queued = 0
+    for phone in phones:
+        response = client.post(f'{base}/send-template', json={**template, 'recipient': phone}, headers=headers)
+        single_queued += response.status_code == 200
+    single_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    bulk_queued = 0
+    for start in range(0, len(phones), args.batch_size):
+        recipients = [{'recipient': phone, 'parameters': []} for phone in phones[start:start + args.batch_size]]
+        response = client.post(f'{base}/send-template/bulk', json={**template, 'recipients': recipients}, headers=headers)
+        if response.status_code == 200:
+            bulk_queued += response.get_json()['queued']
+    bulk_elapsed = time.perf_counter() - started
+
+    print(f"recipients         {len(phones)}")
+    print(f"single queued      {single_queued} in {single_elapsed:.2f}s ({single_queued / single_elapsed:,.0f} msg/s)")
+    print(f"bulk queued        {bulk_queued} in {bulk_elapsed:.2f}s ({bulk_queued / bulk_elapsed:,.0f} msg/s)")
+    if single_queued and bulk_queued:
+        print(f"speedup            {(bulk_queued / bulk_elapsed) / (single_queued / single_elapsed):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
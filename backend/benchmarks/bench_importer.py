@@ -0,0 +1,79 @@
+"""Throughput benchmark for the engagement importer.
+
+Feeds synthetic Graph API comment/reaction pages through the real
+normalize/dedupe/create_many path and reports leads per second. Run it
+against a development database with Redis available:
+
+    python benchmarks/bench_importer.py --user-id <user> --page-id <page> --profiles 50000
+
+A fresh --run-id makes every profile new; reusing one measures the
+dedupe path (all profiles already exist).
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import importer
+
+
+def synthetic_pages(run_id, profiles, page_size, duplicate_ratio):
+    """Build a fetch_pages replacement yielding fake engagement pages"""
+    async def fetch_pages(path, access_token, params=None):
+        edge = path.rsplit('/', 1)[-1]
+        # Split the profiles across the two edges so both code paths are exercised
+        half = profiles // 2
+        offset, count = (0, half) if edge == 'comments' else (half, profiles - half)
+        for start in range(offset, offset + count, page_size):
+            items = []
+            for index in range(start, min(start + page_size, offset + count)):
+                # Re-use earlier IDs to simulate people who engage on several posts
+                if index and (index % 100) < duplicate_ratio * 100:
+                    index = index // 2
+                profile = {'id': f'bench-{run_id}-{index}', 'name': f'Bench User{index}'}
+                items.append({'from': profile} if edge == 'comments' else profile)
+            yield items
+    return fetch_pages
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--page-id', required=True)
+    parser.add_argument('--profiles', type=int, default=20000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2)
+    parser.add_argument('--run-id', default=uuid.uuid4().hex[:8])
+    args = parser.parse_args()
+
+    await importer.prisma.connect()
+    page = await importer.prisma.facebookpage.find_unique(where={'id': args.page_id})
+    if not page:
+        raise SystemExit(f'Page {args.page_id} not found')
+
+    progress = importer.ImportProgress(f'bench-{args.run_id}', args.user_id, page.id, posts_total=1)
+    fetch_pages = synthetic_pages(args.run_id, args.profiles, args.page_size, args.duplicate_ratio)
+
+    started = time.perf_counter()
+    await importer.import_post_engagement(
+        args.user_id, page, 'bench-post', 'bench-token', set(), progress, fetch_pages
+    )
+    elapsed = time.perf_counter() - started
+
+    counters = progress.counters
+    print(f"run id           {args.run_id}")
+    print(f"profiles seen    {counters['profiles_seen']}")
+    print(f"leads created    {counters['leads_created']}")
+    print(f"elapsed          {elapsed:.2f}s")
+    print(f"profiles/second  {counters['profiles_seen'] / elapsed:,.0f}")
+    print(f"leads/second     {counters['leads_created'] / elapsed:,.0f}")
+
+    await importer.prisma.disconnect()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""Per-call cost of token encryption and decryption.
+
+Compares the old behaviour (key derived on every call, no plaintext
+cache) with the cached keys and decrypted-token cache:
+
+    python benchmarks/bench_security.py --iterations 200
+
+Leave ENCRYPTION_KEY and TOKEN_ENCRYPTION_KEYS unset to measure the
+PBKDF2 derivation path.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import security
+
+
+def per_call_us(function, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--bulk', type=int, default=5000, help='tokens for the bulk decrypt run')
+    args = parser.parse_args()
+
+    token = 'EAAB' + 'x' * 200
+    encrypted = security.encrypt_token(token)
+
+    def uncached_decrypt():
+        security.clear_token_cache()
+        security.decrypt_token(encrypted)
+
+    def key_cached_decrypt():
+        with security._token_cache_lock:
+            security._token_cache.clear()
+        security.decrypt_token(encrypted)
+
+    results = [
+        ('decrypt, key derived per call', per_call_us(uncached_decrypt, args.iterations)),
+        ('decrypt, cached key', per_call_us(key_cached_decrypt, args.iterations * 50)),
+        ('decrypt, cached token', per_call_us(lambda: security.decrypt_token(encrypted), args.iterations * 500)),
+        ('encrypt, cached key', per_call_us(lambda: security.encrypt_token(token), args.iterations * 50)),
+    ]
+
+    for name, cost in results:
+        print(f'{name:32} {cost:12.1f} us/call')
+
+    ciphertexts = [security.encrypt_token(f'{token}{i}') for i in range(args.bulk)]
+    security.clear_token_cache()
+    started = time.perf_counter()
+    asyncio.run(security.decrypt_tokens(ciphertexts))
+    print(f'{"bulk decrypt (thread pool)":32} {args.bulk / (time.perf_counter() - started):12.0f} tokens/s')
+
+
+if __name__ == '__main__':
+    main()
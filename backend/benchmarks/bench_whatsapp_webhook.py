@@ -0,0 +1,90 @@
+"""Throughput benchmark for the WhatsApp webhook pipeline.
+
+Replays the recorded payloads in fixtures/whatsapp_webhooks.json, with
+fresh message/status IDs per copy, through both halves of the pipeline:
+the fast-ack XADD done by the endpoint and the batched stream consumer.
+Run it against a development database with Redis available:
+
+    python benchmarks/bench_whatsapp_webhook.py --phone-number-id <id> --copies 2000
+
+--phone-number-id must match a WhatsappNumber.phoneNumberId so events
+resolve to a number; --duplicates re-sends a share of the payloads to
+exercise the dedupe set.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import webhooks, whatsapp_ingest
+from src.utils.worker import STREAM_BATCH_SIZE
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'whatsapp_webhooks.json')
+
+
+def recorded_payloads(copies, phone_number_id, duplicates, run_id):
+    """Build raw webhook bodies with unique IDs per copy"""
+    with open(FIXTURE) as f:
+        template = f.read()
+    recorded = json.loads(template)
+
+    bodies = []
+    for copy in range(copies):
+        for payload in recorded:
+            body = json.dumps(payload)
+            body = body.replace('wamid.', f'wamid.{run_id}{copy}.')
+            body = body.replace('"106540352242922"', json.dumps(phone_number_id))
+            bodies.append(body)
+
+    for body in random.sample(bodies, int(len(bodies) * duplicates)):
+        bodies.append(body)
+    return bodies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--phone-number-id', required=True)
+    parser.add_argument('--copies', type=int, default=1000)
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--run-id', default=uuid.uuid4().hex[:8])
+    args = parser.parse_args()
+
+    bodies = recorded_payloads(args.copies, args.phone_number_id, args.duplicates, args.run_id)
+    stream = f'bench:whatsapp:{args.run_id}'
+
+    started = time.perf_counter()
+    entry_ids = [webhooks.enqueue_webhook(stream, body) for body in bodies]
+    ack_elapsed = time.perf_counter() - started
+
+    await whatsapp_ingest.prisma.connect()
+    entries = [(entry_id, {'body': body}) for entry_id, body in zip(entry_ids, bodies)]
+    totals = {'messages': 0, 'statuses': 0, 'duplicates': 0}
+
+    started = time.perf_counter()
+    for start in range(0, len(entries), STREAM_BATCH_SIZE):
+        result = await whatsapp_ingest.ingest_whatsapp_events(entries[start:start + STREAM_BATCH_SIZE])
+        for name in totals:
+            totals[name] += result.get(name, 0)
+    consume_elapsed = time.perf_counter() - started
+
+    webhooks.redis_client.delete(stream)
+    await whatsapp_ingest.prisma.disconnect()
+
+    print(f"run id             {args.run_id}")
+    print(f"payloads           {len(bodies)}")
+    print(f"ack (XADD)         {ack_elapsed / len(bodies) * 1e6:,.0f} us/request")
+    print(f"inbound created    {totals['messages']}")
+    print(f"status rows moved  {totals['statuses']}")
+    print(f"duplicates skipped {totals['duplicates']}")
+    print(f"consume elapsed    {consume_elapsed:.2f}s")
+    print(f"payloads/second    {len(bodies) / consume_elapsed:,.0f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,38 @@
+-- Merge leads that share a Facebook user ID within one account, so the
+-- @@unique([userId, facebookUserId]) constraint can be created.
+--
+-- Run once, before the `prisma db push` that adds the constraint:
+--
+--     psql "$DATABASE_URL" -f prisma/sql/dedupe_facebook_leads.sql
+--
+-- The oldest lead of each group is kept. Messages and tags of the others
+-- are moved to it before they are deleted.
+
+BEGIN;
+
+CREATE TEMPORARY TABLE lead_merges ON COMMIT DROP AS
+SELECT id AS duplicate_id, keep_id
+FROM (
+    SELECT id,
+           first_value(id) OVER (PARTITION BY "userId", "facebookUserId" ORDER BY "createdAt", id) AS keep_id
+    FROM leads
+    WHERE "facebookUserId" IS NOT NULL
+) ranked
+WHERE id <> keep_id;
+
+UPDATE messages m SET "leadId" = lm.keep_id
+FROM lead_merges lm
+WHERE m."leadId" = lm.duplicate_id;
+
+INSERT INTO lead_tags ("leadId", "tagId", "createdAt")
+SELECT lm.keep_id, lt."tagId", MIN(lt."createdAt")
+FROM lead_tags lt
+JOIN lead_merges lm ON lm.duplicate_id = lt."leadId"
+GROUP BY lm.keep_id, lt."tagId"
+ON CONFLICT ("leadId", "tagId") DO NOTHING;
+
+DELETE FROM leads l
+USING lead_merges lm
+WHERE l.id = lm.duplicate_id;
+
+COMMIT;
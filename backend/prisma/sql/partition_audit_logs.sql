@@ -0,0 +1,54 @@
+-- Convert audit_logs into a table range-partitioned by month on "createdAt".
+--
+-- Run once, after `prisma db push` has created the table, with the API
+-- stopped (buffered audit events are spooled and written afterwards):
+--
+--     psql "$DATABASE_URL" -f prisma/sql/partition_audit_logs.sql
+--
+-- Partitions are named audit_logs_yYYYYmMM. From then on the
+-- maintain-audit-partitions job creates upcoming months and archives
+-- old ones, so this script is never needed again.
+
+BEGIN;
+
+ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned;
+ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT audit_logs_pkey TO audit_logs_unpartitioned_pkey;
+ALTER TABLE audit_logs_unpartitioned RENAME CONSTRAINT "audit_logs_userId_fkey" TO "audit_logs_unpartitioned_userId_fkey";
+
+CREATE TABLE audit_logs (LIKE audit_logs_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE ("createdAt");
+-- A partitioned table's primary key must include the partition column
+ALTER TABLE audit_logs ADD CONSTRAINT audit_logs_pkey PRIMARY KEY (id, "createdAt");
+ALTER TABLE audit_logs ADD CONSTRAINT "audit_logs_userId_fkey"
+    FOREIGN KEY ("userId") REFERENCES users(id) ON DELETE SET NULL ON UPDATE CASCADE;
+
+-- One partition per month from the oldest row to three months ahead
+DO $$
+DECLARE
+    part_start timestamp := date_trunc('month', COALESCE((SELECT MIN("createdAt") FROM audit_logs_unpartitioned), now()));
+    last_start timestamp := date_trunc('month', now()) + interval '3 months';
+BEGIN
+    WHILE part_start <= last_start LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF audit_logs FOR VALUES FROM (%L) TO (%L)',
+            'audit_logs_' || to_char(part_start, '"y"YYYY"m"MM'),
+            part_start,
+            part_start + interval '1 month'
+        );
+        part_start := part_start + interval '1 month';
+    END LOOP;
+END $$;
+
+-- Rows outside every month (a skewed clock, a date far ahead) land here;
+-- the maintenance job moves them into partitions of their own
+CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+
+INSERT INTO audit_logs SELECT * FROM audit_logs_unpartitioned;
+DROP TABLE audit_logs_unpartitioned;
+
+-- Indexes on the parent are created on every partition, current and future
+CREATE INDEX "audit_logs_createdAt_id_idx" ON audit_logs ("createdAt", id);
+CREATE INDEX "audit_logs_userId_createdAt_id_idx" ON audit_logs ("userId", "createdAt", id);
+CREATE INDEX "audit_logs_resource_createdAt_id_idx" ON audit_logs (resource, "createdAt", id);
+CREATE INDEX "audit_logs_action_createdAt_id_idx" ON audit_logs (action, "createdAt", id);
+
+COMMIT;
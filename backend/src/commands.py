@@ -0,0 +1,166 @@
+import asyncio
+import json
+import click
+from flask.cli import AppGroup
+from src.utils import audit, audit_archive, dead_letter, token_rotation
+from src.utils.queue import add_sync_job
+from src.utils.worker import run_workers, connect_clients
+
+dead_letters_cli = AppGroup('dead-letters', help='Inspect and replay dead-lettered jobs.')
+tokens_cli = AppGroup('tokens', help='Manage encrypted access tokens.')
+audit_cli = AppGroup('audit', help='Maintain and search audit log storage.')
+
+def dead_letter_filter_options(f):
+    """Shared filter options for dead letter commands"""
+    options = [
+        click.option('--queue', 'queue_name', help='Queue name, e.g. message-queue.'),
+        click.option('--job-name', help='Job name, e.g. send-message.'),
+        click.option('--error-class', help='Exception class, e.g. GraphAPIError.'),
+        click.option('--error-code', help='Provider error code.'),
+        click.option('--since', type=click.DateTime(), help='Failed at or after this time.'),
+        click.option('--until', type=click.DateTime(), help='Failed at or before this time.'),
+        click.option('--replayed/--not-replayed', default=None, help='Filter on replay state.'),
+    ]
+    for option in reversed(options):
+        f = option(f)
+    return f
+
+@dead_letters_cli.command('list')
+@dead_letter_filter_options
+@click.option('--limit', default=50, show_default=True)
+@click.option('--json', 'as_json', is_flag=True, help='Print records as JSON lines.')
+def list_command(limit, as_json, **filters):
+    """List dead letters matching the filters."""
+    async def run():
+        await connect_clients(dead_letter)
+        where_clause = dead_letter.build_dead_letter_filters(**filters)
+        records, total = await dead_letter.list_dead_letters(where_clause, limit=limit)
+        summary = await dead_letter.summarize_dead_letters(where_clause)
+        return records, total, summary
+
+    records, total, summary = asyncio.run(run())
+
+    if as_json:
+        for record in records:
+            click.echo(json.dumps(dead_letter.serialize_dead_letter(record)))
+        return
+
+    for group in summary:
+        click.echo(f"{group['queueName']:<16} {group['errorClass']:<24} {group['count']}")
+    click.echo(f'-- showing {len(records)} of {total}')
+    for record in records:
+        click.echo(
+            f'{record.id} {record.failedAt.isoformat()} {record.queueName}/{record.jobName} '
+            f'{record.errorClass}: {record.errorMessage or ""}'
+        )
+
+@dead_letters_cli.command('replay')
+@dead_letter_filter_options
+@click.option('--id', 'ids', multiple=True, help='Dead letter ID (repeatable).')
+@click.option('--rate', default=10.0, show_default=True, help='Jobs per second.')
+@click.option('--limit', default=1000, show_default=True)
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def replay_command(ids, rate, limit, yes, **filters):
+    """Re-enqueue dead letters at a controlled rate."""
+    if rate <= 0:
+        raise click.BadParameter('must be positive', param_hint='--rate')
+
+    where_clause = dead_letter.build_dead_letter_filters(ids=ids, **filters)
+    if not where_clause:
+        raise click.UsageError('Pass --id or at least one filter.')
+
+    async def run():
+        await connect_clients(dead_letter)
+        _, total = await dead_letter.list_dead_letters(where_clause, limit=1)
+        if not yes:
+            click.confirm(f'Replay {min(total, limit)} dead letters at {rate}/s?', abort=True)
+        return await dead_letter.replay_dead_letters(where_clause, rate=rate, limit=limit)
+
+    replayed = asyncio.run(run())
+    for queue_name, count in replayed.items():
+        click.echo(f'{queue_name}: {count} jobs queued')
+
+@tokens_cli.command('reencrypt')
+@click.option('--chunk-size', default=token_rotation.REENCRYPT_CHUNK_SIZE, show_default=True)
+@click.option('--inline', is_flag=True, help='Run here instead of queueing a background job.')
+def reencrypt_command(chunk_size, inline):
+    """Re-encrypt stored tokens under the active TOKEN_ENCRYPTION_KEYS key."""
+    if not inline:
+        job_id = asyncio.run(add_sync_job('reencrypt-tokens', {'chunk_size': chunk_size}))
+        click.echo(f'Queued re-encryption job {job_id}')
+        return
+
+    async def run():
+        await connect_clients(token_rotation)
+        return await token_rotation.reencrypt_all_tokens(chunk_size)
+
+    for name, counts in asyncio.run(run()).items():
+        click.echo(f"{name:<28} scanned={counts['scanned']} reencrypted={counts['reencrypted']} "
+                   f"undecryptable={counts['undecryptable']}")
+
+@audit_cli.command('maintain')
+@click.option('--retention-months', default=audit_archive.AUDIT_RETENTION_MONTHS, show_default=True,
+              help='Months kept in the database before the current one.')
+@click.option('--inline', is_flag=True, help='Run here instead of queueing a background job.')
+def maintain_command(retention_months, inline):
+    """Create upcoming audit log partitions and archive expired ones."""
+    if not inline:
+        job_id = asyncio.run(add_sync_job('maintain-audit-partitions', {'retention_months': retention_months}))
+        click.echo(f'Queued audit partition maintenance job {job_id}')
+        return
+
+    async def run():
+        await connect_clients(audit_archive)
+        created = await audit_archive.ensure_partitions()
+        archived = await audit_archive.archive_old_partitions(retention_months)
+        return created, archived
+
+    created, archived = asyncio.run(run())
+    click.echo(f"created: {', '.join(created) or 'none'}")
+    click.echo(f"archived: {', '.join(archived) or 'none'}")
+
+@audit_cli.command('search')
+@click.option('--user-id', help='User who performed the action.')
+@click.option('--resource', help='Resource type, e.g. campaign.')
+@click.option('--action', help='Action, e.g. delete_lead.')
+@click.option('--since', type=click.DateTime(), help='Logged at or after this time.')
+@click.option('--until', type=click.DateTime(), help='Logged at or before this time.')
+@click.option('--limit', default=1000, show_default=True)
+def search_command(user_id, resource, action, since, until, limit):
+    """Print matching audit logs as JSON lines, including archived months."""
+    where_clause = audit.build_audit_filters(user_id=user_id, resource=resource, action=action,
+                                             start_date=since, end_date=until)
+
+    async def run():
+        await connect_clients(audit, audit_archive)
+        logs, _ = await audit_archive.search_audit_logs(where_clause, limit=limit, include_archived=True)
+        return logs
+
+    for log in asyncio.run(run()):
+        click.echo(json.dumps({
+            'id': log.id,
+            'createdAt': log.createdAt.isoformat(),
+            'userId': log.userId,
+            'action': log.action,
+            'resource': log.resource,
+            'resourceId': log.resourceId,
+            'details': log.details,
+            'ipAddress': log.ipAddress,
+            'userAgent': log.userAgent
+        }, default=str))
+
+@click.command('worker')
+@click.option('--queue', 'queue_names', multiple=True, help='Queue to consume (repeatable, default all).')
+@click.option('--concurrency', default=5, show_default=True)
+@click.option('--scheduler/--no-scheduler', default=True, show_default=True,
+              help='Also enqueue periodic jobs such as page syncs.')
+def worker_command(queue_names, concurrency, scheduler):
+    """Run background job workers."""
+    asyncio.run(run_workers(list(queue_names), concurrency=concurrency, scheduler=scheduler))
+
+def init_commands(app):
+    """Register CLI commands on the app"""
+    app.cli.add_command(dead_letters_cli)
+    app.cli.add_command(tokens_cli)
+    app.cli.add_command(audit_cli)
+    app.cli.add_command(worker_command)
@@ -1,6 +1,6 @@
 import os
 import sys
-import asyncio
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,21 +9,37 @@ load_dotenv()
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
-from src.models import Prisma
 from src.routes.auth import auth_bp
 from src.routes.facebook import facebook_bp
 from src.routes.whatsapp import whatsapp_bp
 from src.routes.leads import leads_bp
 from src.routes.campaigns import campaigns_bp
 from src.routes.admin import admin_bp
+from src.routes.health import health_bp
 from src.utils.security import init_security
+from src.utils.api_keys import init_api_key_auth
+from src.utils.identity import init_identity
 from src.utils.queue import init_queue
+from src.commands import init_commands
+from src.utils.worker import connect_clients
 
-# Initialize Prisma client
-prisma = Prisma()
+# Modules whose Prisma client belongs to a background thread's event loop
+BACKGROUND_CLIENT_MODULES = ('src.utils.health',)
+
+_clients_connected = False
+_connect_lock = threading.Lock()
+
+def request_client_modules():
+    """Loaded route and utility modules that own a Prisma client used by requests"""
+    return [
+        module for name, module in list(sys.modules.items())
+        if name.startswith(('src.routes.', 'src.utils.'))
+        and name not in BACKGROUND_CLIENT_MODULES
+        and getattr(module, 'prisma', None) is not None
+    ]
 
 def create_app():
     app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
@@ -37,12 +53,54 @@ def create_app():
     CORS(app, origins="*")  # Allow all origins for development
     jwt = JWTManager(app)
     
+    # Auth failures use the same {"error": ...} body as every other API error
+    @jwt.unauthorized_loader
+    def missing_token(reason):
+        return jsonify({'error': reason}), 401
+    
+    @jwt.invalid_token_loader
+    def invalid_token(reason):
+        return jsonify({'error': reason}), 401
+    
+    @jwt.expired_token_loader
+    def expired_token(jwt_header, jwt_payload):
+        return jsonify({'error': 'Token has expired'}), 401
+    
+    # Connect the database clients once per process, on its first request;
+    # they stay connected for the life of the process. Registered
+    # first so the API key and identity hooks below can query
+    @app.before_request
+    async def connect_database():
+        global _clients_connected
+        if _clients_connected:
+            return None
+        with _connect_lock:
+            if not _clients_connected:
+                try:
+                    await connect_clients(*request_client_modules())
+                    _clients_connected = True
+                except Exception as e:
+                    print(f"Failed to connect to the database: {str(e)}")
+        return None
+    
     # Initialize security middleware
     init_security(app)
     
+    # Authenticate requests that carry an X-API-Key header
+    init_api_key_auth(app)
+    
+    # Resolve who each request acts as, once, from its JWT or API key
+    init_identity(app)
+    
     # Initialize message queue
     init_queue()
     
+    # Register CLI commands (flask worker, flask dead-letters ...)
+    init_commands(app)
+    
+    # Serve /api/leads and /api/leads/ alike instead of redirecting
+    app.url_map.strict_slashes = False
+    
     # Register blueprints
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(facebook_bp, url_prefix='/api/facebook')
@@ -50,15 +108,7 @@ def create_app():
     app.register_blueprint(leads_bp, url_prefix='/api/leads')
     app.register_blueprint(campaigns_bp, url_prefix='/api/campaigns')
     app.register_blueprint(admin_bp, url_prefix='/api/admin')
-    
-    # Initialize database connection
-    @app.before_first_request
-    def startup():
-        asyncio.create_task(prisma.connect())
-    
-    @app.teardown_appcontext
-    def shutdown(exception=None):
-        asyncio.create_task(prisma.disconnect())
+    app.register_blueprint(health_bp)
     
     # Serve frontend static files
     @app.route('/', defaults={'path': ''})
@@ -1,11 +1,24 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import wraps
 import hashlib
 from src.models import Prisma
-from src.utils.audit import log_action, get_audit_logs
+from src.utils.audit import (
+    COUNT_MODES, log_action, get_audit_logs, build_audit_filters, count_audit_logs
+)
+from src.utils.audit_archive import search_audit_logs
 from src.utils.security import generate_api_key, hash_api_key
+from src.utils.api_keys import invalidate_api_key
+from src.utils.identity import current_identity, invalidate_user
 from src.utils.queue import get_queue_stats
+from src.utils.graph_cache import get_graph_cache_stats
+from src.utils.health import get_probe_results, readiness, worst_status
+from src.utils.dashboard_stats import get_dashboard_stats
+from src.utils.dead_letter import (
+    build_dead_letter_filters, list_dead_letters, summarize_dead_letters,
+    replay_dead_letters, serialize_dead_letter, MAX_REPLAY_BATCH
+)
 
 admin_bp = Blueprint('admin', __name__)
 prisma = Prisma()
@@ -13,11 +26,12 @@ prisma = Prisma()
 def require_admin():
     """Decorator to require admin role"""
     def decorator(f):
+        @wraps(f)
         async def decorated_function(*args, **kwargs):
-            user_id = get_jwt_identity()
-            user = await prisma.user.find_unique(where={'id': user_id})
+            # Role comes from the request's identity, resolved without a query
+            identity = current_identity()
             
-            if not user or user.role != 'ADMIN':
+            if not identity or not identity.is_admin:
                 return jsonify({'error': 'Admin access required'}), 403
             
             return await f(*args, **kwargs)
@@ -32,78 +46,16 @@ async def get_admin_dashboard():
     try:
         user_id = get_jwt_identity()
         
-        # Get various statistics
-        stats = {}
-        
-        # User statistics
-        total_users = await prisma.user.count()
-        active_users = await prisma.user.count(
-            where={
-                'updatedAt': {
-                    'gte': datetime.utcnow() - timedelta(days=30)
-                }
-            }
-        )
-        stats['users'] = {
-            'total': total_users,
-            'active_last_30_days': active_users
-        }
-        
-        # Lead statistics
-        total_leads = await prisma.lead.count()
-        consented_leads = await prisma.lead.count(where={'consentGiven': True})
-        stats['leads'] = {
-            'total': total_leads,
-            'consented': consented_leads,
-            'consent_rate': round((consented_leads / total_leads * 100) if total_leads > 0 else 0, 2)
-        }
-        
-        # Message statistics
-        total_messages = await prisma.message.count()
-        sent_messages = await prisma.message.count(where={'status': 'SENT'})
-        failed_messages = await prisma.message.count(where={'status': 'FAILED'})
-        stats['messages'] = {
-            'total': total_messages,
-            'sent': sent_messages,
-            'failed': failed_messages,
-            'success_rate': round((sent_messages / total_messages * 100) if total_messages > 0 else 0, 2)
-        }
-        
-        # Campaign statistics
-        total_campaigns = await prisma.campaign.count()
-        active_campaigns = await prisma.campaign.count(
-            where={'status': {'in': ['RUNNING', 'SCHEDULED']}}
-        )
-        stats['campaigns'] = {
-            'total': total_campaigns,
-            'active': active_campaigns
-        }
-        
-        # Facebook Pages statistics
-        total_pages = await prisma.facebookpage.count()
-        active_pages = await prisma.facebookpage.count(where={'isActive': True})
-        stats['facebook_pages'] = {
-            'total': total_pages,
-            'active': active_pages
-        }
-        
-        # WhatsApp Numbers statistics
-        total_numbers = await prisma.whatsappnumber.count()
-        active_numbers = await prisma.whatsappnumber.count(where={'isActive': True})
-        stats['whatsapp_numbers'] = {
-            'total': total_numbers,
-            'active': active_numbers
-        }
+        # Counts come from a shared snapshot refreshed by the worker
+        snapshot = await get_dashboard_stats()
+        stats = dict(snapshot['stats'])
         
         # Queue statistics
         queue_stats = get_queue_stats()
         stats['queues'] = queue_stats
         
         # Recent activity (last 24 hours)
-        recent_activity = await get_audit_logs(
-            limit=10,
-            offset=0
-        )
+        recent_activity, _ = await get_audit_logs(limit=10)
         
         activity_data = [
             {
@@ -129,12 +81,33 @@ async def get_admin_dashboard():
         
         return jsonify({
             'stats': stats,
+            'computedAt': snapshot['computedAt'],
             'recent_activity': activity_data
         })
         
     except Exception as e:
         return jsonify({'error': f'Failed to get dashboard data: {str(e)}'}), 500
 
+# Per-user stat -> model holding the rows, each counted by userId
+USER_STAT_MODELS = {
+    'facebook_pages': 'facebookpage',
+    'whatsapp_numbers': 'whatsappnumber',
+    'leads': 'lead',
+    'campaigns': 'campaign'
+}
+
+async def get_relation_counts(user_ids):
+    """Count each user's related rows with one grouped query per model"""
+    counts = {}
+    for stat, model in USER_STAT_MODELS.items():
+        groups = await getattr(prisma, model).group_by(
+            ['userId'],
+            where={'userId': {'in': user_ids}},
+            count=True
+        ) if user_ids else []
+        counts[stat] = {group['userId']: group['_count']['_all'] for group in groups}
+    return counts
+
 @admin_bp.route('/users', methods=['GET'])
 @jwt_required()
 @require_admin()
@@ -167,21 +140,13 @@ async def get_users():
         # Get users with pagination
         users = await prisma.user.find_many(
             where=where_clause,
-            include={
-                'facebookPages': True,
-                'whatsappNumbers': True,
-                'leads': {
-                    'select': {'id': True}
-                },
-                'campaigns': {
-                    'select': {'id': True}
-                }
-            },
             order_by={'createdAt': 'desc'},
             take=limit,
             skip=(page - 1) * limit
         )
         
+        counts = await get_relation_counts([user.id for user in users])
+        
         users_data = [
             {
                 'id': user.id,
@@ -191,12 +156,7 @@ async def get_users():
                 'facebookId': user.facebookId,
                 'createdAt': user.createdAt.isoformat(),
                 'updatedAt': user.updatedAt.isoformat(),
-                'stats': {
-                    'facebook_pages': len(user.facebookPages),
-                    'whatsapp_numbers': len(user.whatsappNumbers),
-                    'leads': len(user.leads),
-                    'campaigns': len(user.campaigns)
-                }
+                'stats': {stat: counts[stat].get(user.id, 0) for stat in USER_STAT_MODELS}
             } for user in users
         ]
         
@@ -246,6 +206,7 @@ async def update_user_role(user_id):
             where={'id': user_id},
             data={'role': data['role']}
         )
+        invalidate_user(user_id)
         
         await log_action(
             user_id=admin_user_id,
@@ -277,44 +238,39 @@ async def get_admin_audit_logs():
         admin_user_id = get_jwt_identity()
         
         # Get query parameters
-        page = request.args.get('page', 1, type=int)
-        limit = request.args.get('limit', 50, type=int)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        cursor = request.args.get('cursor')
+        count_mode = request.args.get('count', 'estimate')
+        include_archived = request.args.get('archived', 'false').lower() == 'true'
         user_id = request.args.get('user_id')
         resource = request.args.get('resource')
         action = request.args.get('action')
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        # Build where clause
-        where_clause = {}
-        
-        if user_id:
-            where_clause['userId'] = user_id
-        
-        if resource:
-            where_clause['resource'] = resource
+        if count_mode not in COUNT_MODES:
+            return jsonify({'error': f'count must be one of: {", ".join(COUNT_MODES)}'}), 400
         
-        if action:
-            where_clause['action'] = action
+        try:
+            where_clause = build_audit_filters(
+                user_id=user_id,
+                resource=resource,
+                action=action,
+                start_date=datetime.fromisoformat(start_date) if start_date else None,
+                end_date=datetime.fromisoformat(end_date) if end_date else None
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
         
-        if start_date or end_date:
-            where_clause['createdAt'] = {}
-            if start_date:
-                where_clause['createdAt']['gte'] = datetime.fromisoformat(start_date)
-            if end_date:
-                where_clause['createdAt']['lte'] = datetime.fromisoformat(end_date)
+        try:
+            logs, next_cursor = await search_audit_logs(
+                where_clause, limit=limit, cursor=cursor, include_archived=include_archived
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Get total count
-        total = await prisma.auditlog.count(where=where_clause)
-        
-        # Get audit logs
-        logs = await prisma.auditlog.find_many(
-            where=where_clause,
-            include={'user': True},
-            order_by={'createdAt': 'desc'},
-            take=limit,
-            skip=(page - 1) * limit
-        )
+        # Only the first page is counted; later pages reuse the client's total
+        total, total_exact = (None, False) if cursor else await count_audit_logs(where_clause, count_mode)
         
         logs_data = [
             {
@@ -338,7 +294,7 @@ async def get_admin_audit_logs():
             user_id=admin_user_id,
             action='view_audit_logs',
             resource='audit_log',
-            details={'page': page, 'limit': limit, 'filters': {
+            details={'cursor': cursor, 'limit': limit, 'archived': include_archived, 'filters': {
                 'user_id': user_id,
                 'resource': resource,
                 'action': action
@@ -348,10 +304,11 @@ async def get_admin_audit_logs():
         return jsonify({
             'logs': logs_data,
             'pagination': {
-                'page': page,
                 'limit': limit,
+                'next_cursor': next_cursor,
+                'has_more': next_cursor is not None,
                 'total': total,
-                'pages': (total + limit - 1) // limit
+                'total_exact': total_exact
             }
         })
         
@@ -376,6 +333,7 @@ async def get_api_keys():
                 'name': key.name,
                 'permissions': key.permissions,
                 'isActive': key.isActive,
+                'userId': key.userId,
                 'lastUsedAt': key.lastUsedAt.isoformat() if key.lastUsedAt else None,
                 'expiresAt': key.expiresAt.isoformat() if key.expiresAt else None,
                 'createdAt': key.createdAt.isoformat()
@@ -405,6 +363,11 @@ async def create_api_key():
         if not data or not data.get('name'):
             return jsonify({'error': 'API key name is required'}), 400
         
+        # The key acts as this user; defaults to the admin creating it
+        owner_id = data.get('userId') or admin_user_id
+        if not await prisma.user.find_unique(where={'id': owner_id}):
+            return jsonify({'error': 'User not found'}), 404
+        
         # Generate API key
         api_key = generate_api_key()
         key_hash = hash_api_key(api_key)
@@ -415,7 +378,8 @@ async def create_api_key():
                 'name': data['name'],
                 'keyHash': key_hash,
                 'permissions': data.get('permissions', []),
-                'expiresAt': datetime.fromisoformat(data['expiresAt']) if data.get('expiresAt') else None
+                'expiresAt': datetime.fromisoformat(data['expiresAt']) if data.get('expiresAt') else None,
+                'userId': owner_id
             }
         )
         
@@ -424,7 +388,7 @@ async def create_api_key():
             action='create_api_key',
             resource='api_key',
             resource_id=api_key_record.id,
-            details={'name': data['name']}
+            details={'name': data['name'], 'userId': owner_id}
         )
         
         return jsonify({
@@ -433,6 +397,7 @@ async def create_api_key():
             'key_info': {
                 'id': api_key_record.id,
                 'name': api_key_record.name,
+                'userId': api_key_record.userId,
                 'permissions': api_key_record.permissions,
                 'expiresAt': api_key_record.expiresAt.isoformat() if api_key_record.expiresAt else None
             }
@@ -474,6 +439,7 @@ async def update_api_key(key_id):
                 where={'id': key_id},
                 data=update_data
             )
+            invalidate_api_key(key_id)
         else:
             updated_key = api_key
         
@@ -514,6 +480,7 @@ async def delete_api_key(key_id):
         
         # Delete API key
         await prisma.apikey.delete(where={'id': key_id})
+        invalidate_api_key(key_id)
         
         await log_action(
             user_id=admin_user_id,
@@ -581,16 +548,26 @@ async def get_system_health():
     try:
         admin_user_id = get_jwt_identity()
         
+        probes = get_probe_results()
+        is_ready, _ = readiness(probes)
+        
         health_data = {
-            'database': 'healthy',  # Would check actual DB connection
-            'redis': 'healthy',     # Would check Redis connection
+            'status': 'healthy' if is_ready else 'error',
+            'database': worst_status(probes['query_engine']['status'], probes['postgres']['status']),
+            'redis': probes['redis']['status'],
             'queues': get_queue_stats(),
+            'graph_cache': get_graph_cache_stats(),
+            'probes': probes,
+            # Third-party APIs are not probed; failures show up in dead letters
             'api_integrations': {
-                'facebook': 'healthy',  # Would check Facebook API
-                'whatsapp': 'healthy',  # Would check WhatsApp API
-                'twilio': 'healthy'     # Would check Twilio API
+                'facebook': 'unknown',
+                'whatsapp': 'unknown',
+                'twilio': 'unknown'
             },
-            'last_checked': datetime.utcnow().isoformat()
+            'last_checked': min(
+                (result['checked_at'] for result in probes.values() if result['checked_at']),
+                default=None
+            )
         }
         
         await log_action(
@@ -604,3 +581,129 @@ async def get_system_health():
     except Exception as e:
         return jsonify({'error': f'Failed to get system health: {str(e)}'}), 500
 
+
+# Keys accepted in a replay request's filters; anything else is rejected
+DEAD_LETTER_FILTER_KEYS = (
+    'queue', 'job_name', 'error_class', 'error_code', 'start_date', 'end_date', 'replayed', 'ids'
+)
+
+def parse_dead_letter_filters(source):
+    """Build dead letter filters from query args or a JSON body"""
+    replayed = source.get('replayed')
+    if isinstance(replayed, str):
+        replayed = {'true': True, 'false': False}.get(replayed.lower())
+    
+    start_date = source.get('start_date')
+    end_date = source.get('end_date')
+    
+    return build_dead_letter_filters(
+        queue_name=source.get('queue'),
+        job_name=source.get('job_name'),
+        error_class=source.get('error_class'),
+        error_code=source.get('error_code'),
+        since=datetime.fromisoformat(start_date) if start_date else None,
+        until=datetime.fromisoformat(end_date) if end_date else None,
+        replayed=replayed,
+        ids=source.get('ids')
+    )
+
+@admin_bp.route('/dead-letters', methods=['GET'])
+@jwt_required()
+@require_admin()
+async def get_dead_letters():
+    """Get dead-lettered jobs with filtering"""
+    try:
+        admin_user_id = get_jwt_identity()
+        
+        # Get query parameters
+        page = max(request.args.get('page', 1, type=int), 1)
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        
+        try:
+            where_clause = parse_dead_letter_filters(request.args)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        dead_letters, total = await list_dead_letters(
+            where_clause,
+            limit=limit,
+            offset=(page - 1) * limit
+        )
+        summary = await summarize_dead_letters(where_clause)
+        
+        await log_action(
+            user_id=admin_user_id,
+            action='view_dead_letters',
+            resource='dead_letter',
+            details={'page': page, 'limit': limit}
+        )
+        
+        return jsonify({
+            'dead_letters': [serialize_dead_letter(dead_letter) for dead_letter in dead_letters],
+            'summary': summary,
+            'pagination': {
+                'page': page,
+                'limit': limit,
+                'total': total,
+                'pages': (total + limit - 1) // limit
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get dead letters: {str(e)}'}), 500
+
+@admin_bp.route('/dead-letters/replay', methods=['POST'])
+@jwt_required()
+@require_admin()
+async def replay_dead_letter_jobs():
+    """Replay dead-lettered jobs in bulk at a controlled rate"""
+    try:
+        admin_user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'Filters must be an object'}), 400
+        
+        unknown = sorted(set(filters) - set(DEAD_LETTER_FILTER_KEYS))
+        if unknown:
+            return jsonify({'error': f'Unknown dead letter filters: {", ".join(unknown)}'}), 400
+        
+        filters = dict(filters)
+        if data.get('ids'):
+            filters['ids'] = data['ids']
+        
+        rate = data.get('rate', 10)
+        limit = data.get('limit', 1000)
+        if not isinstance(rate, (int, float)) or rate <= 0:
+            return jsonify({'error': 'Rate must be a positive number of jobs per second'}), 400
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit <= 0:
+            return jsonify({'error': 'Limit must be a positive integer'}), 400
+        limit = min(limit, MAX_REPLAY_BATCH)
+        
+        try:
+            where_clause = parse_dead_letter_filters(filters)
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        # Filters that parse to nothing would replay every dead letter
+        if not where_clause:
+            return jsonify({'error': 'Dead letter IDs or filters are required'}), 400
+        
+        replayed = await replay_dead_letters(where_clause, rate=rate, limit=limit)
+        
+        await log_action(
+            user_id=admin_user_id,
+            action='replay_dead_letters',
+            resource='dead_letter',
+            details={'filters': filters, 'rate': rate, 'replayed': replayed}
+        )
+        
+        return jsonify({
+            'message': 'Dead letters queued for replay',
+            'replayed': replayed,
+            'total': sum(replayed.values())
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to replay dead letters: {str(e)}'}), 500
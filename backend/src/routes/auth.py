@@ -2,10 +2,14 @@ from flask import Blueprint, request, jsonify, redirect, url_for, session
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 import requests
 import os
+import asyncio
 from datetime import datetime
 from src.models import Prisma
 from src.utils.security import encrypt_token, decrypt_token
 from src.utils.audit import log_action
+from src.utils.queue import add_sync_job
+from src.utils.graph_cache import invalidate_token_cache
+from src.utils.identity import current_identity, invalidate_user
 
 auth_bp = Blueprint('auth', __name__)
 prisma = Prisma()
@@ -94,6 +98,12 @@ async def facebook_callback():
                     'updatedAt': datetime.utcnow()
                 }
             )
+            invalidate_user(user.id)
+            
+            # The replaced token must not keep passing cached Graph checks
+            previous_token = decrypt_token(existing_user.facebookToken) if existing_user.facebookToken else None
+            if previous_token and previous_token != access_token:
+                invalidate_token_cache(previous_token)
         else:
             # Create new user
             user = await prisma.user.create(
@@ -105,8 +115,15 @@ async def facebook_callback():
                 }
             )
         
+        # Refresh the user's pages in the background with the new token
+        await add_sync_job('sync-facebook-pages', {'user_id': user.id})
+        
         # Create JWT token
-        jwt_token = create_access_token(identity=user.id)
+        # Each user is their own tenant; role is re-checked against the user cache
+        jwt_token = create_access_token(
+            identity=user.id,
+            additional_claims={'role': user.role, 'tenant': user.id}
+        )
         
         # Log the action
         await log_action(
@@ -129,32 +146,30 @@ async def facebook_callback():
 async def get_current_user():
     """Get current user information"""
     try:
-        user_id = get_jwt_identity()
-        user = await prisma.user.find_unique(
-            where={'id': user_id},
-            include={
-                'facebookPages': True,
-                'whatsappNumbers': True
-            }
-        )
-        
-        if not user:
+        identity = current_identity()
+        if not identity:
             return jsonify({'error': 'User not found'}), 404
         
+        # Profile fields come from the identity; only the relations are queried
+        pages, numbers = await asyncio.gather(
+            prisma.facebookpage.find_many(where={'userId': identity.user_id}),
+            prisma.whatsappnumber.find_many(where={'userId': identity.user_id})
+        )
+        
         # Remove sensitive data
         user_data = {
-            'id': user.id,
-            'name': user.name,
-            'email': user.email,
-            'role': user.role,
-            'createdAt': user.createdAt.isoformat(),
+            'id': identity.user_id,
+            'name': identity.name,
+            'email': identity.email,
+            'role': identity.role,
+            'createdAt': identity.created_at.isoformat(),
             'facebookPages': [
                 {
                     'id': page.id,
                     'name': page.name,
                     'facebookPageId': page.facebookPageId,
                     'isActive': page.isActive
-                } for page in user.facebookPages
+                } for page in pages
             ],
             'whatsappNumbers': [
                 {
@@ -162,7 +177,7 @@ async def get_current_user():
                     'phoneNumber': number.phoneNumber,
                     'displayName': number.displayName,
                     'isActive': number.isActive
-                } for number in user.whatsappNumbers
+                } for number in numbers
             ]
         }
         
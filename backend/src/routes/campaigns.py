@@ -5,10 +5,17 @@ import json
 from src.models import Prisma
 from src.utils.audit import log_action
 from src.utils.queue import add_message_job, schedule_message
+from src.utils.eligibility import eligible_lead_ids
 
 campaigns_bp = Blueprint('campaigns', __name__)
 prisma = Prisma()
 
+# Campaign types whose recipients must pass the channel's consent rules
+CAMPAIGN_CHANNELS = {
+    'WHATSAPP_TEMPLATE': 'whatsapp',
+    'MESSENGER_BROADCAST': 'messenger',
+}
+
 @campaigns_bp.route('/', methods=['GET'])
 @jwt_required()
 async def get_campaigns():
@@ -135,6 +142,17 @@ async def create_campaign():
             except ValueError:
                 return jsonify({'error': 'Invalid scheduled time format'}), 400
         
+        # Header media for template campaigns, uploaded once per number on first send
+        if data.get('mediaAssetId'):
+            if data['type'] != 'WHATSAPP_TEMPLATE':
+                return jsonify({'error': 'Media is only supported for WhatsApp template campaigns'}), 400
+            asset = await prisma.mediaasset.find_first(
+                where={'id': data['mediaAssetId'], 'userId': user_id}
+            )
+            if not asset:
+                return jsonify({'error': 'Media not found'}), 404
+            campaign_data['mediaAssetId'] = asset.id
+        
         campaign = await prisma.campaign.create(data=campaign_data)
         
         await log_action(
@@ -270,16 +288,9 @@ async def start_campaign(campaign_id):
             }
         )
         
-        # Queue messages for each lead
+        # Queue messages for each lead that passes consent for the campaign type
         queued_messages = 0
-        for lead in leads:
-            # Check consent for the campaign type
-            if campaign.type == 'WHATSAPP_TEMPLATE' and not lead.consentGiven:
-                continue
-            
-            if campaign.type == 'MESSENGER_BROADCAST' and not (lead.consentGiven or lead.source == 'FACEBOOK_MESSAGE'):
-                continue
-            
+        for lead in await filter_eligible_leads(user_id, campaign.type, leads):
             # Create message record
             message = await prisma.message.create(
                 data={
@@ -289,7 +300,8 @@ async def start_campaign(campaign_id):
                     'content': campaign.messageTemplate,
                     'status': 'PENDING',
                     'leadId': lead.id,
-                    'campaignId': campaign_id
+                    'campaignId': campaign_id,
+                    'mediaAssetId': campaign.mediaAssetId
                 }
             )
             
@@ -463,14 +475,7 @@ async def preview_campaign(campaign_id):
         leads = await get_campaign_leads(user_id, campaign.targetAudience)
         
         # Filter leads based on consent for the campaign type
-        eligible_leads = []
-        for lead in leads:
-            if campaign.type == 'WHATSAPP_TEMPLATE' and lead.consentGiven:
-                eligible_leads.append(lead)
-            elif campaign.type == 'MESSENGER_BROADCAST' and (lead.consentGiven or lead.source == 'FACEBOOK_MESSAGE'):
-                eligible_leads.append(lead)
-            elif campaign.type == 'FOLLOW_UP':
-                eligible_leads.append(lead)
+        eligible_leads = await filter_eligible_leads(user_id, campaign.type, leads)
         
         # Create preview data
         preview_data = {
@@ -495,6 +500,15 @@ async def preview_campaign(campaign_id):
     except Exception as e:
         return jsonify({'error': f'Failed to preview campaign: {str(e)}'}), 500
 
+async def filter_eligible_leads(user_id, campaign_type, leads):
+    """Keep the leads that may be messaged for a campaign type"""
+    channel = CAMPAIGN_CHANNELS.get(campaign_type)
+    if channel is None:
+        return list(leads)
+    
+    eligible = set(await eligible_lead_ids(user_id, channel, [lead.id for lead in leads]))
+    return [lead for lead in leads if lead.id in eligible]
+
 async def get_campaign_leads(user_id, target_audience):
     """Get leads based on target audience criteria"""
     where_clause = {'userId': user_id}
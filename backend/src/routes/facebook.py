@@ -1,208 +1,235 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import requests
 import os
+import uuid
 from datetime import datetime, timedelta
 from src.models import Prisma
-from src.utils.security import encrypt_token, decrypt_token
+from src.utils.security import decrypt_token
 from src.utils.audit import log_action
-from src.utils.queue import add_import_job
+from src.utils.queue import add_import_job, add_sync_job
+from src.utils.graph import GraphAPIError
+from src.utils.messaging import record_sent, send_messenger
+from src.utils.facebook_sync import sync_user_pages, FacebookNotConnected
+from src.utils.post_sync import decode_post_cursor, encode_post_cursor, queue_page_post_sync
+from src.utils.importer import get_import_progress
+from src.utils.webhooks import MESSENGER_STREAM, verify_signature, enqueue_webhook
+from src.utils.eligibility import find_eligible_lead_id
+from src.utils.identity import current_identity
 
 facebook_bp = Blueprint('facebook', __name__)
 prisma = Prisma()
 
+def serialize_page(page):
+    """Convert a Facebook page record into a JSON-friendly dict"""
+    return {
+        'id': page.id,
+        'facebookPageId': page.facebookPageId,
+        'name': page.name,
+        'isActive': page.isActive,
+        'createdAt': page.createdAt.isoformat(),
+        'updatedAt': page.updatedAt.isoformat()
+    }
+
 @facebook_bp.route('/pages', methods=['GET'])
 @jwt_required()
 async def get_facebook_pages():
-    """Get user's Facebook pages"""
+    """Get user's Facebook pages
+
+    Pages are served from the database and refreshed by the background
+    page sync. Only a user who has never been synced is synced inline.
+    """
     try:
         user_id = get_jwt_identity()
-        user = await prisma.user.find_unique(
-            where={'id': user_id},
-            include={'facebookPages': True}
-        )
+        identity = current_identity()
         
-        if not user or not user.facebookToken:
+        if not identity or not identity.facebook_connected:
             return jsonify({'error': 'Facebook not connected'}), 400
         
-        # Decrypt and use Facebook token
-        access_token = decrypt_token(user.facebookToken)
-        if not access_token:
-            return jsonify({'error': 'Invalid Facebook token'}), 400
-        
-        # Get pages from Facebook API
-        pages_url = f'https://graph.facebook.com/v18.0/me/accounts?access_token={access_token}'
-        response = requests.get(pages_url)
-        pages_data = response.json()
-        
-        if 'error' in pages_data:
-            return jsonify({'error': f'Facebook API error: {pages_data["error"]["message"]}'}), 400
-        
-        # Update database with current pages
-        for page_data in pages_data.get('data', []):
-            page_id = page_data['id']
-            page_name = page_data['name']
-            page_access_token = page_data['access_token']
-            
-            # Check if page exists
-            existing_page = await prisma.facebookpage.find_unique(
-                where={'facebookPageId': page_id}
+        if identity.pages_synced_at is None:
+            try:
+                pages, _ = await sync_user_pages(user_id)
+            except FacebookNotConnected as e:
+                return jsonify({'error': str(e)}), 400
+            except GraphAPIError as e:
+                return jsonify({'error': f'Facebook API error: {str(e)}'}), 400
+        else:
+            pages = await prisma.facebookpage.find_many(
+                where={'userId': user_id, 'isActive': True},
+                order_by={'createdAt': 'asc'}
             )
-            
-            if existing_page:
-                # Update existing page
-                await prisma.facebookpage.update(
-                    where={'id': existing_page.id},
-                    data={
-                        'name': page_name,
-                        'accessToken': encrypt_token(page_access_token),
-                        'updatedAt': datetime.utcnow()
-                    }
-                )
-            else:
-                # Create new page
-                await prisma.facebookpage.create(
-                    data={
-                        'facebookPageId': page_id,
-                        'name': page_name,
-                        'accessToken': encrypt_token(page_access_token),
-                        'userId': user_id
-                    }
-                )
-        
-        # Get updated pages from database
-        updated_user = await prisma.user.find_unique(
-            where={'id': user_id},
-            include={'facebookPages': True}
-        )
         
-        pages = [
-            {
-                'id': page.id,
-                'facebookPageId': page.facebookPageId,
-                'name': page.name,
-                'isActive': page.isActive,
-                'createdAt': page.createdAt.isoformat(),
-                'updatedAt': page.updatedAt.isoformat()
-            } for page in updated_user.facebookPages
-        ]
+        pages_data = [serialize_page(page) for page in pages]
         
         await log_action(
             user_id=user_id,
             action='get_facebook_pages',
             resource='facebook_page',
-            details={'pages_count': len(pages)}
+            details={'pages_count': len(pages_data)}
         )
         
-        return jsonify({'pages': pages})
+        return jsonify({
+            'pages': pages_data,
+            'syncedAt': identity.pages_synced_at.isoformat() if identity.pages_synced_at else datetime.utcnow().isoformat()
+        })
         
     except Exception as e:
         return jsonify({'error': f'Failed to get Facebook pages: {str(e)}'}), 500
 
+@facebook_bp.route('/pages/sync', methods=['POST'])
+@jwt_required()
+async def sync_facebook_pages():
+    """Queue a sync of the user's Facebook pages"""
+    try:
+        user_id = get_jwt_identity()
+        
+        # Deduplicate repeated clicks within the same minute
+        minute = int(datetime.utcnow().timestamp() // 60)
+        job_id = await add_sync_job(
+            'sync-facebook-pages',
+            {'user_id': user_id},
+            job_id=f'sync-facebook-pages:{user_id}:manual-{minute}'
+        )
+        
+        if not job_id:
+            return jsonify({'error': 'Failed to queue page sync'}), 500
+        
+        await log_action(
+            user_id=user_id,
+            action='sync_facebook_pages',
+            resource='facebook_page',
+            details={'job_id': job_id}
+        )
+        
+        return jsonify({
+            'message': 'Page sync queued successfully',
+            'job_id': job_id
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to sync Facebook pages: {str(e)}'}), 500
+
 @facebook_bp.route('/pages/<page_id>/posts', methods=['GET'])
 @jwt_required()
 async def get_page_posts(page_id):
-    """Get posts from a Facebook page"""
+    """Get synced posts of a Facebook page
+
+    Posts come from the local table, kept current by the background post
+    sync. Pages that have never been synced get a sync queued.
+    """
     try:
         user_id = get_jwt_identity()
         
         # Get page from database
-        page = await prisma.facebookpage.find_unique(
+        page = await prisma.facebookpage.find_first(
             where={'id': page_id, 'userId': user_id}
         )
         
         if not page:
             return jsonify({'error': 'Page not found'}), 404
         
-        # Decrypt page access token
-        page_access_token = decrypt_token(page.accessToken)
-        if not page_access_token:
-            return jsonify({'error': 'Invalid page token'}), 400
-        
         # Get query parameters
-        limit = request.args.get('limit', 25, type=int)
+        limit = min(max(request.args.get('limit', 25, type=int), 1), 100)
         since = request.args.get('since')  # ISO date string
+        before = request.args.get('before')  # Cursor: paging.before of the previous page
+        
+        where_clause = {'facebookPageId': page.id}
+        try:
+            if since:
+                where_clause['createdTime'] = {'gte': datetime.fromisoformat(since.replace('Z', '+00:00'))}
+        except ValueError:
+            return jsonify({'error': 'Invalid date format'}), 400
+        
+        # Seek past the last post seen; the id breaks ties between posts created in the same second
+        if before:
+            try:
+                created_time, post_id = decode_post_cursor(before)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            where_clause['OR'] = [
+                {'createdTime': {'lt': created_time}},
+                {'createdTime': created_time, 'id': {'lt': post_id}}
+            ]
+        
+        syncing = False
+        if page.postsSyncedAt is None:
+            syncing = bool(await queue_page_post_sync(page.id, dedupe_key='initial'))
+        
+        posts = await prisma.facebookpost.find_many(
+            where=where_clause,
+            order_by=[{'createdTime': 'desc'}, {'id': 'desc'}],
+            take=limit + 1
+        )
+        next_cursor = encode_post_cursor(posts[limit - 1]) if len(posts) > limit else None
+        posts = posts[:limit]
         
-        # Build Facebook API URL
-        posts_url = f'https://graph.facebook.com/v18.0/{page.facebookPageId}/posts'
-        params = {
-            'access_token': page_access_token,
-            'fields': 'id,message,story,created_time,likes.summary(true),comments.summary(true),shares',
-            'limit': min(limit, 100)  # Facebook API limit
-        }
+        posts_data = [
+            {
+                'id': post.facebookPostId,
+                'message': post.message,
+                'story': post.story,
+                'createdTime': post.createdTime.isoformat(),
+                'likesCount': post.likesCount,
+                'commentsCount': post.commentsCount,
+                'sharesCount': post.sharesCount
+            } for post in posts
+        ]
+        
+        await log_action(
+            user_id=user_id,
+            action='get_page_posts',
+            resource='facebook_post',
+            resource_id=page_id,
+            details={'posts_count': len(posts_data)}
+        )
+        
+        return jsonify({
+            'posts': posts_data,
+            'paging': {
+                'before': next_cursor
+            },
+            'syncedAt': page.postsSyncedAt.isoformat() if page.postsSyncedAt else None,
+            'syncing': syncing
+        })
         
-        if since:
-            params['since'] = since
+    except Exception as e:
+        return jsonify({'error': f'Failed to get page posts: {str(e)}'}), 500
+
+@facebook_bp.route('/pages/<page_id>/posts/sync', methods=['POST'])
+@jwt_required()
+async def sync_page_posts(page_id):
+    """Queue an incremental sync of a page's posts"""
+    try:
+        user_id = get_jwt_identity()
         
-        response = requests.get(posts_url, params=params)
-        posts_data = response.json()
+        page = await prisma.facebookpage.find_first(
+            where={'id': page_id, 'userId': user_id}
+        )
         
-        if 'error' in posts_data:
-            return jsonify({'error': f'Facebook API error: {posts_data["error"]["message"]}'}), 400
+        if not page:
+            return jsonify({'error': 'Page not found'}), 404
         
-        # Process and store posts
-        posts = []
-        for post_data in posts_data.get('data', []):
-            post_id = post_data['id']
-            
-            # Check if post exists in database
-            existing_post = await prisma.facebookpost.find_unique(
-                where={'facebookPostId': post_id}
-            )
-            
-            post_info = {
-                'facebookPostId': post_id,
-                'message': post_data.get('message'),
-                'story': post_data.get('story'),
-                'createdTime': datetime.fromisoformat(post_data['created_time'].replace('Z', '+00:00')),
-                'likesCount': post_data.get('likes', {}).get('summary', {}).get('total_count', 0),
-                'commentsCount': post_data.get('comments', {}).get('summary', {}).get('total_count', 0),
-                'sharesCount': post_data.get('shares', {}).get('count', 0)
-            }
-            
-            if existing_post:
-                # Update existing post
-                await prisma.facebookpost.update(
-                    where={'id': existing_post.id},
-                    data={
-                        **post_info,
-                        'updatedAt': datetime.utcnow()
-                    }
-                )
-            else:
-                # Create new post
-                await prisma.facebookpost.create(
-                    data={
-                        **post_info,
-                        'facebookPageId': page.id
-                    }
-                )
-            
-            posts.append({
-                'id': post_id,
-                'message': post_info['message'],
-                'story': post_info['story'],
-                'createdTime': post_info['createdTime'].isoformat(),
-                'likesCount': post_info['likesCount'],
-                'commentsCount': post_info['commentsCount'],
-                'sharesCount': post_info['sharesCount']
-            })
+        # Deduplicate repeated clicks within the same minute
+        minute = int(datetime.utcnow().timestamp() // 60)
+        job_id = await queue_page_post_sync(page.id, dedupe_key=f'manual-{minute}')
+        
+        if not job_id:
+            return jsonify({'error': 'Failed to queue post sync'}), 500
         
         await log_action(
             user_id=user_id,
-            action='get_page_posts',
+            action='sync_page_posts',
             resource='facebook_post',
             resource_id=page_id,
-            details={'posts_count': len(posts)}
+            details={'job_id': job_id}
         )
         
         return jsonify({
-            'posts': posts,
-            'paging': posts_data.get('paging', {})
+            'message': 'Post sync queued successfully',
+            'job_id': job_id
         })
         
     except Exception as e:
-        return jsonify({'error': f'Failed to get page posts: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to sync page posts: {str(e)}'}), 500
 
 @facebook_bp.route('/pages/<page_id>/import-engagement', methods=['POST'])
 @jwt_required()
@@ -220,8 +247,10 @@ async def import_page_engagement(page_id):
             return jsonify({'error': 'Page not found'}), 404
         
         # Add import job to queue
+        import_id = uuid.uuid4().hex
         job_data = {
             'type': 'import_engagement',
+            'import_id': import_id,
             'user_id': user_id,
             'page_id': page_id,
             'facebook_page_id': page.facebookPageId
@@ -237,17 +266,45 @@ async def import_page_engagement(page_id):
             action='import_page_engagement',
             resource='facebook_page',
             resource_id=page_id,
-            details={'job_id': job_id}
+            details={'job_id': job_id, 'import_id': import_id}
         )
         
         return jsonify({
             'message': 'Import job queued successfully',
-            'job_id': job_id
+            'job_id': job_id,
+            'import_id': import_id
         })
         
     except Exception as e:
         return jsonify({'error': f'Failed to import engagement: {str(e)}'}), 500
 
+@facebook_bp.route('/imports/<import_id>', methods=['GET'])
+@jwt_required()
+async def get_import_status(import_id):
+    """Get progress of an engagement import"""
+    try:
+        user_id = get_jwt_identity()
+        
+        progress = get_import_progress(import_id)
+        if not progress or progress.get('user_id') != user_id:
+            return jsonify({'error': 'Import not found'}), 404
+        
+        return jsonify({
+            'import_id': import_id,
+            'status': progress.get('status'),
+            'posts_total': int(progress.get('posts_total', 0)),
+            'posts_done': int(progress.get('posts_done', 0)),
+            'profiles_seen': int(progress.get('profiles_seen', 0)),
+            'leads_created': int(progress.get('leads_created', 0)),
+            'leads_per_second': float(progress.get('leads_per_second', 0)),
+            'error': progress.get('error'),
+            'started_at': progress.get('started_at'),
+            'updated_at': progress.get('updated_at')
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get import status: {str(e)}'}), 500
+
 @facebook_bp.route('/pages/<page_id>/send-message', methods=['POST'])
 @jwt_required()
 async def send_messenger_message(page_id):
@@ -269,18 +326,11 @@ async def send_messenger_message(page_id):
         
         # Check if recipient has consented or has messaged the page
         recipient_id = data['recipient']
-        lead = await prisma.lead.find_first(
-            where={
-                'facebookUserId': recipient_id,
-                'facebookPageId': page_id,
-                'OR': [
-                    {'consentGiven': True},
-                    {'source': 'FACEBOOK_MESSAGE'}
-                ]
-            }
+        lead_id = await find_eligible_lead_id(
+            user_id, 'messenger', facebook_user_id=recipient_id, page_id=page_id
         )
         
-        if not lead:
+        if not lead_id:
             return jsonify({'error': 'Recipient has not consented or messaged the page'}), 403
         
         # Decrypt page access token
@@ -288,46 +338,30 @@ async def send_messenger_message(page_id):
         if not page_access_token:
             return jsonify({'error': 'Invalid page token'}), 400
         
-        # Send message via Facebook Messenger API
-        messenger_url = f'https://graph.facebook.com/v18.0/me/messages'
-        message_data = {
-            'recipient': {'id': recipient_id},
-            'message': {'text': data['message']},
-            'access_token': page_access_token
-        }
-        
-        response = requests.post(messenger_url, json=message_data)
-        response_data = response.json()
-        
-        if 'error' in response_data:
-            # Log failed message
-            await prisma.message.create(
-                data={
-                    'type': 'TEXT',
-                    'platform': 'MESSENGER',
-                    'recipient': recipient_id,
-                    'content': data['message'],
-                    'status': 'FAILED',
-                    'errorMessage': response_data['error']['message'],
-                    'leadId': lead.id
-                }
-            )
-            
-            return jsonify({'error': f'Messenger API error: {response_data["error"]["message"]}'}), 400
-        
-        # Log successful message
+        # The row exists before the send so its delivery receipts can be matched
         message = await prisma.message.create(
             data={
                 'type': 'TEXT',
                 'platform': 'MESSENGER',
                 'recipient': recipient_id,
                 'content': data['message'],
-                'status': 'SENT',
-                'sentAt': datetime.utcnow(),
-                'leadId': lead.id
+                'status': 'PENDING',
+                'leadId': lead_id
             }
         )
         
+        # Send message via Facebook Messenger API
+        try:
+            response_data = await send_messenger(page, recipient_id, data['message'])
+        except GraphAPIError as e:
+            await prisma.message.update(
+                where={'id': message.id},
+                data={'status': 'FAILED', 'errorMessage': str(e)[:1000]}
+            )
+            return jsonify({'error': f'Messenger API error: {str(e)}'}), 400
+        
+        provider_message_id = await record_sent(message.id, response_data)
+        
         await log_action(
             user_id=user_id,
             action='send_messenger_message',
@@ -339,9 +373,39 @@ async def send_messenger_message(page_id):
         return jsonify({
             'message': 'Message sent successfully',
             'message_id': message.id,
-            'facebook_message_id': response_data.get('message_id')
+            'facebook_message_id': provider_message_id
         })
         
     except Exception as e:
         return jsonify({'error': f'Failed to send message: {str(e)}'}), 500
 
+@facebook_bp.route('/webhook', methods=['GET', 'POST'])
+def messenger_webhook():
+    """Handle Messenger webhook events
+
+    Events are only verified and appended to a Redis stream here; the
+    worker's stream consumer turns them into leads and messages, so the
+    acknowledgement never waits on the database.
+    """
+    if request.method == 'GET':
+        # Webhook verification
+        mode = request.args.get('hub.mode')
+        token = request.args.get('hub.verify_token')
+        challenge = request.args.get('hub.challenge')
+
+        if mode == 'subscribe' and token and token == os.getenv('FACEBOOK_VERIFY_TOKEN'):
+            return challenge
+        return 'Forbidden', 403
+
+    raw_body = request.get_data()
+    if not verify_signature(raw_body, request.headers.get('X-Hub-Signature-256'), os.getenv('FACEBOOK_APP_SECRET')):
+        return 'Forbidden', 403
+
+    try:
+        enqueue_webhook(MESSENGER_STREAM, raw_body)
+    except Exception as e:
+        # A non-2xx makes Facebook redeliver the event later
+        print(f"Messenger webhook enqueue error: {str(e)}")
+        return 'Error', 503
+
+    return 'EVENT_RECEIVED', 200
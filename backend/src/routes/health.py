@@ -0,0 +1,28 @@
+from flask import Blueprint, Response, jsonify
+from src.utils.health import get_probe_results, readiness, render_metrics
+from src.utils.queue import get_queue_stats
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/health', methods=['GET'])
+def health():
+    """Liveness: the process is up and serving requests; touches no dependencies"""
+    return jsonify({'status': 'ok'})
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    """Readiness from the cached background probes; never probes inline"""
+    results = get_probe_results()
+    is_ready, failing = readiness(results)
+    body = {
+        'status': 'ready' if is_ready else 'not_ready',
+        'checks': {name: {'status': result['status'], 'checked_at': result['checked_at']} for name, result in results.items()}
+    }
+    if failing:
+        body['failing'] = failing
+    return jsonify(body), 200 if is_ready else 503
+
+@health_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics for queues and dependency probes, from cached values"""
+    return Response(render_metrics(get_queue_stats(), get_probe_results()), mimetype='text/plain; version=0.0.4')
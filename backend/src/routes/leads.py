@@ -5,17 +5,20 @@ import io
 import os
 from datetime import datetime, timedelta
 from src.models import Prisma
+from src.models.errors import UniqueViolationError
 from src.utils.audit import log_action
+from src.utils.api_keys import api_key_or_jwt_required, current_user_id
+from src.utils.eligibility import CHANNELS, MAX_ELIGIBILITY_BATCH, eligible_lead_ids, mark_leads_changed
 
 leads_bp = Blueprint('leads', __name__)
 prisma = Prisma()
 
 @leads_bp.route('/', methods=['GET'])
-@jwt_required()
+@api_key_or_jwt_required('leads:read')
 async def get_leads():
     """Get leads with filtering and pagination"""
     try:
-        user_id = get_jwt_identity()
+        user_id = current_user_id()
         
         # Get query parameters
         page = request.args.get('page', 1, type=int)
@@ -124,11 +127,11 @@ async def get_leads():
         return jsonify({'error': f'Failed to get leads: {str(e)}'}), 500
 
 @leads_bp.route('/', methods=['POST'])
-@jwt_required()
+@api_key_or_jwt_required('leads:write')
 async def create_lead():
     """Create a new lead"""
     try:
-        user_id = get_jwt_identity()
+        user_id = current_user_id()
         data = request.get_json()
         
         if not data:
@@ -179,7 +182,12 @@ async def create_lead():
         if data.get('facebookPageId'):
             lead_data['facebookPageId'] = data['facebookPageId']
         
-        lead = await prisma.lead.create(data=lead_data)
+        try:
+            lead = await prisma.lead.create(data=lead_data)
+        except UniqueViolationError:
+            # A concurrent request, import or ingest created the same profile or number first
+            return jsonify({'error': 'Lead with this email, phone, or Facebook ID already exists'}), 409
+        mark_leads_changed(user_id, [lead.id])
         
         # Add tags if provided
         if data.get('tagIds'):
@@ -217,11 +225,11 @@ async def create_lead():
         return jsonify({'error': f'Failed to create lead: {str(e)}'}), 500
 
 @leads_bp.route('/<lead_id>', methods=['PUT'])
-@jwt_required()
+@api_key_or_jwt_required('leads:write')
 async def update_lead(lead_id):
     """Update a lead"""
     try:
-        user_id = get_jwt_identity()
+        user_id = current_user_id()
         data = request.get_json()
         
         if not data:
@@ -252,10 +260,14 @@ async def update_lead(lead_id):
         
         if update_data:
             update_data['updatedAt'] = datetime.utcnow()
-            updated_lead = await prisma.lead.update(
-                where={'id': lead_id},
-                data=update_data
-            )
+            try:
+                updated_lead = await prisma.lead.update(
+                    where={'id': lead_id},
+                    data=update_data
+                )
+            except UniqueViolationError:
+                return jsonify({'error': 'Lead with this phone number already exists'}), 409
+            mark_leads_changed(user_id, [lead_id])
         else:
             updated_lead = lead
         
@@ -283,6 +295,40 @@ async def update_lead(lead_id):
     except Exception as e:
         return jsonify({'error': f'Failed to update lead: {str(e)}'}), 500
 
+@leads_bp.route('/eligibility', methods=['POST'])
+@api_key_or_jwt_required('leads:read')
+async def check_lead_eligibility():
+    """Filter lead IDs down to those that may be messaged on a channel"""
+    try:
+        user_id = current_user_id()
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({'error': 'Request data is required'}), 400
+        
+        channel = data.get('channel')
+        if channel not in CHANNELS:
+            return jsonify({'error': f'Channel must be one of: {", ".join(CHANNELS)}'}), 400
+        
+        lead_ids = data.get('leadIds')
+        if not isinstance(lead_ids, list):
+            return jsonify({'error': 'leadIds must be a list'}), 400
+        
+        if len(lead_ids) > MAX_ELIGIBILITY_BATCH:
+            return jsonify({'error': f'At most {MAX_ELIGIBILITY_BATCH} lead IDs per request'}), 400
+        
+        eligible = await eligible_lead_ids(user_id, channel, lead_ids)
+        
+        return jsonify({
+            'channel': channel,
+            'eligibleLeadIds': eligible,
+            'checked': len(lead_ids),
+            'eligible': len(eligible)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to check eligibility: {str(e)}'}), 500
+
 @leads_bp.route('/<lead_id>/tags', methods=['POST'])
 @jwt_required()
 async def add_lead_tags(lead_id):
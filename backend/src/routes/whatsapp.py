@@ -1,16 +1,25 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import requests
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 from src.models import Prisma
-from src.utils.security import encrypt_token, decrypt_token
+from src.utils.security import encrypt_token
 from src.utils.audit import log_action
-from src.utils.queue import add_message_job
+from src.utils.queue import add_message_job, add_message_jobs
+from src.utils.graph import GraphAPIError
+from src.utils.graph_cache import invalidate_graph_cache, verify_graph_token
+from src.utils.webhooks import WHATSAPP_STREAM, verify_signature, enqueue_webhook
+from src.utils.template_sync import queue_template_sync
+from src.utils.session_window import MAX_WINDOW_BATCH, get_window_expiries, is_window_open
+from src.utils.eligibility import find_eligible_lead_id, find_eligible_leads_by_phone
+from src.utils.media import MediaError, store_media
+from src.utils.ids import new_cuid
 
 whatsapp_bp = Blueprint('whatsapp', __name__)
 prisma = Prisma()
 
+MAX_BULK_RECIPIENTS = 5000
+
 @whatsapp_bp.route('/numbers', methods=['GET'])
 @jwt_required()
 async def get_whatsapp_numbers():
@@ -53,11 +62,9 @@ async def add_whatsapp_number():
             return jsonify({'error': 'Phone number, business account ID, and access token are required'}), 400
         
         # Verify the WhatsApp Business API token
-        verify_url = f'https://graph.facebook.com/v18.0/{data["businessAccountId"]}'
-        headers = {'Authorization': f'Bearer {data["accessToken"]}'}
-        
-        response = requests.get(verify_url, headers=headers)
-        if response.status_code != 200:
+        try:
+            verify_graph_token(data['businessAccountId'], data['accessToken'])
+        except GraphAPIError:
             return jsonify({'error': 'Invalid WhatsApp Business API token'}), 400
         
         # Check if number already exists
@@ -79,6 +86,10 @@ async def add_whatsapp_number():
             }
         )
         
+        # A newly connected number changes what this endpoint returns
+        invalidate_graph_cache(f'{data["businessAccountId"]}/phone_numbers', data['accessToken'])
+        await queue_template_sync(number.id)
+        
         await log_action(
             user_id=user_id,
             action='add_whatsapp_number',
@@ -103,7 +114,11 @@ async def add_whatsapp_number():
 @whatsapp_bp.route('/numbers/<number_id>/templates', methods=['GET'])
 @jwt_required()
 async def get_whatsapp_templates(number_id):
-    """Get WhatsApp message templates for a number"""
+    """Get WhatsApp message templates for a number
+
+    Templates are served from the database and kept current by the
+    background template sync; `?refresh=true` queues a sync.
+    """
     try:
         user_id = get_jwt_identity()
         
@@ -115,59 +130,15 @@ async def get_whatsapp_templates(number_id):
         if not number:
             return jsonify({'error': 'WhatsApp number not found'}), 404
         
-        # Get templates from database
-        templates = await prisma.whatsapptemplate.find_many(
-            where={'whatsappNumberId': number_id}
-        )
+        syncing = False
+        if number.templatesSyncedAt is None or request.args.get('refresh', 'false').lower() == 'true':
+            # Deduplicate repeated refreshes within the same minute
+            minute = int(datetime.utcnow().timestamp() // 60)
+            syncing = bool(await queue_template_sync(number.id, dedupe_key=f'manual-{minute}'))
         
-        # Also fetch latest templates from WhatsApp API
-        access_token = decrypt_token(number.accessToken)
-        if access_token:
-            templates_url = f'https://graph.facebook.com/v18.0/{number.businessAccountId}/message_templates'
-            headers = {'Authorization': f'Bearer {access_token}'}
-            
-            response = requests.get(templates_url, headers=headers)
-            if response.status_code == 200:
-                api_templates = response.json().get('data', [])
-                
-                # Update database with latest templates
-                for template_data in api_templates:
-                    existing_template = await prisma.whatsapptemplate.find_unique(
-                        where={
-                            'whatsappNumberId_name': {
-                                'whatsappNumberId': number_id,
-                                'name': template_data['name']
-                            }
-                        }
-                    )
-                    
-                    template_info = {
-                        'name': template_data['name'],
-                        'language': template_data['language'],
-                        'status': template_data['status'],
-                        'category': template_data['category'],
-                        'components': template_data.get('components', [])
-                    }
-                    
-                    if existing_template:
-                        await prisma.whatsapptemplate.update(
-                            where={'id': existing_template.id},
-                            data={
-                                **template_info,
-                                'updatedAt': datetime.utcnow()
-                            }
-                        )
-                    else:
-                        await prisma.whatsapptemplate.create(
-                            data={
-                                **template_info,
-                                'whatsappNumberId': number_id
-                            }
-                        )
-        
-        # Get updated templates from database
-        updated_templates = await prisma.whatsapptemplate.find_many(
-            where={'whatsappNumberId': number_id}
+        templates = await prisma.whatsapptemplate.find_many(
+            where={'whatsappNumberId': number_id},
+            order_by={'name': 'asc'}
         )
         
         templates_data = [
@@ -180,10 +151,14 @@ async def get_whatsapp_templates(number_id):
                 'components': template.components,
                 'createdAt': template.createdAt.isoformat(),
                 'updatedAt': template.updatedAt.isoformat()
-            } for template in updated_templates
+            } for template in templates
         ]
         
-        return jsonify({'templates': templates_data})
+        return jsonify({
+            'templates': templates_data,
+            'syncedAt': number.templatesSyncedAt.isoformat() if number.templatesSyncedAt else None,
+            'syncing': syncing
+        })
         
     except Exception as e:
         return jsonify({'error': f'Failed to get WhatsApp templates: {str(e)}'}), 500
@@ -210,15 +185,9 @@ async def send_whatsapp_template(number_id):
         
         # Check if recipient has consented
         recipient_phone = data['recipient']
-        lead = await prisma.lead.find_first(
-            where={
-                'phoneNumber': recipient_phone,
-                'consentGiven': True,
-                'userId': user_id
-            }
-        )
+        lead_id = await find_eligible_lead_id(user_id, 'whatsapp', phone_number=recipient_phone)
         
-        if not lead:
+        if not lead_id:
             return jsonify({'error': 'Recipient has not consented to receive messages'}), 403
         
         # Get template
@@ -234,37 +203,50 @@ async def send_whatsapp_template(number_id):
         if not template or template.status != 'APPROVED':
             return jsonify({'error': 'Template not found or not approved'}), 400
         
+        # Optional header image, video or document uploaded through /media
+        media_asset_id = data.get('mediaAssetId')
+        if media_asset_id and not await prisma.mediaasset.find_first(
+            where={'id': media_asset_id, 'userId': user_id}
+        ):
+            return jsonify({'error': 'Media not found'}), 404
+        
+        # Create message record so the queued job can be linked back to it
+        message = await prisma.message.create(
+            data={
+                'type': 'TEMPLATE',
+                'platform': 'WHATSAPP',
+                'recipient': recipient_phone,
+                'content': f'Template: {data["templateName"]}',
+                'status': 'PENDING',
+                'leadId': lead_id,
+                'whatsappNumberId': number_id,
+                'whatsappTemplateId': template.id,
+                'mediaAssetId': media_asset_id
+            }
+        )
+        
         # Add message to queue for sending
         job_data = {
             'type': 'whatsapp_template',
+            'message_id': message.id,
             'number_id': number_id,
             'recipient': recipient_phone,
             'template_name': data['templateName'],
             'language': data['language'],
             'parameters': data.get('parameters', []),
-            'lead_id': lead.id,
+            'lead_id': lead_id,
             'user_id': user_id
         }
         
         job_id = await add_message_job(job_data)
         
         if not job_id:
+            await prisma.message.update(
+                where={'id': message.id},
+                data={'status': 'FAILED', 'errorMessage': 'Failed to queue message'}
+            )
             return jsonify({'error': 'Failed to queue message'}), 500
         
-        # Create message record
-        message = await prisma.message.create(
-            data={
-                'type': 'TEMPLATE',
-                'platform': 'WHATSAPP',
-                'recipient': recipient_phone,
-                'content': f'Template: {data["templateName"]}',
-                'status': 'PENDING',
-                'leadId': lead.id,
-                'whatsappNumberId': number_id,
-                'whatsappTemplateId': template.id
-            }
-        )
-        
         await log_action(
             user_id=user_id,
             action='send_whatsapp_template',
@@ -286,6 +268,146 @@ async def send_whatsapp_template(number_id):
     except Exception as e:
         return jsonify({'error': f'Failed to send template message: {str(e)}'}), 500
 
+@whatsapp_bp.route('/numbers/<number_id>/send-template/bulk', methods=['POST'])
+@jwt_required()
+async def send_whatsapp_template_bulk(number_id):
+    """Send a WhatsApp template message to many recipients
+    
+    Consent is checked for the whole batch in one index lookup, the
+    template is resolved once, and messages and jobs are written in bulk.
+    Every entry gets a result in request order.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        
+        if not data or not data.get('templateName') or not data.get('language'):
+            return jsonify({'error': 'Template name and language are required'}), 400
+        
+        entries = data.get('recipients')
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'error': 'Recipients must be a non-empty list'}), 400
+        
+        if len(entries) > MAX_BULK_RECIPIENTS:
+            return jsonify({'error': f'At most {MAX_BULK_RECIPIENTS} recipients per request'}), 400
+        
+        # Verify user owns the number
+        number = await prisma.whatsappnumber.find_unique(
+            where={'id': number_id, 'userId': user_id}
+        )
+        
+        if not number:
+            return jsonify({'error': 'WhatsApp number not found'}), 404
+        
+        template = await prisma.whatsapptemplate.find_unique(
+            where={
+                'whatsappNumberId_name': {
+                    'whatsappNumberId': number_id,
+                    'name': data['templateName']
+                }
+            }
+        )
+        
+        if not template or template.status != 'APPROVED':
+            return jsonify({'error': 'Template not found or not approved'}), 400
+        
+        # Optional header image, video or document uploaded through /media
+        media_asset_id = data.get('mediaAssetId')
+        if media_asset_id and not await prisma.mediaasset.find_first(
+            where={'id': media_asset_id, 'userId': user_id}
+        ):
+            return jsonify({'error': 'Media not found'}), 404
+        
+        recipients = [
+            entry.get('recipient') if isinstance(entry, dict) else None
+            for entry in entries
+        ]
+        lead_ids = await find_eligible_leads_by_phone(
+            user_id, 'whatsapp', [recipient for recipient in recipients if recipient]
+        )
+        
+        results, messages, jobs_data = [], [], []
+        seen = set()
+        for entry, recipient in zip(entries, recipients):
+            if not recipient:
+                results.append({'recipient': recipient, 'status': 'invalid', 'error': 'Recipient is required'})
+                continue
+            if recipient in seen:
+                results.append({'recipient': recipient, 'status': 'duplicate'})
+                continue
+            seen.add(recipient)
+            
+            lead_id = lead_ids.get(recipient)
+            if not lead_id:
+                results.append({'recipient': recipient, 'status': 'rejected', 'error': 'Recipient has not consented to receive messages'})
+                continue
+            
+            # IDs are assigned up front so create_many rows and jobs line up
+            message_id = new_cuid()
+            messages.append({
+                'id': message_id,
+                'type': 'TEMPLATE',
+                'platform': 'WHATSAPP',
+                'recipient': recipient,
+                'content': f'Template: {data["templateName"]}',
+                'status': 'PENDING',
+                'leadId': lead_id,
+                'whatsappNumberId': number_id,
+                'whatsappTemplateId': template.id,
+                'mediaAssetId': media_asset_id
+            })
+            jobs_data.append({
+                'type': 'whatsapp_template',
+                'message_id': message_id,
+                'number_id': number_id,
+                'recipient': recipient,
+                'template_name': data['templateName'],
+                'language': data['language'],
+                'parameters': entry.get('parameters', []),
+                'lead_id': lead_id,
+                'user_id': user_id
+            })
+            results.append({'recipient': recipient, 'status': 'queued', 'message_id': message_id})
+        
+        job_ids = []
+        if messages:
+            await prisma.message.create_many(data=messages)
+            
+            job_ids = await add_message_jobs(jobs_data)
+            if job_ids is None:
+                await prisma.message.update_many(
+                    where={'id': {'in': [message['id'] for message in messages]}},
+                    data={'status': 'FAILED', 'errorMessage': 'Failed to queue message'}
+                )
+                return jsonify({'error': 'Failed to queue messages'}), 500
+        
+        queued_jobs = iter(job_ids)
+        for result in results:
+            if result['status'] == 'queued':
+                result['job_id'] = next(queued_jobs)
+        
+        await log_action(
+            user_id=user_id,
+            action='send_whatsapp_template_bulk',
+            resource='whatsapp_number',
+            resource_id=number_id,
+            details={
+                'template_name': data['templateName'],
+                'requested': len(entries),
+                'queued': len(messages)
+            }
+        )
+        
+        return jsonify({
+            'message': f'{len(messages)} of {len(entries)} template messages queued',
+            'queued': len(messages),
+            'rejected': len(entries) - len(messages),
+            'results': results
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to send template messages: {str(e)}'}), 500
+
 @whatsapp_bp.route('/numbers/<number_id>/send-text', methods=['POST'])
 @jwt_required()
 async def send_whatsapp_text(number_id):
@@ -307,18 +429,7 @@ async def send_whatsapp_text(number_id):
         
         # Check if recipient has messaged recently (24-hour window)
         recipient_phone = data['recipient']
-        recent_message = await prisma.message.find_first(
-            where={
-                'recipient': recipient_phone,
-                'platform': 'WHATSAPP',
-                'createdAt': {
-                    'gte': datetime.utcnow() - timedelta(hours=24)
-                }
-            },
-            order_by={'createdAt': 'desc'}
-        )
-        
-        if not recent_message:
+        if not await is_window_open(number_id, recipient_phone):
             return jsonify({'error': 'Can only send text messages within 24 hours of last customer message. Use template messages instead.'}), 403
         
         # Get lead
@@ -332,9 +443,23 @@ async def send_whatsapp_text(number_id):
         if not lead:
             return jsonify({'error': 'Lead not found'}), 404
         
+        # Create message record so the queued job can be linked back to it
+        message = await prisma.message.create(
+            data={
+                'type': 'TEXT',
+                'platform': 'WHATSAPP',
+                'recipient': recipient_phone,
+                'content': data['message'],
+                'status': 'PENDING',
+                'leadId': lead.id,
+                'whatsappNumberId': number_id
+            }
+        )
+        
         # Add message to queue for sending
         job_data = {
             'type': 'whatsapp_text',
+            'message_id': message.id,
             'number_id': number_id,
             'recipient': recipient_phone,
             'message': data['message'],
@@ -345,44 +470,212 @@ async def send_whatsapp_text(number_id):
         job_id = await add_message_job(job_data)
         
         if not job_id:
+            await prisma.message.update(
+                where={'id': message.id},
+                data={'status': 'FAILED', 'errorMessage': 'Failed to queue message'}
+            )
             return jsonify({'error': 'Failed to queue message'}), 500
         
-        # Create message record
+        await log_action(
+            user_id=user_id,
+            action='send_whatsapp_text',
+            resource='message',
+            resource_id=message.id,
+            details={
+                'recipient': recipient_phone,
+                'job_id': job_id
+            }
+        )
+        
+        return jsonify({
+            'message': 'Text message queued successfully',
+            'message_id': message.id,
+            'job_id': job_id
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to send text message: {str(e)}'}), 500
+
+@whatsapp_bp.route('/media', methods=['POST'])
+@jwt_required()
+async def upload_media():
+    """Upload a media file for WhatsApp messages
+    
+    Files are stored once per user by content hash; uploading the same
+    file again returns the existing media. It is sent to WhatsApp on
+    first use from each number.
+    """
+    try:
+        user_id = get_jwt_identity()
+        upload = request.files.get('file')
+        
+        if not upload or not upload.filename:
+            return jsonify({'error': 'A file is required'}), 400
+        
+        try:
+            asset = await store_media(user_id, upload.stream, upload.mimetype, upload.filename)
+        except MediaError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        await log_action(
+            user_id=user_id,
+            action='upload_media',
+            resource='media',
+            resource_id=asset.id,
+            details={'mime_type': asset.mimeType, 'size': asset.size}
+        )
+        
+        return jsonify({
+            'message': 'Media uploaded successfully',
+            'media': {
+                'id': asset.id,
+                'sha256': asset.sha256,
+                'mimeType': asset.mimeType,
+                'size': asset.size,
+                'filename': asset.filename
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to upload media: {str(e)}'}), 500
+
+@whatsapp_bp.route('/numbers/<number_id>/send-media', methods=['POST'])
+@jwt_required()
+async def send_whatsapp_media(number_id):
+    """Send a WhatsApp media message (only within 24-hour window)"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        
+        if not data or not data.get('recipient') or not data.get('mediaAssetId'):
+            return jsonify({'error': 'Recipient and media ID are required'}), 400
+        
+        # Verify user owns the number
+        number = await prisma.whatsappnumber.find_unique(
+            where={'id': number_id, 'userId': user_id}
+        )
+        
+        if not number:
+            return jsonify({'error': 'WhatsApp number not found'}), 404
+        
+        asset = await prisma.mediaasset.find_first(
+            where={'id': data['mediaAssetId'], 'userId': user_id}
+        )
+        
+        if not asset:
+            return jsonify({'error': 'Media not found'}), 404
+        
+        recipient_phone = data['recipient']
+        if not await is_window_open(number_id, recipient_phone):
+            return jsonify({'error': 'Can only send media messages within 24 hours of last customer message. Use template messages instead.'}), 403
+        
+        lead = await prisma.lead.find_first(
+            where={
+                'phoneNumber': recipient_phone,
+                'userId': user_id
+            }
+        )
+        
+        if not lead:
+            return jsonify({'error': 'Lead not found'}), 404
+        
+        # The caption is kept as the message content
         message = await prisma.message.create(
             data={
-                'type': 'TEXT',
+                'type': 'MEDIA',
                 'platform': 'WHATSAPP',
                 'recipient': recipient_phone,
-                'content': data['message'],
+                'content': data.get('caption') or '',
                 'status': 'PENDING',
                 'leadId': lead.id,
-                'whatsappNumberId': number_id
+                'whatsappNumberId': number_id,
+                'mediaAssetId': asset.id
             }
         )
         
+        job_data = {
+            'type': 'whatsapp_media',
+            'message_id': message.id,
+            'number_id': number_id,
+            'recipient': recipient_phone,
+            'lead_id': lead.id,
+            'user_id': user_id
+        }
+        
+        job_id = await add_message_job(job_data)
+        
+        if not job_id:
+            await prisma.message.update(
+                where={'id': message.id},
+                data={'status': 'FAILED', 'errorMessage': 'Failed to queue message'}
+            )
+            return jsonify({'error': 'Failed to queue message'}), 500
+        
         await log_action(
             user_id=user_id,
-            action='send_whatsapp_text',
+            action='send_whatsapp_media',
             resource='message',
             resource_id=message.id,
             details={
                 'recipient': recipient_phone,
+                'media_id': asset.id,
                 'job_id': job_id
             }
         )
         
         return jsonify({
-            'message': 'Text message queued successfully',
+            'message': 'Media message queued successfully',
             'message_id': message.id,
             'job_id': job_id
         })
         
     except Exception as e:
-        return jsonify({'error': f'Failed to send text message: {str(e)}'}), 500
+        return jsonify({'error': f'Failed to send media message: {str(e)}'}), 500
+
+@whatsapp_bp.route('/numbers/<number_id>/windows', methods=['POST'])
+@jwt_required()
+async def get_conversation_windows(number_id):
+    """Get the 24-hour window status of many recipients at once"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        
+        recipients = (data or {}).get('recipients')
+        if not isinstance(recipients, list) or not recipients:
+            return jsonify({'error': 'recipients must be a non-empty list'}), 400
+        
+        if len(recipients) > MAX_WINDOW_BATCH:
+            return jsonify({'error': f'At most {MAX_WINDOW_BATCH} recipients per request'}), 400
+        
+        number = await prisma.whatsappnumber.find_first(
+            where={'id': number_id, 'userId': user_id}
+        )
+        
+        if not number:
+            return jsonify({'error': 'WhatsApp number not found'}), 404
+        
+        expiries = await get_window_expiries(number.id, [str(recipient) for recipient in recipients])
+        
+        return jsonify({
+            'windows': {
+                recipient: {
+                    'open': expires_at is not None,
+                    'expiresAt': expires_at.isoformat() if expires_at else None
+                } for recipient, expires_at in expiries.items()
+            },
+            'openCount': sum(1 for expires_at in expiries.values() if expires_at)
+        })
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get conversation windows: {str(e)}'}), 500
 
 @whatsapp_bp.route('/webhook', methods=['GET', 'POST'])
 def whatsapp_webhook():
-    """Handle WhatsApp webhook for message status updates"""
+    """Handle WhatsApp webhook for incoming messages and status updates
+
+    Events are verified and appended to a Redis stream; the worker's
+    stream consumer deduplicates them and applies them in batches.
+    """
     if request.method == 'GET':
         # Webhook verification
         verify_token = os.getenv('WHATSAPP_VERIFY_TOKEN')
@@ -390,43 +683,20 @@ def whatsapp_webhook():
         token = request.args.get('hub.verify_token')
         challenge = request.args.get('hub.challenge')
         
-        if mode == 'subscribe' and token == verify_token:
+        if mode == 'subscribe' and token and token == verify_token:
             return challenge
         else:
             return 'Forbidden', 403
     
-    elif request.method == 'POST':
-        # Handle webhook events
-        try:
-            data = request.get_json()
-            
-            # Process webhook data (message status updates, incoming messages)
-            for entry in data.get('entry', []):
-                for change in entry.get('changes', []):
-                    if change.get('field') == 'messages':
-                        value = change.get('value', {})
-                        
-                        # Handle message status updates
-                        for status in value.get('statuses', []):
-                            message_id = status.get('id')
-                            status_type = status.get('status')
-                            timestamp = status.get('timestamp')
-                            
-                            # Update message status in database
-                            # This would require storing WhatsApp message IDs
-                            # Implementation depends on your message tracking needs
-                        
-                        # Handle incoming messages
-                        for message in value.get('messages', []):
-                            from_number = message.get('from')
-                            message_type = message.get('type')
-                            
-                            # Create or update lead for incoming message
-                            # This ensures we can respond within 24-hour window
-                            
-            return 'OK', 200
-            
-        except Exception as e:
-            print(f"Webhook error: {str(e)}")
-            return 'Error', 500
-
+    raw_body = request.get_data()
+    if not verify_signature(raw_body, request.headers.get('X-Hub-Signature-256'), os.getenv('FACEBOOK_APP_SECRET')):
+        return 'Forbidden', 403
+    
+    try:
+        enqueue_webhook(WHATSAPP_STREAM, raw_body)
+    except Exception as e:
+        # A non-2xx makes Meta redeliver the event later
+        print(f"Webhook error: {str(e)}")
+        return 'Error', 503
+    
+    return 'OK', 200
@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, jsonify, request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from src.models import Prisma
+from src.utils.invalidation import (
+    is_listening, publish_invalidation, register_invalidation, start_invalidation_listener
+)
+from src.utils.queue import redis_client
+from src.utils.security import hash_api_key
+
+prisma = Prisma()
+
+API_KEY_HEADER = 'X-API-Key'
+# Pub/sub is the normal invalidation path; the TTL bounds staleness if a message is lost
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', 300))
+API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', 1024))
+# Unknown keys are remembered briefly so guessing does not reach the database
+NEGATIVE_CACHE_TTL = 60
+LAST_USED_INTERVAL = 60
+INVALIDATION_CHANNEL = 'api-keys:invalidate'
+WILDCARD_PERMISSION = '*'
+
+# key hash -> (cached at, entry or None for an unknown key)
+_cache = OrderedDict()
+_hash_by_id = {}
+_cache_lock = threading.Lock()
+_last_touched = {}
+
+def _clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _hash_by_id.clear()
+
+def _evict(key_id):
+    with _cache_lock:
+        if key_id == WILDCARD_PERMISSION:
+            _cache.clear()
+            _hash_by_id.clear()
+            return
+        key_hash = _hash_by_id.pop(key_id, None)
+        if key_hash:
+            _cache.pop(key_hash, None)
+
+register_invalidation(INVALIDATION_CHANNEL, _evict, _clear_cache)
+
+def invalidate_api_key(key_id):
+    """Drop a key from every process's cache; call after updating or deleting it"""
+    _evict(key_id)
+    publish_invalidation(INVALIDATION_CHANNEL, key_id)
+
+def _cached(key_hash):
+    with _cache_lock:
+        cached = _cache.get(key_hash)
+        if cached is None:
+            return False, None
+        cached_at, entry = cached
+        ttl = API_KEY_CACHE_TTL if entry else NEGATIVE_CACHE_TTL
+        if time.monotonic() - cached_at > ttl:
+            del _cache[key_hash]
+            return False, None
+        _cache.move_to_end(key_hash)
+        return True, entry
+
+def _store(key_hash, entry):
+    # Without the listener, an update elsewhere could go unnoticed
+    if entry and not is_listening():
+        return
+    with _cache_lock:
+        _cache[key_hash] = (time.monotonic(), entry)
+        _cache.move_to_end(key_hash)
+        if entry:
+            _hash_by_id[entry['id']] = key_hash
+        while len(_cache) > API_KEY_CACHE_SIZE:
+            _, (_, evicted) = _cache.popitem(last=False)
+            if evicted:
+                _hash_by_id.pop(evicted['id'], None)
+
+async def authenticate_api_key(api_key):
+    """Get the usable key record for a presented key, or None
+
+    Verified keys are served from the in-process cache; expiry is checked
+    on every call, so keys stop working on time without an invalidation.
+    """
+    start_invalidation_listener()
+    key_hash = hash_api_key(api_key)
+    found, entry = _cached(key_hash)
+    if not found:
+        record = await prisma.apikey.find_unique(where={'keyHash': key_hash})
+        entry = {
+            'id': record.id,
+            'userId': record.userId,
+            'permissions': list(record.permissions or []),
+            'isActive': record.isActive,
+            'expiresAt': record.expiresAt
+        } if record else None
+        _store(key_hash, entry)
+
+    if not entry or not entry['isActive']:
+        return None
+    if entry['expiresAt'] and entry['expiresAt'] <= datetime.now(timezone.utc):
+        return None
+    return entry
+
+async def touch_api_key(entry):
+    """Update lastUsedAt at most once per key per minute across all processes"""
+    now = time.monotonic()
+    if now - _last_touched.get(entry['id'], -LAST_USED_INTERVAL) < LAST_USED_INTERVAL:
+        return
+    _last_touched[entry['id']] = now
+    try:
+        if redis_client.set(f'api-key-used:{entry["id"]}', 1, nx=True, ex=LAST_USED_INTERVAL):
+            await prisma.apikey.update_many(where={'id': entry['id']}, data={'lastUsedAt': datetime.utcnow()})
+    except Exception as e:
+        print(f"Failed to update API key last use: {str(e)}")
+
+def init_api_key_auth(app):
+    """Authenticate requests that present an API key"""
+
+    @app.before_request
+    async def authenticate_request():
+        api_key = request.headers.get(API_KEY_HEADER)
+        if not api_key:
+            return None
+        entry = await authenticate_api_key(api_key)
+        if not entry:
+            return jsonify({'error': 'Invalid or expired API key'}), 401
+        g.api_key = entry
+        await touch_api_key(entry)
+        return None
+
+def has_permission(entry, permission):
+    permissions = entry['permissions']
+    return WILDCARD_PERMISSION in permissions or permission in permissions
+
+def api_key_or_jwt_required(permission):
+    """Accept a JWT, or an API key with `permission` acting as its owner"""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            entry = g.get('api_key')
+            if entry is None:
+                verify_jwt_in_request()
+                g.user_id = get_jwt_identity()
+            elif not has_permission(entry, permission):
+                return jsonify({'error': f'API key lacks the {permission} permission'}), 403
+            elif not entry['userId']:
+                return jsonify({'error': 'API key has no owner'}), 403
+            else:
+                g.user_id = entry['userId']
+            return await f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def current_user_id():
+    """ID of the user a request acts as, from its JWT or API key"""
+    return g.get('user_id')
@@ -1,47 +1,454 @@
+import asyncio
+import atexit
+import base64
+import fcntl
+import json
+import os
+import random
+import threading
+import uuid
+from collections import deque
 from datetime import datetime
+from flask import has_request_context
 from src.models import Prisma
 from src.utils.security import get_client_ip, get_user_agent
 
 prisma = Prisma()
+# The writer thread runs its own event loop, so it gets its own client
+writer_prisma = Prisma()
+
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', 10000))
+AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))
+AUDIT_BATCH_SIZE = 500
+AUDIT_SPOOL_PATH = os.getenv(
+    'AUDIT_SPOOL_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'spool', 'audit.jsonl')
+)
+# How often the spool is retried while the database is unavailable
+SPOOL_RETRY_INTERVAL = 30
+SHUTDOWN_TIMEOUT = 5
+
+# How log_action records an action: every call, a random sample of calls,
+# or one row per (minute, user, action) holding the call count
+RECORD = 'record'
+SAMPLE = 'sample'
+ROLLUP = 'rollup'
+# Only reads may be sampled or rolled up; writes and consent changes are
+# always recorded, whatever the configuration says
+READ_ACTION_PREFIXES = ('view_', 'get_', 'check_')
+DEFAULT_ACTION_POLICIES = {
+    'view_audit_logs': (ROLLUP, None),
+    'view_admin_dashboard': (ROLLUP, None),
+    'view_users': (ROLLUP, None),
+    'view_data_requests': (ROLLUP, None),
+    'view_dead_letters': (ROLLUP, None),
+    'view_api_keys': (ROLLUP, None),
+    'check_system_health': (ROLLUP, None),
+    'get_page_posts': (ROLLUP, None),
+    'get_facebook_pages': (ROLLUP, None),
+}
+
+# Totals are counted exactly up to this many rows, then estimated
+AUDIT_COUNT_CAP = 10000
+COUNT_MODES = ('estimate', 'exact', 'none')
+
+def parse_action_policies(spec):
+    """Parse 'action=rollup,action=sample:0.1,action=record' into policies
+
+    Entries for actions that are not reads are ignored.
+    """
+    policies = {}
+    for entry in filter(None, (part.strip() for part in (spec or '').split(','))):
+        action, _, policy = entry.partition('=')
+        mode, _, rate = policy.strip().partition(':')
+        action = action.strip()
+        if mode not in (RECORD, SAMPLE, ROLLUP) or (mode == SAMPLE and not rate):
+            raise ValueError(f'Invalid audit policy: {entry}')
+        if not action.startswith(READ_ACTION_PREFIXES):
+            print(f"Ignoring audit policy for {action}: only read actions can be sampled or rolled up")
+            continue
+        policies[action] = (mode, float(rate) if mode == SAMPLE else None)
+    return policies
+
+AUDIT_ACTION_POLICIES = {**DEFAULT_ACTION_POLICIES, **parse_action_policies(os.getenv('AUDIT_ACTION_POLICIES'))}
+
+def action_policy(action):
+    """Get the (mode, sample rate) log_action applies to an action"""
+    if not action or not action.startswith(READ_ACTION_PREFIXES):
+        return RECORD, None
+    return AUDIT_ACTION_POLICIES.get(action, (RECORD, None))
+
+_buffer = deque()
+# (minute, user, action, resource) -> calls, turned into rows once the minute ends
+_rollups = {}
+_rollups_lock = threading.Lock()
+_wake = threading.Event()
+_stopping = threading.Event()
+_spool_lock = threading.Lock()
+_writer = None
+_writer_guard = threading.Lock()
 
 async def log_action(user_id=None, action=None, resource=None, resource_id=None, details=None):
-    """Log an action for audit purposes"""
+    """Log an action for audit purposes
+
+    The request context is captured now and the event is queued for the
+    writer thread, so the request never waits on the database. Read
+    actions may instead be sampled or counted, see AUDIT_ACTION_POLICIES.
+    """
     try:
-        await prisma.auditlog.create(
-            data={
-                'userId': user_id,
-                'action': action,
-                'resource': resource,
-                'resourceId': resource_id,
-                'details': details,
-                'ipAddress': get_client_ip(),
-                'userAgent': get_user_agent(),
-                'createdAt': datetime.utcnow()
-            }
-        )
+        mode, rate = action_policy(action)
+        if mode == ROLLUP:
+            minute = datetime.utcnow().replace(second=0, microsecond=0)
+            with _rollups_lock:
+                key = (minute, user_id, action, resource)
+                _rollups[key] = _rollups.get(key, 0) + 1
+            start_audit_writer()
+            return
+        if mode == SAMPLE:
+            if random.random() >= rate:
+                return
+            details = {'sampleRate': rate, **details} if isinstance(details, dict) else {'sampleRate': rate, 'details': details}
+
+        event = {
+            'id': uuid.uuid4().hex,
+            'userId': user_id,
+            'action': action,
+            'resource': resource,
+            'resourceId': resource_id,
+            'details': details,
+            'ipAddress': get_client_ip() if has_request_context() else None,
+            'userAgent': get_user_agent() if has_request_context() else None,
+            'createdAt': datetime.utcnow()
+        }
+        if len(_buffer) >= AUDIT_BUFFER_SIZE:
+            # The writer is behind; keep the event on disk rather than drop it
+            _spool([event])
+            return
+        _buffer.append(event)
+        if len(_buffer) >= AUDIT_BATCH_SIZE:
+            _wake.set()
+        start_audit_writer()
     except Exception as e:
-        # Log to system logger if database logging fails
+        # Log to system logger if the event cannot be queued
         print(f"Failed to log audit action: {str(e)}")
 
-async def get_audit_logs(user_id=None, resource=None, limit=100, offset=0):
-    """Get audit logs with optional filtering"""
+def _close_rollups(everything=False):
+    """Turn finished minutes of rolled-up calls into audit rows"""
+    current = datetime.utcnow().replace(second=0, microsecond=0)
+    with _rollups_lock:
+        closed = [key for key in _rollups if everything or key[0] < current]
+        counts = {key: _rollups.pop(key) for key in closed}
+    return [
+        {
+            'id': uuid.uuid4().hex,
+            'userId': user_id,
+            'action': action,
+            'resource': resource,
+            'resourceId': None,
+            'details': {'rollup': 'minute', 'count': count},
+            'ipAddress': None,
+            'userAgent': None,
+            'createdAt': minute
+        } for (minute, user_id, action, resource), count in counts.items()
+    ]
+
+def _drain(limit=None):
+    batch = []
+    while _buffer and (limit is None or len(batch) < limit):
+        batch.append(_buffer.popleft())
+    return batch
+
+def _lock_path(f, path, blocking=True):
+    """Lock an open spool file; False if it is locked elsewhere or no longer at path
+
+    Locks are released when their process exits, so a lock that can be
+    taken means nobody is using the file.
+    """
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    try:
+        # Another process may have claimed the file while we waited
+        return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+def _spool(events):
+    """Append events to the spool file, one JSON object per line"""
+    if not events:
+        return
+    lines = ''.join(json.dumps({**event, 'createdAt': event['createdAt'].isoformat()}, default=str) + '\n' for event in events)
+    with _spool_lock:
+        os.makedirs(os.path.dirname(AUDIT_SPOOL_PATH), exist_ok=True)
+        while True:
+            with open(AUDIT_SPOOL_PATH, 'a') as f:
+                if not _lock_path(f, AUDIT_SPOOL_PATH):
+                    # Claimed for replay before we wrote; append to the new spool
+                    continue
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+                return
+
+def _read_spool(path):
+    events = []
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+                event['createdAt'] = datetime.fromisoformat(event['createdAt'])
+                events.append(event)
+            except (ValueError, KeyError):
+                # A torn last line from a crash mid-write
+                print(f"Skipping unreadable audit spool line: {line[:100]!r}")
+    return events
+
+async def _insert(events):
+    # Event IDs are assigned up front, so replaying a batch is idempotent
+    await writer_prisma.auditlog.create_many(data=events, skip_duplicates=True)
+
+async def _flush():
+    """Write everything buffered; spool batches the database rejects"""
+    while _buffer:
+        batch = _drain(AUDIT_BATCH_SIZE)
+        try:
+            await _insert(batch)
+        except Exception as e:
+            print(f"Failed to write audit logs, spooling {len(batch)}: {str(e)}")
+            _spool(batch + _drain())
+            return False
+    return True
+
+def _claim_spool_files():
+    """Take the spool and any abandoned replay files for this process
+
+    Each file is locked before it is renamed to a name only this call
+    owns, and stays locked until it has been replayed. New events keep
+    going to a fresh spool meanwhile. A replay file whose lock can be
+    taken belongs to a process that died mid-replay. Returns (path, open
+    file) pairs; the caller closes them.
+    """
+    directory = os.path.dirname(AUDIT_SPOOL_PATH)
+    base = os.path.basename(AUDIT_SPOOL_PATH)
+    candidates = [AUDIT_SPOOL_PATH]
+    if os.path.isdir(directory):
+        candidates.extend(
+            os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(f'{base}.') and name.endswith('.replaying')
+        )
+
+    claimed = []
+    with _spool_lock:
+        for path in candidates:
+            try:
+                f = open(path)
+            except FileNotFoundError:
+                continue
+            if not _lock_path(f, path, blocking=False):
+                f.close()
+                continue
+            target = f'{AUDIT_SPOOL_PATH}.{uuid.uuid4().hex}.replaying'
+            os.replace(path, target)
+            claimed.append((target, f))
+    return claimed
+
+async def replay_spool():
+    """Insert spooled events; returns how many were written
+
+    Runs on the writer thread, which owns its event loop, so file work is
+    done inline rather than on the default executor; that executor is
+    gone by the time the interpreter runs its exit hooks.
+    """
+    written = 0
+    for path, f in _claim_spool_files():
+        try:
+            events = _read_spool(path)
+            done = 0
+            try:
+                for start in range(0, len(events), AUDIT_BATCH_SIZE):
+                    await _insert(events[start:start + AUDIT_BATCH_SIZE])
+                    done = start + AUDIT_BATCH_SIZE
+            except Exception as e:
+                print(f"Failed to replay audit spool: {str(e)}")
+                _spool(events[done:])
+            os.unlink(path)
+            written += min(done, len(events))
+        finally:
+            f.close()
+    return written
+
+async def _run_writer():
+    next_replay = 0
+    while True:
+        stopping = _stopping.is_set()
+        try:
+            if not writer_prisma.is_connected():
+                await writer_prisma.connect()
+            _buffer.extend(_close_rollups(everything=stopping))
+            flushed = await _flush()
+            loop_time = asyncio.get_running_loop().time()
+            if flushed and loop_time >= next_replay:
+                if await replay_spool():
+                    print("Replayed spooled audit logs")
+                next_replay = loop_time + SPOOL_RETRY_INTERVAL
+        except Exception as e:
+            print(f"Audit writer error: {str(e)}")
+            _spool(_drain())
+        if stopping:
+            break
+        # Nothing else runs on this thread's loop, so it can block here
+        _wake.wait(AUDIT_FLUSH_INTERVAL)
+        _wake.clear()
+
+    try:
+        if writer_prisma.is_connected():
+            await writer_prisma.disconnect()
+    except Exception as e:
+        print(f"Failed to disconnect audit writer: {str(e)}")
+
+def _writer_main():
+    asyncio.run(_run_writer())
+
+def start_audit_writer():
+    """Start the writer thread once per process; it replays the spool first
+
+    log_action calls this, so only processes that audit something run a
+    writer.
+    """
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_guard:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_main, name='audit-writer', daemon=True)
+            _writer.start()
+
+@atexit.register
+def stop_audit_writer():
+    """Flush what is buffered; anything the database does not take is spooled
+
+    Registered with atexit, so events queued just before shutdown reach the
+    database or the spool even though the writer is a daemon thread.
+    """
+    _stopping.set()
+    _wake.set()
+    if _writer is not None:
+        _writer.join(SHUTDOWN_TIMEOUT)
+    _spool(_close_rollups(everything=True) + _drain())
+
+def encode_audit_cursor(log):
+    """Opaque cursor pointing just past an audit log in (createdAt, id) order"""
+    raw = f'{log.createdAt.isoformat()}|{log.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_audit_cursor(cursor):
+    """Get (createdAt, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, log_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), log_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def build_audit_filters(user_id=None, resource=None, action=None, start_date=None, end_date=None):
+    """Build the where clause for the filters the audit log indexes cover"""
+    where_clause = {}
+    if user_id:
+        where_clause['userId'] = user_id
+    if resource:
+        where_clause['resource'] = resource
+    if action:
+        where_clause['action'] = action
+    if start_date or end_date:
+        where_clause['createdAt'] = {}
+        if start_date:
+            where_clause['createdAt']['gte'] = start_date
+        if end_date:
+            where_clause['createdAt']['lte'] = end_date
+    return where_clause
+
+async def get_audit_logs(where_clause=None, limit=100, cursor=None):
+    """Get a page of audit logs, newest first, and the cursor of the next page
+
+    Pages are read by seeking past the cursor's (createdAt, id) on the
+    composite indexes, so deep pages cost the same as the first one.
+    Raises ValueError for a malformed cursor.
+    """
+    where_clause = dict(where_clause or {})
+    if cursor:
+        created_at, log_id = decode_audit_cursor(cursor)
+        where_clause['OR'] = [
+            {'createdAt': {'lt': created_at}},
+            {'createdAt': created_at, 'id': {'lt': log_id}}
+        ]
+
     try:
-        where_clause = {}
-        if user_id:
-            where_clause['userId'] = user_id
-        if resource:
-            where_clause['resource'] = resource
-        
         logs = await prisma.auditlog.find_many(
             where=where_clause,
-            order_by={'createdAt': 'desc'},
-            take=limit,
-            skip=offset,
+            order_by=[{'createdAt': 'desc'}, {'id': 'desc'}],
+            take=limit + 1,
             include={'user': True}
         )
-        
-        return logs
+
+        next_cursor = encode_audit_cursor(logs[limit - 1]) if len(logs) > limit else None
+        return logs[:limit], next_cursor
     except Exception as e:
         print(f"Failed to get audit logs: {str(e)}")
-        return []
+        return [], None
+
+def _filter_sql(where_clause):
+    """Translate build_audit_filters output into a parameterized SQL condition"""
+    clauses, params = [], []
+    for column in ('userId', 'resource', 'action'):
+        if column in where_clause:
+            params.append(where_clause[column])
+            clauses.append(f'"{column}" = ${len(params)}')
+
+    for operator, sql_operator in (('gte', '>='), ('lte', '<=')):
+        value = where_clause.get('createdAt', {}).get(operator)
+        if value is not None:
+            params.append(value)
+            clauses.append(f'"createdAt" {sql_operator} ${len(params)}::timestamp')
+
+    return ' AND '.join(clauses) or 'TRUE', params
+
+async def _estimate_audit_logs(where_clause):
+    """Planner row estimate: table statistics, no rows are read"""
+    if not where_clause:
+        # A partitioned table has no statistics of its own; sum its partitions
+        row = await prisma.query_first("""
+            SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint AS estimate
+              FROM pg_class c
+             WHERE c.relname = 'audit_logs'
+                OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'audit_logs'::regclass)
+        """)
+        return max(int((row or {}).get('estimate') or 0), 0)
 
+    condition, params = _filter_sql(where_clause)
+    plan = await prisma.query_raw(
+        f'EXPLAIN (FORMAT JSON) SELECT 1 FROM audit_logs WHERE {condition}',
+        *params
+    )
+    return int(plan[0]['QUERY PLAN'][0]['Plan']['Plan Rows'])
+
+async def count_audit_logs(where_clause, mode='estimate'):
+    """Count audit logs matching a filter; returns (total, exact)
+
+    'exact' always counts. 'estimate' counts up to AUDIT_COUNT_CAP rows and
+    falls back to the planner's estimate beyond that. 'none' skips counting.
+    """
+    if mode == 'none':
+        return None, False
+    if mode == 'exact':
+        return await prisma.auditlog.count(where=where_clause), True
+
+    bounded = await prisma.auditlog.count(where=where_clause, take=AUDIT_COUNT_CAP + 1)
+    if bounded <= AUDIT_COUNT_CAP:
+        return bounded, True
+
+    try:
+        return max(await _estimate_audit_logs(where_clause), bounded), False
+    except Exception as e:
+        print(f"Failed to estimate audit log count: {str(e)}")
+        return bounded, False
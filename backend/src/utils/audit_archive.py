@@ -0,0 +1,340 @@
+import asyncio
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timezone
+import boto3
+from src.models import Prisma
+from src.models.models import AuditLog
+from src.utils.audit import decode_audit_cursor, encode_audit_cursor, get_audit_logs
+from src.utils.worker import job_handler, periodic_job
+
+prisma = Prisma()
+
+# Months kept in the database before the current one; older ones are archived
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', 3))
+# Archives go to S3 (or any S3-compatible store via AWS_ENDPOINT_URL) when
+# a bucket is set, otherwise to a local directory
+AUDIT_ARCHIVE_BUCKET = os.getenv('AUDIT_ARCHIVE_BUCKET')
+AUDIT_ARCHIVE_PREFIX = os.getenv('AUDIT_ARCHIVE_PREFIX', 'audit-logs/')
+AUDIT_ARCHIVE_DIR = os.getenv(
+    'AUDIT_ARCHIVE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'archive', 'audit-logs')
+)
+PARTITIONS_AHEAD = 3
+PARTITION_MAINTENANCE_INTERVAL = 6 * 3600
+ROW_GROUP_SIZE = 10000
+ARCHIVE_FORMAT_VERSION = 1
+
+COLUMNS = ('id', 'createdAt', 'userId', 'action', 'resource', 'resourceId', 'details', 'ipAddress', 'userAgent')
+PARTITION_PATTERN = re.compile(r'^audit_logs_y(\d{4})m(\d{2})$')
+# Catches rows outside every month partition, e.g. from a skewed clock
+DEFAULT_PARTITION = 'audit_logs_default'
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+def partition_name(month):
+    return f'audit_logs_y{month.year}m{month.month:02d}'
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+async def is_partitioned():
+    row = await prisma.query_first("SELECT relkind::text AS kind FROM pg_class WHERE relname = 'audit_logs'")
+    return bool(row) and row['kind'] == 'p'
+
+async def list_partition_tables():
+    """Map the month of every audit_logs_yYYYYmMM table to whether it is attached
+
+    Detached tables are left behind when an archive run stops partway; the
+    next run picks them up.
+    """
+    rows = await prisma.query_raw("""
+        SELECT c.relname AS name, i.inhrelid IS NOT NULL AS attached
+          FROM pg_class c
+          LEFT JOIN pg_inherits i ON i.inhrelid = c.oid
+         WHERE c.relkind = 'r' AND c.relname LIKE 'audit\\_logs\\_y%'
+    """)
+    tables = {}
+    for row in rows:
+        match = PARTITION_PATTERN.match(row['name'])
+        if match:
+            tables[datetime(int(match.group(1)), int(match.group(2)), 1)] = bool(row['attached'])
+    return tables
+
+async def _create_partition(month):
+    """Create a month's partition, moving in any of its rows the default partition holds
+
+    Postgres refuses to add a partition while the default one has rows in
+    its range, so the table is filled first and then attached.
+    """
+    table = partition_name(month)
+    # Names and bounds come from dates, never from input
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    async with prisma.tx() as transaction:
+        await transaction.execute_raw(f'CREATE TABLE {table} (LIKE audit_logs INCLUDING DEFAULTS)')
+        await transaction.execute_raw(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            f'WHERE "createdAt" >= $1::timestamp AND "createdAt" < $2::timestamp RETURNING *) '
+            f'INSERT INTO {table} SELECT * FROM moved',
+            month.isoformat(),
+            add_months(month, 1).isoformat()
+        )
+        await transaction.execute_raw(f'ALTER TABLE audit_logs ATTACH PARTITION {table} {bounds}')
+
+async def ensure_partitions(ahead=PARTITIONS_AHEAD):
+    """Create the partitions for this month and the next few; returns the new ones
+
+    Months that only have rows in the default partition get a partition
+    of their own too, so those rows are archived like any other month.
+    """
+    if not await is_partitioned():
+        print("audit_logs is not partitioned yet; run prisma/sql/partition_audit_logs.sql")
+        return []
+
+    await prisma.execute_raw(f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF audit_logs DEFAULT')
+    stray = await prisma.query_raw(
+        f'SELECT DISTINCT date_trunc(\'month\', "createdAt") AS month FROM {DEFAULT_PARTITION}'
+    )
+
+    existing = await list_partition_tables()
+    current = month_start(datetime.utcnow())
+    months = {add_months(current, offset) for offset in range(ahead + 1)}
+    months.update(month_start(_as_datetime(row['month'])) for row in stray)
+
+    created = []
+    for month in sorted(months):
+        if month in existing:
+            continue
+        await _create_partition(month)
+        created.append(partition_name(month))
+    return created
+
+def _as_datetime(value):
+    return _naive_utc(datetime.fromisoformat(value.replace('Z', '+00:00'))) if isinstance(value, str) else _naive_utc(value)
+
+def _encode_value(column, value):
+    if column == 'createdAt':
+        return _as_datetime(value).isoformat()
+    if column == 'details' and isinstance(value, str):
+        # Raw queries may hand JSON columns back as text
+        return json.loads(value)
+    return value
+
+def _write_row_group(f, rows):
+    group = {'rows': len(rows), 'columns': {column: [_encode_value(column, row[column]) for row in rows] for column in COLUMNS}}
+    f.write((json.dumps(group, default=str) + '\n').encode())
+
+async def _export_table(table, path):
+    """Stream a partition table to a gzip file of columnar row groups
+
+    The first line is a header; every following line holds up to
+    ROW_GROUP_SIZE rows stored column by column, which compresses far
+    better than row-per-line JSON.
+    """
+    rows_written = 0
+    after = None
+    with gzip.open(path, 'wb') as f:
+        f.write((json.dumps({'format': 'audit-archive', 'version': ARCHIVE_FORMAT_VERSION, 'columns': COLUMNS}) + '\n').encode())
+        while True:
+            condition, params = ('WHERE ("createdAt", id) > ($1::timestamp, $2)', [after[0], after[1]]) if after else ('', [])
+            rows = await prisma.query_raw(
+                f'SELECT id, "createdAt", "userId", action, resource, "resourceId", details, "ipAddress", "userAgent" '
+                f'FROM {table} {condition} ORDER BY "createdAt", id LIMIT {ROW_GROUP_SIZE}',
+                *params
+            )
+            if not rows:
+                break
+            await asyncio.to_thread(_write_row_group, f, rows)
+            rows_written += len(rows)
+            after = (_as_datetime(rows[-1]['createdAt']).isoformat(), rows[-1]['id'])
+    return rows_written
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _store_archive(path, name):
+    """Move a finished archive file to archive storage; returns its location"""
+    if AUDIT_ARCHIVE_BUCKET:
+        key = f'{AUDIT_ARCHIVE_PREFIX}{name}'
+        boto3.client('s3').upload_file(path, AUDIT_ARCHIVE_BUCKET, key)
+        os.unlink(path)
+        return f's3://{AUDIT_ARCHIVE_BUCKET}/{key}'
+
+    os.makedirs(AUDIT_ARCHIVE_DIR, exist_ok=True)
+    location = os.path.join(AUDIT_ARCHIVE_DIR, name)
+    shutil.move(path, location)
+    return location
+
+async def archive_partition(month, attached=True):
+    """Archive one month of audit logs and drop its partition
+
+    The partition is detached first so no write can land in it while it
+    is exported; detaching and dropping a table replaces deleting the
+    month row by row.
+    """
+    table = partition_name(month)
+    if attached:
+        await prisma.execute_raw(f'ALTER TABLE audit_logs DETACH PARTITION {table}')
+
+    fd, temp_path = tempfile.mkstemp(prefix=f'{table}-', suffix='.jsonl.gz')
+    os.close(fd)
+    try:
+        rows = await _export_table(table, temp_path)
+        sha256 = await asyncio.to_thread(_sha256_file, temp_path)
+        size = os.path.getsize(temp_path)
+        location = await asyncio.to_thread(_store_archive, temp_path, f'{table}.jsonl.gz')
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    archive = {'location': location, 'rows': rows, 'sizeBytes': size, 'sha256': sha256}
+    await prisma.auditarchive.upsert(
+        where={'month': month},
+        data={'create': {'month': month, **archive}, 'update': archive}
+    )
+    await prisma.execute_raw(f'DROP TABLE {table}')
+    return archive
+
+async def archive_old_partitions(retention_months=AUDIT_RETENTION_MONTHS):
+    """Archive every month older than the retention window; returns the archived months"""
+    if not await is_partitioned():
+        return []
+
+    cutoff = add_months(month_start(datetime.utcnow()), -retention_months)
+    archived = []
+    for month, attached in sorted((await list_partition_tables()).items()):
+        if month >= cutoff:
+            continue
+        archive = await archive_partition(month, attached=attached)
+        print(f"Archived {partition_name(month)}: {archive['rows']} rows to {archive['location']}")
+        archived.append(month.strftime('%Y-%m'))
+    return archived
+
+def _open_archive(location):
+    """Open an archive for reading, downloading it first when it is in S3"""
+    if not location.startswith('s3://'):
+        return gzip.open(location, 'rt')
+
+    bucket, key = location[len('s3://'):].split('/', 1)
+    download = tempfile.TemporaryFile()
+    boto3.client('s3').download_fileobj(bucket, key, download)
+    download.seek(0)
+    return gzip.open(download, 'rt')
+
+def _matches(row, where_clause, before):
+    for column in ('userId', 'resource', 'action'):
+        if column in where_clause and row[column] != where_clause[column]:
+            return False
+    created_range = where_clause.get('createdAt', {})
+    if created_range.get('gte') and row['createdAt'] < created_range['gte']:
+        return False
+    if created_range.get('lte') and row['createdAt'] > created_range['lte']:
+        return False
+    return before is None or (row['createdAt'], row['id']) < before
+
+def _archive_rows(f, location):
+    header = json.loads(f.readline())
+    if header.get('format') != 'audit-archive':
+        raise ValueError(f'{location} is not an audit archive')
+    for line in f:
+        group = json.loads(line)
+        columns = group['columns']
+        for i in range(group['rows']):
+            row = {column: columns[column][i] for column in header['columns']}
+            row['createdAt'] = datetime.fromisoformat(row['createdAt'])
+            yield row
+
+def _read_archive(location, where_clause, before, limit):
+    """The newest `limit` matching rows of one archive, newest first
+
+    Only the current top rows are kept while the archive streams past, so
+    memory stays bounded by the page size rather than the month.
+    """
+    with _open_archive(location) as f:
+        matches = (row for row in _archive_rows(f, location) if _matches(row, where_clause, before))
+        return heapq.nlargest(limit, matches, key=lambda row: (row['createdAt'], row['id']))
+
+async def search_archived_audit_logs(where_clause, limit, before=None):
+    """Scan archives newest first for logs matching build_audit_filters output
+
+    `before` is a (createdAt, id) position; only older logs are returned.
+    Archives outside the date range are skipped without being read.
+    """
+    before = (_naive_utc(before[0]), before[1]) if before else None
+    where_clause = {
+        **where_clause,
+        'createdAt': {op: _naive_utc(value) for op, value in where_clause.get('createdAt', {}).items()}
+    }
+    month_filter = {}
+    newest = min(filter(None, [where_clause['createdAt'].get('lte'), before and before[0]]), default=None)
+    if newest:
+        month_filter['lte'] = newest
+    if where_clause['createdAt'].get('gte'):
+        month_filter['gte'] = month_start(where_clause['createdAt']['gte'])
+
+    archives = await prisma.auditarchive.find_many(
+        where={'month': month_filter} if month_filter else {},
+        order_by={'month': 'desc'}
+    )
+    rows = []
+    for archive in archives:
+        rows.extend(await asyncio.to_thread(_read_archive, archive.location, where_clause, before, limit - len(rows)))
+        if len(rows) >= limit:
+            break
+    rows = rows[:limit]
+
+    user_ids = list({row['userId'] for row in rows if row['userId']})
+    users = {user.id: user for user in await prisma.user.find_many(where={'id': {'in': user_ids}})} if user_ids else {}
+    return [
+        AuditLog.model_construct(**{
+            **row,
+            'createdAt': row['createdAt'].replace(tzinfo=timezone.utc),
+            'user': users.get(row['userId'])
+        }) for row in rows
+    ]
+
+async def search_audit_logs(where_clause=None, limit=100, cursor=None, include_archived=False):
+    """Get a page of audit logs like get_audit_logs, continuing into archives
+
+    Archived months are all older than the database ones, so the same
+    (createdAt, id) cursor pages through both. Raises ValueError for a
+    malformed cursor.
+    """
+    logs, next_cursor = await get_audit_logs(where_clause, limit=limit, cursor=cursor)
+    if not include_archived or next_cursor:
+        return logs, next_cursor
+
+    if logs:
+        before = (logs[-1].createdAt, logs[-1].id)
+    else:
+        before = decode_audit_cursor(cursor) if cursor else None
+    archived = await search_archived_audit_logs(where_clause or {}, limit - len(logs) + 1, before)
+
+    logs = logs + archived
+    next_cursor = encode_audit_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return logs[:limit], next_cursor
+
+@periodic_job('sync-queue', 'maintain-audit-partitions', PARTITION_MAINTENANCE_INTERVAL)
+@job_handler('sync-queue', 'maintain-audit-partitions')
+async def process_maintain_audit_partitions_job(job_data):
+    """Create upcoming audit log partitions and archive expired ones"""
+    created = await ensure_partitions()
+    archived = await archive_old_partitions(job_data.get('retention_months', AUDIT_RETENTION_MONTHS))
+    return {'created': created, 'archived': archived}
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from src.models import Prisma
+from src.utils.queue import redis_client
+from src.utils.worker import job_handler, periodic_job
+
+prisma = Prisma()
+
+# The warmer runs more often than the snapshot expires, so page views
+# normally read a snapshot and never wait on the database
+DASHBOARD_STATS_TTL = int(os.getenv('DASHBOARD_STATS_TTL', 60))
+DASHBOARD_WARM_INTERVAL = max(DASHBOARD_STATS_TTL // 2, 5)
+CACHE_KEY = 'admin:dashboard-stats'
+LOCK_TTL = 30
+WAIT_INTERVAL = 0.1
+
+# One statement: each subquery scans its table once and FILTER splits the counts
+STATS_QUERY = """
+SELECT
+    u.total AS users_total, u.active AS users_active,
+    l.total AS leads_total, l.consented AS leads_consented,
+    m.total AS messages_total, m.sent AS messages_sent, m.failed AS messages_failed,
+    c.total AS campaigns_total, c.active AS campaigns_active,
+    p.total AS pages_total, p.active AS pages_active,
+    n.total AS numbers_total, n.active AS numbers_active
+FROM
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE "updatedAt" >= NOW() - INTERVAL '30 days') AS active
+       FROM users) u,
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE "consentGiven") AS consented
+       FROM leads) l,
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE status = 'SENT') AS sent,
+            COUNT(*) FILTER (WHERE status = 'FAILED') AS failed
+       FROM messages) m,
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE status IN ('RUNNING', 'SCHEDULED')) AS active
+       FROM campaigns) c,
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE "isActive") AS active
+       FROM facebook_pages) p,
+    (SELECT COUNT(*) AS total,
+            COUNT(*) FILTER (WHERE "isActive") AS active
+       FROM whatsapp_numbers) n
+"""
+
+# Flask runs each async view on its own thread and event loop
+_compute_lock = threading.Lock()
+
+def _rate(part, total):
+    return round((part / total * 100) if total > 0 else 0, 2)
+
+async def compute_dashboard_stats():
+    """Compute the admin dashboard counts with a single SQL statement"""
+    row = await prisma.query_first(STATS_QUERY)
+    counts = {key: int(value or 0) for key, value in row.items()}
+
+    return {
+        'users': {
+            'total': counts['users_total'],
+            'active_last_30_days': counts['users_active']
+        },
+        'leads': {
+            'total': counts['leads_total'],
+            'consented': counts['leads_consented'],
+            'consent_rate': _rate(counts['leads_consented'], counts['leads_total'])
+        },
+        'messages': {
+            'total': counts['messages_total'],
+            'sent': counts['messages_sent'],
+            'failed': counts['messages_failed'],
+            'success_rate': _rate(counts['messages_sent'], counts['messages_total'])
+        },
+        'campaigns': {
+            'total': counts['campaigns_total'],
+            'active': counts['campaigns_active']
+        },
+        'facebook_pages': {
+            'total': counts['pages_total'],
+            'active': counts['pages_active']
+        },
+        'whatsapp_numbers': {
+            'total': counts['numbers_total'],
+            'active': counts['numbers_active']
+        }
+    }
+
+def _read_snapshot():
+    try:
+        cached = redis_client.get(CACHE_KEY)
+    except Exception as e:
+        print(f"Failed to read dashboard stats: {str(e)}")
+        return None
+    return json.loads(cached) if cached else None
+
+async def refresh_dashboard_stats():
+    """Recompute the snapshot and store it for every process to read"""
+    snapshot = {
+        'stats': await compute_dashboard_stats(),
+        'computedAt': datetime.utcnow().isoformat()
+    }
+    try:
+        redis_client.set(CACHE_KEY, json.dumps(snapshot), ex=DASHBOARD_STATS_TTL)
+    except Exception as e:
+        print(f"Failed to cache dashboard stats: {str(e)}")
+    return snapshot
+
+async def _load_snapshot():
+    # Across processes, one computes while the others poll for its result
+    lock_key = f'{CACHE_KEY}:lock'
+    deadline = time.monotonic() + LOCK_TTL
+    try:
+        while not redis_client.set(lock_key, 1, nx=True, ex=LOCK_TTL):
+            await asyncio.sleep(WAIT_INTERVAL)
+            snapshot = _read_snapshot()
+            if snapshot:
+                return snapshot
+            if time.monotonic() > deadline:
+                break
+    except Exception as e:
+        print(f"Failed to take dashboard stats lock: {str(e)}")
+        return await refresh_dashboard_stats()
+
+    try:
+        return _read_snapshot() or await refresh_dashboard_stats()
+    finally:
+        redis_client.delete(lock_key)
+
+async def get_dashboard_stats():
+    """Get the cached dashboard snapshot, computing it once if it is missing
+
+    Concurrent requests in a process wait for the first one instead of
+    running the query again.
+    """
+    snapshot = _read_snapshot()
+    if snapshot:
+        return snapshot
+
+    # Poll rather than park an executor thread while another request computes
+    deadline = time.monotonic() + LOCK_TTL
+    acquired = _compute_lock.acquire(blocking=False)
+    while not acquired and time.monotonic() < deadline:
+        await asyncio.sleep(WAIT_INTERVAL)
+        snapshot = _read_snapshot()
+        if snapshot:
+            return snapshot
+        acquired = _compute_lock.acquire(blocking=False)
+    try:
+        return _read_snapshot() or await _load_snapshot()
+    finally:
+        if acquired:
+            _compute_lock.release()
+
+@periodic_job('sync-queue', 'warm-dashboard-stats', DASHBOARD_WARM_INTERVAL)
+@job_handler('sync-queue', 'warm-dashboard-stats')
+async def process_warm_dashboard_stats_job(job_data):
+    """Keep the dashboard snapshot fresh so page views never compute it"""
+    snapshot = await refresh_dashboard_stats()
+    return {'computedAt': snapshot['computedAt']}
@@ -0,0 +1,192 @@
+import json
+from datetime import datetime
+from src.models import Prisma
+from src.utils.queue import requeue_jobs
+from src.utils.webhooks import WEBHOOK_STREAM_PREFIX, enqueue_webhook
+
+prisma = Prisma()
+
+# Upper bound for a single replay request
+MAX_REPLAY_BATCH = 5000
+REPLAY_CHUNK_SIZE = 500
+
+def is_final_attempt(job):
+    """Check whether a job is running its last allowed attempt"""
+    attempts = (job.opts or {}).get('attempts', 1)
+    return job.attemptsMade + 1 >= attempts
+
+async def record_dead_letter(job, error):
+    """Persist a job that exhausted its retries and fail its linked message"""
+    return await record_failed_payload(
+        job.queue.name,
+        job.name,
+        job.data or {},
+        error,
+        attempts_made=job.attemptsMade + 1,
+        job_id=str(job.id) if job.id else None
+    )
+
+async def record_failed_payload(queue_name, job_name, data, error, attempts_made=1, job_id=None):
+    """Persist any failed payload (queue job or stream event) as a dead letter"""
+    message_id = data.get('message_id') if isinstance(data, dict) else None
+    error_code = getattr(error, 'code', None)
+
+    try:
+        dead_letter = await prisma.deadletterjob.create(
+            data={
+                'queueName': queue_name,
+                'jobName': job_name,
+                'jobId': job_id,
+                'data': data,
+                'errorClass': type(error).__name__,
+                'errorCode': str(error_code) if error_code is not None else None,
+                'errorMessage': str(error)[:1000],
+                'attemptsMade': attempts_made,
+                'failedAt': datetime.utcnow(),
+                'messageId': message_id
+            }
+        )
+
+        if message_id:
+            await prisma.message.update_many(
+                where={'id': message_id},
+                data={
+                    'status': 'FAILED',
+                    'errorMessage': str(error)[:1000],
+                    'retryCount': attempts_made
+                }
+            )
+
+        return dead_letter
+    except Exception as e:
+        print(f"Failed to record dead letter for {queue_name}/{job_name}: {str(e)}")
+        return None
+
+def build_dead_letter_filters(queue_name=None, job_name=None, error_class=None,
+                              error_code=None, since=None, until=None, replayed=None, ids=None):
+    """Build a where clause for dead letter queries"""
+    where_clause = {}
+
+    if ids:
+        where_clause['id'] = {'in': list(ids)}
+    if queue_name:
+        where_clause['queueName'] = queue_name
+    if job_name:
+        where_clause['jobName'] = job_name
+    if error_class:
+        where_clause['errorClass'] = error_class
+    if error_code:
+        where_clause['errorCode'] = str(error_code)
+    if since or until:
+        where_clause['failedAt'] = {}
+        if since:
+            where_clause['failedAt']['gte'] = since
+        if until:
+            where_clause['failedAt']['lte'] = until
+    if replayed is True:
+        where_clause['replayCount'] = {'gt': 0}
+    elif replayed is False:
+        where_clause['replayCount'] = 0
+
+    return where_clause
+
+async def list_dead_letters(where_clause, limit=50, offset=0):
+    """List dead letters matching a where clause, newest first"""
+    total = await prisma.deadletterjob.count(where=where_clause)
+    dead_letters = await prisma.deadletterjob.find_many(
+        where=where_clause,
+        order_by={'failedAt': 'desc'},
+        take=limit,
+        skip=offset
+    )
+    return dead_letters, total
+
+async def summarize_dead_letters(where_clause):
+    """Count dead letters grouped by queue and error class"""
+    groups = await prisma.deadletterjob.group_by(
+        ['queueName', 'errorClass'],
+        where=where_clause,
+        count=True
+    )
+    return [
+        {
+            'queueName': group['queueName'],
+            'errorClass': group['errorClass'],
+            'count': group['_count']['_all']
+        } for group in groups
+    ]
+
+async def replay_dead_letters(where_clause, rate=10, limit=1000):
+    """Re-enqueue dead letters, spacing them at `rate` jobs per second
+
+    Jobs are added with increasing delays rather than sent in a burst, so a
+    large replay after an outage does not overwhelm the downstream API.
+    Returns the number of replayed jobs per queue.
+    """
+    limit = min(limit, MAX_REPLAY_BATCH)
+    interval_ms = int(1000 / rate) if rate and rate > 0 else 0
+
+    dead_letters = await prisma.deadletterjob.find_many(
+        where=where_clause,
+        order_by={'failedAt': 'asc'},
+        take=limit
+    )
+
+    replayed = {}
+    for start in range(0, len(dead_letters), REPLAY_CHUNK_SIZE):
+        chunk = dead_letters[start:start + REPLAY_CHUNK_SIZE]
+
+        by_queue = {}
+        for index, dead_letter in enumerate(chunk):
+            by_queue.setdefault(dead_letter.queueName, []).append({
+                'name': dead_letter.jobName,
+                'data': dead_letter.data,
+                'delay': (start + index) * interval_ms
+            })
+
+        for queue_name, jobs in by_queue.items():
+            if queue_name.startswith(WEBHOOK_STREAM_PREFIX):
+                # Stream entries have no delay; the consumer batches them anyway
+                for job in jobs:
+                    if 'body' in job['data']:
+                        enqueue_webhook(queue_name, json.dumps(job['data']['body']))
+            else:
+                await requeue_jobs(queue_name, jobs)
+            replayed[queue_name] = replayed.get(queue_name, 0) + len(jobs)
+
+        chunk_ids = [dead_letter.id for dead_letter in chunk]
+        message_ids = [dead_letter.messageId for dead_letter in chunk if dead_letter.messageId]
+
+        await prisma.deadletterjob.update_many(
+            where={'id': {'in': chunk_ids}},
+            data={
+                'replayCount': {'increment': 1},
+                'replayedAt': datetime.utcnow()
+            }
+        )
+
+        if message_ids:
+            await prisma.message.update_many(
+                where={'id': {'in': message_ids}, 'status': 'FAILED'},
+                data={'status': 'PENDING', 'errorMessage': None}
+            )
+
+    return replayed
+
+def serialize_dead_letter(dead_letter):
+    """Convert a dead letter record into a JSON-friendly dict"""
+    return {
+        'id': dead_letter.id,
+        'queueName': dead_letter.queueName,
+        'jobName': dead_letter.jobName,
+        'jobId': dead_letter.jobId,
+        'data': dead_letter.data,
+        'errorClass': dead_letter.errorClass,
+        'errorCode': dead_letter.errorCode,
+        'errorMessage': dead_letter.errorMessage,
+        'attemptsMade': dead_letter.attemptsMade,
+        'messageId': dead_letter.messageId,
+        'replayCount': dead_letter.replayCount,
+        'failedAt': dead_letter.failedAt.isoformat(),
+        'replayedAt': dead_letter.replayedAt.isoformat() if dead_letter.replayedAt else None
+    }
@@ -0,0 +1,272 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from src.models import Prisma
+from src.utils.queue import redis_client
+
+prisma = Prisma()
+
+CHANNELS = ('whatsapp', 'messenger')
+FLAGS = ('consent', 'unsubscribed', 'messaged_page')
+
+BUILD_CHUNK_SIZE = 5000
+# Changes beyond this are cheaper to apply with a full rebuild
+MAX_PATCH_SIZE = 2000
+# Change log entries kept per user for incremental refreshes
+CHANGE_LOG_SIZE = 10000
+# Upper bound on staleness if a write path ever misses mark_leads_changed
+MAX_INDEX_AGE = 1800
+MAX_CACHED_USERS = 64
+MAX_ELIGIBILITY_BATCH = 100000
+# How often a request waiting on another request's build checks the lock
+BUILD_LOCK_POLL_INTERVAL = 0.05
+
+# Bumps the user's version and logs the changed leads under the new versions
+_log_changes = redis_client.register_script(f"""
+local version = redis.call('INCRBY', KEYS[1], #ARGV)
+for i, lead_id in ipairs(ARGV) do
+    redis.call('ZADD', KEYS[2], version - #ARGV + i, lead_id)
+end
+redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -{CHANGE_LOG_SIZE + 1})
+return version
+""")
+
+_indexes = OrderedDict()
+# Flask runs each async view on its own thread and event loop, so builds
+# are serialized with thread locks rather than asyncio locks. Waiters poll
+# them instead of parking an executor thread for the length of a build.
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+def _digits(phone_number):
+    return re.sub(r'\D', '', phone_number or '')
+
+def _version_key(user_id):
+    return f'elig:{user_id}:version'
+
+def _changes_key(user_id):
+    return f'elig:{user_id}:changes'
+
+class EligibilityIndex:
+    """Per-user bitsets of lead flags with lookups by lead ID, phone and PSID
+
+    Each lead gets a bit offset; consent, unsubscribed and messaged-page
+    status are one bit each, so a 100k-lead user needs about 37 KB of
+    bitsets and a membership check is two byte reads.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.offsets = {}
+        self.lead_ids = []
+        self.by_phone = {}
+        self.by_psid = {}
+        self.phone_at = []
+        self.psid_at = []
+        self.page_at = []
+        self.bits = {flag: bytearray() for flag in FLAGS}
+
+    def copy(self):
+        """A copy that can be patched while readers keep using this one"""
+        index = EligibilityIndex(self.version)
+        index.built_at = self.built_at
+        index.offsets = dict(self.offsets)
+        index.lead_ids = list(self.lead_ids)
+        index.by_phone = dict(self.by_phone)
+        index.by_psid = dict(self.by_psid)
+        index.phone_at = list(self.phone_at)
+        index.psid_at = list(self.psid_at)
+        index.page_at = list(self.page_at)
+        index.bits = {flag: bytearray(bits) for flag, bits in self.bits.items()}
+        return index
+
+    def _get(self, flag, offset):
+        bits = self.bits[flag]
+        byte = offset >> 3
+        return byte < len(bits) and bits[byte] >> (offset & 7) & 1
+
+    def _set(self, flag, offset, value):
+        bits = self.bits[flag]
+        byte = offset >> 3
+        if byte >= len(bits):
+            bits.extend(bytes(byte - len(bits) + 1024))
+        if value:
+            bits[byte] |= 1 << (offset & 7)
+        else:
+            bits[byte] &= ~(1 << (offset & 7)) & 0xFF
+
+    def set_lead(self, lead):
+        offset = self.offsets.get(lead.id)
+        if offset is None:
+            offset = len(self.lead_ids)
+            self.offsets[lead.id] = offset
+            self.lead_ids.append(lead.id)
+            self.phone_at.append(None)
+            self.psid_at.append(None)
+            self.page_at.append(None)
+
+        phone = _digits(lead.phoneNumber) or None
+        if self.phone_at[offset] != phone:
+            if self.by_phone.get(self.phone_at[offset]) == offset:
+                del self.by_phone[self.phone_at[offset]]
+            if phone:
+                self.by_phone[phone] = offset
+            self.phone_at[offset] = phone
+
+        if self.psid_at[offset] != lead.facebookUserId:
+            if self.by_psid.get(self.psid_at[offset]) == offset:
+                del self.by_psid[self.psid_at[offset]]
+            if lead.facebookUserId:
+                self.by_psid[lead.facebookUserId] = offset
+            self.psid_at[offset] = lead.facebookUserId
+
+        self.page_at[offset] = lead.facebookPageId
+        self._set('consent', offset, lead.consentGiven)
+        self._set('unsubscribed', offset, lead.status == 'UNSUBSCRIBED')
+        self._set('messaged_page', offset, lead.source == 'FACEBOOK_MESSAGE')
+
+    def remove_lead(self, lead_id):
+        offset = self.offsets.get(lead_id)
+        if offset is not None:
+            for flag in FLAGS:
+                self._set(flag, offset, False)
+
+    def is_eligible(self, offset, channel):
+        if offset is None or self._get('unsubscribed', offset):
+            return False
+        if channel == 'whatsapp':
+            return bool(self._get('consent', offset))
+        return bool(self._get('consent', offset) or self._get('messaged_page', offset))
+
+def _current_version(user_id):
+    try:
+        return int(redis_client.get(_version_key(user_id)) or 0)
+    except Exception:
+        return None
+
+async def _build_index(user_id, version):
+    index = EligibilityIndex(version)
+    cursor = None
+    while True:
+        leads = await prisma.lead.find_many(
+            where={'userId': user_id},
+            order_by={'id': 'asc'},
+            take=BUILD_CHUNK_SIZE,
+            **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+        )
+        if not leads:
+            break
+        for lead in leads:
+            index.set_lead(lead)
+        cursor = leads[-1].id
+    return index
+
+async def _patch_index(user_id, index, version):
+    """Apply logged changes since the index version to a copy of it
+
+    The cached index is never modified, as other requests may be reading
+    it. Returns the patched copy, or None if a rebuild is needed.
+    """
+    # A version behind ours means the Redis counter was reset
+    if version < index.version or version - index.version > MAX_PATCH_SIZE:
+        return None
+
+    changes = redis_client.zrangebyscore(_changes_key(user_id), f'({index.version}', '+inf', withscores=True)
+    oldest = redis_client.zrange(_changes_key(user_id), 0, 0, withscores=True)
+    if oldest and oldest[0][1] > index.version + 1 and redis_client.zcard(_changes_key(user_id)) >= CHANGE_LOG_SIZE:
+        # Entries we have not applied may have been trimmed
+        return None
+
+    lead_ids = [lead_id for lead_id, _ in changes]
+    leads = await prisma.lead.find_many(where={'id': {'in': lead_ids}, 'userId': user_id}) if lead_ids else []
+    found = {lead.id for lead in leads}
+    index = index.copy()
+    for lead in leads:
+        index.set_lead(lead)
+    for lead_id in lead_ids:
+        if lead_id not in found:
+            index.remove_lead(lead_id)
+
+    index.version = version
+    return index
+
+async def get_eligibility_index(user_id):
+    """Get a current eligibility index for a user, refreshing it if needed"""
+    version = _current_version(user_id)
+    index = _indexes.get(user_id)
+    fresh = index is not None and time.monotonic() - index.built_at < MAX_INDEX_AGE
+    # Without Redis, a cached index is trusted until it ages out
+    if fresh and (version is None or index.version == version):
+        with _build_locks_guard:
+            if user_id in _indexes:
+                _indexes.move_to_end(user_id)
+        return index
+
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(user_id, threading.Lock())
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(BUILD_LOCK_POLL_INTERVAL)
+    try:
+        index = _indexes.get(user_id)
+        fresh = index is not None and time.monotonic() - index.built_at < MAX_INDEX_AGE
+        if fresh and (version is None or index.version == version):
+            return index
+
+        patched = await _patch_index(user_id, index, version) if fresh else None
+        index = patched or await _build_index(user_id, version or 0)
+
+        with _build_locks_guard:
+            _indexes[user_id] = index
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > MAX_CACHED_USERS:
+                evicted, _ = _indexes.popitem(last=False)
+                _build_locks.pop(evicted, None)
+        return index
+    finally:
+        lock.release()
+
+def mark_leads_changed(user_id, lead_ids):
+    """Record that leads were created, updated or deleted
+
+    Call after any write that can change consent, status, source, phone
+    number or Facebook ID. Every process picks the change up on its next
+    lookup for the user.
+    """
+    lead_ids = [lead_id for lead_id in lead_ids if lead_id]
+    if not lead_ids:
+        return
+    try:
+        _log_changes(keys=[_version_key(user_id), _changes_key(user_id)], args=lead_ids)
+    except Exception as e:
+        print(f"Failed to record lead changes: {str(e)}")
+        _indexes.pop(user_id, None)
+
+async def eligible_lead_ids(user_id, channel, lead_ids):
+    """Filter lead IDs down to those that may be messaged on a channel"""
+    index = await get_eligibility_index(user_id)
+    offsets = index.offsets
+    return [lead_id for lead_id in lead_ids if index.is_eligible(offsets.get(lead_id), channel)]
+
+async def find_eligible_lead_id(user_id, channel, phone_number=None, facebook_user_id=None, page_id=None):
+    """Get the ID of the eligible lead for a recipient, or None"""
+    index = await get_eligibility_index(user_id)
+    if phone_number:
+        offset = index.by_phone.get(_digits(phone_number))
+    else:
+        offset = index.by_psid.get(facebook_user_id)
+        if offset is not None and page_id and index.page_at[offset] != page_id:
+            return None
+
+    return index.lead_ids[offset] if index.is_eligible(offset, channel) else None
+
+async def find_eligible_leads_by_phone(user_id, channel, phone_numbers):
+    """Map each phone number to its eligible lead ID, or None, from one index lookup"""
+    index = await get_eligibility_index(user_id)
+    eligible = {}
+    for phone_number in phone_numbers:
+        offset = index.by_phone.get(_digits(phone_number))
+        eligible[phone_number] = index.lead_ids[offset] if index.is_eligible(offset, channel) else None
+    return eligible
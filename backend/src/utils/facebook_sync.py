@@ -0,0 +1,175 @@
+import os
+import time
+from datetime import datetime
+from src.models import Prisma
+from src.utils.security import encrypt_token, decrypt_token, token_fingerprint
+from src.utils.graph import graph_pages
+from src.utils.identity import invalidate_user
+from src.utils.queue import add_sync_job
+from src.utils.worker import job_handler, periodic_job
+
+prisma = Prisma()
+
+PAGE_SYNC_INTERVAL = int(os.getenv('FACEBOOK_PAGE_SYNC_INTERVAL', 3600))
+USER_SCAN_CHUNK_SIZE = 500
+
+class FacebookNotConnected(Exception):
+    """The user has no usable Facebook token"""
+
+def diff_pages(user_id, existing_pages, api_pages):
+    """Compute the page rows to create, update and deactivate
+
+    Pages are compared on name, token fingerprint, owner and active flag,
+    so a sync where nothing changed produces no writes at all.
+    """
+    existing_by_page_id = {page.facebookPageId: page for page in existing_pages}
+    seen = set()
+    creates, updates = [], []
+
+    for page_data in api_pages:
+        page_id = page_data['id']
+        seen.add(page_id)
+        fingerprint = token_fingerprint(page_data['access_token'])
+        existing = existing_by_page_id.get(page_id)
+
+        if existing is None:
+            creates.append({
+                'facebookPageId': page_id,
+                'name': page_data['name'],
+                'accessToken': encrypt_token(page_data['access_token']),
+                'tokenFingerprint': fingerprint,
+                'userId': user_id
+            })
+            continue
+
+        changes = {}
+        if existing.name != page_data['name']:
+            changes['name'] = page_data['name']
+        if existing.tokenFingerprint != fingerprint:
+            changes['accessToken'] = encrypt_token(page_data['access_token'])
+            changes['tokenFingerprint'] = fingerprint
+        if existing.userId != user_id:
+            changes['userId'] = user_id
+        if not existing.isActive:
+            changes['isActive'] = True
+
+        if changes:
+            updates.append((existing.id, changes))
+
+    deactivations = [
+        page.id for page in existing_pages
+        if page.userId == user_id and page.isActive and page.facebookPageId not in seen
+    ]
+
+    return creates, updates, deactivations
+
+async def sync_user_pages(user_id):
+    """Sync a user's pages from /me/accounts, writing only changed rows
+
+    Returns the user's active pages after the sync without re-reading them.
+    """
+    user = await prisma.user.find_unique(where={'id': user_id})
+    if not user or not user.facebookToken:
+        raise FacebookNotConnected('Facebook not connected')
+
+    access_token = decrypt_token(user.facebookToken)
+    if not access_token:
+        raise FacebookNotConnected('Invalid Facebook token')
+
+    # Pages are fetched in a worker thread so other jobs keep running meanwhile
+    api_pages = [
+        page
+        async for batch in graph_pages('me/accounts', access_token, {'fields': 'id,name,access_token', 'limit': 100})
+        for page in batch
+    ]
+    page_ids = [page['id'] for page in api_pages]
+
+    # One read covers the user's pages and pages previously owned by someone else
+    existing_pages = await prisma.facebookpage.find_many(
+        where={
+            'OR': [
+                {'userId': user_id},
+                {'facebookPageId': {'in': page_ids}}
+            ]
+        }
+    )
+
+    creates, updates, deactivations = diff_pages(user_id, existing_pages, api_pages)
+    merged = {page.id: page for page in existing_pages}
+
+    if creates or updates or deactivations:
+        async with prisma.tx() as transaction:
+            for data in creates:
+                page = await transaction.facebookpage.create(data=data)
+                merged[page.id] = page
+
+            for page_id, changes in updates:
+                page = await transaction.facebookpage.update(where={'id': page_id}, data=changes)
+                merged[page.id] = page
+
+            if deactivations:
+                await transaction.facebookpage.update_many(
+                    where={'id': {'in': deactivations}},
+                    data={'isActive': False}
+                )
+
+            await transaction.user.update(
+                where={'id': user_id},
+                data={'pagesSyncedAt': datetime.utcnow()}
+            )
+    else:
+        await prisma.user.update(
+            where={'id': user_id},
+            data={'pagesSyncedAt': datetime.utcnow()}
+        )
+    invalidate_user(user_id)
+
+    synced_page_ids = set(page_ids)
+    pages = [page for page in merged.values() if page.facebookPageId in synced_page_ids]
+
+    return pages, {
+        'created': len(creates),
+        'updated': len(updates),
+        'deactivated': len(deactivations),
+        'unchanged': len(api_pages) - len(creates) - len(updates)
+    }
+
+@job_handler('sync-queue', 'sync-facebook-pages')
+async def process_page_sync_job(job_data):
+    """Sync the pages of a single user"""
+    try:
+        _, counts = await sync_user_pages(job_data['user_id'])
+    except FacebookNotConnected as e:
+        return {'skipped': str(e)}
+    return counts
+
+@periodic_job('sync-queue', 'sync-all-facebook-pages', PAGE_SYNC_INTERVAL)
+@job_handler('sync-queue', 'sync-all-facebook-pages')
+async def process_all_page_sync_job(job_data):
+    """Fan out one page sync job per connected user"""
+    slot = job_data.get('slot') or int(time.time() // PAGE_SYNC_INTERVAL)
+    cursor = None
+    queued = 0
+
+    while True:
+        users = await prisma.user.find_many(
+            where={'facebookToken': {'not': None}},
+            order_by={'id': 'asc'},
+            take=USER_SCAN_CHUNK_SIZE,
+            **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+        )
+        if not users:
+            break
+
+        for user in users:
+            job_id = await add_sync_job(
+                'sync-facebook-pages',
+                {'user_id': user.id},
+                job_id=f'sync-facebook-pages:{user.id}:{slot}'
+            )
+            if job_id:
+                queued += 1
+
+        cursor = users[-1].id
+
+    return {'queued': queued}
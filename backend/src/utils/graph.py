@@ -0,0 +1,111 @@
+import asyncio
+import httpx
+import requests
+
+GRAPH_API_URL = 'https://graph.facebook.com/v18.0'
+# Graph API error code for an invalid, expired or revoked access token
+AUTH_ERROR_CODE = 190
+
+# Called with the access token whenever the Graph API rejects it
+_auth_error_handlers = []
+
+class GraphAPIError(Exception):
+    """Error returned by the Facebook Graph API"""
+
+    def __init__(self, message, code=None, subcode=None, status_code=None):
+        super().__init__(message)
+        self.code = code
+        self.subcode = subcode
+        self.status_code = status_code
+
+def on_auth_error(handler):
+    """Register a callable to run with any access token the Graph API rejects"""
+    _auth_error_handlers.append(handler)
+    return handler
+
+def raise_for_graph_error(response, access_token=None):
+    """Raise GraphAPIError if a Graph API response carries an error"""
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+
+    if 'error' in payload:
+        error = payload['error']
+        if error.get('code') == AUTH_ERROR_CODE and access_token:
+            for handler in _auth_error_handlers:
+                handler(access_token)
+        raise GraphAPIError(
+            error.get('message', 'Unknown Graph API error'),
+            code=error.get('code'),
+            subcode=error.get('error_subcode'),
+            status_code=response.status_code
+        )
+
+    if response.status_code >= 400:
+        raise GraphAPIError(
+            f'Graph API request failed with status {response.status_code}',
+            status_code=response.status_code
+        )
+
+    return payload
+
+def graph_post(path, access_token, payload):
+    """POST to a Graph API endpoint and return the decoded response"""
+    response = requests.post(
+        f'{GRAPH_API_URL}/{path.lstrip("/")}',
+        json=payload,
+        headers={'Authorization': f'Bearer {access_token}'},
+        timeout=30
+    )
+    return raise_for_graph_error(response, access_token)
+
+def graph_upload(path, access_token, fields, file_obj, filename, mime_type):
+    """POST a file to a Graph API endpoint as multipart form data
+
+    httpx reads file_obj in chunks while sending, so the file is never
+    held in memory; requests would build the whole body first.
+    """
+    response = httpx.post(
+        f'{GRAPH_API_URL}/{path.lstrip("/")}',
+        data=fields,
+        files={'file': (filename, file_obj, mime_type)},
+        headers={'Authorization': f'Bearer {access_token}'},
+        timeout=120
+    )
+    return raise_for_graph_error(response, access_token)
+
+def graph_get(path, access_token, params=None):
+    """GET a Graph API endpoint and return the decoded response"""
+    response = requests.get(
+        f'{GRAPH_API_URL}/{path.lstrip("/")}',
+        params=params or {},
+        headers={'Authorization': f'Bearer {access_token}'},
+        timeout=30
+    )
+    return raise_for_graph_error(response, access_token)
+
+async def graph_pages(path, access_token, params=None, max_pages=None):
+    """Async generator yielding each page of results of a Graph API edge
+
+    Requests run in a worker thread so several syncs can share one event
+    loop without blocking each other.
+    """
+    payload = await asyncio.to_thread(graph_get, path, access_token, params)
+    pages = 1
+
+    while True:
+        yield payload.get('data', [])
+
+        next_url = payload.get('paging', {}).get('next')
+        if not next_url or (max_pages and pages >= max_pages):
+            return
+
+        response = await asyncio.to_thread(
+            requests.get,
+            next_url,
+            headers={'Authorization': f'Bearer {access_token}'},
+            timeout=30
+        )
+        payload = raise_for_graph_error(response, access_token)
+        pages += 1
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+import requests
+from src.utils.graph import GRAPH_API_URL, on_auth_error, raise_for_graph_error
+from src.utils.queue import redis_client
+from src.utils.security import token_fingerprint
+
+# Seconds an entry is served without asking Facebook, by last path segment
+GRAPH_CACHE_TTLS = {
+    'accounts': 300,
+    'posts': 120,
+    'message_templates': 300,
+    'phone_numbers': 3600,
+}
+DEFAULT_TTL = 600
+# Token checks are cached briefly, so a revoked token stops passing quickly
+AUTH_CHECK_TTL = 30
+
+# Expired entries are kept this many TTLs longer for ETag revalidation
+STALE_RETENTION = 10
+# L1 entries are capped so invalidations in other processes are seen quickly
+L1_MAX_TTL = 30
+L1_MAX_ENTRIES = 2048
+
+REDIS_PREFIX = 'graph-cache'
+# Shared counters are pushed to Redis in batches to keep L1 hits local
+STATS_FLUSH_EVERY = 100
+
+_l1 = OrderedDict()
+_l1_lock = threading.Lock()
+_stats = {'l1_hits': 0, 'l2_hits': 0, 'revalidated': 0, 'misses': 0, 'errors': 0}
+_pending_stats = {}
+
+def _ttl_for(path):
+    return GRAPH_CACHE_TTLS.get(path.rstrip('/').rsplit('/', 1)[-1], DEFAULT_TTL)
+
+def _token_prefix(access_token):
+    return f'{REDIS_PREFIX}:{token_fingerprint(access_token)}:'
+
+def _group_key(path, access_token):
+    """Redis hash holding every cached variant of one endpoint for one credential"""
+    return f'{_token_prefix(access_token)}{path.strip("/")}'
+
+def _token_index_key(access_token):
+    """Redis set of every endpoint hash cached for one credential"""
+    return f'{REDIS_PREFIX}:tokens:{token_fingerprint(access_token)}'
+
+def _params_key(params):
+    canonical = json.dumps(
+        {key: value for key, value in (params or {}).items() if key != 'access_token'},
+        sort_keys=True
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+def _flush_stats():
+    with _l1_lock:
+        pending = dict(_pending_stats)
+        _pending_stats.clear()
+    if not pending:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for stat, value in pending.items():
+            pipe.hincrby(f'{REDIS_PREFIX}:stats', stat, value)
+        pipe.execute()
+    except Exception:
+        pass
+
+def _count(stat):
+    with _l1_lock:
+        _stats[stat] += 1
+        _pending_stats[stat] = _pending_stats.get(stat, 0) + 1
+        should_flush = sum(_pending_stats.values()) >= STATS_FLUSH_EVERY
+    if should_flush:
+        _flush_stats()
+
+def _l1_get(key):
+    with _l1_lock:
+        entry = _l1.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            del _l1[key]
+            return None
+        _l1.move_to_end(key)
+        return entry[1]
+
+def _l1_set(key, body, ttl):
+    with _l1_lock:
+        _l1[key] = (time.time() + min(ttl, L1_MAX_TTL), body)
+        _l1.move_to_end(key)
+        while len(_l1) > L1_MAX_ENTRIES:
+            _l1.popitem(last=False)
+
+def cached_graph_get(path, access_token, params=None, ttl=None):
+    """GET a Graph API endpoint through the L1 (process) and L2 (Redis) cache
+
+    Fresh entries are served directly. Expired entries that carry an ETag
+    are revalidated with If-None-Match, so an unchanged resource costs a
+    304 instead of a full body. `ttl` overrides the per-endpoint TTL.
+    """
+    group = _group_key(path, access_token)
+    field = _params_key(params)
+    l1_key = f'{group}:{field}'
+    ttl = ttl or _ttl_for(path)
+
+    body = _l1_get(l1_key)
+    if body is not None:
+        _count('l1_hits')
+        return body
+
+    entry = None
+    try:
+        raw = redis_client.hget(group, field)
+        entry = json.loads(raw) if raw else None
+    except Exception:
+        _count('errors')
+
+    now = time.time()
+    if entry and entry['expires_at'] > now:
+        _count('l2_hits')
+        _l1_set(l1_key, entry['body'], entry['expires_at'] - now)
+        return entry['body']
+
+    headers = {'Authorization': f'Bearer {access_token}'}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+
+    response = requests.get(
+        f'{GRAPH_API_URL}/{path.lstrip("/")}',
+        params=params or {},
+        headers=headers,
+        timeout=30
+    )
+
+    if response.status_code == 304 and entry:
+        _count('revalidated')
+        body = entry['body']
+        etag = entry['etag']
+    else:
+        _count('misses')
+        body = raise_for_graph_error(response, access_token)
+        etag = response.headers.get('ETag')
+
+    try:
+        redis_client.hset(group, field, json.dumps({
+            'body': body,
+            'etag': etag,
+            'expires_at': now + ttl
+        }))
+        redis_client.expire(group, ttl * STALE_RETENTION)
+        index = _token_index_key(access_token)
+        redis_client.sadd(index, group)
+        redis_client.expire(index, max(DEFAULT_TTL, *GRAPH_CACHE_TTLS.values()) * STALE_RETENTION)
+    except Exception:
+        _count('errors')
+
+    _l1_set(l1_key, body, ttl)
+    return body
+
+def invalidate_graph_cache(path, access_token):
+    """Drop every cached variant of an endpoint for one credential
+
+    Call after a write that changes what the endpoint returns.
+    """
+    group = _group_key(path, access_token)
+    with _l1_lock:
+        for key in [key for key in _l1 if key.startswith(f'{group}:')]:
+            del _l1[key]
+    try:
+        redis_client.delete(group)
+    except Exception:
+        _count('errors')
+
+def verify_graph_token(path, access_token):
+    """Check a token by reading `path` with it, caching a pass for AUTH_CHECK_TTL
+
+    Raises GraphAPIError if the token is rejected.
+    """
+    return cached_graph_get(path, access_token, ttl=AUTH_CHECK_TTL)
+
+@on_auth_error
+def invalidate_token_cache(access_token):
+    """Drop everything cached for a credential, in this process and in Redis
+
+    Runs on every Graph auth error (code 190); call it when a token is
+    disconnected, so no cached read keeps vouching for it.
+    """
+    prefix = _token_prefix(access_token)
+    with _l1_lock:
+        for key in [key for key in _l1 if key.startswith(prefix)]:
+            del _l1[key]
+    try:
+        index = _token_index_key(access_token)
+        groups = redis_client.smembers(index)
+        redis_client.delete(index, *groups)
+    except Exception:
+        _count('errors')
+
+def get_graph_cache_stats():
+    """Hit-rate metrics for this process and across all processes"""
+    def with_rates(counters):
+        lookups = sum(counters.get(stat, 0) for stat in ('l1_hits', 'l2_hits', 'revalidated', 'misses'))
+        hits = counters.get('l1_hits', 0) + counters.get('l2_hits', 0)
+        return {
+            **counters,
+            'lookups': lookups,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+            # A 304 still avoids downloading and decoding the body
+            'served_from_cache_rate': round((hits + counters.get('revalidated', 0)) / lookups, 4) if lookups else 0.0
+        }
+
+    _flush_stats()
+    try:
+        shared = {stat: int(value) for stat, value in redis_client.hgetall(f'{REDIS_PREFIX}:stats').items()}
+    except Exception:
+        shared = {}
+
+    return {
+        'process': {**with_rates(dict(_stats)), 'l1_entries': len(_l1)},
+        'cluster': with_rates(shared)
+    }
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from src.models import Prisma
+from src.utils.queue import JOB_STATE_KEYS, get_queue_stats, redis_client
+
+# The probe thread runs its own event loop, so it gets its own client
+prisma = Prisma()
+
+HEALTH_PROBE_INTERVAL = float(os.getenv('HEALTH_PROBE_INTERVAL', 15))
+PROBE_TIMEOUT = 5
+# Results older than this no longer count as a passing check
+STALE_AFTER = HEALTH_PROBE_INTERVAL * 3
+# Oldest waiting job age, in seconds, that marks a queue as warning / error
+QUEUE_LAG_WARNING = 60
+QUEUE_LAG_ERROR = 600
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# A failing one of these makes the process not ready; queue lag only warns
+READINESS_PROBES = ('query_engine', 'postgres', 'redis')
+STATUSES = ('healthy', 'warning', 'error')
+
+class LatencyHistogram:
+    """Cumulative latency histogram with fixed millisecond buckets"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, latency_ms):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency_ms <= bound:
+                break
+        else:
+            i = len(LATENCY_BUCKETS)
+        self.counts[i] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+
+    def snapshot(self):
+        cumulative, buckets = 0, {}
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            'buckets': buckets,
+            'count': self.total,
+            'sum_ms': round(self.sum_ms, 2),
+            'avg_ms': round(self.sum_ms / self.total, 2) if self.total else None
+        }
+
+_results = {}
+_histograms = {}
+_results_lock = threading.Lock()
+_prober = None
+_prober_guard = threading.Lock()
+
+async def _probe_query_engine():
+    # A model query goes through the engine's query planning, not just SQL
+    await prisma.user.find_first()
+
+async def _probe_postgres():
+    row = await prisma.query_first('SELECT pg_is_in_recovery() AS in_recovery')
+    if row and row.get('in_recovery'):
+        return 'warning', {'detail': 'database is a read-only replica'}
+    return 'healthy', {}
+
+async def _probe_redis():
+    await asyncio.to_thread(redis_client.ping)
+
+async def _probe_queue_lag():
+    stats = await asyncio.to_thread(get_queue_stats)
+    if not stats:
+        raise RuntimeError('queue stats unavailable')
+    lags = {name: queue['oldest_waiting_seconds'] for name, queue in stats.items()}
+    worst = max(lags.values(), default=0)
+    status = 'error' if worst >= QUEUE_LAG_ERROR else 'warning' if worst >= QUEUE_LAG_WARNING else 'healthy'
+    return status, {'lag_seconds': lags}
+
+PROBES = {
+    'query_engine': _probe_query_engine,
+    'postgres': _probe_postgres,
+    'redis': _probe_redis,
+    'queue_lag': _probe_queue_lag,
+}
+
+async def run_probe(name):
+    """Run one probe with a timeout and record its result and latency"""
+    started = time.perf_counter()
+    try:
+        outcome = await asyncio.wait_for(PROBES[name](), PROBE_TIMEOUT)
+        status, extra = outcome if outcome else ('healthy', {})
+        error = None
+    except asyncio.TimeoutError:
+        status, extra, error = 'error', {}, f'timed out after {PROBE_TIMEOUT}s'
+    except Exception as e:
+        status, extra, error = 'error', {}, str(e)
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    with _results_lock:
+        _histograms.setdefault(name, LatencyHistogram()).observe(latency_ms)
+        _results[name] = {
+            'status': status,
+            'latency_ms': round(latency_ms, 2),
+            'error': error,
+            'checked_at': datetime.utcnow().isoformat(),
+            'checked_monotonic': time.monotonic(),
+            **extra
+        }
+
+async def _run_prober():
+    while True:
+        if not prisma.is_connected():
+            try:
+                await prisma.connect()
+            except Exception as e:
+                print(f"Health probe could not connect to the database: {str(e)}")
+        await asyncio.gather(*(run_probe(name) for name in PROBES))
+        await asyncio.sleep(HEALTH_PROBE_INTERVAL)
+
+def _prober_main():
+    asyncio.run(_run_prober())
+
+def start_health_probes():
+    """Start the background probe thread once per process"""
+    global _prober
+    if _prober is not None:
+        return
+    with _prober_guard:
+        if _prober is None:
+            _prober = threading.Thread(target=_prober_main, name='health-probes', daemon=True)
+            _prober.start()
+
+def get_probe_results():
+    """Latest cached result and latency histogram of every probe
+
+    Results that have not been refreshed within STALE_AFTER are reported
+    as errors, so a stuck probe thread cannot keep a process looking ready.
+    """
+    # Probes start with the first read, so only processes that serve health
+    # checks run them
+    start_health_probes()
+    now = time.monotonic()
+    with _results_lock:
+        results = {}
+        for name in PROBES:
+            result = dict(_results.get(name) or {'status': 'error', 'error': 'not checked yet', 'checked_at': None})
+            checked = result.pop('checked_monotonic', None)
+            if checked is not None and now - checked > STALE_AFTER:
+                result.update(status='error', error=f'last check is older than {STALE_AFTER:.0f}s')
+            histogram = _histograms.get(name)
+            result['histogram'] = histogram.snapshot() if histogram else None
+            results[name] = result
+    return results
+
+def worst_status(*statuses):
+    return max(statuses, key=STATUSES.index)
+
+def readiness(results=None):
+    """Whether this process can serve traffic, and the probes that say otherwise"""
+    results = results or get_probe_results()
+    failing = [name for name in READINESS_PROBES if results[name]['status'] == 'error']
+    return not failing, failing
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}'
+
+def render_metrics(queue_stats, probe_results):
+    """Queue and probe metrics in the Prometheus text exposition format"""
+    lines = [
+        '# TYPE queue_jobs gauge',
+        *(f'queue_jobs{_labels(queue=queue, state=state)} {queue_stats[queue][state]}'
+          for queue in queue_stats for state in JOB_STATE_KEYS),
+        '# TYPE queue_oldest_waiting_seconds gauge',
+        *(f'queue_oldest_waiting_seconds{_labels(queue=queue)} {stats["oldest_waiting_seconds"]}'
+          for queue, stats in queue_stats.items()),
+        '# TYPE queue_throughput_per_minute gauge',
+        *(f'queue_throughput_per_minute{_labels(queue=queue, outcome=outcome)} {rate}'
+          for queue, stats in queue_stats.items() for outcome, rate in stats['throughput_per_minute'].items()),
+        '# TYPE health_probe_up gauge',
+        *(f'health_probe_up{_labels(probe=probe)} {int(result["status"] != "error")}'
+          for probe, result in probe_results.items()),
+        '# TYPE health_probe_latency_ms histogram',
+    ]
+    for probe, result in probe_results.items():
+        histogram = result['histogram']
+        if not histogram:
+            continue
+        lines.extend(
+            f'health_probe_latency_ms_bucket{_labels(probe=probe, le=bound)} {count}'
+            for bound, count in histogram['buckets'].items()
+        )
+        lines.append(f'health_probe_latency_ms_sum{_labels(probe=probe)} {histogram["sum_ms"]}')
+        lines.append(f'health_probe_latency_ms_count{_labels(probe=probe)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
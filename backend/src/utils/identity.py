@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import g, jsonify, request
+from flask_jwt_extended import get_jwt, get_jwt_identity, verify_jwt_in_request
+from src.models import Prisma
+from src.utils.invalidation import (
+    is_listening, publish_invalidation, register_invalidation, start_invalidation_listener
+)
+
+prisma = Prisma()
+
+# Short, as the TTL is all that bounds staleness if an invalidation is lost
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 4096))
+INVALIDATION_CHANNEL = 'users:invalidate'
+# Requests to these blueprints never resolve an identity
+ANONYMOUS_BLUEPRINTS = ('health',)
+
+_users = OrderedDict()
+_users_lock = threading.Lock()
+
+class Identity:
+    """Who a request acts as, resolved once before the view runs
+
+    The user ID and tenant come from the JWT claims or the API key; role
+    and profile fields come from the user cache, so a role change applies
+    to tokens that were issued before it.
+    """
+
+    __slots__ = ('user_id', 'tenant_id', 'role', 'name', 'email', 'created_at',
+                 'facebook_connected', 'pages_synced_at', 'via')
+
+    def __init__(self, user, tenant_id, via):
+        self.user_id = user['id']
+        self.tenant_id = tenant_id
+        self.role = user['role']
+        self.name = user['name']
+        self.email = user['email']
+        self.created_at = user['createdAt']
+        self.facebook_connected = user['facebookConnected']
+        self.pages_synced_at = user['pagesSyncedAt']
+        self.via = via
+
+    @property
+    def is_admin(self):
+        return self.role == 'ADMIN'
+
+def _clear_users():
+    with _users_lock:
+        _users.clear()
+
+def _evict_user(user_id):
+    with _users_lock:
+        _users.pop(user_id, None)
+
+register_invalidation(INVALIDATION_CHANNEL, _evict_user, _clear_users)
+
+def invalidate_user(user_id):
+    """Drop a user from every process's cache; call after changing role, profile or tokens"""
+    _evict_user(user_id)
+    publish_invalidation(INVALIDATION_CHANNEL, user_id)
+
+async def get_cached_user(user_id):
+    """The identity fields of a user, from the cache or one query; None if missing"""
+    start_invalidation_listener()
+    with _users_lock:
+        cached = _users.get(user_id)
+        if cached and time.monotonic() - cached[0] < USER_CACHE_TTL:
+            _users.move_to_end(user_id)
+            return cached[1]
+
+    user = await prisma.user.find_unique(where={'id': user_id})
+    if not user:
+        return None
+    entry = {
+        'id': user.id,
+        'role': user.role,
+        'name': user.name,
+        'email': user.email,
+        'createdAt': user.createdAt,
+        'facebookConnected': bool(user.facebookToken),
+        'pagesSyncedAt': user.pagesSyncedAt
+    }
+    # Without the listener, a role change elsewhere could go unnoticed
+    if is_listening():
+        with _users_lock:
+            _users[user_id] = (time.monotonic(), entry)
+            _users.move_to_end(user_id)
+            while len(_users) > USER_CACHE_SIZE:
+                _users.popitem(last=False)
+    return entry
+
+def init_identity(app):
+    """Resolve the request's identity before any view runs
+
+    Register after init_api_key_auth so requests with an API key act as
+    the key's owner. Invalid tokens are left for @jwt_required to reject.
+    """
+
+    @app.before_request
+    async def load_identity():
+        g.identity = None
+        if request.blueprint in ANONYMOUS_BLUEPRINTS:
+            return None
+
+        api_key = g.get('api_key')
+        if api_key:
+            user_id, tenant_id, via = api_key['userId'], api_key['userId'], 'api_key'
+        else:
+            try:
+                verify_jwt_in_request(optional=True)
+            except Exception:
+                return None
+            user_id = get_jwt_identity()
+            tenant_id, via = get_jwt().get('tenant', user_id), 'jwt'
+
+        if user_id:
+            try:
+                user = await get_cached_user(user_id)
+            except Exception as e:
+                print(f"Failed to load request identity: {str(e)}")
+                return jsonify({'error': f'Failed to load user: {str(e)}'}), 500
+            if user:
+                g.identity = Identity(user, tenant_id, via)
+        return None
+
+def current_identity():
+    """The request's Identity, or None for anonymous requests and unknown users"""
+    return g.get('identity')
@@ -0,0 +1,48 @@
+import itertools
+import os
+import secrets
+import socket
+import threading
+import time
+
+# cuid() as the Prisma schema generates it: "c" + timestamp, counter,
+# host fingerprint and randomness, each in base 36, 25 characters in all
+BASE = 36
+BLOCK_SIZE = 4
+DISCRETE_VALUES = BASE ** BLOCK_SIZE
+ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+_counter = itertools.count()
+_counter_lock = threading.Lock()
+
+def _base36(value, width=None):
+    digits = ''
+    while True:
+        value, remainder = divmod(value, BASE)
+        digits = ALPHABET[remainder] + digits
+        if not value:
+            break
+    return digits[-width:].rjust(width, '0') if width else digits
+
+def _fingerprint():
+    pid = _base36(os.getpid(), 2)
+    hostname = socket.gethostname()
+    host = _base36(sum(map(ord, hostname)) + len(hostname) + BASE, 2)
+    return pid + host
+
+def new_cuid():
+    """An ID in the same form as the schema's cuid() default
+
+    For rows whose IDs must be known before a create_many, which does not
+    return the rows it inserted.
+    """
+    with _counter_lock:
+        count = next(_counter) % DISCRETE_VALUES
+    return (
+        'c'
+        + _base36(int(time.time() * 1000))
+        + _base36(count, BLOCK_SIZE)
+        + _fingerprint()
+        + _base36(secrets.randbelow(DISCRETE_VALUES), BLOCK_SIZE)
+        + _base36(secrets.randbelow(DISCRETE_VALUES), BLOCK_SIZE)
+    )
@@ -0,0 +1,189 @@
+import time
+from datetime import datetime
+from src.models import Prisma
+from src.utils.security import decrypt_token
+from src.utils.graph import graph_pages
+from src.utils.queue import redis_client
+from src.utils.worker import job_handler
+
+prisma = Prisma()
+
+POST_SCAN_CHUNK_SIZE = 200
+# Checkpoints and progress outlive retries and restarts of the same import
+IMPORT_STATE_TTL = 7 * 24 * 3600
+
+ENGAGEMENT_EDGES = [
+    # (edge, fields, lead source, how to get the profile from an item)
+    ('comments', 'from{id,name}', 'FACEBOOK_COMMENT', lambda item: item.get('from')),
+    ('reactions', 'id,name', 'FACEBOOK_LIKE', lambda item: item),
+]
+
+def _progress_key(import_id):
+    return f'import:{import_id}:progress'
+
+def _checkpoint_key(import_id):
+    return f'import:{import_id}:done_posts'
+
+def get_import_progress(import_id):
+    """Get the progress hash of an import, or None if unknown"""
+    progress = redis_client.hgetall(_progress_key(import_id))
+    return progress or None
+
+class ImportProgress:
+    """Counters for one import run, mirrored to Redis for the progress API"""
+
+    def __init__(self, import_id, user_id, page_id, posts_total):
+        self.import_id = import_id
+        self.started = time.monotonic()
+        self.counters = {'posts_done': 0, 'profiles_seen': 0, 'leads_created': 0}
+        self._save({
+            'user_id': user_id,
+            'page_id': page_id,
+            'posts_total': posts_total,
+            'status': 'running',
+            'started_at': datetime.utcnow().isoformat()
+        })
+
+    def _save(self, fields):
+        key = _progress_key(self.import_id)
+        redis_client.hset(key, mapping=fields)
+        redis_client.expire(key, IMPORT_STATE_TTL)
+
+    @property
+    def leads_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return round(self.counters['leads_created'] / elapsed, 2) if elapsed > 0 else 0.0
+
+    def add(self, **increments):
+        for name, value in increments.items():
+            self.counters[name] += value
+
+    def flush(self, **fields):
+        self._save({
+            **self.counters,
+            **fields,
+            'leads_per_second': self.leads_per_second,
+            'updated_at': datetime.utcnow().isoformat()
+        })
+
+def normalize_profile(profile, source, user_id, page_id):
+    """Build Lead fields from a Graph API profile, or None if unusable"""
+    if not profile or not profile.get('id'):
+        return None
+
+    name = (profile.get('name') or '').strip()
+    first_name, _, last_name = name.partition(' ')
+
+    return {
+        'facebookUserId': profile['id'],
+        'firstName': first_name or None,
+        'lastName': last_name or None,
+        'source': source,
+        'status': 'NEW',
+        'consentGiven': False,
+        'userId': user_id,
+        'facebookPageId': page_id,
+        'lastInteraction': datetime.utcnow()
+    }
+
+async def insert_new_leads(user_id, leads, seen):
+    """Insert leads whose facebookUserId is not yet known for the user
+
+    `seen` holds IDs already handled in this run, so most duplicates are
+    dropped before touching the database. Returns the number inserted.
+    """
+    batch = {}
+    for lead in leads:
+        facebook_user_id = lead['facebookUserId']
+        if facebook_user_id not in seen and facebook_user_id not in batch:
+            batch[facebook_user_id] = lead
+
+    if not batch:
+        return 0
+
+    existing = await prisma.lead.find_many(
+        where={'userId': user_id, 'facebookUserId': {'in': list(batch)}}
+    )
+    for lead in existing:
+        batch.pop(lead.facebookUserId, None)
+        seen.add(lead.facebookUserId)
+
+    if not batch:
+        return 0
+
+    # A concurrent import of the same page may have inserted some of these
+    created = await prisma.lead.create_many(data=list(batch.values()), skip_duplicates=True)
+    seen.update(batch)
+    return created
+
+async def import_post_engagement(user_id, page, post_id, access_token, seen, progress, fetch_pages=graph_pages):
+    """Stream commenters and reactors of one post into leads"""
+    for edge, fields, source, get_profile in ENGAGEMENT_EDGES:
+        async for items in fetch_pages(f'{post_id}/{edge}', access_token, {'fields': fields, 'limit': 100}):
+            leads = [
+                lead for lead in (
+                    normalize_profile(get_profile(item), source, user_id, page.id) for item in items
+                ) if lead
+            ]
+            created = await insert_new_leads(user_id, leads, seen)
+            progress.add(profiles_seen=len(items), leads_created=created)
+
+async def import_page_engagement(import_id, user_id, page_id, fetch_pages=graph_pages):
+    """Import engagement for every synced post of a page, resuming from checkpoints"""
+    page = await prisma.facebookpage.find_first(where={'id': page_id, 'userId': user_id})
+    if not page:
+        raise LookupError(f'Page {page_id} not found')
+
+    access_token = decrypt_token(page.accessToken)
+    if not access_token:
+        raise ValueError('Invalid page token')
+
+    posts_total = await prisma.facebookpost.count(where={'facebookPageId': page.id})
+    progress = ImportProgress(import_id, user_id, page_id, posts_total)
+    checkpoint_key = _checkpoint_key(import_id)
+    done_posts = redis_client.smembers(checkpoint_key)
+    progress.add(posts_done=len(done_posts))
+    seen = set()
+    cursor = None
+
+    try:
+        while True:
+            posts = await prisma.facebookpost.find_many(
+                where={'facebookPageId': page.id},
+                order_by={'id': 'asc'},
+                take=POST_SCAN_CHUNK_SIZE,
+                **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+            )
+            if not posts:
+                break
+
+            for post in posts:
+                if post.facebookPostId in done_posts:
+                    continue
+
+                await import_post_engagement(user_id, page, post.facebookPostId, access_token, seen, progress, fetch_pages)
+
+                redis_client.sadd(checkpoint_key, post.facebookPostId)
+                redis_client.expire(checkpoint_key, IMPORT_STATE_TTL)
+                progress.add(posts_done=1)
+                progress.flush()
+
+            cursor = posts[-1].id
+    except Exception as e:
+        progress.flush(status='failed', error=str(e)[:500])
+        raise
+
+    progress.flush(status='completed', completed_at=datetime.utcnow().isoformat())
+    return {**progress.counters, 'leads_per_second': progress.leads_per_second}
+
+@job_handler('import-queue', 'import-data')
+async def process_import_job(job_data):
+    """Dispatch import jobs by type"""
+    if job_data.get('type') != 'import_engagement':
+        raise ValueError(f"Unknown import type: {job_data.get('type')}")
+
+    return await import_page_engagement(
+        job_data.get('import_id') or job_data['page_id'],
+        job_data['user_id'],
+        job_data['page_id']
+    )
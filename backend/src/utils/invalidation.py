@@ -0,0 +1,60 @@
+import threading
+import time
+from src.utils.queue import redis_client
+
+LISTENER_RETRY_INTERVAL = 5
+
+# channel -> (called with each message, called when messages may have been missed)
+_channels = {}
+_listener = None
+_listener_guard = threading.Lock()
+_listening = threading.Event()
+
+def register_invalidation(channel, on_message, on_reset):
+    """Route messages on a pub/sub channel to an in-process cache
+
+    Register at import time; the listener subscribes to every channel
+    registered before it starts.
+    """
+    _channels[channel] = (on_message, on_reset)
+
+def _reset_all():
+    for _, on_reset in _channels.values():
+        on_reset()
+
+def _listen():
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(*_channels)
+            # Anything published before the subscription was missed
+            _reset_all()
+            _listening.set()
+            for message in pubsub.listen():
+                on_message, _ = _channels[message['channel']]
+                on_message(message['data'])
+        except Exception as e:
+            print(f"Cache invalidation listener failed: {str(e)}")
+        _listening.clear()
+        _reset_all()
+        time.sleep(LISTENER_RETRY_INTERVAL)
+
+def start_invalidation_listener():
+    """Start the shared subscriber thread once per process"""
+    global _listener
+    if _listener is not None:
+        return
+    with _listener_guard:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, name='cache-invalidation', daemon=True)
+            _listener.start()
+
+def is_listening():
+    """Whether invalidations are being received; caches should not fill otherwise"""
+    return _listening.is_set()
+
+def publish_invalidation(channel, message):
+    try:
+        redis_client.publish(channel, message)
+    except Exception as e:
+        print(f"Failed to publish cache invalidation: {str(e)}")
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+from src.models import Prisma
+from src.utils.graph import graph_upload
+from src.utils.queue import redis_client
+from src.utils.security import decrypt_token
+
+prisma = Prisma()
+
+MEDIA_STORAGE_DIR = os.getenv(
+    'MEDIA_STORAGE_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'media')
+)
+CHUNK_SIZE = 64 * 1024
+
+# WhatsApp keeps uploaded media for 30 days; re-upload a day early
+MEDIA_ID_LIFETIME = timedelta(days=30)
+MEDIA_REFRESH_MARGIN = timedelta(days=1)
+REDIS_PREFIX = 'wa-media'
+# Concurrent sends of the same asset wait for one upload instead of racing
+UPLOAD_LOCK_TTL = 180
+UPLOAD_WAIT_INTERVAL = 0.5
+
+# Deletes the upload lock only while it still holds our token; a lock that
+# expired and was taken by another worker is left alone
+_release_lock = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+# WhatsApp message type -> (accepted MIME types, maximum size in bytes)
+MEDIA_TYPES = {
+    'image': ({'image/jpeg', 'image/png'}, 5 * 1024 * 1024),
+    'video': ({'video/mp4', 'video/3gpp'}, 16 * 1024 * 1024),
+    'audio': ({'audio/aac', 'audio/mp4', 'audio/mpeg', 'audio/amr', 'audio/ogg'}, 16 * 1024 * 1024),
+    'document': ({
+        'application/pdf', 'text/plain', 'application/msword',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'application/vnd.ms-excel',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'application/vnd.ms-powerpoint',
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+    }, 100 * 1024 * 1024),
+}
+
+class MediaError(Exception):
+    """The media file is not accepted or could not be uploaded"""
+
+def media_message_type(mime_type):
+    """Get the WhatsApp message type for a MIME type, or None if unsupported"""
+    for message_type, (mime_types, _) in MEDIA_TYPES.items():
+        if mime_type in mime_types:
+            return message_type
+    return None
+
+def media_path(sha256):
+    """Local path of a stored file, sharded by the first two hash characters"""
+    return os.path.join(MEDIA_STORAGE_DIR, sha256[:2], sha256)
+
+def _write_stream(stream, max_size):
+    """Copy a stream to a temporary file in chunks, hashing as it goes"""
+    os.makedirs(MEDIA_STORAGE_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=MEDIA_STORAGE_DIR, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise MediaError(f'File exceeds the {max_size // (1024 * 1024)} MB limit')
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return temp_path, digest.hexdigest(), size
+
+async def store_media(user_id, stream, mime_type, filename=None):
+    """Store an uploaded file by content hash and return its MediaAsset
+
+    Uploading identical content again returns the existing asset and
+    leaves the stored file untouched.
+    """
+    message_type = media_message_type(mime_type)
+    if not message_type:
+        raise MediaError(f'Unsupported media type: {mime_type}')
+
+    temp_path, sha256, size = await asyncio.to_thread(_write_stream, stream, MEDIA_TYPES[message_type][1])
+    if size == 0:
+        os.unlink(temp_path)
+        raise MediaError('File is empty')
+
+    path = media_path(sha256)
+    if os.path.exists(path):
+        os.unlink(temp_path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    return await prisma.mediaasset.upsert(
+        where={'userId_sha256': {'userId': user_id, 'sha256': sha256}},
+        data={
+            'create': {
+                'userId': user_id,
+                'sha256': sha256,
+                'mimeType': mime_type,
+                'size': size,
+                'filename': filename
+            },
+            'update': {}
+        }
+    )
+
+def _cache_key(number_id, sha256):
+    return f'{REDIS_PREFIX}:{number_id}:{sha256}'
+
+def _as_utc(value):
+    """Aware UTC datetime; naive values are taken to be UTC already"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _cache_media_id(number_id, sha256, media_id, expires_at):
+    ttl = int((_as_utc(expires_at) - MEDIA_REFRESH_MARGIN - datetime.now(timezone.utc)).total_seconds())
+    if ttl > 0:
+        redis_client.set(_cache_key(number_id, sha256), media_id, ex=ttl)
+
+async def _lookup_media_id(number, asset):
+    """Cached media ID for an asset on a number: Redis, then the database"""
+    media_id = redis_client.get(_cache_key(number.id, asset.sha256))
+    if media_id:
+        return media_id
+
+    upload = await prisma.whatsappmedia.find_unique(
+        where={'mediaAssetId_whatsappNumberId': {'mediaAssetId': asset.id, 'whatsappNumberId': number.id}}
+    )
+    if upload and _as_utc(upload.expiresAt) - MEDIA_REFRESH_MARGIN > datetime.now(timezone.utc):
+        _cache_media_id(number.id, asset.sha256, upload.mediaId, upload.expiresAt)
+        return upload.mediaId
+    return None
+
+def _upload_file(phone_number_id, access_token, asset):
+    with open(media_path(asset.sha256), 'rb') as f:
+        response = graph_upload(
+            f'{phone_number_id}/media',
+            access_token,
+            {'messaging_product': 'whatsapp', 'type': asset.mimeType},
+            f,
+            asset.filename or asset.sha256,
+            asset.mimeType
+        )
+    if not response.get('id'):
+        raise MediaError('WhatsApp media upload returned no ID')
+    return response['id']
+
+async def get_whatsapp_media_id(number, asset, phone_number_id):
+    """Get a WhatsApp media ID for an asset on a number, uploading at most once
+
+    Every send of the same asset from the same number shares one upload
+    until the media ID nears expiry. While one worker uploads, the others
+    wait on the lock and then read the cached ID.
+    """
+    media_id = await _lookup_media_id(number, asset)
+    if media_id:
+        return media_id
+
+    if not os.path.exists(media_path(asset.sha256)):
+        raise MediaError(f'Media file {asset.sha256} is missing from storage')
+
+    lock_key = f'{_cache_key(number.id, asset.sha256)}:lock'
+    lock_token = uuid.uuid4().hex
+    waited = 0
+    while not redis_client.set(lock_key, lock_token, nx=True, ex=UPLOAD_LOCK_TTL):
+        await asyncio.sleep(UPLOAD_WAIT_INTERVAL)
+        waited += UPLOAD_WAIT_INTERVAL
+        media_id = await _lookup_media_id(number, asset)
+        if media_id:
+            return media_id
+        if waited >= UPLOAD_LOCK_TTL:
+            raise MediaError('Timed out waiting for a concurrent media upload')
+
+    try:
+        # Another worker may have finished between our lookup and the lock
+        media_id = await _lookup_media_id(number, asset)
+        if media_id:
+            return media_id
+
+        access_token = decrypt_token(number.accessToken)
+        if not access_token:
+            raise MediaError('Invalid WhatsApp access token')
+
+        media_id = await asyncio.to_thread(_upload_file, phone_number_id, access_token, asset)
+        expires_at = datetime.now(timezone.utc) + MEDIA_ID_LIFETIME
+        await prisma.whatsappmedia.upsert(
+            where={'mediaAssetId_whatsappNumberId': {'mediaAssetId': asset.id, 'whatsappNumberId': number.id}},
+            data={
+                'create': {
+                    'mediaAssetId': asset.id,
+                    'whatsappNumberId': number.id,
+                    'mediaId': media_id,
+                    'expiresAt': expires_at
+                },
+                'update': {'mediaId': media_id, 'expiresAt': expires_at}
+            }
+        )
+        _cache_media_id(number.id, asset.sha256, media_id, expires_at)
+        return media_id
+    finally:
+        _release_lock(keys=[lock_key], args=[lock_token])
+
+def build_media_object(media_id, caption=None, filename=None, message_type=None):
+    """Build the media object of a WhatsApp message or template header parameter"""
+    media = {'id': media_id}
+    if caption and message_type in ('image', 'video', 'document'):
+        media['caption'] = caption
+    if filename and message_type == 'document':
+        media['filename'] = filename
+    return media
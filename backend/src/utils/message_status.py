@@ -0,0 +1,148 @@
+from datetime import timezone
+from src.models import Prisma
+from src.utils.queue import redis_client
+
+prisma = Prisma()
+
+# Recent sends are resolved from Redis; older ones fall back to the unique index
+PROVIDER_ID_TTL = 7 * 24 * 3600
+PROVIDER_ID_PREFIX = 'provider-msg'
+
+# Provider status -> (Message status, rank). FAILED sits between SENT and
+# DELIVERED: a delivery or read receipt overrides it, a late "sent" does not.
+PROVIDER_STATUSES = {
+    'sent': ('SENT', 1),
+    'failed': ('FAILED', 2),
+    'delivered': ('DELIVERED', 3),
+    'read': ('READ', 4),
+}
+# Timestamp columns written by status events, in VALUES column order
+TIMESTAMP_FIELDS = ('sentAt', 'deliveredAt', 'readAt')
+# Rows per UPDATE ... FROM (VALUES ...) statement, well under the bind parameter limit
+TIMESTAMP_UPDATE_CHUNK = 1000
+
+# Statuses a message may move from when advancing to each status
+ADVANCES_FROM = {
+    'SENT': ['PENDING'],
+    'FAILED': ['PENDING', 'SENT'],
+    'DELIVERED': ['PENDING', 'SENT', 'FAILED'],
+    'READ': ['PENDING', 'SENT', 'DELIVERED', 'FAILED'],
+}
+
+def remember_provider_message(provider_message_id, message_id):
+    """Map a provider message ID (wamid / mid) to our message ID for status lookups"""
+    if not provider_message_id:
+        return
+    try:
+        redis_client.set(f'{PROVIDER_ID_PREFIX}:{provider_message_id}', message_id, ex=PROVIDER_ID_TTL)
+    except Exception as e:
+        print(f"Failed to cache provider message ID: {str(e)}")
+
+async def resolve_provider_messages(provider_message_ids):
+    """Map provider message IDs to message IDs: one MGET, then one query for misses"""
+    provider_message_ids = list(dict.fromkeys(pid for pid in provider_message_ids if pid))
+    if not provider_message_ids:
+        return {}
+
+    cached = redis_client.mget([f'{PROVIDER_ID_PREFIX}:{pid}' for pid in provider_message_ids])
+    resolved = {pid: message_id for pid, message_id in zip(provider_message_ids, cached) if message_id}
+
+    misses = [pid for pid in provider_message_ids if pid not in resolved]
+    if misses:
+        messages = await prisma.message.find_many(where={'providerMessageId': {'in': misses}})
+        pipe = redis_client.pipeline(transaction=False)
+        for message in messages:
+            resolved[message.providerMessageId] = message.id
+            pipe.set(f'{PROVIDER_ID_PREFIX}:{message.providerMessageId}', message.id, ex=PROVIDER_ID_TTL)
+        pipe.execute()
+
+    return resolved
+
+def merge_status_events(events, message_ids):
+    """Collapse status events per message into its final state
+
+    Events may arrive in any order (READ before DELIVERED, or split across
+    batches). The highest-ranked status wins and each timestamp keeps its
+    earliest value; a read also implies delivery.
+    """
+    merged = {}
+    for event in events:
+        message_id = message_ids.get(event['id'])
+        if message_id is None or event['status'] not in PROVIDER_STATUSES:
+            continue
+
+        status, rank = PROVIDER_STATUSES[event['status']]
+        state = merged.setdefault(message_id, {'rank': 0, 'timestamps': {}})
+        if rank > state['rank']:
+            state.update(rank=rank, status=status, error=event.get('error'))
+
+        fields = {'sent': ['sentAt'], 'delivered': ['deliveredAt'], 'read': ['readAt', 'deliveredAt']}
+        for field in fields.get(event['status'], []):
+            current = state['timestamps'].get(field)
+            state['timestamps'][field] = min(current, event['at']) if current else event['at']
+
+    return merged
+
+def _sql_timestamp(at):
+    if at is None:
+        return None
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    return at.isoformat()
+
+async def _merge_timestamps(merged):
+    """Write every message's timestamps in one statement per chunk
+
+    LEAST ignores NULLs, so a missing timestamp is filled and an existing
+    one is only ever replaced by an earlier event, whichever batch it
+    arrives in.
+    """
+    rows = list(merged.items())
+    for start in range(0, len(rows), TIMESTAMP_UPDATE_CHUNK):
+        values, params = [], []
+        for message_id, state in rows[start:start + TIMESTAMP_UPDATE_CHUNK]:
+            n = len(params)
+            values.append(f'(${n + 1}, ${n + 2}::timestamp, ${n + 3}::timestamp, ${n + 4}::timestamp)')
+            params.append(message_id)
+            params.extend(_sql_timestamp(state['timestamps'].get(field)) for field in TIMESTAMP_FIELDS)
+
+        await prisma.execute_raw(
+            'UPDATE messages AS m SET '
+            '"sentAt" = LEAST(m."sentAt", v.sent_at), '
+            '"deliveredAt" = LEAST(m."deliveredAt", v.delivered_at), '
+            '"readAt" = LEAST(m."readAt", v.read_at) '
+            f'FROM (VALUES {", ".join(values)}) AS v(id, sent_at, delivered_at, read_at) '
+            'WHERE m.id = v.id',
+            *params
+        )
+
+async def apply_provider_statuses(events):
+    """Apply status events keyed by provider message ID in a few set-based writes
+
+    Each event is {'id', 'status', 'at', 'error'}. Returns (messages
+    advanced, events whose provider ID is unknown).
+    """
+    message_ids = await resolve_provider_messages(event['id'] for event in events)
+    unresolved = [event for event in events if event['id'] not in message_ids]
+    merged = merge_status_events(events, message_ids)
+    if not merged:
+        return 0, unresolved
+
+    await _merge_timestamps(merged)
+
+    # Move statuses forward only; a stale event never regresses a row
+    by_status = {}
+    for message_id, state in merged.items():
+        by_status.setdefault((state['status'], state['error']), []).append(message_id)
+
+    advanced = 0
+    for (status, error), ids in by_status.items():
+        data = {'status': status}
+        if status == 'FAILED':
+            data['errorMessage'] = (error or 'Delivery failed')[:1000]
+        advanced += await prisma.message.update_many(
+            where={'id': {'in': ids}, 'status': {'in': ADVANCES_FROM[status]}},
+            data=data
+        )
+
+    return advanced, unresolved
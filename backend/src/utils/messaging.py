@@ -0,0 +1,239 @@
+import asyncio
+import re
+from datetime import datetime
+from src.models import Prisma
+from src.utils.security import decrypt_token
+from src.utils.graph import graph_post, GraphAPIError
+from src.utils.graph_cache import cached_graph_get
+from src.utils.message_status import remember_provider_message
+from src.utils.media import MediaError, build_media_object, get_whatsapp_media_id, media_message_type
+from src.utils.session_window import is_window_open
+from src.utils.worker import job_handler
+
+prisma = Prisma()
+
+class MessageSendError(Exception):
+    """A queued message could not be sent"""
+
+def _digits(phone_number):
+    return re.sub(r'\D', '', phone_number or '')
+
+async def resolve_phone_number_id(number, access_token):
+    """Get the Graph API phone number ID for a WhatsApp number, caching it on the row"""
+    if number.phoneNumberId:
+        return number.phoneNumberId
+
+    # Graph requests block, so they run in a thread to keep other jobs moving
+    response = await asyncio.to_thread(
+        cached_graph_get,
+        f'{number.businessAccountId}/phone_numbers',
+        access_token,
+        {'fields': 'id,display_phone_number'}
+    )
+
+    for phone in response.get('data', []):
+        if _digits(phone.get('display_phone_number')) == _digits(number.phoneNumber):
+            await prisma.whatsappnumber.update(
+                where={'id': number.id},
+                data={'phoneNumberId': phone['id']}
+            )
+            return phone['id']
+
+    raise MessageSendError(f'Phone number {number.phoneNumber} not found on business account')
+
+def build_template_components(parameters, header_media=None):
+    """Build WhatsApp template components from a body parameter list
+
+    header_media is an optional (message type, media object) pair for
+    templates with an image, video or document header.
+    """
+    components = []
+    if header_media:
+        message_type, media = header_media
+        components.append({
+            'type': 'header',
+            'parameters': [{'type': message_type, message_type: media}]
+        })
+
+    if parameters:
+        components.append({
+            'type': 'body',
+            'parameters': [
+                parameter if isinstance(parameter, dict) else {'type': 'text', 'text': str(parameter)}
+                for parameter in parameters
+            ]
+        })
+
+    return components
+
+async def get_phone_number_id(number):
+    """Get the Graph API phone number ID of a number, checking its token"""
+    access_token = decrypt_token(number.accessToken)
+    if not access_token:
+        raise MessageSendError('Invalid WhatsApp access token')
+    return await resolve_phone_number_id(number, access_token)
+
+async def resolve_media(number, asset):
+    """Get (message type, media ID) for a stored asset on a number"""
+    message_type = media_message_type(asset.mimeType)
+    if not message_type:
+        raise MessageSendError(f'Unsupported media type: {asset.mimeType}')
+    media_id = await get_whatsapp_media_id(number, asset, await get_phone_number_id(number))
+    return message_type, media_id
+
+async def send_whatsapp(number, payload):
+    """Send a WhatsApp Cloud API message from a number"""
+    access_token = decrypt_token(number.accessToken)
+    if not access_token:
+        raise MessageSendError('Invalid WhatsApp access token')
+
+    phone_number_id = await resolve_phone_number_id(number, access_token)
+    return await asyncio.to_thread(
+        graph_post,
+        f'{phone_number_id}/messages',
+        access_token,
+        {'messaging_product': 'whatsapp', **payload}
+    )
+
+async def send_messenger(page, recipient_id, text):
+    """Send a Messenger text message from a page"""
+    page_access_token = decrypt_token(page.accessToken)
+    if not page_access_token:
+        raise MessageSendError('Invalid page token')
+
+    return await asyncio.to_thread(
+        graph_post,
+        'me/messages',
+        page_access_token,
+        {'recipient': {'id': recipient_id}, 'message': {'text': text}}
+    )
+
+def extract_provider_message_id(response):
+    """Get the wamid (WhatsApp) or mid (Messenger) from a send response"""
+    messages = (response or {}).get('messages') or []
+    if messages:
+        return messages[0].get('id')
+    return (response or {}).get('message_id')
+
+async def record_sent(message_id, response):
+    """Mark a PENDING message SENT with its provider ID; returns the provider ID
+
+    The ID is mapped before the row is written, as a status webhook can
+    beat the update.
+    """
+    provider_message_id = extract_provider_message_id(response)
+    remember_provider_message(provider_message_id, message_id)
+
+    sent = {'sentAt': datetime.utcnow(), 'errorMessage': None, 'providerMessageId': provider_message_id}
+    advanced = await prisma.message.update_many(
+        where={'id': message_id, 'status': 'PENDING'},
+        data={**sent, 'status': 'SENT'}
+    )
+    if not advanced:
+        # A webhook already moved it past SENT; keep that status
+        await prisma.message.update(where={'id': message_id}, data=sent)
+    return provider_message_id
+
+async def _get_campaign_number(user_id):
+    number = await prisma.whatsappnumber.find_first(
+        where={'userId': user_id, 'isActive': True},
+        order_by={'createdAt': 'asc'}
+    )
+    if not number:
+        raise MessageSendError('No active WhatsApp number for campaign')
+    return number
+
+@job_handler('message-queue', 'send-message')
+async def process_message_job(job_data):
+    """Send a queued message and record the outcome on its Message row"""
+    message_id = job_data.get('message_id')
+    if not message_id:
+        raise MessageSendError('Job has no message_id')
+
+    message = await prisma.message.find_unique(
+        where={'id': message_id},
+        include={
+            'lead': {'include': {'facebookPage': True}},
+            'whatsappNumber': True,
+            'whatsappTemplate': True,
+            'campaign': True,
+            'mediaAsset': True
+        }
+    )
+
+    if not message:
+        raise MessageSendError(f'Message {message_id} not found')
+
+    # Cancelled campaigns and already-delivered messages are not re-sent
+    if message.status != 'PENDING':
+        return {'skipped': True, 'status': message.status}
+
+    job_type = job_data.get('type')
+
+    try:
+        if message.platform == 'WHATSAPP':
+            number = message.whatsappNumber or await _get_campaign_number(job_data['user_id'])
+
+            if message.type == 'TEMPLATE':
+                template_name = job_data.get('template_name') or (
+                    message.whatsappTemplate.name if message.whatsappTemplate else message.content
+                )
+                language = job_data.get('language') or (
+                    message.whatsappTemplate.language if message.whatsappTemplate else 'en_US'
+                )
+                header_media = None
+                if message.mediaAsset:
+                    message_type, media_id = await resolve_media(number, message.mediaAsset)
+                    header_media = (message_type, build_media_object(
+                        media_id, filename=message.mediaAsset.filename, message_type=message_type
+                    ))
+                payload = {
+                    'to': message.recipient,
+                    'type': 'template',
+                    'template': {
+                        'name': template_name,
+                        'language': {'code': language},
+                        'components': build_template_components(job_data.get('parameters'), header_media)
+                    }
+                }
+            else:
+                # The window may have closed while the message was queued; retrying cannot help
+                if not await is_window_open(number.id, message.recipient):
+                    await prisma.message.update(
+                        where={'id': message_id},
+                        data={'status': 'FAILED', 'errorMessage': '24-hour customer service window is closed'}
+                    )
+                    return {'skipped': True, 'status': 'FAILED'}
+
+                if message.type == 'MEDIA':
+                    if not message.mediaAsset:
+                        raise MessageSendError('Media message has no media asset')
+                    message_type, media_id = await resolve_media(number, message.mediaAsset)
+                    payload = {
+                        'to': message.recipient,
+                        'type': message_type,
+                        message_type: build_media_object(
+                            media_id, message.content, message.mediaAsset.filename, message_type
+                        )
+                    }
+                else:
+                    payload = {
+                        'to': message.recipient,
+                        'type': 'text',
+                        'text': {'body': message.content}
+                    }
+
+            response = await send_whatsapp(number, payload)
+        else:
+            if not message.lead or not message.lead.facebookPage:
+                raise MessageSendError('Messenger recipient has no linked page')
+            response = await send_messenger(message.lead.facebookPage, message.recipient, message.content)
+    except (GraphAPIError, MessageSendError, MediaError) as e:
+        await prisma.message.update(
+            where={'id': message_id},
+            data={'errorMessage': str(e)[:1000], 'retryCount': {'increment': 1}}
+        )
+        raise
+
+    provider_message_id = await record_sent(message_id, response)
+    return {'sent': True, 'type': job_type, 'provider_message_id': provider_message_id}
@@ -0,0 +1,197 @@
+import json
+from datetime import datetime, timezone
+from src.models import Prisma
+from src.utils.webhooks import MESSENGER_STREAM
+from src.utils.message_status import apply_provider_statuses
+from src.utils.eligibility import mark_leads_changed
+from src.utils.worker import stream_consumer
+
+prisma = Prisma()
+
+MESSENGER_CONSUMER_GROUP = 'messenger-ingest'
+
+def _from_millis(timestamp):
+    return datetime.fromtimestamp(int(timestamp) / 1000, timezone.utc) if timestamp else datetime.now(timezone.utc)
+
+def parse_messaging_events(entries):
+    """Flatten stream entries into (page facebook ID, messaging event) pairs
+
+    Entries that are not valid page webhooks are dropped; they were
+    already acknowledged to Facebook and retrying cannot fix them.
+    """
+    events = []
+    for _, fields in entries:
+        try:
+            payload = json.loads(fields.get('body') or 'null')
+        except ValueError:
+            continue
+        if not isinstance(payload, dict) or payload.get('object') != 'page':
+            continue
+
+        for entry in payload.get('entry', []):
+            for event in entry.get('messaging', []):
+                events.append((str(entry.get('id')), event))
+    return events
+
+def classify_event(event):
+    """Turn a messaging event into ('inbound' | 'delivery' | 'read', fields) or None"""
+    psid = (event.get('sender') or {}).get('id')
+    if not psid:
+        return None
+
+    message = event.get('message')
+    if message is not None:
+        if message.get('is_echo'):
+            return None
+        attachments = message.get('attachments') or []
+        return 'inbound', {
+            'psid': psid,
+            'mid': message.get('mid'),
+            'type': 'MEDIA' if attachments and not message.get('text') else 'TEXT',
+            'content': message.get('text') or json.dumps(attachments),
+            'at': _from_millis(event.get('timestamp'))
+        }
+
+    postback = event.get('postback')
+    if postback is not None:
+        return 'inbound', {
+            'psid': psid,
+            'mid': postback.get('mid'),
+            'type': 'TEXT',
+            'content': postback.get('payload') or postback.get('title') or '',
+            'at': _from_millis(event.get('timestamp'))
+        }
+
+    # Receipts are sent by the user, so the outbound recipient is the sender
+    for kind in ('delivery', 'read'):
+        receipt = event.get(kind)
+        if receipt is not None and receipt.get('watermark'):
+            return kind, {
+                'psid': psid,
+                'mids': receipt.get('mids') or [],
+                'at': _from_millis(receipt['watermark'])
+            }
+
+    return None
+
+async def upsert_message_leads(page, psids, interaction_at):
+    """Get lead IDs for Messenger senders of a page, creating missing leads"""
+    where = {'userId': page.userId, 'facebookUserId': {'in': list(psids)}}
+    existing = await prisma.lead.find_many(where=where)
+    lead_ids = {lead.facebookUserId: lead.id for lead in existing}
+
+    missing = [psid for psid in psids if psid not in lead_ids]
+    if missing:
+        await prisma.lead.create_many(
+            data=[{
+                'facebookUserId': psid,
+                'source': 'FACEBOOK_MESSAGE',
+                'status': 'NEW',
+                'consentGiven': False,
+                'userId': page.userId,
+                'facebookPageId': page.id,
+                'lastInteraction': interaction_at
+            } for psid in missing],
+            skip_duplicates=True
+        )
+        created = await prisma.lead.find_many(
+            where={'userId': page.userId, 'facebookUserId': {'in': missing}}
+        )
+        lead_ids.update({lead.facebookUserId: lead.id for lead in created})
+        # Messenger senders can be messaged back, so the index must see them
+        mark_leads_changed(page.userId, [lead.id for lead in created])
+
+    if existing:
+        await prisma.lead.update_many(
+            where={'id': {'in': [lead.id for lead in existing]}},
+            data={'lastInteraction': interaction_at}
+        )
+
+    return lead_ids
+
+async def apply_receipts(page, receipts):
+    """Advance outbound Messenger messages up to each receipt watermark
+
+    Read receipts only carry a watermark, and delivery receipts only list
+    mids for some clients, so the watermark is the general mechanism.
+    """
+    transitions = {
+        'delivery': (['SENT'], 'DELIVERED', 'deliveredAt'),
+        'read': (['SENT', 'DELIVERED'], 'READ', 'readAt'),
+    }
+
+    updated = 0
+    for (kind, psid), watermark in receipts.items():
+        from_statuses, status, timestamp_field = transitions[kind]
+        updated += await prisma.message.update_many(
+            where={
+                'platform': 'MESSENGER',
+                'direction': 'OUTBOUND',
+                'recipient': psid,
+                'status': {'in': from_statuses},
+                'sentAt': {'lte': watermark},
+                'lead': {'is': {'facebookPageId': page.id}}
+            },
+            data={'status': status, timestamp_field: watermark}
+        )
+    return updated
+
+@stream_consumer(MESSENGER_STREAM, MESSENGER_CONSUMER_GROUP)
+async def ingest_messenger_events(entries):
+    """Apply a batch of Messenger webhook entries with a handful of queries per page"""
+    by_page = {}
+    for page_facebook_id, event in parse_messaging_events(entries):
+        classified = classify_event(event)
+        if classified:
+            by_page.setdefault(page_facebook_id, []).append(classified)
+
+    if not by_page:
+        return {'pages': 0}
+
+    pages = await prisma.facebookpage.find_many(
+        where={'facebookPageId': {'in': list(by_page)}, 'isActive': True}
+    )
+
+    totals = {'pages': len(pages), 'messages': 0, 'receipts': 0}
+    for page in pages:
+        inbound, receipts, delivered_mids = [], {}, []
+        for kind, fields in by_page[page.facebookPageId]:
+            if kind == 'inbound':
+                inbound.append(fields)
+            else:
+                key = (kind, fields['psid'])
+                receipts[key] = max(receipts.get(key, fields['at']), fields['at'])
+                delivered_mids.extend(
+                    {'id': mid, 'status': 'delivered', 'at': fields['at']} for mid in fields['mids']
+                )
+
+        if delivered_mids:
+            advanced, _ = await apply_provider_statuses(delivered_mids)
+            totals['receipts'] += advanced
+
+        if inbound:
+            lead_ids = await upsert_message_leads(
+                page,
+                {fields['psid'] for fields in inbound},
+                max(fields['at'] for fields in inbound)
+            )
+            totals['messages'] += await prisma.message.create_many(
+                data=[{
+                    'type': fields['type'],
+                    'platform': 'MESSENGER',
+                    'direction': 'INBOUND',
+                    'recipient': fields['psid'],
+                    'content': fields['content'],
+                    'status': 'DELIVERED',
+                    'sentAt': fields['at'],
+                    'deliveredAt': fields['at'],
+                    'leadId': lead_ids.get(fields['psid']),
+                    'providerMessageId': fields['mid']
+                } for fields in inbound],
+                skip_duplicates=True
+            )
+
+        if receipts:
+            totals['receipts'] += await apply_receipts(page, receipts)
+
+    return totals
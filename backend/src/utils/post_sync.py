@@ -0,0 +1,173 @@
+import asyncio
+import base64
+import os
+import time
+from datetime import datetime, timedelta
+from src.models import Prisma
+from src.utils.security import decrypt_token
+from src.utils.graph import graph_pages
+from src.utils.queue import add_sync_job
+from src.utils.worker import job_handler, periodic_job
+
+prisma = Prisma()
+
+POST_SYNC_INTERVAL = int(os.getenv('FACEBOOK_POST_SYNC_INTERVAL', 900))
+POST_SYNC_CONCURRENCY = int(os.getenv('FACEBOOK_POST_SYNC_CONCURRENCY', 4))
+POST_FIELDS = 'id,message,story,created_time,likes.summary(true),comments.summary(true),shares'
+# Re-read a small window before the high-water mark to pick up late edits
+SINCE_OVERLAP = timedelta(hours=1)
+PAGE_SCAN_CHUNK_SIZE = 500
+
+# Bounds concurrent Graph API crawls within one worker process
+_crawl_semaphore = asyncio.Semaphore(POST_SYNC_CONCURRENCY)
+
+class PageNotSyncable(Exception):
+    """The page is missing, inactive or has no usable token"""
+
+def encode_post_cursor(post):
+    """Opaque cursor pointing just past a post in (createdTime, id) order"""
+    raw = f'{post.createdTime.isoformat()}|{post.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_post_cursor(cursor):
+    """Get (createdTime, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_time, post_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_time), post_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def parse_post(post_data):
+    """Convert a Graph API post into FacebookPost fields"""
+    return {
+        'facebookPostId': post_data['id'],
+        'message': post_data.get('message'),
+        'story': post_data.get('story'),
+        'createdTime': datetime.fromisoformat(post_data['created_time'].replace('Z', '+00:00')),
+        'likesCount': post_data.get('likes', {}).get('summary', {}).get('total_count', 0),
+        'commentsCount': post_data.get('comments', {}).get('summary', {}).get('total_count', 0),
+        'sharesCount': post_data.get('shares', {}).get('count', 0)
+    }
+
+async def upsert_posts(page_id, posts):
+    """Insert new posts with create_many and update only changed ones
+
+    Returns (created, updated) counts.
+    """
+    post_ids = [post['facebookPostId'] for post in posts]
+    existing_posts = await prisma.facebookpost.find_many(
+        where={'facebookPostId': {'in': post_ids}}
+    )
+    existing_by_post_id = {post.facebookPostId: post for post in existing_posts}
+
+    creates, updates = [], []
+    for post in posts:
+        existing = existing_by_post_id.get(post['facebookPostId'])
+        if existing is None:
+            creates.append({**post, 'facebookPageId': page_id})
+            continue
+
+        changes = {
+            field: value for field, value in post.items()
+            if field not in ('facebookPostId', 'createdTime') and getattr(existing, field) != value
+        }
+        if changes:
+            updates.append((existing.id, changes))
+
+    if not creates and not updates:
+        return 0, 0
+
+    async with prisma.tx() as transaction:
+        if creates:
+            await transaction.facebookpost.create_many(data=creates, skip_duplicates=True)
+        for post_id, changes in updates:
+            await transaction.facebookpost.update(where={'id': post_id}, data=changes)
+
+    return len(creates), len(updates)
+
+async def sync_page_posts(page_id):
+    """Fetch posts newer than the page's high-water mark and upsert them
+
+    Every Graph page of results is written as one chunk, so the cost of a
+    refresh is proportional to the number of new posts.
+    """
+    page = await prisma.facebookpage.find_unique(where={'id': page_id})
+    if not page or not page.isActive:
+        raise PageNotSyncable('Page not found or inactive')
+
+    page_access_token = decrypt_token(page.accessToken)
+    if not page_access_token:
+        raise PageNotSyncable('Invalid page token')
+
+    params = {'fields': POST_FIELDS, 'limit': 100}
+    if page.postsSince:
+        params['since'] = int((page.postsSince - SINCE_OVERLAP).timestamp())
+
+    high_water_mark = page.postsSince
+    totals = {'fetched': 0, 'created': 0, 'updated': 0}
+
+    async with _crawl_semaphore:
+        async for batch in graph_pages(f'{page.facebookPageId}/posts', page_access_token, params):
+            if not batch:
+                continue
+
+            posts = [parse_post(post_data) for post_data in batch]
+            created, updated = await upsert_posts(page.id, posts)
+
+            totals['fetched'] += len(posts)
+            totals['created'] += created
+            totals['updated'] += updated
+
+            newest = max(post['createdTime'] for post in posts)
+            if high_water_mark is None or newest > high_water_mark:
+                high_water_mark = newest
+
+    await prisma.facebookpage.update(
+        where={'id': page.id},
+        data={'postsSince': high_water_mark, 'postsSyncedAt': datetime.utcnow()}
+    )
+
+    return totals
+
+async def queue_page_post_sync(page_id, dedupe_key=None):
+    """Queue a post sync for one page"""
+    return await add_sync_job(
+        'sync-page-posts',
+        {'page_id': page_id},
+        job_id=f'sync-page-posts:{page_id}:{dedupe_key}' if dedupe_key else None
+    )
+
+@job_handler('sync-queue', 'sync-page-posts')
+async def process_post_sync_job(job_data):
+    """Sync the posts of a single page"""
+    try:
+        return await sync_page_posts(job_data['page_id'])
+    except PageNotSyncable as e:
+        return {'skipped': str(e)}
+
+@periodic_job('sync-queue', 'sync-all-page-posts', POST_SYNC_INTERVAL)
+@job_handler('sync-queue', 'sync-all-page-posts')
+async def process_all_post_sync_job(job_data):
+    """Fan out one post sync job per active page"""
+    slot = job_data.get('slot') or int(time.time() // POST_SYNC_INTERVAL)
+    cursor = None
+    queued = 0
+
+    while True:
+        pages = await prisma.facebookpage.find_many(
+            where={'isActive': True},
+            order_by={'id': 'asc'},
+            take=PAGE_SCAN_CHUNK_SIZE,
+            **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+        )
+        if not pages:
+            break
+
+        for page in pages:
+            if await queue_page_post_sync(page.id, dedupe_key=slot):
+                queued += 1
+
+        cursor = pages[-1].id
+
+    return {'queued': queued}
@@ -1,73 +1,192 @@
 import os
+import threading
+import time
 import redis
 from bullmq import Queue, Worker
 import json
 from datetime import datetime, timedelta
 
 # Redis connection
-redis_client = redis.Redis(
-    host=os.getenv('REDIS_HOST', 'localhost'),
-    port=int(os.getenv('REDIS_PORT', 6379)),
-    decode_responses=True
-)
+REDIS_CONNECTION = {
+    'host': os.getenv('REDIS_HOST', 'localhost'),
+    'port': int(os.getenv('REDIS_PORT', 6379))
+}
+
+redis_client = redis.Redis(**REDIS_CONNECTION, decode_responses=True)
 
 # Message queues
 message_queue = None
 import_queue = None
+sync_queue = None
+
+MESSAGE_JOB_OPTIONS = {
+    'attempts': 3,
+    'backoff': {
+        'type': 'exponential',
+        'delay': 2000,
+    },
+    'removeOnComplete': 100,
+    'removeOnFail': 50
+}
+
+IMPORT_JOB_OPTIONS = {
+    'attempts': 2,
+    'backoff': {
+        'type': 'fixed',
+        'delay': 5000,
+    },
+    'removeOnComplete': 50,
+    'removeOnFail': 25
+}
+
+SYNC_JOB_OPTIONS = {
+    'attempts': 3,
+    'backoff': {
+        'type': 'exponential',
+        'delay': 10000,
+    },
+    'removeOnComplete': 100,
+    'removeOnFail': 100
+}
+
+JOB_OPTIONS = {
+    'message-queue': MESSAGE_JOB_OPTIONS,
+    'import-queue': IMPORT_JOB_OPTIONS,
+    'sync-queue': SYNC_JOB_OPTIONS
+}
+
+QUEUE_STATS_TTL = 5
+QUEUE_STATS_PREFIX = 'queue-stats'
+THROUGHPUT_WINDOW_MINUTES = 5
+JOB_OUTCOMES = ('completed', 'failed')
+# bullmq key per job state and the Redis command that counts it
+JOB_STATE_KEYS = {
+    'waiting': ('llen', 'wait'),
+    'active': ('llen', 'active'),
+    'paused': ('llen', 'paused'),
+    'prioritized': ('zcard', 'prioritized'),
+    'delayed': ('zcard', 'delayed'),
+    'waiting_children': ('zcard', 'waiting-children'),
+    'completed': ('zcard', 'completed'),
+    'failed': ('zcard', 'failed'),
+}
+
+_queue_stats_cache = (0, None)
+_queue_stats_lock = threading.Lock()
 
 def init_queue():
     """Initialize message queues"""
-    global message_queue, import_queue
+    global message_queue, import_queue, sync_queue
     
     try:
-        message_queue = Queue('message-queue', connection=redis_client)
-        import_queue = Queue('import-queue', connection=redis_client)
+        message_queue = Queue('message-queue', {'connection': REDIS_CONNECTION})
+        import_queue = Queue('import-queue', {'connection': REDIS_CONNECTION})
+        sync_queue = Queue('sync-queue', {'connection': REDIS_CONNECTION})
         print("Message queues initialized successfully")
     except Exception as e:
         print(f"Failed to initialize queues: {str(e)}")
 
+def get_queue(queue_name):
+    """Get an initialized queue by name"""
+    if not message_queue:
+        init_queue()
+    
+    queues = {
+        'message-queue': message_queue,
+        'import-queue': import_queue,
+        'sync-queue': sync_queue
+    }
+    return queues.get(queue_name)
+
 async def add_message_job(job_data):
     """Add a message sending job to the queue"""
     try:
         if not message_queue:
             init_queue()
         
-        job = await message_queue.add('send-message', job_data, {
-            'attempts': 3,
-            'backoff': {
-                'type': 'exponential',
-                'delay': 2000,
-            },
-            'removeOnComplete': 100,
-            'removeOnFail': 50
-        })
+        job = await message_queue.add('send-message', job_data, MESSAGE_JOB_OPTIONS)
         
         return job.id
     except Exception as e:
         print(f"Failed to add message job: {str(e)}")
         return None
 
+async def add_message_jobs(jobs_data):
+    """Add many message sending jobs in one round trip
+
+    Returns the job IDs in input order, or None if the batch could not be
+    queued.
+    """
+    try:
+        if not message_queue:
+            init_queue()
+        
+        jobs = await message_queue.addBulk([
+            {'name': 'send-message', 'data': job_data, 'opts': MESSAGE_JOB_OPTIONS}
+            for job_data in jobs_data
+        ])
+        
+        return [job.id for job in jobs]
+    except Exception as e:
+        print(f"Failed to add message jobs: {str(e)}")
+        return None
+
+async def requeue_jobs(queue_name, jobs):
+    """Re-add jobs to a queue in bulk
+
+    Each entry is a dict with 'name', 'data' and an optional 'delay' in
+    milliseconds. Returns the new job IDs in input order.
+    """
+    queue = get_queue(queue_name)
+    if not queue:
+        raise ValueError(f'Unknown queue: {queue_name}')
+    
+    default_options = JOB_OPTIONS.get(queue_name, {})
+    bulk = [
+        {
+            'name': job['name'],
+            'data': job['data'],
+            'opts': {**default_options, 'delay': job.get('delay', 0)}
+        } for job in jobs
+    ]
+    
+    added = await queue.addBulk(bulk)
+    return [job.id for job in added]
+
 async def add_import_job(job_data):
     """Add a data import job to the queue"""
     try:
         if not import_queue:
             init_queue()
         
-        job = await import_queue.add('import-data', job_data, {
-            'attempts': 2,
-            'backoff': {
-                'type': 'fixed',
-                'delay': 5000,
-            },
-            'removeOnComplete': 50,
-            'removeOnFail': 25
-        })
+        job = await import_queue.add('import-data', job_data, IMPORT_JOB_OPTIONS)
         
         return job.id
     except Exception as e:
         print(f"Failed to add import job: {str(e)}")
         return None
 
+async def add_sync_job(job_name, job_data, job_id=None):
+    """Add a background sync job to the queue
+
+    Passing a job_id deduplicates the job while an earlier one with the
+    same ID is still waiting or running.
+    """
+    try:
+        if not sync_queue:
+            init_queue()
+        
+        options = dict(SYNC_JOB_OPTIONS)
+        if job_id:
+            options['jobId'] = job_id
+        
+        job = await sync_queue.add(job_name, job_data, options)
+        
+        return job.id
+    except Exception as e:
+        print(f"Failed to add sync job: {str(e)}")
+        return None
+
 async def schedule_message(message_data, send_at):
     """Schedule a message to be sent at a specific time"""
     try:
@@ -92,29 +211,78 @@ async def schedule_message(message_data, send_at):
         print(f"Failed to schedule message: {str(e)}")
         return None
 
-def get_queue_stats():
-    """Get queue statistics"""
+def _stats_name(queue_name):
+    return queue_name.replace('-', '_')
+
+def _throughput_key(queue_name, outcome, minute):
+    return f'{QUEUE_STATS_PREFIX}:{queue_name}:{outcome}:{minute}'
+
+def record_job_outcome(queue_name, outcome):
+    """Count a completed or failed job attempt in the current minute"""
     try:
-        stats = {}
-        
-        if message_queue:
-            stats['message_queue'] = {
-                'waiting': message_queue.count(),
-                'active': len(message_queue.get_active()),
-                'completed': len(message_queue.get_completed()),
-                'failed': len(message_queue.get_failed())
-            }
-        
-        if import_queue:
-            stats['import_queue'] = {
-                'waiting': import_queue.count(),
-                'active': len(import_queue.get_active()),
-                'completed': len(import_queue.get_completed()),
-                'failed': len(import_queue.get_failed())
-            }
-        
-        return stats
+        key = _throughput_key(queue_name, outcome, int(time.time() // 60))
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.incr(key)
+        pipe.expire(key, (THROUGHPUT_WINDOW_MINUTES + 1) * 60)
+        pipe.execute()
     except Exception as e:
-        print(f"Failed to get queue stats: {str(e)}")
-        return {}
+        print(f"Failed to record job outcome: {str(e)}")
+
+def _compute_queue_stats():
+    """Read every queue's counts in two pipelined round trips
+
+    Only list and sorted-set lengths are read, the same keys bullmq's
+    getJobCounts uses, so the cost does not grow with the backlog.
+    """
+    now = time.time()
+    # Finished minutes only; the current one is still filling up
+    minutes = [int(now // 60) - offset for offset in range(1, THROUGHPUT_WINDOW_MINUTES + 1)]
 
+    pipe = redis_client.pipeline(transaction=False)
+    for queue_name in JOB_OPTIONS:
+        for command, key in JOB_STATE_KEYS.values():
+            getattr(pipe, command)(f'bull:{queue_name}:{key}')
+        pipe.lindex(f'bull:{queue_name}:wait', -1)
+        for outcome in JOB_OUTCOMES:
+            pipe.mget([_throughput_key(queue_name, outcome, minute) for minute in minutes])
+    replies = iter(pipe.execute())
+
+    stats, oldest_ids = {}, {}
+    for queue_name in JOB_OPTIONS:
+        queue_stats = {state: next(replies) or 0 for state in JOB_STATE_KEYS}
+        oldest_ids[queue_name] = next(replies)
+        queue_stats['throughput_per_minute'] = {
+            outcome: round(sum(int(count or 0) for count in next(replies)) / THROUGHPUT_WINDOW_MINUTES, 2)
+            for outcome in JOB_OUTCOMES
+        }
+        stats[queue_name] = queue_stats
+
+    pipe = redis_client.pipeline(transaction=False)
+    waiting = [name for name, job_id in oldest_ids.items() if job_id]
+    for queue_name in waiting:
+        pipe.hget(f'bull:{queue_name}:{oldest_ids[queue_name]}', 'timestamp')
+    timestamps = dict(zip(waiting, pipe.execute())) if waiting else {}
+    for queue_name, queue_stats in stats.items():
+        timestamp = timestamps.get(queue_name)
+        queue_stats['oldest_waiting_seconds'] = round(max(now - int(timestamp) / 1000, 0), 1) if timestamp else 0
+
+    return {_stats_name(queue_name): queue_stats for queue_name, queue_stats in stats.items()}
+
+def get_queue_stats(max_age=QUEUE_STATS_TTL):
+    """Get per-state job counts, oldest waiting age and throughput of every queue
+
+    Results are cached in the process for a few seconds so dashboards,
+    health checks and metrics scrapes share one read.
+    """
+    global _queue_stats_cache
+    with _queue_stats_lock:
+        cached_at, stats = _queue_stats_cache
+        if stats is not None and time.monotonic() - cached_at < max_age:
+            return stats
+        try:
+            stats = _compute_queue_stats()
+        except Exception as e:
+            print(f"Failed to get queue stats: {str(e)}")
+            return {}
+        _queue_stats_cache = (time.monotonic(), stats)
+        return stats
@@ -1,53 +1,266 @@
 import os
+import asyncio
 import base64
-from cryptography.fernet import Fernet
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, MultiFernet
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from flask import request
 import hashlib
+import hmac
 import secrets
 
+# Decrypted tokens are kept briefly so hot paths skip decryption
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+# Bulk operations smaller than this are not worth a thread hop
+BULK_CRYPTO_THRESHOLD = 32
+
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_crypto_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('CRYPTO_THREADS', 4)),
+    thread_name_prefix='crypto'
+)
+
+ENVELOPE_VERSION = 'g1'
+NONCE_SIZE = 12
+
+@lru_cache(maxsize=4)
+def _derive_key_material(secret, salt):
+    """PBKDF2 key for setups without configured keys; cached, as it is slow"""
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt.encode(),
+        iterations=100000,
+    )
+    return kdf.derive(secret.encode())
+
+def _legacy_key_settings():
+    keys = tuple(key.strip() for key in os.getenv('ENCRYPTION_KEY', '').split(',') if key.strip())
+    return keys, os.getenv('SECRET_KEY', 'default-secret'), os.getenv('ENCRYPTION_SALT', 'default-salt')
+
+@lru_cache(maxsize=4)
+def _build_fernet(keys, secret, salt):
+    """Build the Fernet for a key configuration"""
+    if not keys:
+        # Derive a key (in production, ENCRYPTION_KEY should be set)
+        return Fernet(base64.urlsafe_b64encode(_derive_key_material(secret, salt)))
+
+    fernets = [Fernet(key.encode()) for key in keys]
+    # The first key encrypts; older keys still decrypt during rotation
+    return fernets[0] if len(fernets) == 1 else MultiFernet(fernets)
+
 # Generate or load encryption key
 def get_encryption_key():
-    """Get or generate encryption key for token encryption"""
-    key = os.getenv('ENCRYPTION_KEY')
-    if not key:
-        # Generate a new key (in production, this should be stored securely)
-        password = os.getenv('SECRET_KEY', 'default-secret').encode()
-        salt = os.getenv('ENCRYPTION_SALT', 'default-salt').encode()
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-    else:
-        key = key.encode()
-    
-    return Fernet(key)
+    """Get the Fernet that reads tokens stored before envelope encryption
+
+    ENCRYPTION_KEY may list several comma-separated keys, newest first.
+    """
+    return _build_fernet(*_legacy_key_settings())
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+DERIVED_KEY_ID = 'k0'
+
+class _DerivedKeys:
+    """The k0 key, derivable from every legacy key that may have written it
+
+    k0 follows ENCRYPTION_KEY, whose first entry changes when that key is
+    rotated. Encryption uses the current first entry; decryption tries
+    each listed key and then SECRET_KEY, so envelopes written before a
+    rotation stay readable while the old key remains listed.
+    """
+
+    def __init__(self, candidates):
+        self.candidates = candidates
+
+    def encrypt(self, nonce, data, associated_data):
+        return self.candidates[0].encrypt(nonce, data, associated_data)
+
+    def decrypt(self, nonce, data, associated_data):
+        for candidate in self.candidates[:-1]:
+            try:
+                return candidate.decrypt(nonce, data, associated_data)
+            except InvalidTag:
+                continue
+        return self.candidates[-1].decrypt(nonce, data, associated_data)
+
+def _envelope_key(material):
+    return AESGCM(HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b'token-envelope').derive(material))
+
+def _derived_envelope_key(legacy_settings):
+    """The envelope keys derived from the legacy key configuration"""
+    keys, secret, salt = legacy_settings
+    candidates = [_envelope_key(_b64decode(key)) for key in keys]
+    candidates.append(_envelope_key(_derive_key_material(secret, salt)))
+    return _DerivedKeys(candidates)
+
+@lru_cache(maxsize=4)
+def _build_keyring(keys_setting, legacy_settings):
+    """Parse TOKEN_ENCRYPTION_KEYS into (active key ID, {key ID: AESGCM})
+
+    The derived k0 key, which encrypts while no keys are configured, stays
+    in the keyring for decryption unless an entry named k0 replaces it, so
+    envelopes written before the first explicit key remain readable.
+    """
+    if not keys_setting:
+        return DERIVED_KEY_ID, {DERIVED_KEY_ID: _derived_envelope_key(legacy_settings)}
+
+    keyring = {}
+    for entry in keys_setting.split(','):
+        key_id, _, key = entry.strip().partition(':')
+        if not key_id or not key:
+            raise ValueError('TOKEN_ENCRYPTION_KEYS entries must look like <key id>:<base64 key>')
+        keyring[key_id] = AESGCM(_b64decode(key))
+    active_key_id = next(iter(keyring))
+
+    if DERIVED_KEY_ID not in keyring:
+        keyring[DERIVED_KEY_ID] = _derived_envelope_key(legacy_settings)
+    return active_key_id, keyring
+
+def get_token_keyring():
+    """Get (active key ID, {key ID: AESGCM}) for token envelopes
+
+    TOKEN_ENCRYPTION_KEYS lists comma-separated `<key id>:<base64 32-byte key>`
+    entries, the first of which encrypts. Older entries and the derived k0
+    key only decrypt, until the re-encryption job has moved every stored
+    token to the new key.
+    """
+    return _build_keyring(os.getenv('TOKEN_ENCRYPTION_KEYS', ''), _legacy_key_settings())
+
+def clear_token_cache():
+    """Drop derived keys and decrypted tokens, e.g. after rotating keys"""
+    _derive_key_material.cache_clear()
+    _build_keyring.cache_clear()
+    _build_fernet.cache_clear()
+    with _token_cache_lock:
+        _token_cache.clear()
+
+def _cache_key(encrypted_token):
+    return hashlib.sha256(encrypted_token.encode()).digest()
+
+def _cache_get(key):
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _token_cache[key]
+            return None
+        _token_cache.move_to_end(key)
+        return entry[1]
+
+def _cache_set(key, token):
+    with _token_cache_lock:
+        _token_cache[key] = (time.monotonic() + TOKEN_CACHE_TTL, token)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+def token_key_id(encrypted_token):
+    """Key ID of an envelope token, or None for a legacy Fernet token"""
+    if not encrypted_token or ':' not in encrypted_token:
+        return None
+    version, key_id, _ = encrypted_token.split(':', 2)
+    return key_id if version == ENVELOPE_VERSION else None
+
+def needs_reencryption(encrypted_token):
+    """Check whether a stored token is not yet under the active key"""
+    if not encrypted_token:
+        return False
+    return token_key_id(encrypted_token) != get_token_keyring()[0]
 
 def encrypt_token(token):
-    """Encrypt a token for secure storage"""
+    """Encrypt a token for secure storage
+
+    The result is `g1:<key id>:<base64url(nonce + AES-GCM ciphertext)>`.
+    The header is authenticated, so a token cannot be moved to another key.
+    """
     if not token:
         return None
     
-    fernet = get_encryption_key()
-    encrypted_token = fernet.encrypt(token.encode())
-    return base64.urlsafe_b64encode(encrypted_token).decode()
+    key_id, keyring = get_token_keyring()
+    header = f'{ENVELOPE_VERSION}:{key_id}'
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = keyring[key_id].encrypt(nonce, token.encode(), header.encode())
+    return f"{header}:{base64.urlsafe_b64encode(nonce + ciphertext).decode().rstrip('=')}"
+
+def _decrypt_envelope(encrypted_token):
+    version, key_id, payload = encrypted_token.split(':', 2)
+    aesgcm = get_token_keyring()[1].get(key_id)
+    if version != ENVELOPE_VERSION or aesgcm is None:
+        return None
+
+    data = _b64decode(payload)
+    header = f'{version}:{key_id}'.encode()
+    return aesgcm.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], header).decode()
 
 def decrypt_token(encrypted_token):
     """Decrypt a token for use"""
     if not encrypted_token:
         return None
     
+    key = _cache_key(encrypted_token)
+    token = _cache_get(key)
+    if token is not None:
+        return token
+    
     try:
-        fernet = get_encryption_key()
-        encrypted_data = base64.urlsafe_b64decode(encrypted_token.encode())
-        decrypted_token = fernet.decrypt(encrypted_data)
-        return decrypted_token.decode()
+        if ':' in encrypted_token:
+            token = _decrypt_envelope(encrypted_token)
+        else:
+            # Tokens stored before envelope encryption: base64 of a Fernet token
+            encrypted_data = base64.urlsafe_b64decode(encrypted_token.encode())
+            token = get_encryption_key().decrypt(encrypted_data).decode()
     except Exception:
         return None
+    
+    if token is not None:
+        _cache_set(key, token)
+    return token
+
+async def _map_crypto(function, values):
+    if len(values) < BULK_CRYPTO_THRESHOLD:
+        return [function(value) for value in values]
+    
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_crypto_pool, lambda: [function(value) for value in values])
+
+async def encrypt_tokens(tokens):
+    """Encrypt many tokens off the event loop, preserving order"""
+    return await _map_crypto(encrypt_token, list(tokens))
+
+async def decrypt_tokens(encrypted_tokens):
+    """Decrypt many tokens off the event loop, preserving order"""
+    return await _map_crypto(decrypt_token, list(encrypted_tokens))
+
+async def decrypt_record_tokens(records, field='accessToken'):
+    """Decrypt a token field of many records at once
+
+    Returns {record.id: plaintext or None}, e.g. for a worker that needs
+    the tokens of every page it is about to process.
+    """
+    records = list(records)
+    tokens = await decrypt_tokens([getattr(record, field) for record in records])
+    return {record.id: token for record, token in zip(records, tokens)}
+
+def token_fingerprint(token):
+    """Keyed fingerprint of a plaintext token for change detection"""
+    if not token:
+        return None
+    
+    secret = os.getenv('SECRET_KEY', 'default-secret').encode()
+    return hmac.new(secret, token.encode(), hashlib.sha256).hexdigest()
 
 def hash_api_key(api_key):
     """Hash an API key for secure storage"""
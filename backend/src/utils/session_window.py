@@ -0,0 +1,137 @@
+import re
+from datetime import datetime, timedelta, timezone
+from src.models import Prisma
+from src.utils.queue import redis_client
+
+prisma = Prisma()
+
+# WhatsApp allows free-form messages for 24 hours after the customer's last message
+SESSION_WINDOW = timedelta(hours=24)
+REDIS_PREFIX = 'wa-window'
+# Closed windows are remembered briefly so repeated checks skip the database
+CLOSED_CACHE_TTL = 60
+MAX_WINDOW_BATCH = 10000
+
+# Only moves the expiry forward, so out-of-order webhooks cannot shorten a window
+_extend_window = redis_client.register_script("""
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return 1
+end
+return 0
+""")
+
+def _as_utc(value):
+    """Aware UTC datetime; naive values are taken to be UTC already"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+def _recipient_key(recipient):
+    return re.sub(r'\D', '', recipient or '')
+
+def _window_key(number_id, recipient):
+    return f'{REDIS_PREFIX}:{number_id}:{_recipient_key(recipient)}'
+
+async def open_windows(number_id, inbound_times):
+    """Record inbound messages for a number as {recipient: received at}
+
+    Redis gets one key per recipient that expires with the window; the
+    conversation_windows table keeps the same value for when Redis is cold.
+    """
+    expiries = {}
+    for recipient, received_at in inbound_times.items():
+        key = _recipient_key(recipient)
+        expires_at = _as_utc(received_at) + SESSION_WINDOW
+        if key and (key not in expiries or expires_at > expiries[key]):
+            expiries[key] = expires_at
+    if not expiries:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    pipe = redis_client.pipeline(transaction=False)
+    for recipient, expires_at in expiries.items():
+        ttl = int((expires_at - now).total_seconds())
+        if ttl > 0:
+            _extend_window(
+                keys=[_window_key(number_id, recipient)],
+                args=[int(expires_at.timestamp()), ttl],
+                client=pipe
+            )
+    pipe.execute()
+
+    existing = await prisma.conversationwindow.find_many(
+        where={'whatsappNumberId': number_id, 'recipient': {'in': list(expiries)}}
+    )
+    existing_by_recipient = {window.recipient: window for window in existing}
+
+    creates, extensions = [], {}
+    for recipient, expires_at in expiries.items():
+        window = existing_by_recipient.get(recipient)
+        if window is None:
+            creates.append({
+                'whatsappNumberId': number_id,
+                'recipient': recipient,
+                'lastInboundAt': expires_at - SESSION_WINDOW,
+                'expiresAt': expires_at
+            })
+        elif _as_utc(window.expiresAt) < expires_at:
+            extensions.setdefault(expires_at, []).append(window.id)
+
+    if creates:
+        await prisma.conversationwindow.create_many(data=creates, skip_duplicates=True)
+    for expires_at, window_ids in extensions.items():
+        await prisma.conversationwindow.update_many(
+            where={'id': {'in': window_ids}, 'expiresAt': {'lt': expires_at}},
+            data={'expiresAt': expires_at, 'lastInboundAt': expires_at - SESSION_WINDOW}
+        )
+
+    return len(expiries)
+
+async def get_window_expiries(number_id, recipients):
+    """Map each recipient to its window expiry, or None if the window is closed
+
+    One MGET answers every recipient seen recently; only the rest are
+    looked up in the database, in a single query.
+    """
+    keys = {recipient: _recipient_key(recipient) for recipient in recipients}
+    unique_keys = list(dict.fromkeys(key for key in keys.values() if key))
+    if not unique_keys:
+        return {recipient: None for recipient in recipients}
+
+    now = datetime.now(timezone.utc)
+    cached = redis_client.mget([_window_key(number_id, key) for key in unique_keys])
+    expiries, misses = {}, []
+    for key, value in zip(unique_keys, cached):
+        if value is None:
+            misses.append(key)
+        elif int(value) > now.timestamp():
+            expiries[key] = datetime.fromtimestamp(int(value), timezone.utc)
+
+    if misses:
+        windows = await prisma.conversationwindow.find_many(
+            where={
+                'whatsappNumberId': number_id,
+                'recipient': {'in': misses},
+                'expiresAt': {'gt': now}
+            }
+        )
+        found = {window.recipient: _as_utc(window.expiresAt) for window in windows}
+
+        pipe = redis_client.pipeline(transaction=False)
+        for key in misses:
+            expires_at = found.get(key)
+            if expires_at:
+                expiries[key] = expires_at
+                ttl = int((expires_at - now).total_seconds())
+                pipe.set(_window_key(number_id, key), int(expires_at.timestamp()), ex=max(ttl, 1))
+            else:
+                # An inbound message overwrites this through _extend_window
+                pipe.set(_window_key(number_id, key), 0, ex=CLOSED_CACHE_TTL)
+        pipe.execute()
+
+    return {recipient: expiries.get(key) for recipient, key in keys.items()}
+
+async def is_window_open(number_id, recipient):
+    """Check whether free-form messages can be sent to a recipient now"""
+    expiries = await get_window_expiries(number_id, [recipient])
+    return expiries[recipient] is not None
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+from src.models import Prisma
+from src.utils.security import decrypt_token
+from src.utils.graph import graph_pages
+from src.utils.queue import add_sync_job
+from src.utils.worker import job_handler, periodic_job
+
+prisma = Prisma()
+
+# Approval status changes are what users wait on, so this runs often
+TEMPLATE_SYNC_INTERVAL = int(os.getenv('WHATSAPP_TEMPLATE_SYNC_INTERVAL', 900))
+TEMPLATE_FIELDS = 'name,language,status,category,components'
+NUMBER_SCAN_CHUNK_SIZE = 500
+# Status given to stored templates that no longer exist on the business account
+REMOVED_STATUS = 'DELETED'
+
+class NumberNotSyncable(Exception):
+    """The number is missing, inactive or has no usable token"""
+
+def template_hash(template_data):
+    """Content hash of the template fields that can change after creation"""
+    canonical = json.dumps({
+        'language': template_data.get('language'),
+        'status': template_data.get('status'),
+        'category': template_data.get('category'),
+        'components': template_data.get('components', [])
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def diff_templates(number_id, existing_templates, api_templates):
+    """Compute the template rows to create, update and mark removed
+
+    Rows are compared on their stored content hash, so an unchanged
+    template costs nothing beyond hashing the API response.
+    """
+    existing_by_name = {template.name: template for template in existing_templates}
+    seen = set()
+    creates, updates = [], []
+
+    for template_data in api_templates:
+        name = template_data['name']
+        if name in seen:
+            # Templates are unique per number and name; the first language wins
+            continue
+        seen.add(name)
+
+        content_hash = template_hash(template_data)
+        fields = {
+            'language': template_data['language'],
+            'status': template_data['status'],
+            'category': template_data['category'],
+            'components': template_data.get('components', []),
+            'contentHash': content_hash
+        }
+
+        existing = existing_by_name.get(name)
+        if existing is None:
+            creates.append({**fields, 'name': name, 'whatsappNumberId': number_id})
+        elif existing.contentHash != content_hash or existing.status == REMOVED_STATUS:
+            updates.append((existing.id, fields))
+
+    removed = [
+        template.id for template in existing_templates
+        if template.name not in seen and template.status != REMOVED_STATUS
+    ]
+
+    return creates, updates, removed
+
+async def sync_number_templates(number_id):
+    """Page through a number's templates and write only what changed"""
+    number = await prisma.whatsappnumber.find_unique(where={'id': number_id})
+    if not number or not number.isActive:
+        raise NumberNotSyncable('Number not found or inactive')
+
+    access_token = decrypt_token(number.accessToken)
+    if not access_token:
+        raise NumberNotSyncable('Invalid WhatsApp access token')
+
+    api_templates = []
+    async for batch in graph_pages(
+        f'{number.businessAccountId}/message_templates',
+        access_token,
+        {'fields': TEMPLATE_FIELDS, 'limit': 100}
+    ):
+        api_templates.extend(batch)
+
+    existing_templates = await prisma.whatsapptemplate.find_many(
+        where={'whatsappNumberId': number.id}
+    )
+    creates, updates, removed = diff_templates(number.id, existing_templates, api_templates)
+
+    async with prisma.tx() as transaction:
+        if creates:
+            await transaction.whatsapptemplate.create_many(data=creates, skip_duplicates=True)
+        for template_id, fields in updates:
+            await transaction.whatsapptemplate.update(where={'id': template_id}, data=fields)
+        if removed:
+            await transaction.whatsapptemplate.update_many(
+                where={'id': {'in': removed}},
+                data={'status': REMOVED_STATUS}
+            )
+        await transaction.whatsappnumber.update(
+            where={'id': number.id},
+            data={'templatesSyncedAt': datetime.utcnow()}
+        )
+
+    return {
+        'created': len(creates),
+        'updated': len(updates),
+        'removed': len(removed),
+        'unchanged': len(existing_templates) - len(updates) - len(removed)
+    }
+
+async def queue_template_sync(number_id, dedupe_key=None):
+    """Queue a template sync for one number"""
+    return await add_sync_job(
+        'sync-whatsapp-templates',
+        {'number_id': number_id},
+        job_id=f'sync-whatsapp-templates:{number_id}:{dedupe_key}' if dedupe_key else None
+    )
+
+@job_handler('sync-queue', 'sync-whatsapp-templates')
+async def process_template_sync_job(job_data):
+    """Sync the templates of a single number"""
+    try:
+        return await sync_number_templates(job_data['number_id'])
+    except NumberNotSyncable as e:
+        return {'skipped': str(e)}
+
+@periodic_job('sync-queue', 'sync-all-whatsapp-templates', TEMPLATE_SYNC_INTERVAL)
+@job_handler('sync-queue', 'sync-all-whatsapp-templates')
+async def process_all_template_sync_job(job_data):
+    """Fan out one template sync job per active number"""
+    slot = job_data.get('slot') or int(time.time() // TEMPLATE_SYNC_INTERVAL)
+    cursor = None
+    queued = 0
+
+    while True:
+        numbers = await prisma.whatsappnumber.find_many(
+            where={'isActive': True},
+            order_by={'id': 'asc'},
+            take=NUMBER_SCAN_CHUNK_SIZE,
+            **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+        )
+        if not numbers:
+            break
+
+        for number in numbers:
+            if await queue_template_sync(number.id, dedupe_key=slot):
+                queued += 1
+
+        cursor = numbers[-1].id
+
+    return {'queued': queued}
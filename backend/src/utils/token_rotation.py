@@ -0,0 +1,66 @@
+from src.models import Prisma
+from src.utils.security import decrypt_tokens, encrypt_tokens, needs_reencryption
+from src.utils.worker import job_handler
+
+prisma = Prisma()
+
+REENCRYPT_CHUNK_SIZE = 500
+
+# (prisma model attribute, encrypted field)
+ENCRYPTED_FIELDS = [
+    ('facebookpage', 'accessToken'),
+    ('whatsappnumber', 'accessToken'),
+    ('user', 'facebookToken'),
+]
+
+async def reencrypt_model(model_name, field, chunk_size=REENCRYPT_CHUNK_SIZE):
+    """Move every token of one model to the active key, a chunk at a time
+
+    Each row is updated only if its ciphertext is unchanged, so a token
+    refreshed concurrently is never overwritten with an older value.
+    """
+    model = getattr(prisma, model_name)
+    counts = {'scanned': 0, 'reencrypted': 0, 'undecryptable': 0}
+    cursor = None
+
+    while True:
+        rows = await model.find_many(
+            where={field: {'not': None}},
+            order_by={'id': 'asc'},
+            take=chunk_size,
+            **({'cursor': {'id': cursor}, 'skip': 1} if cursor else {})
+        )
+        if not rows:
+            break
+
+        cursor = rows[-1].id
+        counts['scanned'] += len(rows)
+
+        stale = [row for row in rows if needs_reencryption(getattr(row, field))]
+        if not stale:
+            continue
+
+        plaintexts = await decrypt_tokens([getattr(row, field) for row in stale])
+        readable = [(row, token) for row, token in zip(stale, plaintexts) if token]
+        counts['undecryptable'] += len(stale) - len(readable)
+
+        ciphertexts = await encrypt_tokens([token for _, token in readable])
+        for (row, _), ciphertext in zip(readable, ciphertexts):
+            counts['reencrypted'] += await model.update_many(
+                where={'id': row.id, field: getattr(row, field)},
+                data={field: ciphertext}
+            )
+
+    return counts
+
+async def reencrypt_all_tokens(chunk_size=REENCRYPT_CHUNK_SIZE):
+    """Re-encrypt stored tokens of every model under the active key"""
+    return {
+        f'{model_name}.{field}': await reencrypt_model(model_name, field, chunk_size)
+        for model_name, field in ENCRYPTED_FIELDS
+    }
+
+@job_handler('sync-queue', 'reencrypt-tokens')
+async def process_reencrypt_job(job_data):
+    """Re-encrypt stored tokens after a key rotation"""
+    return await reencrypt_all_tokens(job_data.get('chunk_size') or REENCRYPT_CHUNK_SIZE)
@@ -0,0 +1,66 @@
+import hashlib
+import hmac
+import os
+import time
+from src.utils.queue import redis_client
+
+WEBHOOK_STREAM_PREFIX = 'webhooks:'
+MESSENGER_STREAM = 'webhooks:messenger'
+WHATSAPP_STREAM = 'webhooks:whatsapp'
+# Approximate cap per stream; consumers normally keep it near empty
+WEBHOOK_STREAM_MAXLEN = int(os.getenv('WEBHOOK_STREAM_MAXLEN', 1000000))
+# Meta redelivers for up to a day; anything older is not a duplicate we will see
+WEBHOOK_DEDUPE_TTL = int(os.getenv('WEBHOOK_DEDUPE_TTL', 86400))
+
+def verify_signature(raw_body, signature_header, app_secret):
+    """Check a Meta X-Hub-Signature-256 header against the raw request body"""
+    if not app_secret or not signature_header or not signature_header.startswith('sha256='):
+        return False
+
+    expected = hmac.new(app_secret.encode(), raw_body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature_header[len('sha256='):])
+
+def enqueue_webhook(stream, raw_body):
+    """Append a raw webhook payload to a Redis stream and return its entry ID
+
+    This is the only work done while Facebook waits for the response, so
+    it is a single XADD with no parsing or database access.
+    """
+    return redis_client.xadd(
+        stream,
+        {'body': raw_body, 'received_at': f'{time.time():.3f}'},
+        maxlen=WEBHOOK_STREAM_MAXLEN,
+        approximate=True
+    )
+
+def claim_event_ids(namespace, event_ids, ttl=WEBHOOK_DEDUPE_TTL):
+    """Mark provider event IDs as seen and return the ones not seen before
+
+    One pipelined SET NX per ID, so a batch costs a single round trip.
+    """
+    event_ids = list(dict.fromkeys(event_ids))
+    if not event_ids:
+        return set()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for event_id in event_ids:
+        pipe.set(f'webhook-seen:{namespace}:{event_id}', '1', nx=True, ex=ttl)
+    return {event_id for event_id, claimed in zip(event_ids, pipe.execute()) if claimed}
+
+def release_event_ids(namespace, event_ids):
+    """Forget claimed IDs after a failed batch so the retry applies them"""
+    if event_ids:
+        redis_client.delete(*[f'webhook-seen:{namespace}:{event_id}' for event_id in event_ids])
+
+def get_stream_backlog(stream, group):
+    """Entries not yet acknowledged by a consumer group (pending + unread)"""
+    try:
+        for info in redis_client.xinfo_groups(stream):
+            if info['name'] == group:
+                return {
+                    'pending': info.get('pending', 0),
+                    'lag': info.get('lag')
+                }
+    except Exception:
+        pass
+    return None
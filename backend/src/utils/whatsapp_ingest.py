@@ -0,0 +1,263 @@
+import json
+import re
+from datetime import datetime, timezone
+from src.models import Prisma
+from src.utils.webhooks import WHATSAPP_STREAM, claim_event_ids, release_event_ids
+from src.utils.message_status import apply_provider_statuses
+from src.utils.session_window import open_windows
+from src.utils.worker import stream_consumer
+
+prisma = Prisma()
+
+WHATSAPP_CONSUMER_GROUP = 'whatsapp-ingest'
+DEDUPE_NAMESPACE = 'whatsapp'
+
+# Provider status -> (statuses it may advance from, new status, timestamp field)
+STATUS_TRANSITIONS = {
+    'delivered': (['SENT'], 'DELIVERED', 'deliveredAt'),
+    'read': (['SENT', 'DELIVERED'], 'READ', 'readAt'),
+}
+
+def _digits(phone_number):
+    return re.sub(r'\D', '', phone_number or '')
+
+def _phone_variants(phone_number):
+    """Stored forms of a number; WhatsApp sends digits, the app stores E.164"""
+    digits = _digits(phone_number)
+    return [digits, f'+{digits}']
+
+def _from_seconds(timestamp):
+    return datetime.fromtimestamp(int(timestamp), timezone.utc) if timestamp else datetime.now(timezone.utc)
+
+def _message_content(message):
+    if message.get('type') == 'text':
+        return 'TEXT', (message.get('text') or {}).get('body', '')
+    if message.get('type') in ('button', 'interactive'):
+        reply = message.get('button') or message.get('interactive') or {}
+        return 'TEXT', reply.get('text') or json.dumps(reply)
+    return 'MEDIA', json.dumps(message.get(message.get('type'), {}))
+
+def parse_whatsapp_events(entries):
+    """Flatten stream entries into inbound message and status events"""
+    inbound, statuses = [], []
+    for _, fields in entries:
+        try:
+            payload = json.loads(fields.get('body') or 'null')
+        except ValueError:
+            continue
+        if not isinstance(payload, dict) or payload.get('object') != 'whatsapp_business_account':
+            continue
+
+        for entry in payload.get('entry', []):
+            for change in entry.get('changes', []):
+                if change.get('field') != 'messages':
+                    continue
+                value = change.get('value') or {}
+                metadata = value.get('metadata') or {}
+                number = (metadata.get('phone_number_id'), metadata.get('display_phone_number'))
+                names = {
+                    contact.get('wa_id'): (contact.get('profile') or {}).get('name')
+                    for contact in value.get('contacts', [])
+                }
+
+                for message in value.get('messages', []):
+                    message_type, content = _message_content(message)
+                    inbound.append({
+                        'number': number,
+                        'id': message.get('id'),
+                        'from': message.get('from'),
+                        'name': names.get(message.get('from')),
+                        'type': message_type,
+                        'content': content,
+                        'at': _from_seconds(message.get('timestamp'))
+                    })
+
+                for status in value.get('statuses', []):
+                    errors = status.get('errors') or [{}]
+                    statuses.append({
+                        'number': number,
+                        'id': status.get('id'),
+                        'status': status.get('status'),
+                        'recipient': status.get('recipient_id'),
+                        'at': _from_seconds(status.get('timestamp')),
+                        'error': errors[0].get('message') or errors[0].get('title')
+                    })
+
+    return inbound, statuses
+
+async def resolve_numbers(number_keys):
+    """Map (phone_number_id, display number) pairs to WhatsappNumber rows"""
+    phone_number_ids = {phone_number_id for phone_number_id, _ in number_keys if phone_number_id}
+    numbers = await prisma.whatsappnumber.find_many(
+        where={'phoneNumberId': {'in': list(phone_number_ids)}}
+    )
+    resolved = {number.phoneNumberId: number for number in numbers}
+
+    unresolved = [(pid, display) for pid, display in number_keys if pid and pid not in resolved and display]
+    if unresolved:
+        candidates = await prisma.whatsappnumber.find_many(
+            where={'phoneNumber': {'in': [v for _, display in unresolved for v in _phone_variants(display)]}}
+        )
+        by_digits = {_digits(number.phoneNumber): number for number in candidates}
+        for phone_number_id, display in unresolved:
+            number = by_digits.get(_digits(display))
+            if number:
+                # Remember the ID so later events resolve with the first query
+                await prisma.whatsappnumber.update(
+                    where={'id': number.id},
+                    data={'phoneNumberId': phone_number_id}
+                )
+                resolved[phone_number_id] = number
+
+    return resolved
+
+async def upsert_whatsapp_leads(number, senders, interaction_at):
+    """Get lead IDs keyed by sender digits, creating leads for new senders"""
+    variants = [v for phone in senders for v in _phone_variants(phone)]
+    existing = await prisma.lead.find_many(
+        where={'userId': number.userId, 'phoneNumber': {'in': variants}}
+    )
+    lead_ids = {_digits(lead.phoneNumber): lead.id for lead in existing}
+
+    missing = {phone: name for phone, name in senders.items() if _digits(phone) not in lead_ids}
+    if missing:
+        await prisma.lead.create_many(
+            data=[{
+                'phoneNumber': f'+{_digits(phone)}',
+                'firstName': (name or '').partition(' ')[0] or None,
+                'lastName': (name or '').partition(' ')[2] or None,
+                'source': 'WHATSAPP',
+                'status': 'NEW',
+                'consentGiven': False,
+                'userId': number.userId,
+                'lastInteraction': interaction_at
+            } for phone, name in missing.items()],
+            skip_duplicates=True
+        )
+        created = await prisma.lead.find_many(
+            where={'userId': number.userId, 'phoneNumber': {'in': [f'+{_digits(phone)}' for phone in missing]}}
+        )
+        lead_ids.update({_digits(lead.phoneNumber): lead.id for lead in created})
+
+    if existing:
+        await prisma.lead.update_many(
+            where={'id': {'in': [lead.id for lead in existing]}},
+            data={'lastInteraction': interaction_at}
+        )
+
+    return lead_ids
+
+async def apply_statuses(number, statuses):
+    """Apply statuses by wamid, falling back to recipient watermarks for unknown IDs"""
+    updated, unresolved = await apply_provider_statuses(statuses)
+    if unresolved:
+        updated += await apply_watermark_statuses(number, unresolved)
+    return updated
+
+async def apply_watermark_statuses(number, statuses):
+    """Advance outbound messages to a number's recipients, one write per recipient and status
+
+    Used for messages sent before provider IDs were stored. Failed
+    statuses are skipped: without the wamid there is no way to tell which
+    of a recipient's messages failed.
+    """
+    latest = {}
+    for status in statuses:
+        if status['status'] in STATUS_TRANSITIONS and status['recipient']:
+            key = (_digits(status['recipient']), status['status'])
+            latest[key] = max(latest.get(key, status['at']), status['at'])
+
+    updated = 0
+    for (recipient, provider_status), at in latest.items():
+        from_statuses, new_status, timestamp_field = STATUS_TRANSITIONS[provider_status]
+        updated += await prisma.message.update_many(
+            where={
+                'platform': 'WHATSAPP',
+                'direction': 'OUTBOUND',
+                'whatsappNumberId': number.id,
+                'recipient': {'in': _phone_variants(recipient)},
+                'status': {'in': from_statuses},
+                'sentAt': {'lte': at}
+            },
+            data={'status': new_status, timestamp_field: at}
+        )
+    return updated
+
+async def apply_whatsapp_events(inbound, statuses):
+    """Write deduplicated WhatsApp events with set-based queries per number"""
+    numbers = await resolve_numbers({event['number'] for event in inbound + statuses})
+    totals = {'messages': 0, 'statuses': 0, 'unknown_number': 0}
+
+    by_number = {}
+    for kind, events in (('inbound', inbound), ('statuses', statuses)):
+        for event in events:
+            number = numbers.get(event['number'][0])
+            if number is None:
+                totals['unknown_number'] += 1
+                continue
+            by_number.setdefault(number.id, (number, {'inbound': [], 'statuses': []}))[1][kind].append(event)
+
+    for number, events in by_number.values():
+        if events['inbound']:
+            senders = {}
+            for event in events['inbound']:
+                senders[event['from']] = senders.get(event['from']) or event['name']
+            lead_ids = await upsert_whatsapp_leads(
+                number, senders, max(event['at'] for event in events['inbound'])
+            )
+            totals['messages'] += await prisma.message.create_many(
+                data=[{
+                    'type': event['type'],
+                    'platform': 'WHATSAPP',
+                    'direction': 'INBOUND',
+                    'recipient': event['from'],
+                    'content': event['content'],
+                    'status': 'DELIVERED',
+                    'sentAt': event['at'],
+                    'deliveredAt': event['at'],
+                    'whatsappNumberId': number.id,
+                    'leadId': lead_ids.get(_digits(event['from'])),
+                    'providerMessageId': event['id']
+                } for event in events['inbound']],
+                skip_duplicates=True
+            )
+
+            inbound_times = {}
+            for event in events['inbound']:
+                inbound_times[event['from']] = max(inbound_times.get(event['from'], event['at']), event['at'])
+            await open_windows(number.id, inbound_times)
+
+        if events['statuses']:
+            totals['statuses'] += await apply_statuses(number, events['statuses'])
+
+    return totals
+
+@stream_consumer(WHATSAPP_STREAM, WHATSAPP_CONSUMER_GROUP)
+async def ingest_whatsapp_events(entries):
+    """Apply a batch of WhatsApp webhook entries, skipping redelivered events"""
+    inbound, statuses = parse_whatsapp_events(entries)
+
+    # A status ID repeats across sent/delivered/read, so the status is part of the key
+    keys = [f"msg:{event['id']}" for event in inbound] + \
+           [f"status:{event['id']}:{event['status']}" for event in statuses]
+    fresh = claim_event_ids(DEDUPE_NAMESPACE, keys)
+
+    applied = set()
+    def first_delivery(key):
+        if key not in fresh or key in applied:
+            return False
+        applied.add(key)
+        return True
+
+    inbound = [event for event in inbound if first_delivery(f"msg:{event['id']}")]
+    statuses = [event for event in statuses if first_delivery(f"status:{event['id']}:{event['status']}")]
+    if not inbound and not statuses:
+        return {'messages': 0, 'statuses': 0, 'duplicates': len(keys)}
+
+    try:
+        totals = await apply_whatsapp_events(inbound, statuses)
+    except Exception:
+        release_event_ids(DEDUPE_NAMESPACE, fresh)
+        raise
+
+    return {**totals, 'duplicates': len(keys) - len(fresh)}
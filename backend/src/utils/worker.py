@@ -0,0 +1,210 @@
+import asyncio
+import importlib
+import json
+import os
+import signal
+import socket
+import time
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from bullmq import Worker
+from src.utils.queue import REDIS_CONNECTION, redis_client, get_queue, record_job_outcome, JOB_OPTIONS
+from src.utils import dead_letter
+
+# Modules that register job handlers with @job_handler
+HANDLER_MODULES = [
+    'src.utils.messaging',
+    'src.utils.facebook_sync',
+    'src.utils.post_sync',
+    'src.utils.importer',
+    'src.utils.messenger_ingest',
+    'src.utils.whatsapp_ingest',
+    'src.utils.token_rotation',
+    'src.utils.template_sync',
+    'src.utils.dashboard_stats',
+    'src.utils.audit_archive',
+]
+
+SCHEDULER_TICK_SECONDS = 5
+STREAM_BATCH_SIZE = 200
+STREAM_BLOCK_MS = 1000
+# Entries left pending this long by a dead consumer are taken over
+STREAM_CLAIM_IDLE_MS = 60000
+STREAM_CLAIM_INTERVAL = 30
+
+_job_handlers = {}
+_periodic_jobs = {}
+_stream_consumers = {}
+
+def job_handler(queue_name, job_name):
+    """Register a coroutine as the handler for a queue job"""
+    def decorator(f):
+        _job_handlers[(queue_name, job_name)] = f
+        return f
+    return decorator
+
+def periodic_job(queue_name, job_name, interval_seconds):
+    """Enqueue a job every `interval_seconds` while the scheduler runs"""
+    def decorator(f):
+        _periodic_jobs[(queue_name, job_name)] = interval_seconds
+        return f
+    return decorator
+
+def stream_consumer(stream, group):
+    """Register a coroutine that processes batches of Redis stream entries
+
+    The handler receives a list of (entry_id, fields) tuples and should
+    raise if the batch could not be applied; it is then retried entry by
+    entry and entries that still fail are dead-lettered.
+    """
+    def decorator(f):
+        _stream_consumers[(stream, group)] = f
+        return f
+    return decorator
+
+def load_job_handlers():
+    """Import all handler modules so their handlers are registered"""
+    return [importlib.import_module(name) for name in HANDLER_MODULES]
+
+async def connect_clients(*modules):
+    """Connect the Prisma client owned by each module"""
+    for module in modules:
+        client = getattr(module, 'prisma', None)
+        if client is not None and not client.is_connected():
+            await client.connect()
+
+async def process_job(job, token):
+    """Dispatch a job to its handler, dead-lettering it on the final failure"""
+    handler = _job_handlers.get((job.queue.name, job.name))
+    if handler is None:
+        error = LookupError(f'No handler for job {job.name} on {job.queue.name}')
+        record_job_outcome(job.queue.name, 'failed')
+        if dead_letter.is_final_attempt(job):
+            await dead_letter.record_dead_letter(job, error)
+        raise error
+
+    try:
+        result = await handler(job.data)
+    except Exception as e:
+        record_job_outcome(job.queue.name, 'failed')
+        if dead_letter.is_final_attempt(job):
+            await dead_letter.record_dead_letter(job, e)
+        raise
+    record_job_outcome(job.queue.name, 'completed')
+    return result
+
+async def run_scheduler():
+    """Enqueue periodic jobs; safe to run in several processes
+
+    Each interval slot is claimed with SET NX in Redis, so only one
+    scheduler enqueues a given run no matter how many workers are up.
+    """
+    while True:
+        now = time.time()
+        for (queue_name, job_name), interval in _periodic_jobs.items():
+            slot = int(now // interval)
+            claimed = redis_client.set(f'scheduler:{job_name}:{slot}', '1', nx=True, ex=interval * 2)
+            if not claimed:
+                continue
+            
+            try:
+                await get_queue(queue_name).add(job_name, {'slot': slot}, JOB_OPTIONS.get(queue_name, {}))
+            except Exception as e:
+                print(f"Failed to schedule {job_name}: {str(e)}")
+        
+        await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+async def _retry_entries_individually(stream, group, handler, entries):
+    """Apply a failed batch one entry at a time, dead-lettering poison entries"""
+    for entry_id, fields in entries:
+        try:
+            await handler([(entry_id, fields)])
+        except Exception as e:
+            try:
+                data = {'stream_id': entry_id, 'body': json.loads(fields.get('body', 'null'))}
+            except ValueError:
+                data = {'stream_id': entry_id, 'raw': fields.get('body')}
+            await dead_letter.record_failed_payload(stream, group, data, e, job_id=entry_id)
+
+async def run_stream_consumer(stream, group, handler):
+    """Consume a Redis stream with a consumer group until cancelled"""
+    client = aioredis.Redis(**REDIS_CONNECTION, decode_responses=True)
+    consumer = f'{socket.gethostname()}-{os.getpid()}'
+
+    try:
+        await client.xgroup_create(stream, group, id='0', mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+    next_claim = 0
+    while True:
+        entries, reclaimed = [], False
+
+        if time.monotonic() >= next_claim:
+            next_claim = time.monotonic() + STREAM_CLAIM_INTERVAL
+            result = await client.xautoclaim(
+                stream, group, consumer,
+                min_idle_time=STREAM_CLAIM_IDLE_MS,
+                start_id='0-0',
+                count=STREAM_BATCH_SIZE
+            )
+            entries, reclaimed = result[1], True
+
+        if not entries:
+            response = await client.xreadgroup(
+                group, consumer, {stream: '>'},
+                count=STREAM_BATCH_SIZE,
+                block=STREAM_BLOCK_MS
+            )
+            entries, reclaimed = (response[0][1] if response else []), False
+
+        if not entries:
+            continue
+
+        try:
+            await handler(entries)
+        except Exception as e:
+            print(f"Stream batch on {stream} failed: {str(e)}")
+            if not reclaimed:
+                # Left pending; picked up again by the next claim pass
+                continue
+            await _retry_entries_individually(stream, group, handler, entries)
+
+        await client.xack(stream, group, *[entry_id for entry_id, _ in entries])
+
+async def run_workers(queue_names=None, concurrency=5, scheduler=True):
+    """Run workers for the given queues until SIGINT/SIGTERM"""
+    modules = load_job_handlers()
+    await connect_clients(dead_letter, *modules)
+
+    if not queue_names:
+        queue_names = sorted({queue_name for queue_name, _ in _job_handlers})
+
+    workers = [
+        Worker(queue_name, process_job, {
+            'connection': REDIS_CONNECTION,
+            'concurrency': concurrency
+        }) for queue_name in queue_names
+    ]
+    print(f"Workers started for: {', '.join(queue_names)}")
+    
+    scheduler_task = asyncio.create_task(run_scheduler()) if scheduler else None
+    stream_tasks = [
+        asyncio.create_task(run_stream_consumer(stream, group, handler))
+        for (stream, group), handler in _stream_consumers.items()
+    ]
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await stop.wait()
+
+    if scheduler_task:
+        scheduler_task.cancel()
+    for task in stream_tasks:
+        task.cancel()
+    for worker in workers:
+        await worker.close()
@@ -1,8 +1,22 @@
 import pytest
 import asyncio
+import httpx
+from datetime import datetime, timezone
 from httpx import AsyncClient
+from flask_jwt_extended import create_access_token
 from src.main import app
 
+class WSGIAsyncTransport(httpx.AsyncBaseTransport):
+    """Drive the Flask WSGI app from an AsyncClient"""
+
+    def __init__(self, app):
+        self.transport = httpx.WSGITransport(app=app)
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        response = await asyncio.to_thread(self.transport.handle_request, request)
+        return httpx.Response(response.status_code, headers=response.headers, content=response.read())
+
 @pytest.fixture(scope="session")
 def event_loop():
     """Create an instance of the default event loop for the test session."""
@@ -13,18 +27,42 @@ def event_loop():
 @pytest.fixture
 async def client():
     """Create a test client for the Flask app."""
-    async with AsyncClient(app=app, base_url="http://test") as ac:
+    async with AsyncClient(transport=WSGIAsyncTransport(app), base_url="http://test") as ac:
         yield ac
 
 @pytest.fixture
 def mock_user_token():
-    """Mock JWT token for authenticated requests."""
-    return "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.test_token"
+    """Signed JWT for authenticated requests."""
+    with app.app_context():
+        return create_access_token(identity="user_123", additional_claims={"role": "USER", "tenant": "user_123"})
 
 @pytest.fixture
 def mock_admin_token():
-    """Mock JWT token for admin requests."""
-    return "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.admin_token"
+    """Signed JWT for admin requests."""
+    with app.app_context():
+        return create_access_token(identity="admin_123", additional_claims={"role": "ADMIN", "tenant": "admin_123"})
+
+TEST_USERS = {
+    "user_123": {"id": "user_123", "role": "USER", "name": "Test User", "email": "user@example.com"},
+    "admin_123": {"id": "admin_123", "role": "ADMIN", "name": "Test Admin", "email": "admin@example.com"},
+}
+
+@pytest.fixture(autouse=True)
+def test_users(monkeypatch):
+    """Resolve the test tokens' users without a database."""
+    from src.utils import identity
+
+    async def get_cached_user(user_id):
+        user = TEST_USERS.get(user_id)
+        return user and {
+            **user,
+            "createdAt": datetime(2024, 1, 1, tzinfo=timezone.utc),
+            "facebookConnected": False,
+            "pagesSyncedAt": None
+        }
+
+    monkeypatch.setattr(identity, "get_cached_user", get_cached_user)
+    return TEST_USERS
 
 @pytest.fixture
 def auth_headers(mock_user_token):
@@ -0,0 +1,183 @@
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from httpx import AsyncClient
+from src.routes import admin
+
+class TestAdminAPI:
+    """Test admin endpoints."""
+    
+    async def test_get_dead_letters_without_auth(self, client: AsyncClient):
+        """Test listing dead letters without authentication."""
+        response = await client.get("/api/admin/dead-letters")
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_get_dead_letters_with_filters(self, client: AsyncClient, admin_headers, monkeypatch):
+        """Test listing dead letters with filters."""
+        queries = []
+        
+        async def list_dead_letters(where_clause, limit=50, offset=0):
+            queries.append((where_clause, limit, offset))
+            return [], 0
+        
+        async def summarize_dead_letters(where_clause):
+            return []
+        
+        monkeypatch.setattr(admin, "list_dead_letters", list_dead_letters)
+        monkeypatch.setattr(admin, "summarize_dead_letters", summarize_dead_letters)
+        params = {
+            "queue": "message-queue",
+            "error_class": "GraphAPIError",
+            "replayed": "false",
+            "page": 2,
+            "limit": 10
+        }
+        response = await client.get("/api/admin/dead-letters", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        assert response.json()["pagination"] == {"page": 2, "limit": 10, "total": 0, "pages": 0}
+        assert queries == [(
+            {"queueName": "message-queue", "errorClass": "GraphAPIError", "replayCount": 0}, 10, 10
+        )]
+    
+    async def test_get_dead_letters_clamps_limit_and_page(self, client: AsyncClient, admin_headers, monkeypatch):
+        """Test out-of-range limit and page values are clamped instead of failing."""
+        queries = []
+        
+        async def list_dead_letters(where_clause, limit=50, offset=0):
+            queries.append((limit, offset))
+            return [], 3
+        
+        async def summarize_dead_letters(where_clause):
+            return []
+        
+        monkeypatch.setattr(admin, "list_dead_letters", list_dead_letters)
+        monkeypatch.setattr(admin, "summarize_dead_letters", summarize_dead_letters)
+        for params in ({"limit": 0}, {"limit": -5, "page": 0}, {"limit": 10000}):
+            response = await client.get("/api/admin/dead-letters", params=params, headers=admin_headers)
+            assert response.status_code == 200
+        assert queries == [(1, 0), (1, 0), (500, 0)]
+        assert response.json()["pagination"]["pages"] == 1
+    
+    async def test_replay_dead_letters_without_auth(self, client: AsyncClient):
+        """Test replaying dead letters without authentication."""
+        response = await client.post("/api/admin/dead-letters/replay", json={"ids": ["dlq_123"]})
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_get_audit_logs_without_auth(self, client: AsyncClient):
+        """Test listing audit logs without authentication."""
+        response = await client.get("/api/admin/audit-logs")
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_get_audit_logs_with_cursor(self, client: AsyncClient, admin_headers):
+        """Test listing audit logs with a cursor and estimated count."""
+        params = {"cursor": "not-a-cursor", "count": "estimate", "limit": 20}
+        response = await client.get("/api/admin/audit-logs", params=params, headers=admin_headers)
+        assert response.status_code == 400
+        assert response.json() == {"error": "Invalid cursor"}
+    
+    async def test_get_audit_logs_including_archives(self, client: AsyncClient, admin_headers, monkeypatch):
+        """Test listing audit logs that continue into archived months."""
+        searches = []
+        archived_log = SimpleNamespace(
+            id="log_1", action="update_lead", resource="lead", resourceId=None, details=None,
+            ipAddress=None, userAgent=None, createdAt=datetime(2023, 2, 1), user=None
+        )
+        
+        async def search_audit_logs(where_clause, limit, cursor, include_archived):
+            searches.append((where_clause, limit, cursor, include_archived))
+            return [archived_log], None
+        
+        async def count_audit_logs(where_clause, mode):
+            return 1, True
+        
+        async def log_action(**kwargs):
+            pass
+        
+        monkeypatch.setattr(admin, "search_audit_logs", search_audit_logs)
+        monkeypatch.setattr(admin, "count_audit_logs", count_audit_logs)
+        monkeypatch.setattr(admin, "log_action", log_action)
+        params = {"archived": "true", "start_date": "2023-01-01T00:00:00", "limit": 20}
+        response = await client.get("/api/admin/audit-logs", params=params, headers=admin_headers)
+        assert response.status_code == 200
+        assert [log["id"] for log in response.json()["logs"]] == ["log_1"]
+        assert response.json()["logs"][0]["user"]["name"] == "System"
+        assert searches == [({"createdAt": {"gte": datetime(2023, 1, 1)}}, 20, None, True)]
+    
+    async def test_update_user_role_without_auth(self, client: AsyncClient):
+        """Test changing a user's role without authentication."""
+        response = await client.put("/api/admin/users/user_123/role", json={"role": "ADMIN"})
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_replay_dead_letters_with_unknown_filter(self, client: AsyncClient, admin_headers):
+        """Test replaying with a filter key that does not exist."""
+        response = await client.post("/api/admin/dead-letters/replay", json={"filters": {"typo": 1}}, headers=admin_headers)
+        assert response.status_code == 400
+        assert response.json()["error"] == "Unknown dead letter filters: typo"
+    
+    async def test_replay_dead_letters_with_filters_matching_everything(self, client: AsyncClient, admin_headers):
+        """Test replaying with filters that narrow nothing down."""
+        response = await client.post("/api/admin/dead-letters/replay", json={"filters": {"replayed": "maybe"}}, headers=admin_headers)
+        assert response.status_code == 400
+        assert response.json()["error"] == "Dead letter IDs or filters are required"
+    
+    async def test_replay_dead_letters_with_invalid_limit(self, client: AsyncClient, admin_headers):
+        """Test replaying with a limit that is not a positive integer."""
+        for limit in ["1000", 0, -5, 2.5, True]:
+            body = {"filters": {"queue": "message-queue"}, "limit": limit}
+            response = await client.post("/api/admin/dead-letters/replay", json=body, headers=admin_headers)
+            assert response.status_code == 400
+            assert response.json()["error"] == "Limit must be a positive integer"
+    
+    async def test_replay_dead_letters_as_non_admin(self, client: AsyncClient, auth_headers):
+        """Test replaying dead letters without the admin role."""
+        response = await client.post("/api/admin/dead-letters/replay", json={"ids": ["dlq_123"]}, headers=auth_headers)
+        assert response.status_code == 403
+        assert response.json()["error"] == "Admin access required"
+    
+    async def test_get_users_counts_relations_per_model(self, client: AsyncClient, admin_headers, monkeypatch):
+        """Test user stats come from one grouped count per related model."""
+        created = datetime(2024, 1, 15)
+        users = [
+            SimpleNamespace(id=id, name=id, email=f"{id}@example.com", role="USER", facebookId=None, createdAt=created, updatedAt=created)
+            for id in ("user_a", "user_b")
+        ]
+        group_queries = []
+        
+        def counting(model, counts):
+            async def group_by(by, where, count):
+                group_queries.append((model, by, where))
+                return [{"userId": user_id, "_count": {"_all": n}} for user_id, n in counts.items()]
+            return SimpleNamespace(group_by=group_by)
+        
+        async def count(where):
+            return 2
+        
+        async def find_many(where, order_by, take, skip):
+            return users
+        
+        async def log_action(**kwargs):
+            pass
+        
+        monkeypatch.setattr(admin, "prisma", SimpleNamespace(
+            user=SimpleNamespace(count=count, find_many=find_many),
+            facebookpage=counting("facebookpage", {"user_a": 2}),
+            whatsappnumber=counting("whatsappnumber", {}),
+            lead=counting("lead", {"user_a": 1200, "user_b": 3}),
+            campaign=counting("campaign", {"user_b": 1})
+        ))
+        monkeypatch.setattr(admin, "log_action", log_action)
+        
+        response = await client.get("/api/admin/users", headers=admin_headers)
+        assert response.status_code == 200
+        assert [user["stats"] for user in response.json()["users"]] == [
+            {"facebook_pages": 2, "whatsapp_numbers": 0, "leads": 1200, "campaigns": 0},
+            {"facebook_pages": 0, "whatsapp_numbers": 0, "leads": 3, "campaigns": 1},
+        ]
+        assert group_queries == [
+            (model, ["userId"], {"userId": {"in": ["user_a", "user_b"]}})
+            for model in ("facebookpage", "whatsappnumber", "lead", "campaign")
+        ]
@@ -0,0 +1,74 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from src.utils import api_keys
+
+@pytest.fixture
+def key_table(monkeypatch):
+    """API key rows by hash, counting database lookups."""
+    rows, lookups = {}, []
+
+    async def find_unique(where):
+        lookups.append(where["keyHash"])
+        return rows.get(where["keyHash"])
+
+    monkeypatch.setattr(api_keys, "prisma", SimpleNamespace(apikey=SimpleNamespace(find_unique=find_unique)))
+    monkeypatch.setattr(api_keys, "start_invalidation_listener", lambda: None)
+    monkeypatch.setattr(api_keys, "is_listening", lambda: True)
+    monkeypatch.setattr(api_keys, "publish_invalidation", lambda channel, key_id: None)
+    api_keys._clear_cache()
+    yield rows, lookups
+    api_keys._clear_cache()
+
+def add_key(rows, key, **fields):
+    record = {"id": "key_1", "userId": "user_1", "permissions": ["leads:read"], "isActive": True, "expiresAt": None, **fields}
+    rows[api_keys.hash_api_key(key)] = SimpleNamespace(**record)
+
+class TestAuthenticateApiKey:
+    """Test API keys are verified from the in-process cache."""
+
+    async def test_valid_key_is_cached(self, key_table):
+        """Test a verified key is served without a second lookup."""
+        rows, lookups = key_table
+        add_key(rows, "key-secret")
+
+        first = await api_keys.authenticate_api_key("key-secret")
+        second = await api_keys.authenticate_api_key("key-secret")
+
+        assert first == second
+        assert (first["userId"], first["permissions"]) == ("user_1", ["leads:read"])
+        assert len(lookups) == 1
+
+    async def test_unknown_key_is_negatively_cached(self, key_table):
+        """Test repeated guesses of the same key reach the database once."""
+        rows, lookups = key_table
+
+        assert await api_keys.authenticate_api_key("guess") is None
+        assert await api_keys.authenticate_api_key("guess") is None
+        assert len(lookups) == 1
+
+    async def test_expiry_is_checked_on_every_call(self, key_table):
+        """Test a cached key stops working once it expires."""
+        rows, lookups = key_table
+        add_key(rows, "key-secret", expiresAt=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+        assert await api_keys.authenticate_api_key("key-secret") is None
+        assert await api_keys.authenticate_api_key("key-secret") is None
+        assert len(lookups) == 1
+
+    async def test_invalidation_drops_the_cached_key(self, key_table):
+        """Test a revoked key is looked up again after invalidate_api_key."""
+        rows, lookups = key_table
+        add_key(rows, "key-secret")
+        await api_keys.authenticate_api_key("key-secret")
+
+        add_key(rows, "key-secret", isActive=False)
+        api_keys.invalidate_api_key("key_1")
+
+        assert await api_keys.authenticate_api_key("key-secret") is None
+        assert len(lookups) == 2
+
+    def test_permissions(self):
+        """Test the wildcard grants every permission."""
+        assert api_keys.has_permission({"permissions": ["*"]}, "leads:write")
+        assert not api_keys.has_permission({"permissions": ["leads:read"]}, "leads:write")
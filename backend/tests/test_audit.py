@@ -0,0 +1,238 @@
+import fcntl
+import json
+import os
+import threading
+import pytest
+from collections import deque
+from datetime import datetime
+from types import SimpleNamespace
+from src.utils import audit
+
+def event(id):
+    return {
+        "id": id, "userId": "user_1", "action": "update_lead", "resource": "lead", "resourceId": None,
+        "details": None, "ipAddress": None, "userAgent": None, "createdAt": datetime(2024, 1, 15, 10, 0)
+    }
+
+class FakeWriterPrisma:
+    """The audit writer's client, recording inserted event IDs."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.connected = False
+        self.inserted = []
+        writer = self
+
+        class AuditLog:
+            async def create_many(self, data, skip_duplicates=False):
+                if writer.fail:
+                    raise ConnectionError("database unavailable")
+                writer.inserted.extend(event["id"] for event in data)
+                return len(data)
+
+        self.auditlog = AuditLog()
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        self.connected = True
+
+    async def disconnect(self):
+        self.connected = False
+
+@pytest.fixture
+def writer_state(monkeypatch, tmp_path):
+    """Fresh writer globals, a temporary spool and a fake database client."""
+    client = FakeWriterPrisma()
+    monkeypatch.setattr(audit, "writer_prisma", client)
+    monkeypatch.setattr(audit, "AUDIT_SPOOL_PATH", str(tmp_path / "audit.jsonl"))
+    monkeypatch.setattr(audit, "_buffer", deque())
+    monkeypatch.setattr(audit, "_rollups", {})
+    monkeypatch.setattr(audit, "_wake", threading.Event())
+    monkeypatch.setattr(audit, "_stopping", threading.Event())
+    monkeypatch.setattr(audit, "_writer", None)
+    yield client
+    audit._stopping.set()
+    audit._wake.set()
+    if audit._writer is not None:
+        audit._writer.join(audit.SHUTDOWN_TIMEOUT)
+
+def spooled_ids(path):
+    with open(path) as f:
+        return [json.loads(line)["id"] for line in f]
+
+class TestAuditWriter:
+    """Test the background audit writer and its shutdown."""
+
+    async def test_stopping_writer_flushes_without_the_executor(self, writer_state, monkeypatch):
+        """Test a final flush works once the default executor is shut down."""
+        monkeypatch.setattr(audit.asyncio, "to_thread", lambda *args, **kwargs: pytest.fail("used the default executor"))
+        audit._buffer.extend([event("e1"), event("e2")])
+        audit._stopping.set()
+
+        await audit._run_writer()
+
+        assert writer_state.inserted == ["e1", "e2"]
+        assert not writer_state.connected
+
+    def test_shutdown_hook_drains_the_buffer(self, writer_state, monkeypatch):
+        """Test stop_audit_writer writes queued events before the process exits."""
+        monkeypatch.setattr(audit, "AUDIT_FLUSH_INTERVAL", 60)
+        audit.start_audit_writer()
+        audit._buffer.extend([event("e1"), event("e2")])
+
+        audit.stop_audit_writer()
+
+        assert not audit._writer.is_alive()
+        assert writer_state.inserted == ["e1", "e2"]
+        assert not os.path.exists(audit.AUDIT_SPOOL_PATH)
+
+    def test_shutdown_spools_what_the_database_rejects(self, writer_state):
+        """Test events are kept on disk when the database is down at shutdown."""
+        writer_state.fail = True
+        audit.start_audit_writer()
+        audit._buffer.extend([event("e1"), event("e2")])
+
+        audit.stop_audit_writer()
+
+        assert spooled_ids(audit.AUDIT_SPOOL_PATH) == ["e1", "e2"]
+
+class TestSpoolReplay:
+    """Test spooled events are replayed exactly once."""
+
+    async def test_spool_is_replayed_and_removed(self, writer_state):
+        """Test the spool is inserted and deleted, and later events start a new spool."""
+        audit._spool([event("e1"), event("e2")])
+
+        assert await audit.replay_spool() == 2
+        assert writer_state.inserted == ["e1", "e2"]
+        assert os.listdir(os.path.dirname(audit.AUDIT_SPOOL_PATH)) == []
+
+    async def test_replay_files_in_use_are_not_claimed(self, writer_state):
+        """Test a replay file locked by its owner is skipped however old it is, and taken once released."""
+        audit._spool([event("e1")])
+        orphan = f"{audit.AUDIT_SPOOL_PATH}.other.replaying"
+        os.replace(audit.AUDIT_SPOOL_PATH, orphan)
+        os.utime(orphan, (0, 0))
+
+        with open(orphan) as owner:
+            fcntl.flock(owner.fileno(), fcntl.LOCK_EX)
+            assert await audit.replay_spool() == 0
+            assert os.path.exists(orphan)
+
+        assert await audit.replay_spool() == 1
+        assert writer_state.inserted == ["e1"]
+        assert not os.path.exists(orphan)
+
+    async def test_failed_replay_is_spooled_again(self, writer_state):
+        """Test events that cannot be inserted go back to the spool."""
+        audit._spool([event("e1")])
+        writer_state.fail = True
+
+        assert await audit.replay_spool() == 0
+        assert spooled_ids(audit.AUDIT_SPOOL_PATH) == ["e1"]
+        assert [name for name in os.listdir(os.path.dirname(audit.AUDIT_SPOOL_PATH)) if name.endswith(".replaying")] == []
+
+class TestBackgroundThreads:
+    """Test background threads start only where they are used."""
+
+    def test_create_app_starts_no_threads(self, monkeypatch):
+        """Test building the app starts neither the audit writer nor the health probes."""
+        from src import main
+        from src.utils import health
+
+        monkeypatch.setattr(audit, "start_audit_writer", lambda: pytest.fail("started the audit writer"))
+        monkeypatch.setattr(health, "start_health_probes", lambda: pytest.fail("started the health probes"))
+        before = {thread.name for thread in threading.enumerate()}
+
+        main.create_app()
+
+        assert {thread.name for thread in threading.enumerate()} - before == set()
+
+    async def test_log_action_starts_the_writer(self, writer_state):
+        """Test the first audited action starts the writer lazily."""
+        await audit.log_action(user_id="user_1", action="update_lead", resource="lead")
+
+        assert audit._writer is not None
+        audit.stop_audit_writer()
+        assert len(writer_state.inserted) == 1
+
+class TestAuditPaging:
+    """Test cursor paging and bounded counts."""
+
+    def test_cursor_round_trip(self):
+        """Test a cursor decodes to the (createdAt, id) it was made from."""
+        log = SimpleNamespace(id="log_9", createdAt=datetime(2024, 1, 15, 10, 30, 5, 120000))
+        assert audit.decode_audit_cursor(audit.encode_audit_cursor(log)) == (log.createdAt, "log_9")
+        with pytest.raises(ValueError):
+            audit.decode_audit_cursor("not-a-cursor")
+
+    async def test_count_falls_back_to_the_estimate_past_the_cap(self, monkeypatch):
+        """Test counting stops at the cap and uses the planner estimate beyond it."""
+        counts = []
+
+        async def count(where, take=None):
+            counts.append(take)
+            return min(50000, take or 50000)
+
+        async def estimate(where_clause):
+            return 48000
+
+        monkeypatch.setattr(audit, "AUDIT_COUNT_CAP", 100)
+        monkeypatch.setattr(audit, "prisma", SimpleNamespace(auditlog=SimpleNamespace(count=count)))
+        monkeypatch.setattr(audit, "_estimate_audit_logs", estimate)
+
+        assert await audit.count_audit_logs({"action": "view_users"}) == (48000, False)
+        assert await audit.count_audit_logs({}, mode="exact") == (50000, True)
+        assert await audit.count_audit_logs({}, mode="none") == (None, False)
+        assert counts == [101, None]
+
+class TestActionPolicies:
+    """Test read actions can be sampled or rolled up and writes cannot."""
+
+    def test_parse_policies(self, capsys):
+        """Test the policy string is parsed and policies for writes are ignored."""
+        policies = audit.parse_action_policies("view_leads=sample:0.25, get_stats=rollup,update_lead=rollup,check_x=record")
+
+        assert policies == {"view_leads": ("sample", 0.25), "get_stats": ("rollup", None), "check_x": ("record", None)}
+        assert "update_lead" in capsys.readouterr().out
+        with pytest.raises(ValueError):
+            audit.parse_action_policies("view_leads=sample")
+        with pytest.raises(ValueError):
+            audit.parse_action_policies("view_leads=drop")
+
+    def test_writes_are_always_recorded(self, monkeypatch):
+        """Test a configured policy never applies to an action that is not a read."""
+        monkeypatch.setattr(audit, "AUDIT_ACTION_POLICIES", {"update_lead": ("rollup", None), "view_users": ("rollup", None)})
+
+        assert audit.action_policy("update_lead") == ("record", None)
+        assert audit.action_policy("view_users") == ("rollup", None)
+        assert audit.action_policy("view_leads") == ("record", None)
+
+    async def test_rollups_become_one_row_per_minute(self, writer_state, monkeypatch):
+        """Test repeated reads in a minute are counted into a single row once the minute ends."""
+        monkeypatch.setattr(audit, "start_audit_writer", lambda: None)
+        for _ in range(3):
+            await audit.log_action(user_id="admin_1", action="view_users", resource="user")
+        await audit.log_action(user_id="admin_2", action="view_users", resource="user")
+
+        assert audit._buffer == deque()
+        assert audit._close_rollups() == []
+        rows = audit._close_rollups(everything=True)
+
+        assert sorted((row["userId"], row["details"]["count"]) for row in rows) == [("admin_1", 3), ("admin_2", 1)]
+        assert all(row["createdAt"].second == 0 for row in rows)
+        assert audit._rollups == {}
+
+    async def test_sampled_events_carry_their_rate(self, writer_state, monkeypatch):
+        """Test sampled reads are kept with the sample rate in their details."""
+        monkeypatch.setattr(audit, "start_audit_writer", lambda: None)
+        monkeypatch.setattr(audit, "AUDIT_ACTION_POLICIES", {"view_leads": ("sample", 0.5)})
+        draws = iter([0.1, 0.9])
+        monkeypatch.setattr(audit.random, "random", lambda: next(draws))
+
+        await audit.log_action(user_id="user_1", action="view_leads", details={"page": 2})
+        await audit.log_action(user_id="user_1", action="view_leads", details={"page": 3})
+
+        assert [event["details"] for event in audit._buffer] == [{"sampleRate": 0.5, "page": 2}]
@@ -0,0 +1,136 @@
+import gzip
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime
+from types import SimpleNamespace
+from src.utils import audit_archive
+
+def row(id, day, hour, user_id="user_1", action="update_lead"):
+    return {
+        "id": id, "createdAt": datetime(2024, 1, day, hour), "userId": user_id, "action": action,
+        "resource": "lead", "resourceId": None, "details": {"n": 1}, "ipAddress": None, "userAgent": None
+    }
+
+def write_archive(path, *groups):
+    """Write an archive file the way _export_table does."""
+    with gzip.open(path, "wb") as f:
+        f.write((json.dumps({"format": "audit-archive", "version": 1, "columns": audit_archive.COLUMNS}) + "\n").encode())
+        for rows in groups:
+            audit_archive._write_row_group(f, rows)
+    return str(path)
+
+class TestReadArchive:
+    """Test archived logs are searched without loading a whole month."""
+
+    def test_newest_matches_first_up_to_the_limit(self, tmp_path):
+        """Test only the newest matching rows across row groups are returned."""
+        path = write_archive(
+            tmp_path / "a.jsonl.gz",
+            [row("a1", 3, 9), row("a2", 20, 9, user_id="user_2"), row("a3", 5, 9)],
+            [row("a4", 28, 9), row("a5", 5, 9)],
+        )
+
+        rows = audit_archive._read_archive(path, {"userId": "user_1"}, None, 3)
+
+        assert [r["id"] for r in rows] == ["a4", "a5", "a3"]
+
+    def test_before_and_date_range_are_applied(self, tmp_path):
+        """Test the cursor position and createdAt bounds filter rows."""
+        path = write_archive(tmp_path / "a.jsonl.gz", [row("a1", 3, 9), row("a2", 5, 9), row("a3", 5, 9), row("a4", 9, 9)])
+        where = {"createdAt": {"gte": datetime(2024, 1, 4)}}
+
+        rows = audit_archive._read_archive(path, where, (datetime(2024, 1, 5, 9), "a3"), 10)
+
+        assert [r["id"] for r in rows] == ["a2"]
+
+    def test_memory_is_bounded_by_the_limit(self, tmp_path, monkeypatch):
+        """Test the scan keeps a top-N heap instead of sorting every match."""
+        path = write_archive(tmp_path / "a.jsonl.gz", [row(f"a{i:03d}", 1 + i % 28, i % 24) for i in range(300)])
+        sizes = []
+        nlargest = audit_archive.heapq.nlargest
+
+        def recording_nlargest(n, iterable, key):
+            sizes.append(n)
+            return nlargest(n, iterable, key=key)
+
+        monkeypatch.setattr(audit_archive.heapq, "nlargest", recording_nlargest)
+        rows = audit_archive._read_archive(path, {}, None, 5)
+
+        assert sizes == [5]
+        assert [r["createdAt"] for r in rows] == sorted((r["createdAt"] for r in rows), reverse=True)
+        assert rows[0]["createdAt"] == datetime(2024, 1, 28, 23)
+
+class TestSearchArchivedAuditLogs:
+    """Test searches across several archived months."""
+
+    async def test_stops_once_the_page_is_full(self, tmp_path, monkeypatch):
+        """Test older archives are not opened once enough rows are found."""
+        newer = write_archive(tmp_path / "feb.jsonl.gz", [row("f1", 2, 9), row("f2", 3, 9)])
+        archives = [SimpleNamespace(location=newer), SimpleNamespace(location=str(tmp_path / "missing.jsonl.gz"))]
+        reads = []
+        read_archive = audit_archive._read_archive
+
+        def recording_read(location, where_clause, before, limit):
+            reads.append((location, limit))
+            return read_archive(location, where_clause, before, limit)
+
+        async def find_archives(where, order_by):
+            return archives
+
+        async def find_users(where):
+            return [SimpleNamespace(id="user_1", name="Ada")]
+
+        monkeypatch.setattr(audit_archive, "_read_archive", recording_read)
+        monkeypatch.setattr(audit_archive, "prisma", SimpleNamespace(
+            auditarchive=SimpleNamespace(find_many=find_archives),
+            user=SimpleNamespace(find_many=find_users)
+        ))
+
+        logs = await audit_archive.search_archived_audit_logs({}, 2)
+
+        assert [log.id for log in logs] == ["f2", "f1"]
+        assert logs[0].user.name == "Ada"
+        assert reads == [(newer, 2)]
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def utcnow(cls):
+        return datetime(2024, 1, 15)
+
+class TestEnsurePartitions:
+    """Test partition maintenance."""
+
+    async def test_default_partition_rows_get_their_month(self, monkeypatch):
+        """Test the default partition exists and months found in it are split out."""
+        statements = []
+
+        async def execute_raw(query, *params):
+            statements.append((" ".join(query.split()), params))
+
+        async def query_first(query):
+            return {"kind": "p"}
+
+        async def query_raw(query):
+            if "audit_logs_default" in query:
+                return [{"month": "2023-11-01T00:00:00+00:00"}, {"month": "2024-02-01T00:00:00+00:00"}]
+            return [{"name": "audit_logs_y2024m01", "attached": True}, {"name": "audit_logs_y2024m02", "attached": True}]
+
+        @asynccontextmanager
+        async def tx():
+            yield fake
+
+        fake = SimpleNamespace(execute_raw=execute_raw, query_first=query_first, query_raw=query_raw, tx=tx)
+        monkeypatch.setattr(audit_archive, "prisma", fake)
+        monkeypatch.setattr(audit_archive, "datetime", FrozenDatetime)
+
+        created = await audit_archive.ensure_partitions(ahead=1)
+
+        assert created == ["audit_logs_y2023m11"]
+        assert statements[0][0] == "CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT"
+        assert statements[1][0] == "CREATE TABLE audit_logs_y2023m11 (LIKE audit_logs INCLUDING DEFAULTS)"
+        assert statements[2][0].startswith("WITH moved AS (DELETE FROM audit_logs_default")
+        assert statements[2][1] == ("2023-11-01T00:00:00", "2023-12-01T00:00:00")
+        assert statements[3][0] == (
+            "ALTER TABLE audit_logs ATTACH PARTITION audit_logs_y2023m11 "
+            "FOR VALUES FROM ('2023-11-01T00:00:00') TO ('2023-12-01T00:00:00')"
+        )
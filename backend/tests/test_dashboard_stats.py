@@ -0,0 +1,88 @@
+import asyncio
+import json
+import pytest
+from types import SimpleNamespace
+from src.utils import dashboard_stats
+
+STATS_ROW = {
+    "users_total": 10, "users_active": 4,
+    "leads_total": 8, "leads_consented": 2,
+    "messages_total": 0, "messages_sent": 0, "messages_failed": 0,
+    "campaigns_total": 3, "campaigns_active": 1,
+    "pages_total": 2, "pages_active": 2,
+    "numbers_total": 1, "numbers_active": None,
+}
+
+class FakeRedis:
+    """The string commands the snapshot cache uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+@pytest.fixture
+def stats_db(monkeypatch):
+    """Count every stats query against a fixed result row."""
+    redis, queries = FakeRedis(), []
+
+    async def query_first(query):
+        queries.append(query)
+        await asyncio.sleep(0.01)
+        return STATS_ROW
+
+    monkeypatch.setattr(dashboard_stats, "redis_client", redis)
+    monkeypatch.setattr(dashboard_stats, "prisma", SimpleNamespace(query_first=query_first))
+    monkeypatch.setattr(dashboard_stats, "WAIT_INTERVAL", 0.001)
+    return redis, queries
+
+class TestDashboardStats:
+    """Test the cached admin dashboard snapshot."""
+
+    async def test_counts_and_rates(self, stats_db):
+        """Test counts come from one query and rates handle empty tables."""
+        redis, queries = stats_db
+        stats = await dashboard_stats.compute_dashboard_stats()
+
+        assert len(queries) == 1
+        assert stats["users"] == {"total": 10, "active_last_30_days": 4}
+        assert stats["leads"] == {"total": 8, "consented": 2, "consent_rate": 25.0}
+        assert stats["messages"]["success_rate"] == 0
+        assert stats["whatsapp_numbers"] == {"total": 1, "active": 0}
+
+    async def test_cached_snapshot_is_served(self, stats_db):
+        """Test a stored snapshot is returned without querying."""
+        redis, queries = stats_db
+        redis.data[dashboard_stats.CACHE_KEY] = json.dumps({"stats": {"users": {}}, "computedAt": "2024-01-15T10:00:00"})
+
+        assert (await dashboard_stats.get_dashboard_stats())["computedAt"] == "2024-01-15T10:00:00"
+        assert queries == []
+
+    async def test_concurrent_misses_compute_once(self, stats_db, monkeypatch):
+        """Test simultaneous requests on a cold cache share one query and hold no worker threads."""
+        redis, queries = stats_db
+        monkeypatch.setattr(dashboard_stats.asyncio, "to_thread", lambda *args, **kwargs: pytest.fail("blocked a worker thread"))
+
+        snapshots = await asyncio.gather(*(dashboard_stats.get_dashboard_stats() for _ in range(5)))
+
+        assert len(queries) == 1
+        assert len({snapshot["computedAt"] for snapshot in snapshots}) == 1
+        assert f"{dashboard_stats.CACHE_KEY}:lock" not in redis.data
+        assert not dashboard_stats._compute_lock.locked()
+
+    async def test_warmer_refreshes_the_snapshot(self, stats_db):
+        """Test the periodic job stores a new snapshot."""
+        redis, queries = stats_db
+        result = await dashboard_stats.process_warm_dashboard_stats_job({})
+
+        assert json.loads(redis.data[dashboard_stats.CACHE_KEY])["computedAt"] == result["computedAt"]
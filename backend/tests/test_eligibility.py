@@ -0,0 +1,111 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from src.utils import eligibility
+
+def lead(id, consent=False, status="NEW", source="MANUAL", phone=None, psid=None, page=None):
+    return SimpleNamespace(
+        id=id, consentGiven=consent, status=status, source=source,
+        phoneNumber=phone, facebookUserId=psid, facebookPageId=page
+    )
+
+class FakeRedis:
+    """The version counter and change log commands the index reads."""
+
+    def __init__(self):
+        self.version = 0
+        self.changes = []
+
+    def log(self, *lead_ids):
+        for lead_id in lead_ids:
+            self.version += 1
+            self.changes.append((lead_id, float(self.version)))
+
+    def get(self, key):
+        return str(self.version)
+
+    def zrangebyscore(self, key, low, high, withscores=False):
+        return [(lead_id, score) for lead_id, score in self.changes if score > float(low.lstrip("("))]
+
+    def zrange(self, key, start, end, withscores=False):
+        return self.changes[:1]
+
+    def zcard(self, key):
+        return len(self.changes)
+
+@pytest.fixture
+def leads_db(monkeypatch):
+    """A lead table and Redis change log behind the eligibility index."""
+    redis = FakeRedis()
+    rows = {}
+    queries = []
+
+    async def find_many(where, order_by=None, take=None, cursor=None, skip=0):
+        queries.append(where)
+        if "id" in where:
+            return [rows[id] for id in where["id"]["in"] if id in rows]
+        ids = sorted(rows)
+        start = ids.index(cursor["id"]) + skip if cursor else 0
+        return [rows[id] for id in ids[start:start + take]]
+
+    monkeypatch.setattr(eligibility, "redis_client", redis)
+    monkeypatch.setattr(eligibility, "prisma", SimpleNamespace(lead=SimpleNamespace(find_many=find_many)))
+    monkeypatch.setattr(eligibility, "_indexes", eligibility.OrderedDict())
+    monkeypatch.setattr(eligibility, "_build_locks", {})
+    return redis, rows, queries
+
+class TestEligibilityIndex:
+    """Test lead eligibility lookups from the cached index."""
+
+    async def test_channel_rules(self, leads_db):
+        """Test consent, unsubscribes and page messages per channel."""
+        redis, rows, queries = leads_db
+        rows.update({
+            "l1": lead("l1", consent=True, phone="+1 (555) 010-0001"),
+            "l2": lead("l2", consent=True, status="UNSUBSCRIBED"),
+            "l3": lead("l3", source="FACEBOOK_MESSAGE", psid="psid_3", page="page_1"),
+        })
+
+        assert await eligibility.eligible_lead_ids("user_1", "whatsapp", ["l1", "l2", "l3", "missing"]) == ["l1"]
+        assert await eligibility.eligible_lead_ids("user_1", "messenger", ["l1", "l2", "l3"]) == ["l1", "l3"]
+        assert await eligibility.find_eligible_lead_id("user_1", "whatsapp", phone_number="15550100001") == "l1"
+        assert await eligibility.find_eligible_lead_id("user_1", "messenger", facebook_user_id="psid_3", page_id="page_1") == "l3"
+        assert await eligibility.find_eligible_lead_id("user_1", "messenger", facebook_user_id="psid_3", page_id="page_2") is None
+        assert len(queries) == 2
+
+    async def test_patch_swaps_in_a_copy(self, leads_db):
+        """Test logged changes are applied to a copy, leaving the index other requests hold untouched."""
+        redis, rows, queries = leads_db
+        rows.update({"l1": lead("l1"), "l2": lead("l2", consent=True)})
+        held = await eligibility.get_eligibility_index("user_1")
+
+        rows["l1"] = lead("l1", consent=True)
+        del rows["l2"]
+        redis.log("l1", "l2")
+        patched = await eligibility.get_eligibility_index("user_1")
+
+        assert patched is not held
+        assert patched.version == 2
+        assert eligibility._indexes["user_1"] is patched
+        assert [patched.is_eligible(patched.offsets[id], "whatsapp") for id in ("l1", "l2")] == [True, False]
+        assert held.version == 0
+        assert [held.is_eligible(held.offsets[id], "whatsapp") for id in ("l1", "l2")] == [False, True]
+        assert queries[-1] == {"id": {"in": ["l1", "l2"]}, "userId": "user_1"}
+
+    async def test_waiters_do_not_hold_executor_threads(self, leads_db, monkeypatch):
+        """Test a request waiting on another build polls the lock instead of blocking a thread."""
+        redis, rows, queries = leads_db
+        rows["l1"] = lead("l1", consent=True)
+        monkeypatch.setattr(eligibility, "BUILD_LOCK_POLL_INTERVAL", 0.001)
+        monkeypatch.setattr(eligibility.asyncio, "to_thread", lambda *args: pytest.fail("blocked a worker thread"))
+
+        lock = eligibility._build_locks.setdefault("user_1", eligibility.threading.Lock())
+        lock.acquire()
+        waiter = asyncio.ensure_future(eligibility.get_eligibility_index("user_1"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        lock.release()
+        index = await waiter
+        assert index.lead_ids == ["l1"]
+        assert not lock.locked()
@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import json
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from httpx import AsyncClient
+from src.routes import facebook
+
+@pytest.fixture
+def page_posts(monkeypatch):
+    """A synced page whose posts share creation times, served from a fake table."""
+    same_second = datetime(2024, 1, 15, 9, tzinfo=timezone.utc)
+    posts = [
+        SimpleNamespace(id=f"ckpost{i}", facebookPostId=f"fb_{i}", message=None, story=None,
+                        createdTime=created_time, likesCount=0, commentsCount=0, sharesCount=0)
+        for i, created_time in enumerate([
+            datetime(2024, 1, 15, 10, tzinfo=timezone.utc), same_second, same_second, same_second,
+            datetime(2024, 1, 15, 8, tzinfo=timezone.utc)
+        ])
+    ]
+    page = SimpleNamespace(id="page_1", postsSyncedAt=datetime(2024, 1, 15, 11, tzinfo=timezone.utc))
+
+    async def find_page(where):
+        return page if where == {"id": "page_1", "userId": "user_123"} else None
+
+    def matches(post, where):
+        if "OR" in where:
+            return any(matches(post, clause) for clause in where["OR"])
+        created_time = where.get("createdTime")
+        if isinstance(created_time, dict):
+            if "lt" in created_time and not post.createdTime < created_time["lt"]:
+                return False
+            if "gte" in created_time and not post.createdTime >= created_time["gte"]:
+                return False
+        elif created_time is not None and post.createdTime != created_time:
+            return False
+        return "id" not in where or post.id < where["id"]["lt"]
+
+    async def find_posts(where, order_by, take):
+        assert order_by == [{"createdTime": "desc"}, {"id": "desc"}]
+        found = [post for post in posts if matches(post, where)]
+        return sorted(found, key=lambda post: (post.createdTime, post.id), reverse=True)[:take]
+
+    async def log_action(**kwargs):
+        pass
+
+    monkeypatch.setattr(facebook, "prisma", SimpleNamespace(
+        facebookpage=SimpleNamespace(find_first=find_page),
+        facebookpost=SimpleNamespace(find_many=find_posts)
+    ))
+    monkeypatch.setattr(facebook, "log_action", log_action)
+    return posts
+
+class TestFacebookWebhook:
+    """Test the Messenger webhook endpoint."""
+    
+    async def test_verify_webhook_with_wrong_token(self, client: AsyncClient):
+        """Test webhook verification with a wrong verify token."""
+        params = {
+            "hub.mode": "subscribe",
+            "hub.verify_token": "wrong-token",
+            "hub.challenge": "12345"
+        }
+        response = await client.get("/api/facebook/webhook", params=params)
+        assert response.status_code == 403
+    
+    async def test_webhook_event_without_signature(self, client: AsyncClient):
+        """Test posting a webhook event without a signature."""
+        response = await client.post("/api/facebook/webhook", json={"object": "page", "entry": []})
+        assert response.status_code == 403
+    
+    async def test_webhook_event_with_invalid_signature(self, client: AsyncClient):
+        """Test posting a webhook event signed with the wrong secret."""
+        body = json.dumps({"object": "page", "entry": []}).encode()
+        signature = hmac.new(b"not-the-app-secret", body, hashlib.sha256).hexdigest()
+        response = await client.post(
+            "/api/facebook/webhook",
+            content=body,
+            headers={"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={signature}"}
+        )
+        assert response.status_code == 403
+
+class TestPagePosts:
+    """Test paging through a page's synced posts."""
+    
+    async def test_pages_through_posts_created_in_the_same_second(self, client: AsyncClient, auth_headers, page_posts):
+        """Test the cursor neither skips nor repeats posts that share a creation time."""
+        seen, before = [], None
+        for _ in range(len(page_posts)):
+            params = {"limit": 2, **({"before": before} if before else {})}
+            response = await client.get("/api/facebook/pages/page_1/posts", params=params, headers=auth_headers)
+            assert response.status_code == 200
+            data = response.json()
+            seen.extend(post["id"] for post in data["posts"])
+            before = data["paging"]["before"]
+            if before is None:
+                break
+        assert seen == ["fb_0", "fb_3", "fb_2", "fb_1", "fb_4"]
+    
+    async def test_invalid_cursor(self, client: AsyncClient, auth_headers, page_posts):
+        """Test a malformed cursor is rejected."""
+        response = await client.get(
+            "/api/facebook/pages/page_1/posts", params={"before": "not-a-cursor"}, headers=auth_headers
+        )
+        assert response.status_code == 400
+        assert response.json()["error"] == "Invalid cursor"
@@ -0,0 +1,101 @@
+import threading
+import pytest
+from types import SimpleNamespace
+from src.utils import facebook_sync, graph
+from src.utils.security import token_fingerprint
+
+def stored_page(id, page_id, name, token, user_id="user_1", is_active=True):
+    return SimpleNamespace(
+        id=id, facebookPageId=page_id, name=name, tokenFingerprint=token_fingerprint(token),
+        userId=user_id, isActive=is_active
+    )
+
+class FakeTable:
+    def __init__(self, **methods):
+        for name, method in methods.items():
+            setattr(self, name, method)
+
+class TestDiffPages:
+    """Test which page rows a sync writes."""
+
+    def test_unchanged_pages_produce_no_writes(self):
+        """Test a sync where nothing changed writes nothing."""
+        existing = [stored_page("p1", "fb1", "Shop", "token-1")]
+        api_pages = [{"id": "fb1", "name": "Shop", "access_token": "token-1"}]
+        assert facebook_sync.diff_pages("user_1", existing, api_pages) == ([], [], [])
+
+    def test_changes_creates_and_deactivations(self):
+        """Test renamed, re-tokened, new, moved and vanished pages."""
+        existing = [
+            stored_page("p1", "fb1", "Shop", "token-1"),
+            stored_page("p2", "fb2", "Cafe", "token-2"),
+            stored_page("p3", "fb3", "Gone", "token-3"),
+            stored_page("p4", "fb4", "Moved", "token-4", user_id="user_2", is_active=False),
+        ]
+        api_pages = [
+            {"id": "fb1", "name": "Shop Renamed", "access_token": "token-1"},
+            {"id": "fb2", "name": "Cafe", "access_token": "token-2b"},
+            {"id": "fb4", "name": "Moved", "access_token": "token-4"},
+            {"id": "fb5", "name": "New", "access_token": "token-5"},
+        ]
+        creates, updates, deactivations = facebook_sync.diff_pages("user_1", existing, api_pages)
+
+        assert [(page["facebookPageId"], page["name"], page["userId"]) for page in creates] == [("fb5", "New", "user_1")]
+        assert creates[0]["tokenFingerprint"] == token_fingerprint("token-5")
+        assert creates[0]["accessToken"] != "token-5"
+        assert [(page_id, sorted(changes)) for page_id, changes in updates] == [
+            ("p1", ["name"]),
+            ("p2", ["accessToken", "tokenFingerprint"]),
+            ("p4", ["isActive", "userId"]),
+        ]
+        assert deactivations == ["p3"]
+
+class TestSyncUserPages:
+    """Test the page sync job against a fake database."""
+
+    async def test_unchanged_sync_only_stamps_the_user(self, monkeypatch):
+        """Test an unchanged sync fetches off the event loop and writes one row."""
+        fetch_threads, user_updates, invalidated = [], [], []
+
+        def graph_get(path, access_token, params=None):
+            fetch_threads.append(threading.current_thread())
+            return {"data": [{"id": "fb1", "name": "Shop", "access_token": "token-1"}]}
+
+        async def find_unique(where):
+            return SimpleNamespace(id="user_1", facebookToken="encrypted")
+
+        async def find_many(where):
+            return [stored_page("p1", "fb1", "Shop", "token-1")]
+
+        async def update(where, data):
+            user_updates.append((where, sorted(data)))
+
+        def tx():
+            raise AssertionError("an unchanged sync must not open a transaction")
+
+        prisma = SimpleNamespace(
+            user=FakeTable(find_unique=find_unique, update=update),
+            facebookpage=FakeTable(find_many=find_many),
+            tx=tx
+        )
+        monkeypatch.setattr(graph, "graph_get", graph_get)
+        monkeypatch.setattr(facebook_sync, "prisma", prisma)
+        monkeypatch.setattr(facebook_sync, "decrypt_token", lambda token: "user-token")
+        monkeypatch.setattr(facebook_sync, "invalidate_user", invalidated.append)
+
+        pages, counts = await facebook_sync.sync_user_pages("user_1")
+
+        assert [page.id for page in pages] == ["p1"]
+        assert counts == {"created": 0, "updated": 0, "deactivated": 0, "unchanged": 1}
+        assert user_updates == [({"id": "user_1"}, ["pagesSyncedAt"])]
+        assert invalidated == ["user_1"]
+        assert fetch_threads and fetch_threads[0] is not threading.current_thread()
+
+    async def test_sync_without_token(self, monkeypatch):
+        """Test a user without a Facebook token is reported as not connected."""
+        async def find_unique(where):
+            return SimpleNamespace(id="user_1", facebookToken=None)
+
+        monkeypatch.setattr(facebook_sync, "prisma", SimpleNamespace(user=FakeTable(find_unique=find_unique)))
+        with pytest.raises(facebook_sync.FacebookNotConnected):
+            await facebook_sync.sync_user_pages("user_1")
@@ -0,0 +1,125 @@
+import pytest
+from src.utils import graph, graph_cache
+from src.utils.graph import GraphAPIError
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200, headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def json(self):
+        return self.payload
+
+class FakeRedis:
+    """The hash, set and key commands the Graph cache uses."""
+
+    def __init__(self):
+        self.data = {}
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = value
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def expire(self, key, seconds):
+        pass
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+@pytest.fixture
+def graph_api(monkeypatch):
+    """Serve Graph API GETs from a dict of path -> responses, counting calls."""
+    redis = FakeRedis()
+    responses, calls = {}, []
+
+    def get(url, params=None, headers=None, timeout=None):
+        path = url.split("/v18.0/", 1)[1]
+        calls.append(path)
+        return responses[path].pop(0)
+
+    monkeypatch.setattr(graph_cache, "redis_client", redis)
+    monkeypatch.setattr(graph_cache.requests, "get", get)
+    monkeypatch.setattr(graph_cache, "_l1", graph_cache.OrderedDict())
+    return redis, responses, calls
+
+class TestGraphCache:
+    """Test cached Graph API reads and token checks."""
+
+    def test_reads_are_served_from_cache(self, graph_api):
+        """Test a second read of the same endpoint does not reach the Graph API."""
+        redis, responses, calls = graph_api
+        responses["waba_1/phone_numbers"] = [FakeResponse({"data": [{"id": "pn_1"}]})]
+
+        first = graph_cache.cached_graph_get("waba_1/phone_numbers", "token-1")
+        second = graph_cache.cached_graph_get("waba_1/phone_numbers", "token-1")
+
+        assert first == second == {"data": [{"id": "pn_1"}]}
+        assert calls == ["waba_1/phone_numbers"]
+
+    def test_token_checks_use_the_short_ttl(self, graph_api, monkeypatch):
+        """Test a passing token check expires after AUTH_CHECK_TTL, not the endpoint TTL."""
+        redis, responses, calls = graph_api
+        responses["waba_1"] = [FakeResponse({"id": "waba_1"}), FakeResponse({"id": "waba_1"})]
+        now = [1000.0]
+        monkeypatch.setattr(graph_cache.time, "time", lambda: now[0])
+
+        graph_cache.verify_graph_token("waba_1", "token-1")
+        now[0] += graph_cache.AUTH_CHECK_TTL - 1
+        graph_cache.verify_graph_token("waba_1", "token-1")
+        assert calls == ["waba_1"]
+
+        now[0] += 2
+        graph_cache.verify_graph_token("waba_1", "token-1")
+        assert calls == ["waba_1", "waba_1"]
+        assert graph_cache.AUTH_CHECK_TTL < graph_cache.DEFAULT_TTL
+
+    def test_auth_error_evicts_everything_cached_for_the_token(self, graph_api):
+        """Test a code 190 error drops the token's cached reads in L1 and Redis."""
+        redis, responses, calls = graph_api
+        responses["waba_1"] = [FakeResponse({"id": "waba_1"})]
+        responses["waba_1/phone_numbers"] = [
+            FakeResponse({"error": {"message": "Error validating access token", "code": 190}}, status_code=401)
+        ]
+        responses["me"] = [FakeResponse({"id": "other"})]
+
+        graph_cache.verify_graph_token("waba_1", "token-1")
+        graph_cache.cached_graph_get("me", "token-2")
+        with pytest.raises(GraphAPIError) as error:
+            graph_cache.cached_graph_get("waba_1/phone_numbers", "token-1")
+        assert error.value.code == graph.AUTH_ERROR_CODE
+
+        assert not [key for key in graph_cache._l1 if key.startswith(graph_cache._token_prefix("token-1"))]
+        assert graph_cache._group_key("waba_1", "token-1") not in redis.data
+        assert graph_cache._token_index_key("token-1") not in redis.data
+        # Other credentials keep their entries
+        assert graph_cache._group_key("me", "token-2") in redis.data
+
+        responses["waba_1"] = [FakeResponse({"error": {"message": "Token revoked", "code": 190}}, status_code=401)]
+        with pytest.raises(GraphAPIError):
+            graph_cache.verify_graph_token("waba_1", "token-1")
+
+    def test_auth_error_on_a_send_evicts_the_token(self, graph_api, monkeypatch):
+        """Test a rejected token on an uncached call also drops its cached reads."""
+        redis, responses, calls = graph_api
+        responses["waba_1"] = [FakeResponse({"id": "waba_1"})]
+        graph_cache.verify_graph_token("waba_1", "token-1")
+
+        def post(url, json=None, headers=None, timeout=None):
+            return FakeResponse({"error": {"message": "Session expired", "code": 190}}, status_code=401)
+
+        monkeypatch.setattr(graph_cache.requests, "post", post)
+        with pytest.raises(GraphAPIError):
+            graph.graph_post("pn_1/messages", "token-1", {})
+
+        assert graph_cache._group_key("waba_1", "token-1") not in redis.data
+        assert not graph_cache._l1
@@ -0,0 +1,70 @@
+import time
+import pytest
+from httpx import AsyncClient
+from src.utils import health
+
+@pytest.fixture
+def probe_results(monkeypatch):
+    """Install cached probe results without starting the probe thread."""
+    monkeypatch.setattr(health, "start_health_probes", lambda: None)
+    monkeypatch.setattr(health, "_histograms", {})
+
+    def install(age=0, **statuses):
+        monkeypatch.setattr(health, "_results", {
+            name: {
+                "status": statuses.get(name, "healthy"),
+                "latency_ms": 1.0,
+                "error": None,
+                "checked_at": "2024-01-15T10:00:00",
+                "checked_monotonic": time.monotonic() - age
+            } for name in health.PROBES
+        })
+    return install
+
+class TestHealth:
+    """Test liveness and readiness endpoints."""
+    
+    async def test_health(self, client: AsyncClient):
+        """Test liveness answers without checking dependencies."""
+        response = await client.get("/health")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+    
+    async def test_ready(self, client: AsyncClient, probe_results):
+        """Test readiness passes when every readiness check is healthy."""
+        probe_results(queue_lag="warning")
+        response = await client.get("/ready")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert {name: check["status"] for name, check in data["checks"].items()} == {
+            "query_engine": "healthy", "postgres": "healthy", "redis": "healthy", "queue_lag": "warning"
+        }
+    
+    async def test_not_ready(self, client: AsyncClient, probe_results):
+        """Test a failing readiness check answers 503 and is listed."""
+        probe_results(postgres="error")
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["status"] == "not_ready"
+        assert response.json()["failing"] == ["postgres"]
+    
+    async def test_stale_results_are_not_ready(self, client: AsyncClient, probe_results):
+        """Test results older than STALE_AFTER count as failing."""
+        probe_results(age=health.STALE_AFTER + 1)
+        response = await client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["failing"] == ["query_engine", "postgres", "redis"]
+    
+    async def test_system_health_without_auth(self, client: AsyncClient):
+        """Test the admin health view requires authentication."""
+        response = await client.get("/api/admin/system-health")
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_metrics(self, client: AsyncClient):
+        """Test metrics are served in the Prometheus text format."""
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "health_probe_up" in response.text
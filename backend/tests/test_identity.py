@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+from datetime import datetime, timezone
+from httpx import AsyncClient
+from src.utils import identity
+from src.utils.identity import get_cached_user
+
+class TestIdentity:
+    """Test the request identity is resolved once from a cached user."""
+
+    async def test_user_is_cached(self, monkeypatch):
+        """Test a second lookup is served from the cache until the user is invalidated."""
+        lookups = []
+
+        async def find_unique(where):
+            lookups.append(where["id"])
+            return SimpleNamespace(
+                id=where["id"], role="USER", name="Ada", email="ada@example.com",
+                createdAt=datetime(2024, 1, 1, tzinfo=timezone.utc), facebookToken="encrypted", pagesSyncedAt=None
+            )
+
+        monkeypatch.setattr(identity, "prisma", SimpleNamespace(user=SimpleNamespace(find_unique=find_unique)))
+        monkeypatch.setattr(identity, "start_invalidation_listener", lambda: None)
+        monkeypatch.setattr(identity, "is_listening", lambda: True)
+        monkeypatch.setattr(identity, "publish_invalidation", lambda channel, user_id: None)
+        identity._clear_users()
+
+        first = await get_cached_user("user_1")
+        assert await get_cached_user("user_1") == first
+        assert (first["role"], first["facebookConnected"]) == ("USER", True)
+        assert lookups == ["user_1"]
+
+        identity.invalidate_user("user_1")
+        await get_cached_user("user_1")
+        assert lookups == ["user_1", "user_1"]
+        identity._clear_users()
+
+    async def test_failed_lookup_returns_a_json_error(self, client: AsyncClient, auth_headers, monkeypatch):
+        """Test a database error while loading the user answers with a JSON 500."""
+        async def get_cached_user(user_id):
+            raise ConnectionError("database unavailable")
+
+        monkeypatch.setattr(identity, "get_cached_user", get_cached_user)
+        response = await client.get("/api/leads", headers=auth_headers)
+        assert response.status_code == 500
+        assert response.json() == {"error": "Failed to load user: database unavailable"}
+
+    async def test_health_never_loads_the_user(self, client: AsyncClient, auth_headers, monkeypatch):
+        """Test anonymous blueprints skip identity resolution."""
+        async def get_cached_user(user_id):
+            raise AssertionError("loaded a user for /health")
+
+        monkeypatch.setattr(identity, "get_cached_user", get_cached_user)
+        response = await client.get("/health", headers=auth_headers)
+        assert response.status_code == 200
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+from src.utils import importer
+
+class FakeLeads:
+    """A lead table keyed by (userId, facebookUserId), like the unique constraint."""
+
+    def __init__(self, *existing):
+        self.rows = {("user_1", facebook_user_id) for facebook_user_id in existing}
+        self.create_calls = []
+
+        async def find_many(where):
+            return [
+                SimpleNamespace(facebookUserId=facebook_user_id)
+                for facebook_user_id in where["facebookUserId"]["in"]
+                if (where["userId"], facebook_user_id) in self.rows
+            ]
+
+        async def create_many(data, skip_duplicates=False):
+            self.create_calls.append(([lead["facebookUserId"] for lead in data], skip_duplicates))
+            created = 0
+            for lead in data:
+                key = (lead["userId"], lead["facebookUserId"])
+                if key in self.rows:
+                    assert skip_duplicates, "duplicate insert without skip_duplicates"
+                    continue
+                self.rows.add(key)
+                created += 1
+            return created
+
+        self.prisma = SimpleNamespace(lead=SimpleNamespace(find_many=find_many, create_many=create_many))
+
+def lead(facebook_user_id):
+    return importer.normalize_profile({"id": facebook_user_id, "name": "Ada Lovelace"}, "FACEBOOK_COMMENT", "user_1", "page_1")
+
+class TestNormalizeProfile:
+    """Test Graph API profiles are turned into leads."""
+
+    def test_profile_name_is_split(self):
+        """Test the first word is the first name and the rest the last name."""
+        fields = lead("fb_1")
+        assert (fields["facebookUserId"], fields["firstName"], fields["lastName"]) == ("fb_1", "Ada", "Lovelace")
+        assert (fields["userId"], fields["facebookPageId"], fields["consentGiven"]) == ("user_1", "page_1", False)
+
+    def test_profile_without_id_is_skipped(self):
+        """Test items without a profile ID produce no lead."""
+        assert importer.normalize_profile({"name": "Hidden"}, "FACEBOOK_LIKE", "user_1", "page_1") is None
+        assert importer.normalize_profile(None, "FACEBOOK_COMMENT", "user_1", "page_1") is None
+
+class TestInsertNewLeads:
+    """Test engagement imports insert each profile once."""
+
+    async def test_duplicates_in_batch_and_run_are_dropped(self, monkeypatch):
+        """Test profiles repeated in a batch or seen earlier in the run are not inserted."""
+        fake = FakeLeads("fb_known")
+        monkeypatch.setattr(importer, "prisma", fake.prisma)
+        seen = {"fb_seen"}
+
+        created = await importer.insert_new_leads(
+            "user_1", [lead("fb_1"), lead("fb_1"), lead("fb_seen"), lead("fb_known"), lead("fb_2")], seen
+        )
+
+        assert created == 2
+        assert fake.create_calls == [(["fb_1", "fb_2"], True)]
+        assert seen == {"fb_seen", "fb_known", "fb_1", "fb_2"}
+
+    async def test_concurrent_import_does_not_duplicate(self, monkeypatch):
+        """Test a lead inserted by another import between the read and the insert is skipped."""
+        fake = FakeLeads()
+        monkeypatch.setattr(importer, "prisma", fake.prisma)
+        find_many = fake.prisma.lead.find_many
+
+        async def racing_find_many(where):
+            found = await find_many(where)
+            # Another import of the same page inserts fb_1 right after our read
+            fake.rows.add(("user_1", "fb_1"))
+            return found
+
+        monkeypatch.setattr(fake.prisma.lead, "find_many", racing_find_many)
+
+        created = await importer.insert_new_leads("user_1", [lead("fb_1"), lead("fb_2")], set())
+
+        assert created == 1
+        assert fake.rows == {("user_1", "fb_1"), ("user_1", "fb_2")}
+
+    async def test_nothing_new_skips_the_insert(self, monkeypatch):
+        """Test a batch of known profiles does not reach create_many."""
+        fake = FakeLeads("fb_1")
+        monkeypatch.setattr(importer, "prisma", fake.prisma)
+
+        assert await importer.insert_new_leads("user_1", [lead("fb_1")], set()) == 0
+        assert fake.create_calls == []
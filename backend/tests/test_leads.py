@@ -1,5 +1,7 @@
 import pytest
+from types import SimpleNamespace
 from httpx import AsyncClient
+from src.utils import api_keys
 
 class TestLeadsAPI:
     """Test leads management endpoints."""
@@ -10,6 +12,17 @@ class TestLeadsAPI:
         assert response.status_code == 401
         assert "error" in response.json()
     
+    async def test_get_leads_with_invalid_api_key(self, client: AsyncClient, monkeypatch):
+        """Test getting leads with an unknown API key."""
+        async def find_unique(where):
+            return None
+        
+        monkeypatch.setattr(api_keys, "prisma", SimpleNamespace(apikey=SimpleNamespace(find_unique=find_unique)))
+        monkeypatch.setattr(api_keys, "start_invalidation_listener", lambda: None)
+        response = await client.get("/api/leads", headers={"X-API-Key": "not-a-real-key"})
+        assert response.status_code == 401
+        assert response.json() == {"error": "Invalid or expired API key"}
+    
     async def test_get_leads_with_auth(self, client: AsyncClient, auth_headers):
         """Test getting leads with authentication."""
         # This would normally require mocking the database
@@ -87,6 +100,22 @@ class TestLeadsAPI:
         assert response.status_code == 401
         assert "error" in response.json()
     
+    async def test_check_eligibility_without_auth(self, client: AsyncClient):
+        """Test checking lead eligibility without authentication."""
+        response = await client.post("/api/leads/eligibility", json={"channel": "whatsapp", "leadIds": []})
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_check_eligibility_with_invalid_channel(self, client: AsyncClient, auth_headers):
+        """Test checking lead eligibility with an unknown channel."""
+        response = await client.post(
+            "/api/leads/eligibility",
+            json={"channel": "sms", "leadIds": ["lead_123"]},
+            headers=auth_headers
+        )
+        assert response.status_code == 400
+        assert "error" in response.json()
+    
     async def test_get_lead_tags(self, client: AsyncClient, auth_headers):
         """Test getting available lead tags."""
         response = await client.get("/api/leads/tags", headers=auth_headers)
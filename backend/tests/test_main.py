@@ -0,0 +1,41 @@
+import pytest
+from httpx import AsyncClient
+from src import main
+from src.utils import health
+
+@pytest.fixture
+def connects(monkeypatch):
+    """Record each connect of the request-serving Prisma clients."""
+    calls = []
+
+    async def connect_clients(*modules):
+        calls.append(modules)
+
+    monkeypatch.setattr(main, "connect_clients", connect_clients)
+    monkeypatch.setattr(main, "_clients_connected", False)
+    return calls
+
+class TestDatabaseConnection:
+    """Test the Prisma clients are connected once per process."""
+
+    async def test_connects_once_across_requests(self, client: AsyncClient, connects):
+        """Test the first request connects and later requests reuse the clients."""
+        assert (await client.get("/health")).status_code == 200
+        assert (await client.get("/health")).status_code == 200
+        assert len(connects) == 1
+        names = {module.__name__ for module in connects[0]}
+        assert "src.routes.leads" in names
+        assert "src.utils.audit" in names
+        assert health.__name__ not in names
+
+    async def test_failed_connect_is_retried(self, client: AsyncClient, connects, monkeypatch):
+        """Test a failed connect is retried by the next request."""
+        async def unavailable(*modules):
+            connects.append(modules)
+            raise ConnectionError("database unavailable")
+
+        monkeypatch.setattr(main, "connect_clients", unavailable)
+        await client.get("/health")
+        await client.get("/health")
+        assert len(connects) == 2
+        assert main._clients_connected is False
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import pytest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from src.utils import media
+
+SHA256 = "ab" + "0" * 62
+
+class FakeRedis:
+    """String keys with SET NX and TTLs."""
+
+    def __init__(self):
+        self.data, self.ttls = {}, {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        self.ttls[key] = ex
+        return True
+
+@pytest.fixture
+def media_env(monkeypatch, tmp_path):
+    """A stored asset, a fake Redis, a media table and a recording uploader."""
+    redis, uploads, upserts, rows = FakeRedis(), [], [], {}
+
+    def release_lock(keys, args):
+        if redis.data.get(keys[0]) == args[0]:
+            del redis.data[keys[0]]
+
+    async def find_unique(where):
+        return rows.get("upload")
+
+    async def upsert(where, data):
+        upserts.append(data["update"])
+
+    def upload_file(phone_number_id, access_token, asset):
+        uploads.append((phone_number_id, access_token))
+        return f"media_{len(uploads)}"
+
+    monkeypatch.setattr(media, "MEDIA_STORAGE_DIR", str(tmp_path))
+    os.makedirs(os.path.dirname(media.media_path(SHA256)))
+    open(media.media_path(SHA256), "wb").close()
+    monkeypatch.setattr(media, "redis_client", redis)
+    monkeypatch.setattr(media, "_release_lock", release_lock)
+    monkeypatch.setattr(media, "prisma", SimpleNamespace(whatsappmedia=SimpleNamespace(find_unique=find_unique, upsert=upsert)))
+    monkeypatch.setattr(media, "_upload_file", upload_file)
+    monkeypatch.setattr(media, "decrypt_token", lambda token: "token-1")
+    monkeypatch.setattr(media, "UPLOAD_WAIT_INTERVAL", 0.001)
+    return SimpleNamespace(redis=redis, uploads=uploads, upserts=upserts, rows=rows)
+
+number = SimpleNamespace(id="n1", accessToken="encrypted")
+asset = SimpleNamespace(id="asset_1", sha256=SHA256, mimeType="image/jpeg", filename="offer.jpg")
+cache_key = f"wa-media:n1:{SHA256}"
+
+class TestGetWhatsappMediaId:
+    """Test media IDs are reused until they near expiry."""
+
+    async def test_cache_hit(self, media_env):
+        """Test a cached ID is returned without the database or an upload."""
+        media_env.redis.data[cache_key] = "media_cached"
+
+        assert await media.get_whatsapp_media_id(number, asset, "pn_1") == "media_cached"
+        assert media_env.uploads == []
+
+    async def test_database_fallback(self, media_env):
+        """Test a stored upload with an aware expiry is reused and cached again."""
+        expires_at = datetime.now(timezone.utc) + timedelta(days=10)
+        media_env.rows["upload"] = SimpleNamespace(mediaId="media_stored", expiresAt=expires_at)
+
+        assert await media.get_whatsapp_media_id(number, asset, "pn_1") == "media_stored"
+        assert media_env.uploads == []
+        assert media_env.redis.data[cache_key] == "media_stored"
+        assert abs(media_env.redis.ttls[cache_key] - timedelta(days=9).total_seconds()) < 5
+
+    async def test_expiring_upload_is_refreshed(self, media_env):
+        """Test an upload inside the refresh margin is uploaded again with an aware expiry."""
+        media_env.rows["upload"] = SimpleNamespace(mediaId="media_old", expiresAt=datetime.now(timezone.utc) + timedelta(hours=2))
+
+        assert await media.get_whatsapp_media_id(number, asset, "pn_1") == "media_1"
+        assert media_env.uploads == [("pn_1", "token-1")]
+        assert media_env.upserts[0]["mediaId"] == "media_1"
+        assert media_env.upserts[0]["expiresAt"].tzinfo is not None
+        assert media_env.redis.data[cache_key] == "media_1"
+        assert f"{cache_key}:lock" not in media_env.redis.data
+
+    async def test_waiters_reuse_a_concurrent_upload(self, media_env):
+        """Test a send that finds the lock taken waits for the other upload's ID."""
+        media_env.redis.data[f"{cache_key}:lock"] = "other-worker"
+        waiter = asyncio.ensure_future(media.get_whatsapp_media_id(number, asset, "pn_1"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        media_env.redis.data[cache_key] = "media_other"
+        assert await waiter == "media_other"
+        assert media_env.uploads == []
+        assert media_env.redis.data[f"{cache_key}:lock"] == "other-worker"
+
+    async def test_lock_taken_over_is_not_released(self, media_env, monkeypatch):
+        """Test a lock that expired mid-upload and was taken by another worker is left alone."""
+        def slow_upload(phone_number_id, access_token, asset):
+            media_env.redis.data[f"{cache_key}:lock"] = "other-worker"
+            return "media_1"
+
+        monkeypatch.setattr(media, "_upload_file", slow_upload)
+
+        assert await media.get_whatsapp_media_id(number, asset, "pn_1") == "media_1"
+        assert media_env.redis.data[f"{cache_key}:lock"] == "other-worker"
@@ -0,0 +1,154 @@
+from datetime import datetime
+from types import SimpleNamespace
+from src.utils import message_status, messaging
+
+def event(provider_id, status, minute, error=None):
+    return {"id": provider_id, "status": status, "at": datetime(2024, 1, 15, 10, minute), "error": error}
+
+class FakeRedis:
+    """The string commands provider ID lookups use."""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return SimpleNamespace(set=self.set, execute=lambda: None)
+
+class FakeMessages:
+    """A message table that applies LEAST updates like Postgres."""
+
+    def __init__(self, **rows):
+        self.rows = {
+            id: {"status": status, "sentAt": None, "deliveredAt": None, "readAt": None, "errorMessage": None}
+            for id, status in rows.items()
+        }
+        self.statements = []
+
+        async def execute_raw(query, *params):
+            self.statements.append(query)
+            for i in range(0, len(params), 4):
+                row = self.rows.get(params[i])
+                if row is None:
+                    continue
+                for field, value in zip(message_status.TIMESTAMP_FIELDS, params[i + 1:i + 4]):
+                    if value is not None:
+                        value = datetime.fromisoformat(value)
+                        row[field] = min(row[field], value) if row[field] else value
+            return len(params) // 4
+
+        async def update_many(where, data):
+            updated = 0
+            for id in where["id"]["in"]:
+                row = self.rows[id]
+                if row["status"] in where["status"]["in"]:
+                    row.update(data)
+                    updated += 1
+            return updated
+
+        async def find_many(where):
+            return []
+
+        self.prisma = SimpleNamespace(
+            execute_raw=execute_raw,
+            message=SimpleNamespace(update_many=update_many, find_many=find_many)
+        )
+
+class TestMergeStatusEvents:
+    """Test status events are collapsed per message."""
+
+    def test_read_before_delivered(self):
+        """Test a read receipt arriving first still ends READ with both timestamps."""
+        merged = message_status.merge_status_events(
+            [event("wamid.1", "read", 5), event("wamid.1", "delivered", 3)], {"wamid.1": "m1"}
+        )
+        assert merged["m1"]["status"] == "READ"
+        assert merged["m1"]["timestamps"] == {"readAt": datetime(2024, 1, 15, 10, 5), "deliveredAt": datetime(2024, 1, 15, 10, 3)}
+
+    def test_earliest_timestamp_wins(self):
+        """Test repeated events keep the earliest time whatever their order."""
+        merged = message_status.merge_status_events(
+            [event("wamid.1", "sent", 9), event("wamid.1", "sent", 2), event("wamid.1", "sent", 4)], {"wamid.1": "m1"}
+        )
+        assert merged["m1"]["timestamps"] == {"sentAt": datetime(2024, 1, 15, 10, 2)}
+
+    def test_delivery_overrides_failure(self):
+        """Test a failure is replaced by a later-ranked delivery but not by a sent event."""
+        merged = message_status.merge_status_events(
+            [event("wamid.1", "failed", 1, error="timeout"), event("wamid.1", "sent", 0), event("wamid.2", "failed", 1, error="blocked"),
+             event("wamid.2", "delivered", 2)],
+            {"wamid.1": "m1", "wamid.2": "m2"}
+        )
+        assert (merged["m1"]["status"], merged["m1"]["error"]) == ("FAILED", "timeout")
+        assert (merged["m2"]["status"], merged["m2"]["error"]) == ("DELIVERED", None)
+
+    def test_unknown_messages_and_statuses_are_skipped(self):
+        """Test events without a message or with an unknown status are dropped."""
+        merged = message_status.merge_status_events(
+            [event("wamid.x", "read", 1), event("wamid.1", "deleted", 1)], {"wamid.1": "m1"}
+        )
+        assert merged == {}
+
+class TestApplyProviderStatuses:
+    """Test status events are written in set-based updates."""
+
+    async def test_later_batch_with_an_earlier_time_wins(self, monkeypatch):
+        """Test a delivery arriving after the read lowers the deliveredAt the read filled in."""
+        fake = FakeMessages(m1="SENT")
+        monkeypatch.setattr(message_status, "prisma", fake.prisma)
+        monkeypatch.setattr(message_status, "redis_client", FakeRedis({"provider-msg:wamid.1": "m1"}))
+
+        assert await message_status.apply_provider_statuses([event("wamid.1", "read", 5)]) == (1, [])
+        assert fake.rows["m1"]["deliveredAt"] == datetime(2024, 1, 15, 10, 5)
+
+        assert await message_status.apply_provider_statuses([event("wamid.1", "delivered", 3)]) == (0, [])
+        assert fake.rows["m1"]["status"] == "READ"
+        assert fake.rows["m1"]["deliveredAt"] == datetime(2024, 1, 15, 10, 3)
+        assert fake.rows["m1"]["readAt"] == datetime(2024, 1, 15, 10, 5)
+
+        await message_status.apply_provider_statuses([event("wamid.1", "read", 8)])
+        assert fake.rows["m1"]["readAt"] == datetime(2024, 1, 15, 10, 5)
+
+    async def test_timestamps_are_written_in_one_statement_per_chunk(self, monkeypatch):
+        """Test many messages share an UPDATE instead of one write each."""
+        monkeypatch.setattr(message_status, "TIMESTAMP_UPDATE_CHUNK", 2)
+        fake = FakeMessages(m1="SENT", m2="SENT", m3="PENDING")
+        monkeypatch.setattr(message_status, "prisma", fake.prisma)
+        monkeypatch.setattr(message_status, "redis_client", FakeRedis({
+            "provider-msg:wamid.1": "m1", "provider-msg:wamid.2": "m2", "provider-msg:wamid.3": "m3",
+        }))
+
+        advanced, unresolved = await message_status.apply_provider_statuses([
+            event("wamid.1", "delivered", 1), event("wamid.2", "delivered", 2), event("wamid.3", "failed", 3, error="blocked"),
+            event("wamid.4", "read", 4),
+        ])
+
+        assert advanced == 3
+        assert [e["id"] for e in unresolved] == ["wamid.4"]
+        assert len(fake.statements) == 2
+        assert {id: row["status"] for id, row in fake.rows.items()} == {"m1": "DELIVERED", "m2": "DELIVERED", "m3": "FAILED"}
+        assert fake.rows["m3"]["errorMessage"] == "blocked"
+
+class TestRecordSent:
+    """Test sends are recorded for later status webhooks."""
+
+    async def test_provider_id_is_stored_and_mapped(self, monkeypatch):
+        """Test a Messenger send stores its mid on the row and in Redis."""
+        redis, writes = FakeRedis(), []
+
+        async def update_many(where, data):
+            writes.append((where, data))
+            return 1
+
+        monkeypatch.setattr(message_status, "redis_client", redis)
+        monkeypatch.setattr(messaging, "prisma", SimpleNamespace(message=SimpleNamespace(update_many=update_many)))
+
+        assert await messaging.record_sent("m1", {"recipient_id": "psid_1", "message_id": "mid.1"}) == "mid.1"
+        assert redis.data == {"provider-msg:mid.1": "m1"}
+        assert writes[0][0] == {"id": "m1", "status": "PENDING"}
+        assert (writes[0][1]["status"], writes[0][1]["providerMessageId"]) == ("SENT", "mid.1")
@@ -0,0 +1,189 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from src.utils import messenger_ingest
+
+PAGE = SimpleNamespace(id="page_1", facebookPageId="fbpage_1", userId="user_123")
+SENT_AT = datetime(2024, 1, 15, 10, 0, tzinfo=timezone.utc)
+
+def at(minute):
+    return datetime(2024, 1, 15, 10, minute, tzinfo=timezone.utc)
+
+def millis(minute):
+    return int(at(minute).timestamp() * 1000)
+
+def page_entry(*events):
+    return ("1-0", {"body": json.dumps({"object": "page", "entry": [{"id": "fbpage_1", "messaging": list(events)}]})})
+
+def message_event(psid, mid, text, minute):
+    return {"sender": {"id": psid}, "timestamp": millis(minute), "message": {"mid": mid, "text": text}}
+
+def receipt_event(kind, psid, minute, mids=None):
+    return {"sender": {"id": psid}, kind: {"watermark": millis(minute), **({"mids": mids} if mids else {})}}
+
+class FakeTables:
+    """The page, lead and message tables Messenger ingest writes to."""
+
+    def __init__(self, leads=(), outbound=()):
+        self.leads = {lead.id: lead for lead in leads}
+        self.messages = {
+            message_id: {"direction": "OUTBOUND", "recipient": psid, "status": "SENT", "sentAt": SENT_AT}
+            for message_id, psid in outbound
+        }
+        self.lead_inserts = []
+        self.lead_updates = []
+
+        async def find_pages(where):
+            return [PAGE] if PAGE.facebookPageId in where["facebookPageId"]["in"] else []
+
+        async def find_leads(where):
+            return [
+                lead for lead in self.leads.values()
+                if lead.userId == where["userId"] and lead.facebookUserId in where["facebookUserId"]["in"]
+            ]
+
+        async def create_leads(data, skip_duplicates=False):
+            self.lead_inserts.append(skip_duplicates)
+            for row in data:
+                lead_id = f"lead_{len(self.leads) + 1}"
+                self.leads[lead_id] = SimpleNamespace(id=lead_id, **row)
+            return len(data)
+
+        async def update_leads(where, data):
+            self.lead_updates.append((where["id"]["in"], data))
+            return len(where["id"]["in"])
+
+        async def create_messages(data, skip_duplicates=False):
+            created = 0
+            for row in data:
+                if row["providerMessageId"] not in self.messages:
+                    self.messages[row["providerMessageId"]] = dict(row)
+                    created += 1
+            return created
+
+        async def update_messages(where, data):
+            updated = 0
+            for message in self.messages.values():
+                if (message["direction"] == where["direction"] and message["recipient"] == where["recipient"]
+                        and message["status"] in where["status"]["in"] and message["sentAt"] <= where["sentAt"]["lte"]):
+                    message.update(data)
+                    updated += 1
+            return updated
+
+        self.prisma = SimpleNamespace(
+            facebookpage=SimpleNamespace(find_many=find_pages),
+            lead=SimpleNamespace(find_many=find_leads, create_many=create_leads, update_many=update_leads),
+            message=SimpleNamespace(create_many=create_messages, update_many=update_messages)
+        )
+
+@pytest.fixture
+def ingest(monkeypatch):
+    """Run ingest against fake tables, recording leads marked changed and mid statuses."""
+    state = SimpleNamespace(changed=[], provider_statuses=[])
+
+    async def apply_provider_statuses(statuses):
+        state.provider_statuses.extend(statuses)
+        return 0, statuses
+
+    def use_tables(tables):
+        state.tables = tables
+        monkeypatch.setattr(messenger_ingest, "prisma", tables.prisma)
+
+    monkeypatch.setattr(messenger_ingest, "mark_leads_changed", lambda user_id, lead_ids: state.changed.append((user_id, lead_ids)))
+    monkeypatch.setattr(messenger_ingest, "apply_provider_statuses", apply_provider_statuses)
+    use_tables(FakeTables())
+    state.use_tables = use_tables
+    return state
+
+class TestClassifyEvent:
+    """Test messaging events are classified."""
+
+    def test_text_message(self):
+        """Test a text message is inbound with its mid and aware UTC time."""
+        assert messenger_ingest.classify_event(message_event("psid_1", "m_1", "hi", 5)) == ("inbound", {
+            "psid": "psid_1", "mid": "m_1", "type": "TEXT", "content": "hi", "at": at(5)
+        })
+
+    def test_attachment_only_message_is_media(self):
+        """Test a message with only attachments is stored as media."""
+        attachments = [{"type": "image", "payload": {"url": "https://example.com/a.jpg"}}]
+        event = {"sender": {"id": "psid_1"}, "timestamp": millis(5), "message": {"mid": "m_1", "attachments": attachments}}
+        kind, fields = messenger_ingest.classify_event(event)
+        assert (kind, fields["type"], json.loads(fields["content"])) == ("inbound", "MEDIA", attachments)
+
+    def test_postback(self):
+        """Test a button postback is inbound text carrying its payload."""
+        event = {"sender": {"id": "psid_1"}, "timestamp": millis(5), "postback": {"mid": "m_2", "payload": "GET_STARTED", "title": "Start"}}
+        assert messenger_ingest.classify_event(event)[1]["content"] == "GET_STARTED"
+
+    def test_receipts(self):
+        """Test delivery and read receipts carry the sender, mids and watermark."""
+        assert messenger_ingest.classify_event(receipt_event("delivery", "psid_1", 7, mids=["m_out"])) == (
+            "delivery", {"psid": "psid_1", "mids": ["m_out"], "at": at(7)}
+        )
+        assert messenger_ingest.classify_event(receipt_event("read", "psid_1", 8)) == (
+            "read", {"psid": "psid_1", "mids": [], "at": at(8)}
+        )
+
+    def test_ignored_events(self):
+        """Test echoes, sender-less events and watermark-less receipts are ignored."""
+        echo = {"sender": {"id": "page"}, "message": {"mid": "m_1", "text": "hi", "is_echo": True}}
+        no_sender = {"message": {"mid": "m_1", "text": "hi"}}
+        no_watermark = {"sender": {"id": "psid_1"}, "read": {}}
+        for event in (echo, no_sender, no_watermark):
+            assert messenger_ingest.classify_event(event) is None
+
+class TestUpsertMessageLeads:
+    """Test Messenger senders are matched to leads."""
+
+    async def test_creates_missing_and_touches_existing(self, ingest):
+        """Test new senders get leads idempotently and known senders are only touched."""
+        known = SimpleNamespace(id="lead_known", userId="user_123", facebookUserId="psid_known")
+        ingest.use_tables(FakeTables(leads=[known]))
+        lead_ids = await messenger_ingest.upsert_message_leads(PAGE, {"psid_known", "psid_new"}, at(5))
+        assert lead_ids["psid_known"] == "lead_known"
+        created = ingest.tables.leads[lead_ids["psid_new"]]
+        assert (created.source, created.facebookPageId, created.lastInteraction) == ("FACEBOOK_MESSAGE", "page_1", at(5))
+        assert ingest.tables.lead_inserts == [True]
+        assert ingest.tables.lead_updates == [(["lead_known"], {"lastInteraction": at(5)})]
+        assert ingest.changed == [("user_123", [lead_ids["psid_new"]])]
+
+class TestIngestMessengerEvents:
+    """Test batches of Messenger webhook entries are applied."""
+
+    async def test_duplicate_delivery_writes_message_once(self, ingest):
+        """Test a message delivered twice, in one batch and again later, is stored once under one lead."""
+        entry = page_entry(message_event("psid_1", "m_1", "hi", 5), message_event("psid_1", "m_1", "hi", 5))
+        first = await messenger_ingest.ingest_messenger_events([entry])
+        second = await messenger_ingest.ingest_messenger_events([entry])
+        assert (first["messages"], second["messages"]) == (1, 0)
+        assert len(ingest.tables.leads) == 1
+        assert ingest.tables.lead_inserts == [True]
+        assert ingest.tables.messages["m_1"]["leadId"] == next(iter(ingest.tables.leads))
+
+    async def test_out_of_order_receipts_end_read(self, ingest):
+        """Test a read receipt arriving before the delivery receipt is not undone by it."""
+        ingest.use_tables(FakeTables(outbound=[("m_out", "psid_1")]))
+        await messenger_ingest.ingest_messenger_events([page_entry(receipt_event("read", "psid_1", 9))])
+        await messenger_ingest.ingest_messenger_events([page_entry(receipt_event("delivery", "psid_1", 7))])
+        message = ingest.tables.messages["m_out"]
+        assert (message["status"], message["readAt"]) == ("READ", at(9))
+        assert "deliveredAt" not in message
+
+    async def test_receipts_in_one_batch_use_the_latest_watermark(self, ingest):
+        """Test several receipts of a kind in a batch apply once, at their latest watermark."""
+        ingest.use_tables(FakeTables(outbound=[("m_out", "psid_1")]))
+        result = await messenger_ingest.ingest_messenger_events([page_entry(
+            receipt_event("delivery", "psid_1", 8, mids=["m_out"]),
+            receipt_event("delivery", "psid_1", 6)
+        )])
+        assert result == {"pages": 1, "messages": 0, "receipts": 1}
+        assert ingest.tables.messages["m_out"]["deliveredAt"] == at(8)
+        assert [status["id"] for status in ingest.provider_statuses] == ["m_out"]
+
+    async def test_unknown_page_is_skipped(self, ingest):
+        """Test entries for a page the app does not manage write nothing."""
+        entry = ("1-0", {"body": json.dumps({"object": "page", "entry": [{"id": "other", "messaging": [message_event("psid_1", "m_1", "hi", 5)]}]})})
+        assert await messenger_ingest.ingest_messenger_events([entry]) == {"pages": 0, "messages": 0, "receipts": 0}
+        assert ingest.tables.messages == {}
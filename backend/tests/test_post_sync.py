@@ -0,0 +1,132 @@
+import pytest
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from src.utils import post_sync
+
+def graph_post(id, created_time, likes=0, message=None):
+    return {
+        "id": id,
+        "message": message,
+        "created_time": created_time,
+        "likes": {"summary": {"total_count": likes}},
+        "comments": {"summary": {"total_count": 0}},
+    }
+
+class FakePosts:
+    """Posts and page tables that record every write."""
+
+    def __init__(self, page, stored_posts=()):
+        self.page = page
+        self.stored = {post.facebookPostId: post for post in stored_posts}
+        self.created, self.updated, self.page_updates = [], [], []
+
+        async def find_many(where):
+            return [self.stored[id] for id in where["facebookPostId"]["in"] if id in self.stored]
+
+        async def create_many(data, skip_duplicates=False):
+            self.created.extend(post["facebookPostId"] for post in data)
+
+        async def update(where, data):
+            self.updated.append((where["id"], data))
+
+        async def find_unique(where):
+            return self.page
+
+        async def update_page(where, data):
+            self.page_updates.append(data)
+
+        @asynccontextmanager
+        async def tx():
+            yield self.prisma
+
+        self.prisma = SimpleNamespace(
+            facebookpost=SimpleNamespace(find_many=find_many, create_many=create_many, update=update),
+            facebookpage=SimpleNamespace(find_unique=find_unique, update=update_page),
+            tx=tx
+        )
+
+class TestParsePost:
+    """Test Graph API posts are mapped to FacebookPost fields."""
+
+    def test_parse_post(self):
+        """Test counts, text and the creation time are read."""
+        post = {
+            "id": "fb1_2",
+            "story": "Shop shared a link",
+            "created_time": "2024-01-15T10:30:00Z",
+            "likes": {"summary": {"total_count": 4}},
+            "comments": {"summary": {"total_count": 2}},
+            "shares": {"count": 1},
+        }
+        assert post_sync.parse_post(post) == {
+            "facebookPostId": "fb1_2",
+            "message": None,
+            "story": "Shop shared a link",
+            "createdTime": datetime(2024, 1, 15, 10, 30, tzinfo=timezone.utc),
+            "likesCount": 4,
+            "commentsCount": 2,
+            "sharesCount": 1,
+        }
+
+class TestSyncPagePosts:
+    """Test incremental post syncs against a fake database."""
+
+    async def test_sync_reads_from_the_high_water_mark(self, monkeypatch):
+        """Test a sync asks for posts since the mark, writes only changes and advances it."""
+        mark = datetime(2024, 1, 15, 12, 0, tzinfo=timezone.utc)
+        page = SimpleNamespace(id="p1", facebookPageId="fb1", isActive=True, accessToken="encrypted", postsSince=mark)
+        unchanged = SimpleNamespace(id="post_a", facebookPostId="fb1_a", **{
+            key: value for key, value in post_sync.parse_post(graph_post("fb1_a", "2024-01-15T11:30:00Z")).items()
+            if key != "facebookPostId"
+        })
+        liked = SimpleNamespace(id="post_b", facebookPostId="fb1_b", **{
+            key: value for key, value in post_sync.parse_post(graph_post("fb1_b", "2024-01-15T11:45:00Z")).items()
+            if key != "facebookPostId"
+        })
+        fake = FakePosts(page, [unchanged, liked])
+        requests = []
+
+        async def graph_pages(path, access_token, params=None):
+            requests.append((path, access_token, params))
+            yield [graph_post("fb1_a", "2024-01-15T11:30:00Z"), graph_post("fb1_b", "2024-01-15T11:45:00Z", likes=3)]
+            yield [graph_post("fb1_c", "2024-01-16T08:00:00Z")]
+            yield []
+
+        monkeypatch.setattr(post_sync, "prisma", fake.prisma)
+        monkeypatch.setattr(post_sync, "graph_pages", graph_pages)
+        monkeypatch.setattr(post_sync, "decrypt_token", lambda token: "page-token")
+
+        totals = await post_sync.sync_page_posts("p1")
+
+        assert totals == {"fetched": 3, "created": 1, "updated": 1}
+        assert requests[0][0:2] == ("fb1/posts", "page-token")
+        assert requests[0][2]["since"] == int(datetime(2024, 1, 15, 11, 0, tzinfo=timezone.utc).timestamp())
+        assert fake.created == ["fb1_c"]
+        assert fake.updated == [("post_b", {"likesCount": 3})]
+        assert fake.page_updates[0]["postsSince"] == datetime(2024, 1, 16, 8, 0, tzinfo=timezone.utc)
+
+    async def test_first_sync_has_no_since(self, monkeypatch):
+        """Test a page without a mark is read from the start."""
+        page = SimpleNamespace(id="p1", facebookPageId="fb1", isActive=True, accessToken="encrypted", postsSince=None)
+        fake = FakePosts(page)
+        requests = []
+
+        async def graph_pages(path, access_token, params=None):
+            requests.append(params)
+            yield []
+
+        monkeypatch.setattr(post_sync, "prisma", fake.prisma)
+        monkeypatch.setattr(post_sync, "graph_pages", graph_pages)
+        monkeypatch.setattr(post_sync, "decrypt_token", lambda token: "page-token")
+
+        assert await post_sync.sync_page_posts("p1") == {"fetched": 0, "created": 0, "updated": 0}
+        assert "since" not in requests[0]
+        assert fake.page_updates[0]["postsSince"] is None
+
+    async def test_inactive_page_is_not_synced(self, monkeypatch):
+        """Test an inactive page is skipped."""
+        page = SimpleNamespace(id="p1", isActive=False)
+        monkeypatch.setattr(post_sync, "prisma", FakePosts(page).prisma)
+        with pytest.raises(post_sync.PageNotSyncable):
+            await post_sync.sync_page_posts("p1")
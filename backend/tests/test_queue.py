@@ -0,0 +1,127 @@
+import pytest
+from types import SimpleNamespace
+from src.utils import queue
+
+NOW = 1705312800.0  # 2024-01-15 10:00:00 UTC, the start of a minute
+
+class FakeRedis:
+    """Lists, sorted sets, hashes and counters, read through pipelines."""
+
+    def __init__(self):
+        self.lists, self.zsets, self.hashes, self.strings = {}, {}, {}, {}
+        self.round_trips = 0
+
+    def llen(self, key):
+        return len(self.lists.get(key, []))
+
+    def zcard(self, key):
+        return len(self.zsets.get(key, ()))
+
+    def lindex(self, key, index):
+        items = self.lists.get(key, [])
+        return items[index] if items else None
+
+    def mget(self, keys):
+        return [self.strings.get(key) for key in keys]
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def incr(self, key):
+        self.strings[key] = str(int(self.strings.get(key, 0)) + 1)
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self, transaction=True):
+        redis, calls = self, []
+
+        class Pipeline:
+            def __getattr__(self, command):
+                return lambda *args: calls.append((command, args))
+
+            def execute(self):
+                redis.round_trips += 1
+                return [getattr(redis, command)(*args) for command, args in calls]
+
+        return Pipeline()
+
+@pytest.fixture
+def redis(monkeypatch):
+    """Queue stats read from a fake Redis at a fixed time, with an empty cache."""
+    fake = FakeRedis()
+    clock = SimpleNamespace(time=lambda: NOW, monotonic=lambda: clock.now, now=1000.0)
+    monkeypatch.setattr(queue, "redis_client", fake)
+    monkeypatch.setattr(queue, "time", clock)
+    monkeypatch.setattr(queue, "_queue_stats_cache", (0, None))
+    fake.clock = clock
+    return fake
+
+class TestQueueStats:
+    """Test queue stats are read from bullmq's keys."""
+
+    def test_counts_each_state(self, redis):
+        """Test every job state is counted from its list or sorted set."""
+        redis.lists["bull:message-queue:wait"] = ["3", "2", "1"]
+        redis.lists["bull:message-queue:active"] = ["4"]
+        redis.zsets["bull:message-queue:delayed"] = {"5", "6"}
+        redis.zsets["bull:message-queue:failed"] = {"7"}
+        redis.zsets["bull:sync-queue:completed"] = {"8", "9"}
+        stats = queue._compute_queue_stats()
+        assert set(stats) == {"message_queue", "import_queue", "sync_queue"}
+        counts = {state: stats["message_queue"][state] for state in queue.JOB_STATE_KEYS}
+        assert counts == {
+            "waiting": 3, "active": 1, "paused": 0, "prioritized": 0,
+            "delayed": 2, "waiting_children": 0, "completed": 0, "failed": 1
+        }
+        assert stats["sync_queue"]["completed"] == 2
+        assert redis.round_trips == 2
+
+    def test_oldest_waiting_age(self, redis):
+        """Test the oldest waiting job's age comes from the tail of the wait list."""
+        redis.lists["bull:message-queue:wait"] = ["3", "2", "1"]
+        redis.hashes["bull:message-queue:1"] = {"timestamp": str(int((NOW - 90.25) * 1000))}
+        redis.hashes["bull:message-queue:3"] = {"timestamp": str(int((NOW - 5) * 1000))}
+        stats = queue._compute_queue_stats()
+        assert stats["message_queue"]["oldest_waiting_seconds"] == 90.2
+        assert stats["import_queue"]["oldest_waiting_seconds"] == 0
+
+    def test_throughput_over_finished_minutes(self, redis):
+        """Test throughput averages the last finished minutes and ignores the current one."""
+        clock = redis.clock
+        for minutes_ago, completed in ((1, 10), (2, 5), (5, 5), (6, 100)):
+            clock.time = lambda minutes_ago=minutes_ago: NOW - minutes_ago * 60
+            for _ in range(completed):
+                queue.record_job_outcome("message-queue", "completed")
+        clock.time = lambda: NOW
+        queue.record_job_outcome("message-queue", "completed")
+        queue.record_job_outcome("message-queue", "failed")
+        clock.time = lambda: NOW - 60
+        queue.record_job_outcome("message-queue", "failed")
+        clock.time = lambda: NOW
+
+        throughput = queue._compute_queue_stats()["message_queue"]["throughput_per_minute"]
+        assert throughput == {"completed": 4.0, "failed": 0.2}
+
+    def test_stats_are_cached_for_five_seconds(self, redis):
+        """Test reads within the TTL share one computation and later reads refresh it."""
+        first = queue.get_queue_stats()
+        redis.lists["bull:message-queue:wait"] = ["1"]
+        redis.clock.now += queue.QUEUE_STATS_TTL - 0.1
+        assert queue.get_queue_stats() is first
+        assert redis.round_trips == 1
+
+        redis.clock.now += 0.2
+        assert queue.get_queue_stats()["message_queue"]["waiting"] == 1
+        assert redis.round_trips == 3
+
+    def test_failed_read_is_not_cached(self, redis, monkeypatch):
+        """Test a Redis failure returns empty stats and the next call retries."""
+        def unavailable():
+            raise ConnectionError("redis unavailable")
+
+        compute = queue._compute_queue_stats
+        monkeypatch.setattr(queue, "_compute_queue_stats", unavailable)
+        assert queue.get_queue_stats() == {}
+        monkeypatch.setattr(queue, "_compute_queue_stats", compute)
+        assert "message_queue" in queue.get_queue_stats()
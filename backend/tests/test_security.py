@@ -0,0 +1,209 @@
+import base64
+import os
+import threading
+import pytest
+from types import SimpleNamespace
+from cryptography.fernet import Fernet
+from src.utils import security
+
+@pytest.fixture(autouse=True)
+def key_config(monkeypatch):
+    """Start every test from an unconfigured key setup and empty caches."""
+    for name in ("ENCRYPTION_KEY", "TOKEN_ENCRYPTION_KEYS"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("SECRET_KEY", "test-secret")
+    monkeypatch.setenv("ENCRYPTION_SALT", "test-salt")
+    security.clear_token_cache()
+    yield
+    security.clear_token_cache()
+
+def legacy_token(fernet, token):
+    """A token as stored before envelope encryption"""
+    return base64.urlsafe_b64encode(fernet.encrypt(token.encode())).decode()
+
+class TestTokenCaching:
+    """Test derived keys and decrypted tokens are cached."""
+
+    def test_key_is_derived_once(self, monkeypatch):
+        """Test PBKDF2 runs once per key configuration, not per call."""
+        calls = []
+        derive = security.PBKDF2HMAC.derive
+
+        def counting_derive(self, secret):
+            calls.append(secret)
+            return derive(self, secret)
+
+        monkeypatch.setattr(security.PBKDF2HMAC, "derive", counting_derive)
+        encrypted = [security.encrypt_token(f"token-{i}") for i in range(5)]
+        assert [security.decrypt_token(token) for token in encrypted] == [f"token-{i}" for i in range(5)]
+        assert len(calls) == 1
+
+    def test_decrypted_tokens_are_cached(self, monkeypatch):
+        """Test a repeated decrypt is served without decrypting again."""
+        encrypted = security.encrypt_token("page-token")
+        assert security.decrypt_token(encrypted) == "page-token"
+
+        monkeypatch.setattr(security, "_decrypt_envelope", lambda token: pytest.fail("decrypted twice"))
+        assert security.decrypt_token(encrypted) == "page-token"
+
+    def test_token_cache_is_bounded(self, monkeypatch):
+        """Test the oldest decrypted tokens are dropped past TOKEN_CACHE_SIZE."""
+        monkeypatch.setattr(security, "TOKEN_CACHE_SIZE", 3)
+        encrypted = [security.encrypt_token(f"token-{i}") for i in range(5)]
+        for token in encrypted:
+            security.decrypt_token(token)
+
+        assert len(security._token_cache) == 3
+        assert security._cache_get(security._cache_key(encrypted[0])) is None
+        assert security._cache_get(security._cache_key(encrypted[4])) == "token-4"
+
+    def test_invalid_tokens_are_not_cached(self):
+        """Test a token that cannot be decrypted returns None and is not remembered."""
+        assert security.decrypt_token("g1:k0:not-base64-ciphertext") is None
+        assert security.decrypt_token("not-a-fernet-token") is None
+        assert len(security._token_cache) == 0
+
+    def test_legacy_tokens_decrypt_with_any_configured_key(self, monkeypatch):
+        """Test Fernet tokens from before a key rotation still decrypt."""
+        old_key, new_key = Fernet.generate_key(), Fernet.generate_key()
+        stored = legacy_token(Fernet(old_key), "old-token")
+
+        monkeypatch.setenv("ENCRYPTION_KEY", f"{new_key.decode()},{old_key.decode()}")
+        security.clear_token_cache()
+        assert security.decrypt_token(stored) == "old-token"
+
+    async def test_bulk_decrypt_preserves_order_off_the_loop(self, monkeypatch):
+        """Test large batches decrypt on the crypto pool and keep their order."""
+        count = security.BULK_CRYPTO_THRESHOLD + 8
+        encrypted = [security.encrypt_token(f"token-{i}") for i in range(count)]
+        threads = set()
+        decrypt = security.decrypt_token
+
+        def recording_decrypt(token):
+            threads.add(threading.current_thread().name)
+            return decrypt(token)
+
+        monkeypatch.setattr(security, "decrypt_token", recording_decrypt)
+        assert await security.decrypt_tokens(encrypted) == [f"token-{i}" for i in range(count)]
+        assert all(name.startswith("crypto") for name in threads)
+
+def envelope_key():
+    return base64.urlsafe_b64encode(os.urandom(32)).decode().rstrip("=")
+
+def configure_keys(monkeypatch, value):
+    monkeypatch.setenv("TOKEN_ENCRYPTION_KEYS", value)
+    security.clear_token_cache()
+
+class TestKeyring:
+    """Test token envelopes across key configuration changes."""
+
+    def test_unconfigured_tokens_use_the_derived_key(self):
+        """Test tokens are k0 envelopes while no keys are configured."""
+        encrypted = security.encrypt_token("page-token")
+        assert encrypted.startswith("g1:k0:")
+        assert security.decrypt_token(encrypted) == "page-token"
+
+    def test_k0_tokens_stay_readable_after_keys_are_configured(self, monkeypatch):
+        """Test setting the first explicit key keeps derived-key envelopes readable."""
+        stored = security.encrypt_token("page-token")
+
+        configure_keys(monkeypatch, f"k1:{envelope_key()}")
+
+        assert security.decrypt_token(stored) == "page-token"
+        assert security.needs_reencryption(stored)
+        fresh = security.encrypt_token("page-token")
+        assert security.token_key_id(fresh) == "k1"
+        assert not security.needs_reencryption(fresh)
+
+    def test_rotation_keeps_old_keys_readable(self, monkeypatch):
+        """Test a token under the previous key decrypts once a new key is first."""
+        k1 = envelope_key()
+        configure_keys(monkeypatch, f"k1:{k1}")
+        stored = security.encrypt_token("page-token")
+
+        configure_keys(monkeypatch, f"k2:{envelope_key()},k1:{k1}")
+        assert security.decrypt_token(stored) == "page-token"
+        assert security.token_key_id(security.encrypt_token("page-token")) == "k2"
+
+        configure_keys(monkeypatch, f"k2:{envelope_key()}")
+        assert security.decrypt_token(stored) is None
+
+    def test_explicit_k0_replaces_the_derived_key(self, monkeypatch):
+        """Test a configured k0 entry takes the derived key's place."""
+        stored = security.encrypt_token("page-token")
+        configure_keys(monkeypatch, f"k1:{envelope_key()},k0:{envelope_key()}")
+        assert security.decrypt_token(stored) is None
+
+    def test_k0_tokens_survive_an_encryption_key_rotation(self, monkeypatch):
+        """Test putting a new ENCRYPTION_KEY first keeps existing k0 envelopes readable."""
+        old_key, new_key = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+        monkeypatch.setenv("ENCRYPTION_KEY", old_key)
+        security.clear_token_cache()
+        stored = security.encrypt_token("page-token")
+        assert stored.startswith("g1:k0:")
+
+        monkeypatch.setenv("ENCRYPTION_KEY", f"{new_key},{old_key}")
+        security.clear_token_cache()
+        assert security.decrypt_token(stored) == "page-token"
+        assert security.decrypt_token(security.encrypt_token("other-token")) == "other-token"
+
+        monkeypatch.setenv("ENCRYPTION_KEY", new_key)
+        security.clear_token_cache()
+        assert security.decrypt_token(stored) is None
+
+    def test_secret_derived_k0_survives_setting_an_encryption_key(self, monkeypatch):
+        """Test k0 envelopes written before ENCRYPTION_KEY was set stay readable."""
+        stored = security.encrypt_token("page-token")
+
+        monkeypatch.setenv("ENCRYPTION_KEY", Fernet.generate_key().decode())
+        security.clear_token_cache()
+        assert security.decrypt_token(stored) == "page-token"
+
+    def test_envelope_header_is_authenticated(self, monkeypatch):
+        """Test an envelope relabelled with another key ID does not decrypt."""
+        k1 = envelope_key()
+        configure_keys(monkeypatch, f"k2:{k1},k1:{k1}")
+        stored = security.encrypt_token("page-token")
+        assert stored.startswith("g1:k2:")
+        assert security.decrypt_token(stored.replace("g1:k2:", "g1:k1:", 1)) is None
+
+    def test_malformed_key_entries_are_rejected(self, monkeypatch):
+        """Test an entry without a key ID fails loudly instead of encrypting with nothing."""
+        configure_keys(monkeypatch, envelope_key())
+        with pytest.raises(ValueError):
+            security.get_token_keyring()
+
+    async def test_reencrypt_moves_k0_tokens_to_the_active_key(self, monkeypatch):
+        """Test the re-encryption job rewrites k0 envelopes and skips current ones."""
+        from src.utils import token_rotation
+
+        rows = {
+            "p1": SimpleNamespace(id="p1", accessToken=security.encrypt_token("token-1")),
+            "p2": SimpleNamespace(id="p2", accessToken="g1:k9:unknown-key"),
+        }
+        configure_keys(monkeypatch, f"k1:{envelope_key()}")
+        rows["p3"] = SimpleNamespace(id="p3", accessToken=security.encrypt_token("token-3"))
+        writes = []
+
+        async def find_many(where, order_by, take, cursor=None, skip=0):
+            ids = sorted(rows)
+            start = ids.index(cursor["id"]) + skip if cursor else 0
+            return [rows[id] for id in ids[start:start + take]]
+
+        async def update_many(where, data):
+            row = rows[where["id"]]
+            if row.accessToken != where["accessToken"]:
+                return 0
+            writes.append(where["id"])
+            row.accessToken = data["accessToken"]
+            return 1
+
+        model = SimpleNamespace(find_many=find_many, update_many=update_many)
+        monkeypatch.setattr(token_rotation, "prisma", SimpleNamespace(facebookpage=model))
+
+        counts = await token_rotation.reencrypt_model("facebookpage", "accessToken", chunk_size=2)
+
+        assert counts == {"scanned": 3, "reencrypted": 1, "undecryptable": 1}
+        assert writes == ["p1"]
+        assert security.token_key_id(rows["p1"].accessToken) == "k1"
+        assert security.decrypt_token(rows["p1"].accessToken) == "token-1"
@@ -0,0 +1,155 @@
+import time
+import pytest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from src.utils import session_window
+
+class FakeRedis:
+    """Plain keys with TTLs; pipelines apply their commands on execute."""
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.ttls = {}
+
+    def set(self, key, value, ex=None):
+        self.data[key] = str(value)
+        self.ttls[key] = ex
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        commands = []
+        return SimpleNamespace(
+            set=lambda *args, **kwargs: commands.append((self.set, args, kwargs)),
+            execute=lambda: [command(*args, **kwargs) for command, args, kwargs in commands]
+        )
+
+class FakeWindows:
+    """A conversation_windows table that stores aware datetimes, like Prisma returns."""
+
+    def __init__(self, **expiries):
+        self.rows = {
+            recipient: SimpleNamespace(id=f"w_{recipient}", recipient=recipient, expiresAt=expires_at)
+            for recipient, expires_at in expiries.items()
+        }
+        self.created, self.updated = [], []
+
+        async def find_many(where):
+            rows = [self.rows[r] for r in where["recipient"]["in"] if r in self.rows]
+            if "expiresAt" in where:
+                rows = [row for row in rows if row.expiresAt > where["expiresAt"]["gt"]]
+            return rows
+
+        async def create_many(data, skip_duplicates=False):
+            self.created.extend(data)
+            return len(data)
+
+        async def update_many(where, data):
+            self.updated.append((where, data))
+            return len(where["id"]["in"])
+
+        self.prisma = SimpleNamespace(conversationwindow=SimpleNamespace(
+            find_many=find_many, create_many=create_many, update_many=update_many
+        ))
+
+@pytest.fixture
+def windows(monkeypatch):
+    """Install a fake Redis and a table factory for session window tests."""
+    redis = FakeRedis()
+
+    def extend_window(keys, args, client=None):
+        current = int(redis.data.get(keys[0]) or 0)
+        if args[0] > current:
+            redis.set(keys[0], args[0], ex=args[1])
+
+    monkeypatch.setattr(session_window, "redis_client", redis)
+    monkeypatch.setattr(session_window, "_extend_window", extend_window)
+
+    def install(**expiries):
+        table = FakeWindows(**expiries)
+        monkeypatch.setattr(session_window, "prisma", table.prisma)
+        return table
+    return redis, install
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+class TestOpenWindows:
+    """Test inbound messages open and extend windows."""
+
+    async def test_returning_customer_extends_the_stored_window(self, windows):
+        """Test an aware stored expiry is compared with the new one without errors."""
+        redis, install = windows
+        now = utc_now()
+        table = install(**{"15550001": now + timedelta(hours=1), "15550002": now + timedelta(hours=30)})
+
+        opened = await session_window.open_windows("n1", {
+            "+1 555 0001": now - timedelta(minutes=5),
+            "15550002": (now - timedelta(hours=2)).replace(tzinfo=None),
+            "15550003": now,
+        })
+
+        assert opened == 3
+        assert [row["recipient"] for row in table.created] == ["15550003"]
+        assert table.created[0]["expiresAt"] == now + session_window.SESSION_WINDOW
+        assert table.updated == [(
+            {"id": {"in": ["w_15550001"]}, "expiresAt": {"lt": now + timedelta(hours=24, minutes=-5)}},
+            {"expiresAt": now + timedelta(hours=24, minutes=-5), "lastInboundAt": now - timedelta(minutes=5)}
+        )]
+        assert int(redis.data["wa-window:n1:15550003"]) == int((now + session_window.SESSION_WINDOW).timestamp())
+
+    async def test_latest_message_per_recipient_wins(self, windows):
+        """Test several messages from one recipient keep the latest expiry."""
+        redis, install = windows
+        now = utc_now()
+        table = install()
+
+        await session_window.open_windows("n1", {"+15550001": now - timedelta(hours=1), "15550001": now})
+
+        assert [row["expiresAt"] for row in table.created] == [now + session_window.SESSION_WINDOW]
+
+class TestGetWindowExpiries:
+    """Test window lookups from Redis with a database fallback."""
+
+    async def test_database_fallback_for_redis_misses(self, windows):
+        """Test misses are answered from the table in aware UTC and cached."""
+        redis, install = windows
+        now = utc_now()
+        install(**{"15550001": now + timedelta(hours=3), "15550009": now - timedelta(hours=1)})
+        redis.data["wa-window:n1:15550002"] = str(int((now + timedelta(hours=5)).timestamp()))
+        redis.data["wa-window:n1:15550003"] = "0"
+
+        expiries = await session_window.get_window_expiries("n1", ["+15550001", "15550002", "15550003", "15550009"])
+
+        assert expiries == {
+            "+15550001": now + timedelta(hours=3),
+            "15550002": now + timedelta(hours=5),
+            "15550003": None,
+            "15550009": None,
+        }
+        assert expiries["+15550001"].tzinfo is not None
+        assert int(redis.data["wa-window:n1:15550001"]) == int((now + timedelta(hours=3)).timestamp())
+        assert (redis.data["wa-window:n1:15550009"], redis.ttls["wa-window:n1:15550009"]) == ("0", session_window.CLOSED_CACHE_TTL)
+
+    async def test_epoch_values_do_not_depend_on_the_host_timezone(self, windows, monkeypatch):
+        """Test cached expiries round-trip on a host that is not set to UTC."""
+        redis, install = windows
+        install()
+        monkeypatch.setenv("TZ", "America/New_York")
+        time.tzset()
+        try:
+            expires_at = utc_now() + timedelta(hours=2)
+            await session_window.open_windows("n1", {"15550001": expires_at - session_window.SESSION_WINDOW})
+            assert await session_window.get_window_expiries("n1", ["15550001"]) == {"15550001": expires_at}
+        finally:
+            monkeypatch.delenv("TZ")
+            time.tzset()
+
+    async def test_is_window_open(self, windows):
+        """Test a stored open window counts as open."""
+        redis, install = windows
+        install(**{"15550001": utc_now() + timedelta(minutes=1)})
+
+        assert await session_window.is_window_open("n1", "+15550001")
+        assert not await session_window.is_window_open("n1", "+15550002")
@@ -0,0 +1,138 @@
+import pytest
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from src.utils import template_sync
+
+def api_template(name, status="APPROVED", body="Hello {{1}}", language="en_US"):
+    return {
+        "name": name,
+        "language": language,
+        "status": status,
+        "category": "MARKETING",
+        "components": [{"type": "BODY", "text": body}],
+    }
+
+def stored_template(id, template_data, status=None):
+    return SimpleNamespace(
+        id=id,
+        name=template_data["name"],
+        status=status or template_data["status"],
+        contentHash=template_sync.template_hash(template_data)
+    )
+
+class TestDiffTemplates:
+    """Test template rows are compared by content hash."""
+
+    def test_hash_ignores_key_order(self):
+        """Test the same content hashes the same whatever the key order."""
+        template = api_template("welcome")
+        reordered = dict(reversed(list(template.items())))
+        assert template_sync.template_hash(template) == template_sync.template_hash(reordered)
+        assert template_sync.template_hash(template) != template_sync.template_hash(api_template("welcome", status="REJECTED"))
+
+    def test_only_changes_are_written(self):
+        """Test new, changed, restored and removed templates are split out and unchanged ones skipped."""
+        existing = [
+            stored_template("t1", api_template("unchanged")),
+            stored_template("t2", api_template("edited")),
+            stored_template("t3", api_template("restored"), status=template_sync.REMOVED_STATUS),
+            stored_template("t4", api_template("gone")),
+            stored_template("t5", api_template("already_gone"), status=template_sync.REMOVED_STATUS),
+        ]
+        api = [
+            api_template("unchanged"),
+            api_template("edited", body="Hi {{1}}"),
+            api_template("restored"),
+            api_template("new"),
+            api_template("new", language="es_ES"),
+        ]
+
+        creates, updates, removed = template_sync.diff_templates("n1", existing, api)
+
+        assert [(row["name"], row["language"], row["whatsappNumberId"]) for row in creates] == [("new", "en_US", "n1")]
+        assert [template_id for template_id, fields in updates] == ["t2", "t3"]
+        assert updates[0][1]["contentHash"] == template_sync.template_hash(api_template("edited", body="Hi {{1}}"))
+        assert removed == ["t4"]
+
+class TestSyncNumberTemplates:
+    """Test a number's templates are synced against a fake database."""
+
+    async def test_sync_writes_the_diff_in_one_transaction(self, monkeypatch):
+        """Test every Graph page is read and only the diff is written."""
+        number = SimpleNamespace(id="n1", isActive=True, accessToken="encrypted", businessAccountId="waba_1")
+        existing = [stored_template("t1", api_template("unchanged")), stored_template("t2", api_template("gone"))]
+        writes = []
+
+        async def find_unique(where):
+            return number
+
+        async def find_many(where):
+            return existing
+
+        def recorder(name):
+            async def record(**kwargs):
+                writes.append((name, kwargs))
+            return record
+
+        @asynccontextmanager
+        async def tx():
+            yield fake
+
+        fake = SimpleNamespace(
+            whatsappnumber=SimpleNamespace(find_unique=find_unique, update=recorder("number.update")),
+            whatsapptemplate=SimpleNamespace(
+                find_many=find_many,
+                create_many=recorder("create_many"),
+                update=recorder("update"),
+                update_many=recorder("update_many")
+            ),
+            tx=tx
+        )
+        requests = []
+
+        async def graph_pages(path, access_token, params=None):
+            requests.append((path, access_token))
+            yield [api_template("unchanged")]
+            yield [api_template("new")]
+
+        monkeypatch.setattr(template_sync, "prisma", fake)
+        monkeypatch.setattr(template_sync, "graph_pages", graph_pages)
+        monkeypatch.setattr(template_sync, "decrypt_token", lambda token: "token-1")
+
+        totals = await template_sync.sync_number_templates("n1")
+
+        assert totals == {"created": 1, "updated": 0, "removed": 1, "unchanged": 1}
+        assert requests == [("waba_1/message_templates", "token-1")]
+        assert [name for name, kwargs in writes] == ["create_many", "update_many", "number.update"]
+        assert writes[1][1] == {"where": {"id": {"in": ["t2"]}}, "data": {"status": template_sync.REMOVED_STATUS}}
+
+    async def test_inactive_number_is_skipped(self, monkeypatch):
+        """Test the job reports a skip instead of failing for an inactive number."""
+        async def find_unique(where):
+            return SimpleNamespace(id="n1", isActive=False)
+
+        monkeypatch.setattr(template_sync, "prisma", SimpleNamespace(whatsappnumber=SimpleNamespace(find_unique=find_unique)))
+
+        with pytest.raises(template_sync.NumberNotSyncable):
+            await template_sync.sync_number_templates("n1")
+        assert await template_sync.process_template_sync_job({"number_id": "n1"}) == {"skipped": "Number not found or inactive"}
+
+    async def test_fan_out_dedupes_by_slot(self, monkeypatch):
+        """Test the periodic job pages through numbers and queues one sync per number and slot."""
+        numbers = [SimpleNamespace(id=f"n{i}") for i in range(5)]
+        queued = []
+
+        async def find_many(where, order_by, take, cursor=None, skip=0):
+            start = [number.id for number in numbers].index(cursor["id"]) + skip if cursor else 0
+            return numbers[start:start + take]
+
+        async def queue_template_sync(number_id, dedupe_key=None):
+            queued.append((number_id, dedupe_key))
+            return True
+
+        monkeypatch.setattr(template_sync, "NUMBER_SCAN_CHUNK_SIZE", 2)
+        monkeypatch.setattr(template_sync, "prisma", SimpleNamespace(whatsappnumber=SimpleNamespace(find_many=find_many)))
+        monkeypatch.setattr(template_sync, "queue_template_sync", queue_template_sync)
+
+        assert await template_sync.process_all_template_sync_job({"slot": 7}) == {"queued": 5}
+        assert queued == [(f"n{i}", 7) for i in range(5)]
@@ -0,0 +1,170 @@
+import re
+import pytest
+from types import SimpleNamespace
+from httpx import AsyncClient
+from src.routes import whatsapp
+
+BULK_URL = "/api/whatsapp/numbers/number_123/send-template/bulk"
+
+@pytest.fixture
+def bulk_send(monkeypatch):
+    """Fake the tables, eligibility index and queue behind the bulk template send."""
+    state = SimpleNamespace(messages={}, jobs=[], queue_fails=False)
+
+    async def find_number(where):
+        return SimpleNamespace(id=where["id"]) if where["userId"] == "user_123" else None
+
+    async def find_template(where):
+        return SimpleNamespace(id="tpl_1", status="APPROVED")
+
+    async def create_many(data):
+        state.messages.update({row["id"]: dict(row) for row in data})
+        return len(data)
+
+    async def update_many(where, data):
+        for message_id in where["id"]["in"]:
+            state.messages[message_id].update(data)
+        return len(where["id"]["in"])
+
+    async def find_eligible_leads_by_phone(user_id, channel, phone_numbers):
+        return {phone: f"lead_{phone[-1]}" for phone in phone_numbers if not phone.endswith("0")}
+
+    async def add_message_jobs(jobs_data):
+        if state.queue_fails:
+            return None
+        state.jobs.extend(jobs_data)
+        return [f"job_{i}" for i in range(len(jobs_data))]
+
+    async def log_action(**kwargs):
+        pass
+
+    monkeypatch.setattr(whatsapp, "prisma", SimpleNamespace(
+        whatsappnumber=SimpleNamespace(find_unique=find_number),
+        whatsapptemplate=SimpleNamespace(find_unique=find_template),
+        message=SimpleNamespace(create_many=create_many, update_many=update_many)
+    ))
+    monkeypatch.setattr(whatsapp, "find_eligible_leads_by_phone", find_eligible_leads_by_phone)
+    monkeypatch.setattr(whatsapp, "add_message_jobs", add_message_jobs)
+    monkeypatch.setattr(whatsapp, "log_action", log_action)
+    return state
+
+class TestWhatsAppWebhook:
+    """Test the WhatsApp webhook endpoint."""
+    
+    async def test_verify_webhook_with_wrong_token(self, client: AsyncClient):
+        """Test webhook verification with a wrong verify token."""
+        params = {
+            "hub.mode": "subscribe",
+            "hub.verify_token": "wrong-token",
+            "hub.challenge": "12345"
+        }
+        response = await client.get("/api/whatsapp/webhook", params=params)
+        assert response.status_code == 403
+    
+    async def test_webhook_event_without_signature(self, client: AsyncClient):
+        """Test posting a status update without a signature."""
+        payload = {"object": "whatsapp_business_account", "entry": []}
+        response = await client.post("/api/whatsapp/webhook", json=payload)
+        assert response.status_code == 403
+
+class TestConversationWindows:
+    """Test the conversation window endpoint."""
+    
+    async def test_get_windows_without_auth(self, client: AsyncClient):
+        """Test checking windows without authentication."""
+        response = await client.post("/api/whatsapp/numbers/number_123/windows", json={"recipients": ["+1987654321"]})
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_get_windows_without_recipients(self, client: AsyncClient, auth_headers):
+        """Test checking windows with an empty recipient list."""
+        response = await client.post("/api/whatsapp/numbers/number_123/windows", json={"recipients": []}, headers=auth_headers)
+        assert response.status_code == 400
+        assert "error" in response.json()
+
+class TestBulkTemplateSend:
+    """Test the bulk template send endpoint."""
+    
+    async def test_bulk_send_without_auth(self, client: AsyncClient):
+        """Test bulk sending without authentication."""
+        payload = {
+            "templateName": "welcome_template",
+            "language": "en_US",
+            "recipients": [{"recipient": "+1987654321", "parameters": ["John"]}]
+        }
+        response = await client.post("/api/whatsapp/numbers/number_123/send-template/bulk", json=payload)
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_bulk_send_without_recipients(self, client: AsyncClient, auth_headers):
+        """Test bulk sending with an empty recipient list."""
+        payload = {"templateName": "welcome_template", "language": "en_US", "recipients": []}
+        response = await client.post("/api/whatsapp/numbers/number_123/send-template/bulk", json=payload, headers=auth_headers)
+        assert response.status_code == 400
+        assert "error" in response.json()
+
+    async def test_bulk_send_reports_each_recipient(self, client: AsyncClient, auth_headers, bulk_send):
+        """Test every entry gets a result in request order and only eligible recipients are queued."""
+        payload = {
+            "templateName": "welcome_template",
+            "language": "en_US",
+            "recipients": [
+                {"recipient": "+15550000001", "parameters": ["Ann"]},
+                {"recipient": "+15550000000"},
+                {"recipient": "+15550000001"},
+                {"parameters": ["Nobody"]},
+                {"recipient": "+15550000002", "parameters": ["Bo"]}
+            ]
+        }
+        response = await client.post(BULK_URL, json=payload, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["queued"] == 2
+        results = data["results"]
+        assert [result["status"] for result in results] == ["queued", "rejected", "duplicate", "invalid", "queued"]
+        assert [result.get("job_id") for result in results] == ["job_0", None, None, None, "job_1"]
+        
+        message_ids = [results[0]["message_id"], results[4]["message_id"]]
+        assert all(re.fullmatch(r"c[0-9a-z]{24}", message_id) for message_id in message_ids)
+        assert sorted(bulk_send.messages) == sorted(message_ids)
+        assert [job["message_id"] for job in bulk_send.jobs] == message_ids
+        assert [job["parameters"] for job in bulk_send.jobs] == [["Ann"], ["Bo"]]
+        assert {message["leadId"] for message in bulk_send.messages.values()} == {"lead_1", "lead_2"}
+    
+    async def test_bulk_send_marks_messages_failed_when_queueing_fails(self, client: AsyncClient, auth_headers, bulk_send):
+        """Test messages written for a batch that cannot be queued are marked failed."""
+        bulk_send.queue_fails = True
+        payload = {
+            "templateName": "welcome_template",
+            "language": "en_US",
+            "recipients": [{"recipient": "+15550000001"}, {"recipient": "+15550000002"}]
+        }
+        response = await client.post(BULK_URL, json=payload, headers=auth_headers)
+        assert response.status_code == 500
+        assert "error" in response.json()
+        assert len(bulk_send.messages) == 2
+        assert {message["status"] for message in bulk_send.messages.values()} == {"FAILED"}
+        assert bulk_send.jobs == []
+
+class TestMedia:
+    """Test media upload and media sends."""
+    
+    async def test_upload_media_without_auth(self, client: AsyncClient):
+        """Test uploading media without authentication."""
+        files = {"file": ("offer.jpg", b"\xff\xd8\xff", "image/jpeg")}
+        response = await client.post("/api/whatsapp/media", files=files)
+        assert response.status_code == 401
+        assert "error" in response.json()
+    
+    async def test_upload_media_without_file(self, client: AsyncClient, auth_headers):
+        """Test uploading media without a file."""
+        response = await client.post("/api/whatsapp/media", headers=auth_headers)
+        assert response.status_code == 400
+        assert "error" in response.json()
+    
+    async def test_send_media_without_auth(self, client: AsyncClient):
+        """Test sending a media message without authentication."""
+        payload = {"recipient": "+1987654321", "mediaAssetId": "media_123"}
+        response = await client.post("/api/whatsapp/numbers/number_123/send-media", json=payload)
+        assert response.status_code == 401
+        assert "error" in response.json()
@@ -0,0 +1,225 @@
+import json
+import pytest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from src.utils import webhooks, whatsapp_ingest
+
+NUMBER = SimpleNamespace(id="wn_1", userId="user_123", phoneNumberId="pn_1", phoneNumber="+15550001111")
+
+def webhook_entry(messages=(), statuses=(), contacts=()):
+    body = {
+        "object": "whatsapp_business_account",
+        "entry": [{"changes": [{"field": "messages", "value": {
+            "metadata": {"phone_number_id": "pn_1", "display_phone_number": "15550001111"},
+            "contacts": list(contacts),
+            "messages": list(messages),
+            "statuses": list(statuses)
+        }}]}]
+    }
+    return ("1-0", {"body": json.dumps(body)})
+
+def text_message(id, sender, text, timestamp):
+    return {"id": id, "from": sender, "type": "text", "text": {"body": text}, "timestamp": str(timestamp)}
+
+class FakeRedis:
+    """The SET NX / DEL commands event ID claims use."""
+
+    def __init__(self):
+        self.data = {}
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        results = []
+        return SimpleNamespace(
+            set=lambda *args, **kwargs: results.append(self.set(*args, **kwargs)),
+            execute=lambda: results
+        )
+
+class FakeTables:
+    """The WhatsApp number, lead and message tables ingest writes to."""
+
+    def __init__(self, leads=()):
+        self.leads = {lead.id: lead for lead in leads}
+        self.messages = []
+        self.lead_inserts = []
+        self.lead_updates = []
+
+        async def find_numbers(where):
+            return [NUMBER] if NUMBER.phoneNumberId in where["phoneNumberId"]["in"] else []
+
+        async def find_leads(where):
+            return [
+                lead for lead in self.leads.values()
+                if lead.userId == where["userId"] and lead.phoneNumber in where["phoneNumber"]["in"]
+            ]
+
+        async def create_leads(data, skip_duplicates=False):
+            self.lead_inserts.append(skip_duplicates)
+            for row in data:
+                lead_id = f"lead_{len(self.leads) + 1}"
+                self.leads[lead_id] = SimpleNamespace(id=lead_id, **row)
+            return len(data)
+
+        async def update_leads(where, data):
+            self.lead_updates.append((where["id"]["in"], data))
+            return len(where["id"]["in"])
+
+        async def create_messages(data, skip_duplicates=False):
+            seen = {message["providerMessageId"] for message in self.messages}
+            fresh = [row for row in data if row["providerMessageId"] not in seen]
+            self.messages.extend(fresh)
+            return len(fresh)
+
+        self.prisma = SimpleNamespace(
+            whatsappnumber=SimpleNamespace(find_many=find_numbers),
+            lead=SimpleNamespace(find_many=find_leads, create_many=create_leads, update_many=update_leads),
+            message=SimpleNamespace(create_many=create_messages)
+        )
+
+@pytest.fixture
+def ingest(monkeypatch):
+    """Run ingest against fake tables, recording opened windows and applied statuses."""
+    state = SimpleNamespace(tables=FakeTables(), windows=[], statuses=[])
+
+    async def open_windows(number_id, inbound_times):
+        state.windows.append((number_id, inbound_times))
+
+    async def apply_statuses(number, statuses):
+        state.statuses.extend(statuses)
+        return len(statuses)
+
+    def use_tables(tables):
+        state.tables = tables
+        monkeypatch.setattr(whatsapp_ingest, "prisma", tables.prisma)
+
+    monkeypatch.setattr(webhooks, "redis_client", FakeRedis())
+    monkeypatch.setattr(whatsapp_ingest, "open_windows", open_windows)
+    monkeypatch.setattr(whatsapp_ingest, "apply_statuses", apply_statuses)
+    use_tables(state.tables)
+    state.use_tables = use_tables
+    return state
+
+class TestParseWhatsappEvents:
+    """Test webhook bodies are flattened into events."""
+
+    def test_messages_and_statuses(self):
+        """Test inbound messages and statuses carry their number, sender and aware UTC time."""
+        entry = webhook_entry(
+            messages=[text_message("wamid.in", "15551234567", "hi", 1705312800)],
+            statuses=[{"id": "wamid.out", "status": "failed", "recipient_id": "15557654321",
+                       "timestamp": "1705312860", "errors": [{"title": "Rate limited"}]}],
+            contacts=[{"wa_id": "15551234567", "profile": {"name": "Jane Doe"}}]
+        )
+        inbound, statuses = whatsapp_ingest.parse_whatsapp_events([entry])
+        assert inbound == [{
+            "number": ("pn_1", "15550001111"), "id": "wamid.in", "from": "15551234567", "name": "Jane Doe",
+            "type": "TEXT", "content": "hi", "at": datetime(2024, 1, 15, 10, 0, tzinfo=timezone.utc)
+        }]
+        assert statuses == [{
+            "number": ("pn_1", "15550001111"), "id": "wamid.out", "status": "failed",
+            "recipient": "15557654321", "at": datetime(2024, 1, 15, 10, 1, tzinfo=timezone.utc),
+            "error": "Rate limited"
+        }]
+
+    def test_skips_other_objects_and_bad_bodies(self):
+        """Test bodies that are not WhatsApp Business webhooks are ignored."""
+        entries = [
+            ("1-0", {"body": "not json"}),
+            ("2-0", {"body": json.dumps({"object": "page", "entry": []})}),
+            ("3-0", {})
+        ]
+        assert whatsapp_ingest.parse_whatsapp_events(entries) == ([], [])
+
+    def test_missing_timestamp_is_now_in_utc(self):
+        """Test an event without a timestamp is stamped with the current aware UTC time."""
+        message = text_message("wamid.in", "15551234567", "hi", 0)
+        del message["timestamp"]
+        inbound, _ = whatsapp_ingest.parse_whatsapp_events([webhook_entry(messages=[message])])
+        assert inbound[0]["at"].tzinfo is not None
+        assert abs((datetime.now(timezone.utc) - inbound[0]["at"]).total_seconds()) < 5
+
+class TestIngestWhatsappEvents:
+    """Test redelivered webhook events are applied once."""
+
+    async def test_redelivered_batch_is_skipped(self, ingest):
+        """Test a batch delivered twice writes its message once."""
+        entry = webhook_entry(messages=[text_message("wamid.in", "15551234567", "hi", 1705312800)])
+        first = await whatsapp_ingest.ingest_whatsapp_events([entry])
+        second = await whatsapp_ingest.ingest_whatsapp_events([entry])
+        assert first["messages"] == 1 and first["duplicates"] == 0
+        assert second == {"messages": 0, "statuses": 0, "duplicates": 1}
+        assert len(ingest.tables.messages) == 1
+
+    async def test_each_status_of_a_message_is_applied(self, ingest):
+        """Test delivered and read statuses for one wamid are distinct events."""
+        statuses = [
+            {"id": "wamid.out", "status": status, "recipient_id": "15557654321", "timestamp": "1705312860"}
+            for status in ("delivered", "read", "read")
+        ]
+        result = await whatsapp_ingest.ingest_whatsapp_events([webhook_entry(statuses=statuses)])
+        assert [status["status"] for status in ingest.statuses] == ["delivered", "read"]
+        assert result["statuses"] == 2
+
+    async def test_failed_batch_releases_its_claims(self, ingest, monkeypatch):
+        """Test a batch that fails to apply is applied in full by its retry."""
+        entry = webhook_entry(messages=[text_message("wamid.in", "15551234567", "hi", 1705312800)])
+        apply_whatsapp_events = whatsapp_ingest.apply_whatsapp_events
+
+        async def unavailable(inbound, statuses):
+            raise ConnectionError("database unavailable")
+
+        monkeypatch.setattr(whatsapp_ingest, "apply_whatsapp_events", unavailable)
+        with pytest.raises(ConnectionError):
+            await whatsapp_ingest.ingest_whatsapp_events([entry])
+
+        monkeypatch.setattr(whatsapp_ingest, "apply_whatsapp_events", apply_whatsapp_events)
+        result = await whatsapp_ingest.ingest_whatsapp_events([entry])
+        assert result["messages"] == 1 and result["duplicates"] == 0
+
+class TestApplyWhatsappEvents:
+    """Test inbound messages create leads, messages and conversation windows."""
+
+    async def test_new_sender_gets_a_lead(self, ingest):
+        """Test a first message creates the sender's lead idempotently and links the message."""
+        inbound, _ = whatsapp_ingest.parse_whatsapp_events([webhook_entry(
+            messages=[text_message("wamid.in", "15551234567", "hi", 1705312800)],
+            contacts=[{"wa_id": "15551234567", "profile": {"name": "Jane Doe"}}]
+        )])
+        totals = await whatsapp_ingest.apply_whatsapp_events(inbound, [])
+        assert totals == {"messages": 1, "statuses": 0, "unknown_number": 0}
+        lead = next(iter(ingest.tables.leads.values()))
+        assert (lead.phoneNumber, lead.firstName, lead.lastName) == ("+15551234567", "Jane", "Doe")
+        assert ingest.tables.lead_inserts == [True]
+        assert ingest.tables.messages[0]["leadId"] == lead.id
+
+    async def test_returning_customer_reuses_lead_and_extends_window(self, ingest):
+        """Test a known sender's lead is touched, not recreated, and the window opens from the latest message."""
+        lead = SimpleNamespace(id="lead_known", userId="user_123", phoneNumber="+15551234567")
+        ingest.use_tables(FakeTables(leads=[lead]))
+        inbound, _ = whatsapp_ingest.parse_whatsapp_events([webhook_entry(messages=[
+            text_message("wamid.1", "15551234567", "hello again", 1705312800),
+            text_message("wamid.2", "15551234567", "anyone there?", 1705313400)
+        ])])
+        await whatsapp_ingest.apply_whatsapp_events(inbound, [])
+        latest = datetime(2024, 1, 15, 10, 10, tzinfo=timezone.utc)
+        assert ingest.tables.lead_inserts == []
+        assert ingest.tables.lead_updates == [(["lead_known"], {"lastInteraction": latest})]
+        assert {message["leadId"] for message in ingest.tables.messages} == {"lead_known"}
+        assert ingest.windows == [("wn_1", {"15551234567": latest})]
+
+    async def test_unknown_number_is_counted(self, ingest):
+        """Test events for a number the app does not manage are counted and skipped."""
+        event = {"number": ("pn_other", None), "id": "wamid.in", "from": "15551234567", "name": None,
+                 "type": "TEXT", "content": "hi", "at": datetime(2024, 1, 15, 10, tzinfo=timezone.utc)}
+        totals = await whatsapp_ingest.apply_whatsapp_events([event], [])
+        assert totals == {"messages": 0, "statuses": 0, "unknown_number": 1}
+        assert ingest.tables.messages == []
@@ -0,0 +1,84 @@
+import threading
+import pytest
+from types import SimpleNamespace
+from src.utils import dead_letter, messaging, worker
+
+def make_job(name, attempts_made=0, attempts=3):
+    return SimpleNamespace(
+        id="job_1",
+        name=name,
+        queue=SimpleNamespace(name="message-queue"),
+        opts={"attempts": attempts},
+        attemptsMade=attempts_made,
+        data={"message_id": "msg_1"}
+    )
+
+@pytest.fixture
+def dead_letters(monkeypatch):
+    """Collect dead letters instead of writing them."""
+    recorded = []
+
+    async def record_dead_letter(job, error):
+        recorded.append((job.name, type(error).__name__))
+
+    monkeypatch.setattr(dead_letter, "record_dead_letter", record_dead_letter)
+    monkeypatch.setattr(worker, "record_job_outcome", lambda queue_name, outcome: None)
+    return recorded
+
+class TestProcessJob:
+    """Test job dispatch and dead-lettering."""
+
+    async def test_missing_handler_is_not_dead_lettered_before_final_attempt(self, dead_letters):
+        """Test a job with retries left is not dead-lettered for a missing handler."""
+        with pytest.raises(LookupError):
+            await worker.process_job(make_job("no-such-job", attempts_made=0), None)
+        assert dead_letters == []
+
+    async def test_missing_handler_is_dead_lettered_once_on_final_attempt(self, dead_letters):
+        """Test a missing handler dead-letters the job on its last attempt only."""
+        for attempts_made in range(3):
+            with pytest.raises(LookupError):
+                await worker.process_job(make_job("no-such-job", attempts_made=attempts_made), None)
+        assert dead_letters == [("no-such-job", "LookupError")]
+
+    async def test_missing_handler_counts_as_failed(self, dead_letters, monkeypatch):
+        """Test a job with no handler is counted as a failed job."""
+        outcomes = []
+        monkeypatch.setattr(worker, "record_job_outcome", lambda queue_name, outcome: outcomes.append((queue_name, outcome)))
+        with pytest.raises(LookupError):
+            await worker.process_job(make_job("no-such-job"), None)
+        assert outcomes == [("message-queue", "failed")]
+
+    async def test_handler_failure_is_dead_lettered_on_final_attempt(self, dead_letters, monkeypatch):
+        """Test a failing handler is dead-lettered only after its last attempt."""
+        async def failing_handler(data):
+            raise RuntimeError("boom")
+
+        monkeypatch.setitem(worker._job_handlers, ("message-queue", "always-fails"), failing_handler)
+        for attempts_made in range(3):
+            with pytest.raises(RuntimeError):
+                await worker.process_job(make_job("always-fails", attempts_made=attempts_made), None)
+        assert dead_letters == [("always-fails", "RuntimeError")]
+
+class TestMessaging:
+    """Test message sends do not block the worker's event loop."""
+
+    async def test_send_messenger_posts_from_a_worker_thread(self, monkeypatch):
+        """Test the Graph API request runs off the event loop thread."""
+        calls = []
+
+        def graph_post(path, access_token, payload):
+            calls.append((path, access_token, payload, threading.current_thread()))
+            return {"message_id": "mid.1"}
+
+        monkeypatch.setattr(messaging, "decrypt_token", lambda token: "page-token")
+        monkeypatch.setattr(messaging, "graph_post", graph_post)
+
+        page = SimpleNamespace(accessToken="encrypted")
+        response = await messaging.send_messenger(page, "psid_1", "Hello")
+
+        assert response == {"message_id": "mid.1"}
+        path, access_token, payload, thread = calls[0]
+        assert (path, access_token) == ("me/messages", "page-token")
+        assert payload == {"recipient": {"id": "psid_1"}, "message": {"text": "Hello"}}
+        assert thread is not threading.current_thread()
@@ -148,6 +148,8 @@ const Admin = () => {
       return <Badge className="bg-green-100 text-green-800"><CheckCircle className="h-3 w-3 mr-1" />Healthy</Badge>
     } else if (status === 'warning') {
       return <Badge className="bg-yellow-100 text-yellow-800"><AlertTriangle className="h-3 w-3 mr-1" />Warning</Badge>
+    } else if (status === 'unknown') {
+      return <Badge className="bg-gray-100 text-gray-800">Not monitored</Badge>
     } else {
       return <Badge className="bg-red-100 text-red-800"><XCircle className="h-3 w-3 mr-1" />Error</Badge>
     }